@@ -9,37 +9,65 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+from diagnostics import CAPTURE_QUERY_PARAM, RerunCapture
+
+# Profilo cProfile di un'intera esecuzione dello script, chiesto con
+# ?profile=1 nell'URL o dall'interruttore della diagnostica. L'interruttore
+# vale per l'esecuzione completa successiva a quella che provoca lui stesso.
+rerun_capture = None
+capture_state = st.session_state.get("rerun_capture_state")
+if st.query_params.get(CAPTURE_QUERY_PARAM, "0") not in ("", "0"):
+    del st.query_params[CAPTURE_QUERY_PARAM]
+    capture_state = "next"
+if capture_state == "armed":
+    st.session_state["rerun_capture_state"] = "next"
+elif capture_state == "next":
+    st.session_state["rerun_capture_state"] = None
+    st.session_state["capture_next_rerun"] = False
+    rerun_capture = RerunCapture().start()
+
 # Ora possiamo importare altri moduli
+# Grafici (altair), griglia (st_aggrid) ed export Excel si importano solo
+# quando una scheda ha risultati da mostrare: la prima pagina non li attende.
+# Lo stesso vale per motore, storico, archivio (DuckDB) e analisi: si
+# importano nei percorsi che li usano, dopo il caricamento o l'avvio
 import pandas as pd
 import numpy as np
-import re
-import altair as alt
+import functools
+import importlib.util
 import io
 import json
-import math, statistics
+import os
+import time
 import warnings
-from typing import Optional, Dict, Any
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
-from streamlit_extras.colored_header import colored_header
-from loaders import (
-    load_data,
-    parse_float,
-    parse_int,
-    parse_weight,
+from settings import (
+    OUT_OF_CORE_MIN_UPLOAD_MB,
+    PERF_LOG,
+    PIPELINE_WORKERS,
+    PROFILE_ALLOCATIONS,
+    PROFILE_DIR,
+    RESULTS_DB,
+    SHIPPING_TABLE as SHIPPING_COSTS,
+    SNAPSHOT_DIR,
 )
-from score import (
-    SHIPPING_COSTS,
-    VAT_RATES,
-    normalize_locale,
-    calculate_shipping_cost,
-    calc_final_purchase_price,
-    format_trend,
-    classify_opportunity,
-    compute_scores,
-    aggregate_opportunities,
+from diagnostics import (
+    PipelineProfile,
+    StageMemory,
+    profile_frame,
+    profiled_cache,
+    state_bytes,
 )
+from jobs import BackgroundJob
 from utils import load_preset, save_preset
-from ui import apply_dark_theme
+from ui import apply_dark_theme, colored_header
+
+# Cache di Streamlit solo nell'app: il motore resta indipendente dal runtime
+@profiled_cache(st.cache_data(show_spinner=False))
+def compute_historic_deals(df: pd.DataFrame) -> pd.DataFrame:
+    """:func:`deals.compute_historic_deals`, imported on the first call."""
+    from deals import compute_historic_deals as historic_deals
+
+    return historic_deals(df)
 
 apply_dark_theme()
 
@@ -51,598 +79,675 @@ warnings.filterwarnings(
     module="openpyxl",
 )
 
-# Result grid column order
-# Only the following columns are displayed in this exact sequence.
-DISPLAY_COLS_ORDER = [
-    "Locale (base)",
-    "Locale (comp)",
-    "Title (base)",
-    "ASIN",
-    "Margine_Stimato",
-    "Margine_Netto_%",
-    "Margine_Netto",
-    "Price_Base",
-    "Acquisto_Netto",
-    "Shipping_Cost",
-    "Price_Comp",
-    "Vendita_Netto",
-    "Bought_Comp",
-    "SalesRank_Comp",
-    "Trend",
-    "NewOffer_Comp",
-    "Opportunity_Score",
-    "Opportunity_Class",
-    "Volume_Score",
-    "Weight_kg",
-    "Package: Dimension (cm³) (base)",
-    "IVA_Origine",
-    "IVA_Confronto",
-]
-
-
-# Helper functions
-def float_or_nan(x) -> float:
-    try:
-        if x is None:
-            return float("nan")
-        if isinstance(x, (int, float)):
-            return float(x)
-        s = (
-            str(x)
-            .strip()
-            .replace("%", "")
-            .replace("\u202f", "")
-            .replace(" ", "")
-        )
-        s = s.replace(".", "").replace(",", ".") if s.count(",") and s.count(".") <= 1 else s
-        return float(s)
-    except Exception:
-        return float("nan")
-
-
-def euro_to_float(x: Any) -> float:
-    if x is None or (isinstance(x, float) and math.isnan(x)):
-        return float("nan")
-    s = str(x).replace("€", "").strip()
-    return float_or_nan(s)
-
-
-def apply_discounts(price_gross: float, coupon_abs, coupon_pct, business_pct) -> float:
-    p = float(price_gross) if math.isfinite(price_gross) else float("nan")
-    if not math.isfinite(p):
-        return p
-    ca = euro_to_float(coupon_abs)
-    cp = float_or_nan(coupon_pct)
-    bp = float_or_nan(business_pct)
-    if math.isfinite(ca) and ca > 0:
-        p = max(0.0, p - ca)
-    if math.isfinite(cp) and cp > 0:
-        p = p * (1.0 - cp / 100.0)
-    if math.isfinite(bp) and bp > 0:
-        p = p * (1.0 - bp / 100.0)
-    return max(0.0, p)
-
-
-def pick_current_price(row: pd.Series) -> float:
-    # priorità: BB -> Amazon -> New -> New FBM current (se disponibile)
-    for col in [
-        "Buy Box 🚚: Current",
-        "Amazon: Current",
-        "New: Current",
-        "New, 3rd Party FBM 🚚: Current",
-    ]:
-        if (
-            col in row
-            and math.isfinite(euro_to_float(row[col]))
-            and euro_to_float(row[col]) > 0
-        ):
-            return euro_to_float(row[col])
-    return float("nan")
-
-
-def fair_price_row(row: pd.Series) -> float:
-    # mediana robusta delle medie storiche (BB/Amazon/New su 90/180/365)
-    cols = [
-        "Buy Box 🚚: 90 days avg.",
-        "Buy Box 🚚: 180 days avg.",
-        "Buy Box 🚚: 365 days avg.",
-        "Amazon: 90 days avg.",
-        "Amazon: 180 days avg.",
-        "Amazon: 365 days avg.",
-        "New: 90 days avg.",
-        "New: 180 days avg.",
-        "New: 365 days avg.",
-    ]
-    vals = [euro_to_float(row.get(c)) for c in cols if c in row]
-    vals = [v for v in vals if math.isfinite(v) and v > 0]
-    if not vals:
-        return float("nan")
-    fair = statistics.median(sorted(vals))
-    # clamp entro min/max storico BB se disponibili
-    low = euro_to_float(row.get("Buy Box 🚚: Lowest"))
-    high = euro_to_float(row.get("Buy Box 🚚: Highest"))
-    if math.isfinite(low) and fair < low:
-        fair = low
-    if math.isfinite(high) and fair > high:
-        fair = high
-    return fair
-
-
-def get_vat_for_locale(locale_raw: str) -> float:
-    # RIUSA la tua mappa IVA se esiste (VAT_RATES + normalize_locale).
-    try:
-        loc = normalize_locale(locale_raw)
-        return VAT_RATES.get(loc, 0.22)
-    except Exception:
-        return 0.22
-
-
-def estimate_fulfillment_fee(row: pd.Series) -> float:
-    # Se c'è FBA Pick&Pack Fee usalo, altrimenti stima FBM via peso e tua funzione di spedizione
-    fba = float_or_nan(row.get("FBA Pick&Pack Fee"))
-    if math.isfinite(fba) and fba > 0:
-        return fba
-    # FBM: calcola costo spedizione dalla tua funzione principale, usando peso pacco/item
-    grams = float_or_nan(row.get("Package: Weight (g)"))
-    if not math.isfinite(grams) or grams <= 0:
-        grams = float_or_nan(row.get("Item: Weight (g)"))
-    if not math.isfinite(grams) or grams <= 0:
-        grams = 1000.0  # fallback = 1 kg
-    kg = grams / 1000.0
-    try:
-        return calculate_shipping_cost(kg)
-    except Exception:
-        if kg <= 1:
-            return 5.0
-        elif kg <= 2:
-            return 7.0
-        elif kg <= 5:
-            return 10.0
-        else:
-            return 15.0
-
-
-def demand_score(row: pd.Series) -> float:
-    rank_c = float_or_nan(row.get("Sales Rank: Current"))
-    rank_90 = float_or_nan(row.get("Sales Rank: 90 days avg."))
-    bought = float_or_nan(row.get("Bought in past month"))
-    rev_now = float_or_nan(row.get("Reviews: Rating Count"))
-    rev_90 = float_or_nan(row.get("Reviews: Rating Count - 90 days avg."))
-
-    def vol(r):
-        if not math.isfinite(r) or r <= 0:
-            return 0.0
-        return max(0.0, min(100.0, 1000.0 / math.log(r + 10.0)))
-
-    base = vol(rank_c)
-    if math.isfinite(rank_c) and math.isfinite(rank_90) and rank_c < rank_90:
-        base *= 1.10
-    if math.isfinite(bought) and bought > 0:
-        base += min(30.0, 10.0 * math.log(1.0 + bought))
-    if math.isfinite(rev_now) and math.isfinite(rev_90) and rev_now > rev_90:
-        base += min(10.0, (rev_now - rev_90) * 0.02)
-    return float(max(0.0, min(100.0, base)))
-
-
-def competition_score(row: pd.Series) -> float:
-    offers = float_or_nan(row.get("New Offer Count: Current"))
-    amz90 = float_or_nan(row.get("Buy Box: % Amazon 90 days"))
-    amz180 = float_or_nan(row.get("Buy Box: % Amazon 180 days"))
-    amz = max(
-        amz90 if math.isfinite(amz90) else 0.0,
-        amz180 if math.isfinite(amz180) else 0.0,
-    )
-    unq = 100.0 if str(row.get("Buy Box: Unqualified")).strip().lower() == "yes" else 0.0
-    off_pen = min(100.0, (offers / 50.0) * 50.0) if math.isfinite(offers) else 0.0
-    amz_pen = min(100.0, amz) if math.isfinite(amz) else 0.0
-    return float(max(0.0, min(100.0, 0.6 * off_pen + 0.4 * amz_pen + 0.5 * unq)))
 
+def excel_bytes(df: pd.DataFrame, sheet_name: str = "Sheet1", engine=None) -> bytes:
+    """Return ``df`` as an Excel workbook, for a download button."""
+    bio = io.BytesIO()
+    with pd.ExcelWriter(bio, engine=engine) as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return bio.getvalue()
+
+
+def chart_data(df: pd.DataFrame, columns) -> pd.DataFrame:
+    """Return only the ``columns`` of ``df`` that a chart encodes."""
+    # Altair serializza tutte le colonne ricevute: passiamo solo quelle usate
+    return df[[c for c in columns if c in df.columns]]
+
+
+# Le sezioni dei risultati sono frammenti: un'interazione con i loro widget
+# riesegue solo il frammento, leggendo i risultati salvati in session_state.
+@st.fragment
+def render_dashboard() -> None:
+    """Render the interactive dashboard from the session-cached results."""
+    df_finale = st.session_state.get("filtered_data")
+    if df_finale is None:
+        return
+    import altair as alt
+
+    include_shipping = st.session_state.get("analysis_include_shipping", True)
+
+    st.markdown('<div class="result-container">', unsafe_allow_html=True)
+    st.subheader("📊 Dashboard delle Opportunità")
+
+    # Metriche principali
+    if not df_finale.empty:
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Prodotti Trovati", len(df_finale))
+        with col2:
+            st.metric(
+                "Margine Netto Medio (%)",
+                f"{df_finale['Margine_Netto_%'].mean():.2f}%",
+            )
+        with col3:
+            st.metric(
+                "Margine Netto Medio (€)",
+                f"{df_finale['Margine_Netto'].mean():.2f}€",
+            )
+        with col4:
+            st.metric(
+                "Opportunity Score Massimo",
+                f"{df_finale['Opportunity_Score'].max():.2f}",
+            )
 
-def scale_0_100(series: pd.Series) -> pd.Series:
-    s = series.astype(float).replace([np.inf, -np.inf], np.nan)
-    mn, mx = s.min(skipna=True), s.max(skipna=True)
-    if not math.isfinite(mn) or not math.isfinite(mx) or mx == mn:
-        return pd.Series([50.0] * len(s), index=s.index)
-    return (s - mn) * 100.0 / (mx - mn)
+        st.info(
+            "Aliquote IVA determinate automaticamente per ogni riga | "
+            + ("✅ Spedizione Inclusa" if include_shipping else "❌ Spedizione Esclusa")
+        )
 
+        dark_colors = {
+            "Eccellente": "#2ecc71",
+            "Buona": "#27ae60",
+            "Discreta": "#f39c12",
+            "Bassa": "#e74c3c",
+        }
 
-@st.cache_data(show_spinner=False)
-def compute_historic_deals(df: pd.DataFrame) -> pd.DataFrame:
-    if df is None or df.empty:
-        return pd.DataFrame()
-
-    work = df.copy()
-
-    work["PriceNowGross"] = work.apply(pick_current_price, axis=1)
-    work["PriceNowGrossAfterDisc"] = work.apply(
-        lambda r: apply_discounts(
-            r["PriceNowGross"],
-            r.get("One Time Coupon: Absolute"),
-            r.get("One Time Coupon: Percentage"),
-            r.get("Business Discount: Percentage"),
-        ),
-        axis=1,
-    )
-    if "Locale" not in work.columns:
-        work["Locale"] = (
-            work.get("Locale (comp)", pd.Series("", index=work.index)).fillna("").astype(str)
-            + work.get("Locale (base)", pd.Series("", index=work.index)).fillna("").astype(str)
+        st.subheader("Distribuzione Opportunity Score")
+        hist = (
+            alt.Chart(chart_data(df_finale, ["Opportunity_Score", "Opportunity_Class"]))
+            .mark_bar()
+            .encode(
+                alt.X(
+                    "Opportunity_Score:Q",
+                    bin=alt.Bin(maxbins=20),
+                    title="Opportunity Score",
+                ),
+                alt.Y("count()", title="Numero di Prodotti"),
+                color=alt.Color(
+                    "Opportunity_Class:N",
+                    scale=alt.Scale(domain=list(dark_colors.keys()), range=list(dark_colors.values())),
+                ),
+            )
+            .properties(height=250)
         )
-    work["VAT"] = work["Locale"].apply(get_vat_for_locale)
-    work["NetSale"] = work["PriceNowGrossAfterDisc"] / (1.0 + work["VAT"])
-
-    work["FairPrice"] = work.apply(fair_price_row, axis=1)
-    work["UnderPct"] = (
-        work["FairPrice"] - work["PriceNowGrossAfterDisc"]
-    ) / work["FairPrice"]
-    work.loc[~np.isfinite(work["UnderPct"]), "UnderPct"] = np.nan
-
-    work["ReferralFeePct"] = work.get(
-        "Referral Fee %", pd.Series(np.nan, index=work.index)
-    ).apply(float_or_nan).fillna(0.0)
-    work["ReferralFee€"] = work["NetSale"] * (work["ReferralFeePct"] / 100.0)
-    work["Fulfillment€"] = work.apply(estimate_fulfillment_fee, axis=1)
-    work["NetProceed€"] = (
-        work["NetSale"] - work["ReferralFee€"] - work["Fulfillment€"]
-    )
-
-    if "Acquisto_Netto" not in work.columns:
-        work["Acquisto_Netto"] = np.nan
+        st.altair_chart(hist, use_container_width=True)
+
+        st.subheader("Analisi Multifattoriale")
+        scatter_cols = [
+            "Title (base)",
+            "ASIN",
+            "Locale (comp)",
+            "Margine_Netto_%",
+            "Margine_Netto",
+            "Shipping_Cost",
+            "SalesRank_Comp",
+            "Opportunity_Score",
+            "Volume_Score",
+            "Trend",
+        ]
+        chart = (
+            alt.Chart(chart_data(df_finale, scatter_cols))
+            .mark_circle()
+            .encode(
+                x=alt.X("Margine_Netto_%:Q", title="Margine Netto (%)"),
+                y=alt.Y("Opportunity_Score:Q", title="Opportunity Score"),
+                size=alt.Size("Volume_Score:Q", title="Volume Stimato", scale=alt.Scale(range=[20, 200])),
+                color=alt.Color("Locale (comp):N", title="Mercato Confronto", scale=alt.Scale(scheme="category10")),
+                tooltip=[
+                    "Title (base)",
+                    "ASIN",
+                    "Margine_Netto_%",
+                    "Margine_Netto",
+                    "Shipping_Cost",
+                    "SalesRank_Comp",
+                    "Opportunity_Score",
+                    "Trend",
+                ],
+            )
+            .interactive()
+        )
+        st.altair_chart(chart, use_container_width=True)
+
+        st.subheader("Analisi per Mercato")
+        if "Locale (comp)" in df_finale.columns:
+            market_analysis = (
+                df_finale.groupby("Locale (comp)")
+                .agg({
+                    "ASIN": "count",
+                    "Margine_Netto_%": "mean",
+                    "Margine_Netto": "mean",
+                    "Shipping_Cost": "mean",
+                    "Opportunity_Score": "mean",
+                })
+                .reset_index()
+            )
+            market_analysis.columns = [
+                "Mercato",
+                "Prodotti",
+                "Margine Netto Medio (%)",
+                "Margine Netto Medio (€)",
+                "Costo Spedizione Medio (€)",
+                "Opportunity Score Medio",
+            ]
+            market_analysis = market_analysis.round(2)
+            st.dataframe(market_analysis, use_container_width=True)
 
-    work["Marg€"] = work["NetProceed€"] - work["Acquisto_Netto"]
-    work["Marg%"] = np.where(
-        work["Acquisto_Netto"] > 0,
-        work["Marg€"] / work["Acquisto_Netto"],
-        np.nan,
-    )
+            market_chart = (
+                alt.Chart(market_analysis)
+                .mark_bar()
+                .encode(
+                    x="Mercato:N",
+                    y="Opportunity Score Medio:Q",
+                    color=alt.Color("Mercato:N", scale=alt.Scale(scheme="category10")),
+                    tooltip=[
+                        "Mercato",
+                        "Prodotti",
+                        "Margine Netto Medio (%)",
+                        "Margine Netto Medio (€)",
+                        "Costo Spedizione Medio (€)",
+                        "Opportunity Score Medio",
+                    ],
+                )
+                .properties(height=300)
+            )
+            st.altair_chart(market_chart, use_container_width=True)
+    else:
+        st.info("Nessun prodotto trovato con i filtri applicati.")
 
-    work["Demand"] = work.apply(demand_score, axis=1)
-    vol_candidates = []
-    for c in [
-        "Buy Box: Standard Deviation 90 days",
-        "Buy Box: Standard Deviation 30 days",
-        "Buy Box: Standard Deviation 365 days",
-    ]:
-        if c in work.columns:
-            vol_candidates.append(work[c].apply(euro_to_float))
-    work["Volatility"] = (
-        pd.concat(vol_candidates, axis=1).bfill(axis=1).iloc[:, 0]
-        if vol_candidates
-        else np.nan
-    )
-    work["Competition"] = work.apply(competition_score, axis=1)
+    st.markdown("</div>", unsafe_allow_html=True)
 
-    work["Badge_AMZ_OOS"] = (
-        work.get("Amazon: 90 days OOS", pd.Series(0, index=work.index)).fillna(0) > 0
-    )
-    amzbb90 = work.get("Buy Box: % Amazon 90 days", pd.Series(0, index=work.index))
-    amzbb90 = amzbb90.apply(float_or_nan)
-    work["Badge_BB_Amazon"] = amzbb90.fillna(0) > 50
-    work["Badge_Coupon"] = (
-        work.get("One Time Coupon: Absolute", pd.Series(0, index=work.index))
-        .apply(euro_to_float)
-        .fillna(0)
-        > 0
-    ) | (
-        work.get("One Time Coupon: Percentage", pd.Series(0, index=work.index))
-        .apply(float_or_nan)
-        .fillna(0)
-        > 0
-    )
-    work["Badge_Prime"] = (
-        work.get("Prime Eligible (Buy Box)", pd.Series(False, index=work.index))
-        .astype(str)
-        .str.lower()
-        .eq("yes")
-    )
-    work["Badge_VolHigh"] = False
-    work["Badge_MAP"] = (
-        work.get("MAP restriction", pd.Series("", index=work.index))
-        .astype(str)
-        .str.lower()
-        .eq("yes")
-    )
 
-    return work
+# Risultati dettagliati e filtri interattivi
+@st.fragment
+def render_details() -> None:
+    """Render the detailed results grid with its interactive filters."""
+    df_finale = st.session_state.get("filtered_data")
+    if df_finale is not None and not df_finale.empty:
+        from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
 
-def render_results(df_finale: pd.DataFrame, df_ranked: pd.DataFrame, include_shipping: bool) -> None:
-    """Render the dashboard and detailed results grids."""
-    #################################
-    # Dashboard Interattiva
-    #################################
-    with tab_main2:
         st.markdown('<div class="result-container">', unsafe_allow_html=True)
-        st.subheader("📊 Dashboard delle Opportunità")
+        st.subheader("🔍 Esplora i Risultati")
+
+        st.markdown('<div class="filter-group">', unsafe_allow_html=True)
+        col1, col2, col3 = st.columns(3)
+
+        # Solo selezioni di righe: nessuna copia necessaria
+        filtered_df = df_finale
+
+        with col1:
+            if "Locale (comp)" in filtered_df.columns:
+                markets = ["Tutti"] + sorted(filtered_df["Locale (comp)"].dropna().unique().tolist())
+                selected_market = st.selectbox("Filtra per Mercato", markets)
+                if selected_market != "Tutti":
+                    filtered_df = filtered_df[filtered_df["Locale (comp)"] == selected_market]
+
+        with col2:
+            if "Brand (base)" in filtered_df.columns:
+                brands = ["Tutti"] + sorted(filtered_df["Brand (base)"].dropna().unique().tolist())
+                selected_brand = st.selectbox("Filtra per Brand", brands)
+                if selected_brand != "Tutti":
+                    filtered_df = filtered_df[filtered_df["Brand (base)"] == selected_brand]
+
+        with col3:
+            if "Opportunity_Class" in filtered_df.columns:
+                classes = ["Tutti"] + sorted(filtered_df["Opportunity_Class"].dropna().unique().tolist())
+                selected_class = st.selectbox("Filtra per Qualità Opportunità", classes)
+                if selected_class != "Tutti":
+                    filtered_df = filtered_df[filtered_df["Opportunity_Class"] == selected_class]
+
+        col1, col2 = st.columns(2)
+        with col1:
+            min_op_score = st.slider(
+                "Opportunity Score Minimo",
+                min_value=float(filtered_df["Opportunity_Score"].min()),
+                max_value=float(filtered_df["Opportunity_Score"].max()),
+                value=float(filtered_df["Opportunity_Score"].min()),
+            )
+            filtered_df = filtered_df[filtered_df["Opportunity_Score"] >= min_op_score]
+
+        with col2:
+            min_margin = st.slider(
+                "Margine Netto Minimo (€)",
+                min_value=float(filtered_df["Margine_Netto"].min()),
+                max_value=float(filtered_df["Margine_Netto"].max()),
+                value=float(filtered_df["Margine_Netto"].min()),
+            )
+            filtered_df = filtered_df[filtered_df["Margine_Netto"] >= min_margin]
 
-        # Metriche principali
-        if not df_finale.empty:
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Prodotti Trovati", len(df_finale))
-            with col2:
-                st.metric(
-                    "Margine Netto Medio (%)",
-                    f"{df_finale['Margine_Netto_%'].mean():.2f}%",
-                )
-            with col3:
-                st.metric(
-                    "Margine Netto Medio (€)",
-                    f"{df_finale['Margine_Netto'].mean():.2f}€",
+        search_term = st.text_input(
+            "Cerca per ASIN o Titolo",
+            help="Testo semplice: maiuscole, accenti e spazi ripetuti non contano.",
+        )
+        if search_term:
+            # L'indice viene costruito una sola volta per set di risultati
+            if st.session_state.get("search_index") is None:
+                from search import SearchIndex
+
+                st.session_state["search_index"] = SearchIndex.from_frame(df_finale)
+            hits = st.session_state["search_index"].search(search_term)
+            filtered_df = filtered_df[filtered_df.index.isin(hits)]
+
+        st.markdown("</div>", unsafe_allow_html=True)
+
+        if not filtered_df.empty:
+            def highlight_opportunity(val):
+                if val == "Eccellente":
+                    return "background-color: #153d2e; color: #2ecc71; font-weight: bold"
+                elif val == "Buona":
+                    return "background-color: #14432d; color: #27ae60; font-weight: bold"
+                elif val == "Discreta":
+                    return "background-color: #402d10; color: #f39c12; font-weight: bold"
+                else:
+                    return "background-color: #3d1a15; color: #e74c3c; font-weight: bold"
+
+            def format_with_html(df):
+                styled = df.style.map(
+                    lambda x: highlight_opportunity(x)
+                    if x in ["Eccellente", "Buona", "Discreta", "Bassa"]
+                    else "",
+                    subset=["Opportunity_Class"],
                 )
-            with col4:
-                st.metric(
-                    "Opportunity Score Massimo",
-                    f"{df_finale['Opportunity_Score'].max():.2f}",
+                return styled.format(
+                    {
+                        "Price_Base": "€{:.2f}",
+                        "Acquisto_Netto": "€{:.2f}",
+                        "Price_Comp": "€{:.2f}",
+                        "Vendita_Netto": "€{:.2f}",
+                        "Margine_Stimato": "€{:.2f}",
+                        "Shipping_Cost": "€{:.2f}",
+                        "Margine_Netto": "€{:.2f}",
+                        "Margine_Netto_%": "{:.2f}%",
+                        "Opportunity_Score": "{:.2f}",
+                        "Volume_Score": "{:.2f}",
+                        "Weight_kg": "{:.2f} kg",
+                    }
                 )
 
-            st.info(
-                "Aliquote IVA determinate automaticamente per ogni riga | "
-                + ("✅ Spedizione Inclusa" if include_shipping else "❌ Spedizione Esclusa")
-            )
+            st.markdown(f"**{len(filtered_df)} prodotti trovati**")
 
-            dark_colors = {
-                "Eccellente": "#2ecc71",
-                "Buona": "#27ae60",
-                "Discreta": "#f39c12",
-                "Bassa": "#e74c3c",
-            }
+            from engine import DISPLAY_COLS_ORDER
 
-            st.subheader("Distribuzione Opportunity Score")
-            hist = (
-                alt.Chart(df_finale.reset_index())
-                .mark_bar()
-                .encode(
-                    alt.X(
-                        "Opportunity_Score:Q",
-                        bin=alt.Bin(maxbins=20),
-                        title="Opportunity Score",
-                    ),
-                    alt.Y("count()", title="Numero di Prodotti"),
-                    color=alt.Color(
-                        "Opportunity_Class:N",
-                        scale=alt.Scale(domain=list(dark_colors.keys()), range=list(dark_colors.values())),
-                    ),
-                )
-                .properties(height=250)
-            )
-            st.altair_chart(hist, use_container_width=True)
+            display_cols = [c for c in DISPLAY_COLS_ORDER if c in filtered_df.columns]
+            filtered_df = filtered_df[display_cols]
 
-            st.subheader("Analisi Multifattoriale")
-            chart = (
-                alt.Chart(df_finale.reset_index())
-                .mark_circle()
-                .encode(
-                    x=alt.X("Margine_Netto_%:Q", title="Margine Netto (%)"),
-                    y=alt.Y("Opportunity_Score:Q", title="Opportunity Score"),
-                    size=alt.Size("Volume_Score:Q", title="Volume Stimato", scale=alt.Scale(range=[20, 200])),
-                    color=alt.Color("Locale (comp):N", title="Mercato Confronto", scale=alt.Scale(scheme="category10")),
-                    tooltip=[
-                        "Title (base)",
-                        "ASIN",
-                        "Margine_Netto_%",
-                        "Margine_Netto",
-                        "Shipping_Cost",
-                        "SalesRank_Comp",
-                        "Opportunity_Score",
-                        "Trend",
-                    ],
-                )
-                .interactive()
+            go = GridOptionsBuilder.from_dataframe(filtered_df)
+            go.configure_default_column(sortable=True, filter=True)
+            go.configure_grid_options(enableRangeSelection=True)
+            go.configure_grid_options(autoSizeStrategy={"type": "fitGridWidth"})
+            go = go.build()
+
+            container_cls = "fullscreen" if st.session_state.get("grid_fullscreen") else ""
+            st.markdown(f'<div id="results_grid_container" class="{container_cls}">', unsafe_allow_html=True)
+
+            if st.session_state.get("grid_fullscreen"):
+                if st.button("Chiudi", key="close_grid_fullscreen"):
+                    st.session_state["grid_fullscreen"] = False
+            else:
+                if st.button("Schermo intero", key="open_grid_fullscreen"):
+                    st.session_state["grid_fullscreen"] = True
+
+            AgGrid(
+                filtered_df,
+                gridOptions=go,
+                update_mode=GridUpdateMode.NO_UPDATE,
+                theme="streamlit",
+                key="results_grid",
+                enable_enterprise_modules=True,
             )
-            st.altair_chart(chart, use_container_width=True)
-
-            st.subheader("Analisi per Mercato")
-            if "Locale (comp)" in df_finale.columns:
-                market_analysis = (
-                    df_finale.groupby("Locale (comp)")
-                    .agg({
-                        "ASIN": "count",
-                        "Margine_Netto_%": "mean",
-                        "Margine_Netto": "mean",
-                        "Shipping_Cost": "mean",
-                        "Opportunity_Score": "mean",
-                    })
-                    .reset_index()
-                )
-                market_analysis.columns = [
-                    "Mercato",
-                    "Prodotti",
-                    "Margine Netto Medio (%)",
-                    "Margine Netto Medio (€)",
-                    "Costo Spedizione Medio (€)",
-                    "Opportunity Score Medio",
-                ]
-                market_analysis = market_analysis.round(2)
-                st.dataframe(market_analysis, use_container_width=True)
+            st.markdown("</div>", unsafe_allow_html=True)
 
-                market_chart = (
-                    alt.Chart(market_analysis)
-                    .mark_bar()
-                    .encode(
-                        x="Mercato:N",
-                        y="Opportunity Score Medio:Q",
-                        color=alt.Color("Mercato:N", scale=alt.Scale(scheme="category10")),
-                        tooltip=[
-                            "Mercato",
-                            "Prodotti",
-                            "Margine Netto Medio (%)",
-                            "Margine Netto Medio (€)",
-                            "Costo Spedizione Medio (€)",
-                            "Opportunity Score Medio",
-                        ],
-                    )
-                    .properties(height=300)
+            # Export generati al clic, non a ogni rerun del frammento
+            csv_data = functools.partial(filtered_df.to_csv, index=False, sep=";")
+            excel_data = functools.partial(excel_bytes, filtered_df)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                    label="📥 Scarica CSV",
+                    data=csv_data,
+                    file_name="risultato_opportunity_arbitrage.csv",
+                    mime="text/csv",
+                    use_container_width=True,
+                )
+            with col2:
+                st.download_button(
+                    label="📥 Scarica Excel",
+                    data=excel_data,
+                    file_name="risultato_opportunity_arbitrage.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True,
                 )
-                st.altair_chart(market_chart, use_container_width=True)
         else:
-            st.info("Nessun prodotto trovato con i filtri applicati.")
+            st.warning("Nessun prodotto corrisponde ai filtri selezionati.")
 
         st.markdown("</div>", unsafe_allow_html=True)
+    else:
+        st.info(
+            "👈 Clicca su 'Calcola Opportunity Score' nella barra laterale per visualizzare i risultati."
+        )
 
-    # Risultati dettagliati e filtri interattivi
-    with tab_main3:
-        if df_finale is not None and not df_finale.empty:
-            st.markdown('<div class="result-container">', unsafe_allow_html=True)
-            st.subheader("🔍 Esplora i Risultati")
 
-            st.markdown('<div class="filter-group">', unsafe_allow_html=True)
-            col1, col2, col3 = st.columns(3)
+@st.fragment
+def render_ranking() -> None:
+    """Render the cross-market ranking table."""
+    df_ranked = st.session_state.get("ranked_data")
+    if df_ranked is not None and not df_ranked.empty:
+        st.markdown('<div class="result-container">', unsafe_allow_html=True)
+        st.subheader("🏆 Classifica prodotti")
+        st.dataframe(df_ranked, use_container_width=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+    else:
+        st.info("👈 Calcola le opportunità per vedere la classifica.")
 
-            filtered_df = df_finale.copy()
 
-            with col1:
-                if "Locale (comp)" in filtered_df.columns:
-                    markets = ["Tutti"] + sorted(filtered_df["Locale (comp)"].unique().tolist())
-                    selected_market = st.selectbox("Filtra per Mercato", markets)
-                    if selected_market != "Tutti":
-                        filtered_df = filtered_df[filtered_df["Locale (comp)"] == selected_market]
+@st.fragment
+def render_matrix() -> None:
+    """Render the best route of each ASIN across all the uploaded markets."""
+    routes = st.session_state.get("matrix_routes")
+    if routes is None:
+        st.info(
+            "👈 Attiva 'Matrice di arbitraggio' e calcola per confrontare "
+            "tutti i mercati caricati tra loro."
+        )
+        return
+    st.subheader("🌍 Matrice di arbitraggio")
+    if routes.empty:
+        st.warning("Nessuna rotta supera i filtri impostati.")
+        return
+    st.caption("Rotte migliori per coppia origine → destinazione")
+    st.dataframe(
+        pd.crosstab(routes["Locale (base)"], routes["Locale (comp)"]),
+        use_container_width=True,
+    )
+    st.dataframe(routes, use_container_width=True)
 
-            with col2:
-                if "Brand (base)" in filtered_df.columns:
-                    brands = ["Tutti"] + sorted(filtered_df["Brand (base)"].unique().tolist())
-                    selected_brand = st.selectbox("Filtra per Brand", brands)
-                    if selected_brand != "Tutti":
-                        filtered_df = filtered_df[filtered_df["Brand (base)"] == selected_brand]
-
-            with col3:
-                if "Opportunity_Class" in filtered_df.columns:
-                    classes = ["Tutti"] + sorted(filtered_df["Opportunity_Class"].unique().tolist())
-                    selected_class = st.selectbox("Filtra per Qualità Opportunità", classes)
-                    if selected_class != "Tutti":
-                        filtered_df = filtered_df[filtered_df["Opportunity_Class"] == selected_class]
 
-            col1, col2 = st.columns(2)
-            with col1:
-                min_op_score = st.slider(
-                    "Opportunity Score Minimo",
-                    min_value=float(filtered_df["Opportunity_Score"].min()),
-                    max_value=float(filtered_df["Opportunity_Score"].max()),
-                    value=float(filtered_df["Opportunity_Score"].min()),
-                )
-                filtered_df = filtered_df[filtered_df["Opportunity_Score"] >= min_op_score]
+@st.fragment
+def render_deals() -> None:
+    """Render the "Affari Storici" tab from the full session dataset."""
+    df_final = st.session_state.get("full_data")
 
-            with col2:
-                min_margin = st.slider(
-                    "Margine Netto Minimo (€)",
-                    min_value=float(filtered_df["Margine_Netto"].min()),
-                    max_value=float(filtered_df["Margine_Netto"].max()),
-                    value=float(filtered_df["Margine_Netto"].min()),
-                )
-                filtered_df = filtered_df[filtered_df["Margine_Netto"] >= min_margin]
+    st.subheader("Affari Storici")
 
-            search_term = st.text_input("Cerca per ASIN o Titolo")
-            if search_term:
-                mask = filtered_df["ASIN"].str.contains(search_term, case=False, na=False) | filtered_df[
-                    "Title (base)"
-                ].str.contains(search_term, case=False, na=False)
-                filtered_df = filtered_df[mask]
+    colw1, colw2, colw3, colw4, colw5 = st.columns(5)
+    with colw1:
+        w1 = st.slider("Peso Sottoprezzo", 0.0, 1.0, 0.30, 0.05)
+    with colw2:
+        w2 = st.slider("Peso Margine %", 0.0, 1.0, 0.25, 0.05)
+    with colw3:
+        w3 = st.slider("Peso Domanda", 0.0, 1.0, 0.25, 0.05)
+    with colw4:
+        w4 = st.slider("Penalità Concorrenza", 0.0, 1.0, 0.10, 0.05)
+    with colw5:
+        w5 = st.slider("Penalità Volatilità", 0.0, 1.0, 0.10, 0.05)
 
-            st.markdown("</div>", unsafe_allow_html=True)
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        min_marg_eur = st.number_input("Margine minimo €", 0.0, 10000.0, 10.0)
+        min_under = st.number_input(
+            "Sottoprezzo minimo %", 0.0, 1.0, 0.10, format="%.2f"
+        )
+    with c2:
+        min_marg_pct = st.number_input(
+            "Margine minimo %", 0.0, 1.0, 0.10, format="%.2f"
+        )
+        max_rank = st.number_input("Rank massimo", 0.0, 1e7, 200000.0)
+    with c3:
+        max_offers = st.number_input("Max offerte nuove", 0, 1000, 50)
+        max_vol = st.number_input("Max volatilità (std 90d)", 0.0, 10000.0, 50.0)
 
-            if not filtered_df.empty:
-                def highlight_opportunity(val):
-                    if val == "Eccellente":
-                        return "background-color: #153d2e; color: #2ecc71; font-weight: bold"
-                    elif val == "Buona":
-                        return "background-color: #14432d; color: #27ae60; font-weight: bold"
-                    elif val == "Discreta":
-                        return "background-color: #402d10; color: #f39c12; font-weight: bold"
-                    else:
-                        return "background-color: #3d1a15; color: #e74c3c; font-weight: bold"
-
-                def format_with_html(df):
-                    styled = df.style.map(
-                        lambda x: highlight_opportunity(x)
-                        if x in ["Eccellente", "Buona", "Discreta", "Bassa"]
-                        else "",
-                        subset=["Opportunity_Class"],
-                    )
-                    return styled.format(
-                        {
-                            "Price_Base": "€{:.2f}",
-                            "Acquisto_Netto": "€{:.2f}",
-                            "Price_Comp": "€{:.2f}",
-                            "Vendita_Netto": "€{:.2f}",
-                            "Margine_Stimato": "€{:.2f}",
-                            "Shipping_Cost": "€{:.2f}",
-                            "Margine_Netto": "€{:.2f}",
-                            "Margine_Netto_%": "{:.2f}%",
-                            "Opportunity_Score": "{:.2f}",
-                            "Volume_Score": "{:.2f}",
-                            "Weight_kg": "{:.2f} kg",
-                        }
-                    )
+    excl_amz_bb = st.checkbox(
+        "Escludi se %Amazon in Buy Box > 50%", value=True
+    )
+    only_amz_oos = st.checkbox(
+        "Solo prodotti con Amazon OOS negli ultimi 90 giorni", value=False
+    )
 
-                st.markdown(f"**{len(filtered_df)} prodotti trovati**")
+    # Calcolati una volta per set di risultati: i widget non li ricopiano
+    if st.session_state.get("deals_data") is None and df_final is not None:
+        st.session_state["deals_data"] = compute_historic_deals(df_final)
+    deals_df = st.session_state.get("deals_data")
+    profile_frame("deals_df", deals_df)
 
-                display_cols = [c for c in DISPLAY_COLS_ORDER if c in filtered_df.columns]
-                filtered_df = filtered_df[display_cols]
+    if deals_df is None or deals_df.empty:
+        st.info("Nessun dato disponibile per Affari Storici.")
+    else:
+        from deals import DealFilters, DealWeights, score_deals, select_deals
+
+        deals_f = select_deals(
+            deals_df,
+            DealFilters(
+                min_marg_eur=min_marg_eur,
+                min_under=min_under,
+                min_marg_pct=min_marg_pct,
+                max_rank=max_rank,
+                max_offers=max_offers,
+                max_vol=max_vol,
+                excl_amz_bb=excl_amz_bb,
+                only_amz_oos=only_amz_oos,
+            ),
+        )
 
-                go = GridOptionsBuilder.from_dataframe(filtered_df)
-                go.configure_default_column(sortable=True, filter=True)
-                go.configure_grid_options(enableRangeSelection=True)
-                go.configure_grid_options(autoSizeStrategy={"type": "fitGridWidth"})
-                go = go.build()
+        if deals_f.empty:
+            st.info("Nessun affare storico trovato con i filtri correnti.")
+        else:
+            import altair as alt
 
-                container_cls = "fullscreen" if st.session_state.get("grid_fullscreen") else ""
-                st.markdown(f'<div id="results_grid_container" class="{container_cls}">', unsafe_allow_html=True)
+            deals_f = score_deals(deals_f, DealWeights(w1, w2, w3, w4, w5))
 
-                if st.session_state.get("grid_fullscreen"):
-                    if st.button("Chiudi", key="close_grid_fullscreen"):
-                        st.session_state["grid_fullscreen"] = False
-                else:
-                    if st.button("Schermo intero", key="open_grid_fullscreen"):
-                        st.session_state["grid_fullscreen"] = True
-
-                AgGrid(
-                    filtered_df,
-                    gridOptions=go,
-                    update_mode=GridUpdateMode.NO_UPDATE,
-                    theme="streamlit",
-                    key="results_grid",
-                    enable_enterprise_modules=True,
+            k1, k2, k3, k4 = st.columns(4)
+            with k1:
+                st.metric("Prodotti (filtrati)", len(deals_f))
+            with k2:
+                st.metric(
+                    "Margine medio %",
+                    f"{np.nanmean(deals_f['Marg%']) * 100:0.1f}%",
+                )
+            with k3:
+                st.metric(
+                    "Sottoprezzo medio %",
+                    f"{np.nanmean(deals_f['UnderPct']) * 100:0.1f}%",
+                )
+            with k4:
+                st.metric(
+                    "DealScore medio",
+                    f"{np.nanmean(deals_f['DealScore']):0.1f}",
+                )
+
+            try:
+                scatter = (
+                    alt.Chart(
+                        chart_data(
+                            deals_f,
+                            ["ASIN", "Title", "UnderPct", "Marg%", "DealScore", "Demand"],
+                        )
+                    )
+                    .mark_circle()
+                    .encode(
+                        x=alt.X("UnderPct:Q", title="Sottoprezzo %"),
+                        y=alt.Y("Marg%:Q", title="Margine %"),
+                        color=alt.Color("DealScore:Q"),
+                        size=alt.Size("Demand:Q"),
+                        tooltip=[
+                            "ASIN:N",
+                            "Title:N",
+                            "UnderPct:Q",
+                            "Marg%:Q",
+                            "DealScore:Q",
+                        ],
+                    )
+                    .interactive()
                 )
-                st.markdown("</div>", unsafe_allow_html=True)
+                st.altair_chart(scatter, use_container_width=True)
 
-                csv_data = filtered_df.to_csv(index=False, sep=";").encode("utf-8")
-                excel_data = io.BytesIO()
-                filtered_df.to_excel(excel_data, index=False)
-                excel_data.seek(0)
+                hist = (
+                    alt.Chart(chart_data(deals_f, ["DealScore"]))
+                    .mark_bar()
+                    .encode(
+                        x=alt.X("DealScore:Q", bin=alt.Bin(maxbins=30), title="DealScore"),
+                        y="count()",
+                    )
+                )
+                st.altair_chart(hist, use_container_width=True)
+            except Exception:
+                pass
 
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.download_button(
-                        label="📥 Scarica CSV",
-                        data=csv_data,
-                        file_name="risultato_opportunity_arbitrage.csv",
-                        mime="text/csv",
-                        use_container_width=True,
+            show_cols = [
+                c
+                for c in [
+                    "Locale",
+                    "ASIN",
+                    "Title",
+                    "PriceNowGrossAfterDisc",
+                    "FairPrice",
+                    "UnderPct",
+                    "NetSale",
+                    "ReferralFee€",
+                    "Fulfillment€",
+                    "NetProceed€",
+                    "Acquisto_Netto",
+                    "Marg€",
+                    "Marg%",
+                    "Demand",
+                    "Competition",
+                    "Volatility",
+                    "DealScore",
+                    "URL: Amazon",
+                    "Brand",
+                ]
+                if c in deals_f.columns
+            ]
+
+            # Solo le colonne mostrate; le colonne in euro diventano testo
+            disp = deals_f[show_cols].sort_values("DealScore", ascending=False)
+            disp = disp.assign(
+                **{
+                    c: disp[c].map(
+                        lambda v: f"€ {v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+                        if pd.notna(v)
+                        else v
                     )
-                with col2:
+                    for c in [
+                        "PriceNowGrossAfterDisc",
+                        "FairPrice",
+                        "NetSale",
+                        "ReferralFee€",
+                        "Fulfillment€",
+                        "NetProceed€",
+                        "Acquisto_Netto",
+                        "Marg€",
+                    ]
+                    if c in disp.columns
+                }
+            )
+            st.dataframe(disp, use_container_width=True)
+
+            cexp1, cexp2 = st.columns(2)
+            with cexp1:
+                st.download_button(
+                    "Scarica CSV (Affari Storici)",
+                    functools.partial(deals_f.to_csv, index=False),
+                    file_name="affari_storici.csv",
+                    mime="text/csv",
+                )
+            with cexp2:
+                # Senza xlsxwriter il pulsante non compare, come prima
+                if importlib.util.find_spec("xlsxwriter") is not None:
                     st.download_button(
-                        label="📥 Scarica Excel",
-                        data=excel_data,
-                        file_name="risultato_opportunity_arbitrage.xlsx",
+                        "Scarica XLSX (Affari Storici)",
+                        functools.partial(
+                            excel_bytes, deals_f, "AffariStorici", engine="xlsxwriter"
+                        ),
+                        file_name="affari_storici.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True,
                     )
-            else:
-                st.warning("Nessun prodotto corrisponde ai filtri selezionati.")
 
-            st.markdown("</div>", unsafe_allow_html=True)
-        else:
-            st.info(
-                "👈 Clicca su 'Calcola Opportunity Score' nella barra laterale per visualizzare i risultati."
-            )
 
-    with tab_rank:
-        if df_ranked is not None and not df_ranked.empty:
-            st.markdown('<div class="result-container">', unsafe_allow_html=True)
-            st.subheader("🏆 Classifica prodotti")
-            st.dataframe(df_ranked, use_container_width=True)
-            st.markdown("</div>", unsafe_allow_html=True)
+STAGE_LABELS = {
+    "load": "Caricamento file",
+    "merge": "Unione delle liste",
+    "parse": "Lettura di prezzi, rank e pesi",
+    "margins": "Calcolo dei margini",
+    "scoring": "Calcolo dell'Opportunity Score",
+    "ranking": "Classifica dei risultati",
+}
+
+
+def open_results_db():
+    """Return the archive of analyses, importing DuckDB on first use."""
+    from results_db import ResultsDB
+
+    return ResultsDB(RESULTS_DB)
+
+
+def store_results(results) -> None:
+    """Put the result frames of an analysis in the session.
+
+    Results with a ``"key"`` go through the shared dataset cache, so the
+    sessions that open the same analysis hold a single copy of its frames.
+    """
+    from compact import compact_results, frame_bytes
+    from datacache import DATASETS
+    from results_db import RESULT_FRAMES
+
+    raw_bytes = sum(frame_bytes(results[name]) for name in RESULT_FRAMES)
+    results = compact_results(results)
+    st.session_state["result_memory"] = (
+        raw_bytes,
+        sum(frame_bytes(results[name]) for name in RESULT_FRAMES),
+    )
+    leases = {}
+    if "key" in results:
+        leases = {
+            name: DATASETS.put(f"{results['key']}:{name}", results[name])
+            for name in RESULT_FRAMES
+        }
+    # Le vecchie lease vengono rilasciate quando la sessione le sostituisce
+    st.session_state["result_leases"] = leases
+    # Salviamo i dati nella sessione per i filtri interattivi
+    for name in RESULT_FRAMES:
+        st.session_state[name] = leases[name].frame if leases else results[name]
+    st.session_state["search_index"] = None
+    st.session_state["deals_data"] = None
+    st.session_state["analysis_include_shipping"] = results["config"].include_shipping
+
+
+def render_job_status() -> None:
+    """Show progress of the background analysis and collect its results."""
+    job = st.session_state.get("analysis_job")
+    if job is None:
+        return
+    if job.running:
+        label = STAGE_LABELS.get(job.stage, "Avvio")
+        st.progress(job.progress, text=f"⏳ {label}... ({job.elapsed:.0f}s)")
+        if st.button("⛔ Annulla analisi", key="cancel_analysis"):
+            job.cancel()
+        if job.partial is not None:
+            st.caption("Anteprima dei migliori risultati (provvisoria)")
+            st.dataframe(job.partial, use_container_width=True)
+        return
+
+    # Il motore è già caricato dal job
+    from engine import AnalysisError
+
+    st.session_state["analysis_job"] = None
+    messages = []
+    if job.status == "done":
+        results = job.result
+        messages += [("warning", msg) for msg in results["warnings"]]
+        st.session_state["analysis_profile"] = results.get("profile")
+        if "routes" in results:
+            st.session_state["matrix_routes"] = results["routes"]
         else:
-            st.info("👈 Calcola le opportunità per vedere la classifica.")
+            store_results(results)
+        if "delta" in results:
+            st.session_state["delta_state"] = results["delta"]
+            stats = results["delta"].stats
+            messages.append(
+                (
+                    "info",
+                    f"Aggiornamento delta: {stats['recomputed']} ASIN ricalcolati "
+                    f"su {stats['asins']}, {stats['reused_rows']} righe riutilizzate.",
+                )
+            )
+    elif job.status == "cancelled":
+        messages.append(("warning", "Analisi annullata."))
+    elif isinstance(job.error, AnalysisError):
+        messages.append(("error", str(job.error)))
+    else:
+        messages.append(("error", f"Errore durante l'analisi: {job.error}"))
+    st.session_state["analysis_messages"] = messages
+    st.rerun()
 
 
 # Inizializzazione delle "ricette" in session_state
@@ -655,12 +760,6 @@ if "filtered_data" not in st.session_state:
 if "ranked_data" not in st.session_state:
     st.session_state["ranked_data"] = None
 
-# Flag to indicate if a previous analysis is available
-analysis_available = (
-    st.session_state["filtered_data"] is not None
-    and not st.session_state["filtered_data"].empty
-)
-
 # State for fullscreen grid view
 if "grid_fullscreen" not in st.session_state:
     st.session_state["grid_fullscreen"] = False
@@ -670,13 +769,17 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-tab_main1, tab_main2, tab_main3, tab_rank, tab_deals = st.tabs(
+# Avanzamento dell'analisi in background
+job_area = st.container()
+
+tab_main1, tab_main2, tab_main3, tab_rank, tab_deals, tab_matrix = st.tabs(
     [
         "📋 ASIN Caricati",
         "📊 Analisi Opportunità",
         "📎 Risultati Dettagliati",
         "🏆 Classifica prodotti",
         "📉 Affari Storici",
+        "🌍 Matrice Arbitraggio",
     ]
 )
 
@@ -687,7 +790,6 @@ with st.sidebar:
     colored_header(
         label="🔄 Caricamento Dati",
         description="Carica i file dei mercati",
-        color_name="blue-70",
     )
 
     files_base = st.file_uploader(
@@ -700,14 +802,34 @@ with st.sidebar:
         type=["csv", "xlsx"],
         accept_multiple_files=True,
     )
+    delta_mode = st.checkbox(
+        "Aggiornamento delta",
+        value=False,
+        help="Export aggiornati degli stessi ASIN: ricalcola solo le righe "
+        "aggiunte o modificate rispetto all'analisi precedente",
+    )
+    use_history = st.checkbox(
+        "Storico locale",
+        value=False,
+        help="Salva ogni export come snapshot e usa lo storico accumulato per "
+        "trend, prezzo equo e volatilità",
+    )
+    matrix_mode = st.checkbox(
+        "Matrice di arbitraggio",
+        value=False,
+        help="Usa ogni file caricato come mercato di acquisto e di vendita e "
+        "trova la rotta migliore di ogni ASIN",
+    )
 
     # Precarica i dati base per mostrare gli ASIN disponibili
     df_base = None
     asin_list = []
     if files_base:
         base_list = []
+        from engine import load_shared
+
         for f in files_base:
-            df_temp = load_data(f)
+            df_temp = load_shared(f)
             if df_temp is not None and not df_temp.empty:
                 base_list.append(df_temp)
         if base_list:
@@ -726,15 +848,12 @@ with st.sidebar:
     colored_header(
         label="💰 Impostazioni Prezzi",
         description="Configurazione prezzi",
-        color_name="blue-70",
     )
     price_options = ["Buy Box 🚚: Current", "Amazon: Current", "New: Current"]
     ref_price_base = st.selectbox("Per la Lista di Origine", price_options)
     ref_price_comp = st.selectbox("Per la Lista di Confronto", price_options)
 
-    colored_header(
-        label="🏷️ Sconto", description="Parametri finanziari", color_name="blue-70"
-    )
+    colored_header(label="🏷️ Sconto", description="Parametri finanziari")
     discount_percent = st.number_input(
         "Sconto sugli acquisti (%)",
         min_value=0.0,
@@ -748,7 +867,6 @@ with st.sidebar:
     colored_header(
         label="🚚 Spedizione",
         description="Calcolo costi di spedizione",
-        color_name="blue-70",
     )
 
     # Visualizzazione dei costi di spedizione
@@ -791,7 +909,6 @@ with st.sidebar:
     colored_header(
         label="📈 Opportunity Score",
         description="Pesi e parametri",
-        color_name="blue-70",
     )
 
     tab1, tab2 = st.tabs(["Parametri Base", "Parametri Avanzati"])
@@ -867,7 +984,6 @@ with st.sidebar:
     colored_header(
         label="🔍 Filtri Avanzati",
         description="Limita i risultati",
-        color_name="blue-70",
     )
     with st.expander("Filtri avanzati"):
         max_sales_rank = st.number_input(
@@ -888,7 +1004,6 @@ with st.sidebar:
     colored_header(
         label="📋 Ricette",
         description="Salva e carica configurazioni",
-        color_name="blue-70",
     )
     selected_recipe = st.selectbox(
         "Carica Ricetta",
@@ -945,6 +1060,28 @@ with st.sidebar:
     st.markdown("---")
     avvia = st.button("🚀 Calcola Opportunity Score", use_container_width=True)
 
+    with st.expander("🗄️ Archivio analisi"):
+        # Senza un archivio su disco la prima pagina non carica DuckDB
+        archive = open_results_db().analyses() if os.path.exists(RESULTS_DB) else None
+        if archive is None or archive.empty:
+            st.caption("Nessuna analisi salvata.")
+        else:
+            labels = {
+                row.key: f"{row.created_at:%Y-%m-%d %H:%M} · "
+                f"{', '.join(json.loads(row.files).get('base', []))} "
+                f"({row.rows_filtered} righe)"
+                for row in archive.itertuples()
+            }
+            archived_key = st.selectbox(
+                "Analisi salvate", list(labels), format_func=labels.get
+            )
+            if st.button("📂 Apri analisi", use_container_width=True):
+                store_results(open_results_db().load(archived_key))
+                st.session_state["analysis_messages"] = [
+                    ("info", "Analisi caricata dall'archivio.")
+                ]
+                st.rerun()
+
 with tab_main1:
     if asin_list:
         asin_text = "\n".join(asin_list)
@@ -969,10 +1106,6 @@ with tab_main1:
     else:
         st.info("Carica una Lista di Origine per visualizzare gli ASIN.")
 
-#################################
-# Funzioni di Caricamento e Parsing
-#################################
-
 #################################
 # Elaborazione Completa e Calcolo Opportunity Score
 #################################
@@ -982,284 +1115,173 @@ if avvia:
             st.error("Carica almeno un file di Lista di Origine.")
         st.stop()
 
-    base_list = []
-    for f in files_base:
-        df_temp = load_data(f)
-        if df_temp is not None and not df_temp.empty:
-            base_list.append(df_temp)
-        else:
-            with tab_main1:
-                st.warning(f"Il file base {f.name} è vuoto o non valido.")
-    if not base_list:
-        with tab_main1:
-            st.error("Nessun file di origine valido caricato.")
-        st.stop()
-
-    df_base = pd.concat(base_list, ignore_index=True)
-
     # Controllo file di confronto
     if not comparison_files:
         with tab_main1:
             st.error("Carica almeno un file di Liste di Confronto.")
         st.stop()
 
-    # Elaborazione Liste di Confronto
-    comp_list = []
-    for f in comparison_files:
-        df_temp = load_data(f)
-        if df_temp is not None and not df_temp.empty:
-            comp_list.append(df_temp)
-        else:
-            with tab_main1:
-                st.warning(f"Il file di confronto {f.name} è vuoto o non valido.")
-    if not comp_list:
-        with tab_main1:
-            st.error("Nessun file di confronto valido caricato.")
-        st.stop()
-    df_comp = pd.concat(comp_list, ignore_index=True)
-
-    # Verifica della presenza della colonna ASIN in entrambi i dataset
-    if "ASIN" not in df_base.columns or "ASIN" not in df_comp.columns:
-        with tab_main1:
-            st.error(
-                "Assicurati che entrambi i file (origine e confronto) contengano la colonna ASIN."
-            )
-        st.stop()
-
-    # Normalizza gli ASIN rimuovendo spazi e usando il maiuscolo
-    df_base["ASIN"] = df_base["ASIN"].str.strip().str.upper()
-    df_comp["ASIN"] = df_comp["ASIN"].str.strip().str.upper()
-
-    # Merge tra base e confronto sulla colonna ASIN
-    df_merged = pd.merge(
-        df_base, df_comp, on="ASIN", how="inner", suffixes=(" (base)", " (comp)")
-    )
-    if df_merged.empty:
-        with tab_main1:
-            st.error(
-                "Nessuna corrispondenza trovata tra la Lista di Origine e le Liste di Confronto."
-            )
-        st.stop()
-
-    # Utilizza le colonne di prezzo selezionate dalla sidebar
-    price_col_base = f"{ref_price_base} (base)"
-    price_col_comp = f"{ref_price_comp} (comp)"
-    df_merged["Price_Base"] = df_merged.get(price_col_base, pd.Series(np.nan)).apply(
-        parse_float
+    from datacache import DATASETS, file_fingerprint
+    from delta import analyze_delta
+    from derived import analyze_incremental
+    from engine import STAGES, EngineConfig, Filters, ScoreWeights, analyze_uploads
+    from matrix import analyze_matrix
+    from outofcore import OutOfCoreSettings, run_out_of_core
+    from results_db import RESULT_FRAMES, analysis_key
+    from snapshots import SnapshotStore, upload_source
+
+    results_db = open_results_db()
+
+    config = EngineConfig(
+        ref_price_base=ref_price_base,
+        ref_price_comp=ref_price_comp,
+        discount=discount,
+        include_shipping=include_shipping,
+        weights=ScoreWeights(
+            alpha=alpha,
+            beta=beta,
+            delta=delta,
+            epsilon=epsilon,
+            zeta=zeta,
+            gamma=gamma,
+            theta=theta,
+            min_margin_multiplier=min_margin_multiplier,
+        ),
+        filters=Filters(
+            max_sales_rank=max_sales_rank,
+            max_offer_count=max_offer_count,
+            min_buybox_price=min_buybox_price,
+            max_buybox_price=max_buybox_price,
+            min_margin_pct=min_margin_pct,
+            min_margin_abs=min_margin_abs,
+        ),
     )
-    df_merged["Price_Comp"] = df_merged.get(price_col_comp, pd.Series(np.nan)).apply(
-        parse_float
+    previous_job = st.session_state.get("analysis_job")
+    if previous_job is not None:
+        previous_job.cancel()
+
+    history = SnapshotStore(SNAPSHOT_DIR) if use_history else None
+    files_meta = {
+        "base": [f.name for f in files_base],
+        "comp": [f.name for f in comparison_files],
+    }
+    fingerprints_base = [file_fingerprint(f) for f in files_base]
+    fingerprints_comp = [file_fingerprint(f) for f in comparison_files]
+    # La versione dello storico è quella dopo l'ingestione di questi file,
+    # così la stessa analisi ritrova il proprio archivio
+    key = analysis_key(
+        fingerprints_base,
+        fingerprints_comp,
+        config,
+        history=history.version(
+            [upload_source(fingerprints_base), upload_source(fingerprints_comp)]
+        )
+        if history is not None
+        else None,
     )
 
-    # Conversione dei dati dal mercato di confronto per le altre metriche
-    df_merged["SalesRank_Comp"] = df_merged.get(
-        "Sales Rank: Current (comp)", pd.Series(np.nan)
-    ).apply(parse_int)
-    df_merged["Bought_Comp"] = df_merged.get(
-        "Bought in past month (comp)", pd.Series(np.nan)
-    ).apply(parse_int)
-    df_merged["NewOffer_Comp"] = df_merged.get(
-        "New Offer Count: Current (comp)", pd.Series(np.nan)
-    ).apply(parse_int)
-    # Leggi anche il Sales Rank a 30 giorni, se presente
-    df_merged["SalesRank_30d"] = df_merged.get(
-        "Sales Rank: 30 days avg. (comp)", pd.Series(np.nan)
-    ).apply(parse_int)
-
-    # Estrai informazioni sul peso
-    # Cerca in varie colonne che potrebbero contenere informazioni sul peso
-    possible_weight_cols = [
-        "Weight (base)",
-        "Item Weight (base)",
-        "Package: Weight (kg) (base)",
-        "Package: Weight (g) (base)",
-        "Product details (base)",
-        "Features (base)",
-    ]
-
-    # Inizializza colonna peso
-    df_merged["Weight_kg"] = np.nan
-
-    # Cerca nelle possibili colonne di peso
-    for col in possible_weight_cols:
-        if col in df_merged.columns:
-            if "(g)" in col:
-                # Valori espressi in grammi
-                def to_kg(val):
-                    if pd.isna(val):
-                        return np.nan
-                    try:
-                        num = re.search(r"(\d+\.?\d*)", str(val))
-                        return float(num.group(1)) / 1000 if num else np.nan
-                    except Exception:
-                        return np.nan
-
-                weight_data = df_merged[col].apply(to_kg)
-            else:
-                weight_data = df_merged[col].apply(parse_weight)
-            # Aggiorna solo i valori mancanti
-            df_merged.loc[df_merged["Weight_kg"].isna(), "Weight_kg"] = weight_data.loc[
-                df_merged["Weight_kg"].isna()
-            ]
-
-    # Se non ci sono informazioni sul peso, imposta un valore predefinito
-    df_merged["Weight_kg"] = df_merged["Weight_kg"].fillna(
-        1.0
-    )  # Assume 1kg come predefinito
-
-    # Calcola il costo di spedizione per ogni prodotto
-    df_merged["Shipping_Cost"] = df_merged["Weight_kg"].apply(calculate_shipping_cost)
-
-    # Calcolo del prezzo d'acquisto netto per ogni prodotto dalla lista di origine
-    # Utilizzo della funzione aggiornata con IVA variabile
-    df_merged["Acquisto_Netto"] = df_merged.apply(
-        lambda row: calc_final_purchase_price(row, discount), axis=1
-    )
+    # File molto grandi: elaborazione a blocchi con spill su disco
+    upload_mb = sum(
+        getattr(f, "size", 0) for f in [*files_base, *comparison_files]
+    ) / (1024 * 1024)
+    if upload_mb >= OUT_OF_CORE_MIN_UPLOAD_MB:
+        ignored = [
+            name
+            for name, enabled in (
+                ("Aggiornamento delta", delta_mode),
+                ("Storico locale", use_history),
+            )
+            if enabled
+        ]
+
+        def run_job(report):
+            return run_out_of_core(
+                files_base,
+                comparison_files,
+                config,
+                OutOfCoreSettings(),
+                report,
+                ignored_options=ignored,
+            )
+    elif delta_mode:
+        previous_delta = st.session_state.get("delta_state")
 
-    # NUOVA LOGICA: Calcolo del margine stimato considerando IVA correttamente
-    # 1. Prezzo nel mercato di confronto (lordo IVA)
-    # 2. Prezzo di acquisto netto (già senza IVA)
-    # 3. Margine = Prezzo confronto / (1 + IVA) - Prezzo acquisto netto
+        def run_job(report):
+            return analyze_delta(
+                files_base, comparison_files, config, report, previous_delta, history
+            )
+    elif PIPELINE_WORKERS > 1:
+        def run_job(report):
+            return analyze_uploads(
+                files_base, comparison_files, config, report, PIPELINE_WORKERS, history
+            )
+    else:
+        # Ricalcola solo le colonne toccate dai parametri modificati, con la
+        # cache condivisa tra le sessioni che analizzano gli stessi file
+        def run_job(report):
+            return analyze_incremental(
+                files_base, comparison_files, config, report, history
+            )
 
-    df_merged["Price_Comp"] = df_merged["Price_Comp"].fillna(0)
+    if matrix_mode:
+        # Tutti i mercati caricati, ognuno sia origine sia destinazione
+        def run_job(report):
+            return analyze_matrix([*files_base, *comparison_files], config, report)
 
-    # Prezzo netto di vendita nel mercato di confronto (senza IVA)
-    df_merged["Vendita_Netto"] = df_merged.apply(
-        lambda row: row["Price_Comp"]
-        / (
-            1 + VAT_RATES.get(normalize_locale(row.get("Locale (comp)", "")), 0) / 100.0
-        ),
-        axis=1,
+    profile = PipelineProfile(
+        "analysis", memory=StageMemory() if PROFILE_ALLOCATIONS else None
     )
 
-    # Margine stimato e percentuale rispetto al prezzo d'acquisto
-    df_merged["Margine_Stimato"] = (
-        df_merged["Vendita_Netto"] - df_merged["Acquisto_Netto"]
-    )
-    df_merged["Margine_%"] = (
-        df_merged["Margine_Stimato"] / df_merged["Acquisto_Netto"]
-    ) * 100
-
-    # Calcolo del margine netto con o senza costi di spedizione
-    if include_shipping:
-        df_merged["Margine_Netto"] = (
-            df_merged["Margine_Stimato"] - df_merged["Shipping_Cost"]
+    def run_profiled(report, run=run_job):
+        # Il profilo è attivo solo nel thread dell'analisi
+        with profile.activate():
+            results = run(report)
+        results["profile"] = profile
+        profile.append_log(PERF_LOG)
+        return results
+
+    def run_and_save(report, run=run_profiled):
+        start = time.perf_counter()
+        results = run(report)
+        results["key"] = key
+        results_db.save(
+            key, results, files_meta, elapsed_s=time.perf_counter() - start
         )
-        df_merged["Margine_Netto_%"] = (
-            df_merged["Margine_Netto"] / df_merged["Acquisto_Netto"]
-        ) * 100
-    else:
-        df_merged["Margine_Netto"] = df_merged["Margine_Stimato"]
-        df_merged["Margine_Netto_%"] = df_merged["Margine_%"]
-
-    # Margine percentuale lordo per riferimento
-    df_merged["Margin_Pct_Lordo"] = (
-        (df_merged["Price_Comp"] - df_merged["Price_Base"]) / df_merged["Price_Base"]
-    ) * 100
-
-    df_merged["SalesRank_Comp"] = df_merged["SalesRank_Comp"].fillna(999999)
-    df_merged["NewOffer_Comp"] = df_merged["NewOffer_Comp"].fillna(0)
-    mask = (
-        (df_merged["Margine_Netto_%"] > min_margin_pct)
-        & (df_merged["Margine_Netto"] > min_margin_abs)
-        & (df_merged["SalesRank_Comp"] <= max_sales_rank)
-        & (df_merged["NewOffer_Comp"] <= max_offer_count)
-        & (df_merged["Price_Comp"].between(min_buybox_price, max_buybox_price))
-    )
-    df_merged = df_merged[mask]
+        return results
 
-    # Calcolo del bonus/penalità per il Trend del Sales Rank
-    df_merged["Trend_Bonus"] = np.log(
-        (df_merged["SalesRank_30d"].fillna(df_merged["SalesRank_Comp"]) + 1)
-        / (df_merged["SalesRank_Comp"] + 1)
-    )
-    # Formattiamo il trend in una stringa con icona
-    df_merged["Trend"] = df_merged["Trend_Bonus"].apply(format_trend)
-
-    df_merged["Norm_Rank"] = np.log(df_merged["SalesRank_Comp"].fillna(999999) + 10)
-    df_merged["Volume_Score"] = 1000 / df_merged["Norm_Rank"]
-    df_merged["ROI_Factor"] = df_merged["Margine_Netto"] / df_merged["Acquisto_Netto"]
-
-    weights = {
-        "margin": epsilon + theta,
-        "demand": beta + gamma,
-        "competition": delta,
-        "volatility": zeta,
-        "risk": alpha,
-    }
-    df_scores = compute_scores(df_merged, weights)
-    df_merged["Opportunity_Score"] = df_scores["final_score"]
-
-    min_margin_threshold = min_margin_abs * min_margin_multiplier
-    df_merged.loc[
-        df_merged["Margine_Netto"] < min_margin_threshold, "Opportunity_Score"
-    ] *= (df_merged["Margine_Netto"] / min_margin_threshold)
-
-    # Classificazione dell'opportunità - Correzione dell'errore
-    # Invece di assegnare una Series a due colonne, creiamo le colonne separatamente
-    df_merged["Opportunity_Class"] = df_merged["Opportunity_Score"].apply(
-        lambda score: classify_opportunity(score)[
-            0
-        ]  # Solo il primo elemento della tupla
-    )
-    df_merged["Opportunity_Tag"] = df_merged["Opportunity_Score"].apply(
-        lambda score: classify_opportunity(score)[
-            1
-        ]  # Solo il secondo elemento della tupla
-    )
-
-    # Aggiunta dell'informazione sulle aliquote IVA utilizzate
-    df_merged["IVA_Origine"] = df_merged["Locale (base)"].map(
-        lambda x: f"{VAT_RATES.get(normalize_locale(x), 0)}%"
-    )
-    df_merged["IVA_Confronto"] = df_merged["Locale (comp)"].map(
-        lambda x: f"{VAT_RATES.get(normalize_locale(x), 0)}%"
-    )
-
-    # Ordiniamo i risultati per Opportunity Score decrescente
-    df_merged = df_merged.sort_values("Opportunity_Score", ascending=False)
-
-    # Salva il dataset completo nella sessione per utilizzi futuri
-    st.session_state["full_data"] = df_merged
-
-    # Selezione delle colonne finali da visualizzare
-    cols_final = [c for c in DISPLAY_COLS_ORDER if c in df_merged.columns]
-    df_finale = df_merged[cols_final].copy()
-
-    # Arrotonda i valori numerici principali a 2 decimali
-    cols_to_round = [
-        "Price_Base",
-        "Acquisto_Netto",
-        "Price_Comp",
-        "Vendita_Netto",
-        "Margine_Stimato",
-        "Shipping_Cost",
-        "Margine_Netto",
-        "Margine_Netto_%",
-        "Margine_%",
-        "Opportunity_Score",
-        "Volume_Score",
-        "Weight_kg",
-    ]
-    for col in cols_to_round:
-        if col in df_finale.columns:
-            df_finale[col] = df_finale[col].round(2)
+    if matrix_mode:
+        st.session_state["analysis_job"] = BackgroundJob(run_profiled, STAGES).start()
+        st.session_state["analysis_messages"] = []
+    else:
+        shared_keys = {f"{key}:{name}": name for name in RESULT_FRAMES}
+        # Le lease servono solo a copiare i risultati di un'altra sessione:
+        # store_results tiene le proprie, queste si chiudono con il blocco
+        with DATASETS.acquire_all(shared_keys) as shared:
+            if shared is not None:
+                # Un'altra sessione ha già in memoria la stessa analisi
+                results = {shared_keys[k]: lease.frame for k, lease in shared.items()}
+                store_results({**results, "key": key, "config": config})
+                st.session_state["analysis_messages"] = []
+            elif results_db.exists(key):
+                # Stessi file e parametri: riapriamo l'analisi salvata
+                store_results(results_db.load(key))
+                st.session_state["analysis_messages"] = [
+                    ("info", "Analisi già calcolata: risultati caricati dall'archivio.")
+                ]
+            else:
+                # L'analisi gira in un thread separato: lo script resta reattivo
+                st.session_state["analysis_job"] = BackgroundJob(
+                    run_and_save, STAGES
+                ).start()
+                st.session_state["analysis_messages"] = []
 
-    # Classifica cross-country per ASIN
-    df_ranked = aggregate_opportunities(df_finale)
+with tab_main1:
+    for level, message in st.session_state.get("analysis_messages", []):
+        getattr(st, level)(message)
 
-    # Salviamo i dati nella sessione per i filtri interattivi
-    st.session_state["filtered_data"] = df_finale
-    st.session_state["ranked_data"] = df_ranked
-    analysis_available = True
-
-    render_results(df_finale, df_ranked, include_shipping)
-elif analysis_available:
-    render_results(
-        st.session_state["filtered_data"],
-        st.session_state["ranked_data"],
-        include_shipping,
-    )
+if st.session_state.get("analysis_job") is not None:
+    with job_area:
+        st.fragment(render_job_status, run_every=1.0)()
 
 # Aggiunta dell'help
 with st.expander("ℹ️ Come funziona l'Opportunity Score"):
@@ -1310,244 +1332,90 @@ with st.expander("ℹ️ Come funziona l'Opportunity Score"):
     """
     )
 
-# Tab Affari Storici
-df_final = st.session_state.get("full_data")
-
-with tab_deals:
-    st.subheader("Affari Storici")
-
-    colw1, colw2, colw3, colw4, colw5 = st.columns(5)
-    with colw1:
-        w1 = st.slider("Peso Sottoprezzo", 0.0, 1.0, 0.30, 0.05)
-    with colw2:
-        w2 = st.slider("Peso Margine %", 0.0, 1.0, 0.25, 0.05)
-    with colw3:
-        w3 = st.slider("Peso Domanda", 0.0, 1.0, 0.25, 0.05)
-    with colw4:
-        w4 = st.slider("Penalità Concorrenza", 0.0, 1.0, 0.10, 0.05)
-    with colw5:
-        w5 = st.slider("Penalità Volatilità", 0.0, 1.0, 0.10, 0.05)
-
-    c1, c2, c3 = st.columns(3)
-    with c1:
-        min_marg_eur = st.number_input("Margine minimo €", 0.0, 10000.0, 10.0)
-        min_under = st.number_input(
-            "Sottoprezzo minimo %", 0.0, 1.0, 0.10, format="%.2f"
-        )
-    with c2:
-        min_marg_pct = st.number_input(
-            "Margine minimo %", 0.0, 1.0, 0.10, format="%.2f"
+# Sezioni dei risultati (frammenti con rerun indipendente)
+rerun_profile = PipelineProfile("rerun")
+with rerun_profile.activate():
+    with tab_main2, rerun_profile.stage("render_dashboard"):
+        render_dashboard()
+    with tab_main3, rerun_profile.stage("render_details"):
+        render_details()
+    with tab_rank, rerun_profile.stage("render_ranking"):
+        render_ranking()
+    with tab_deals, rerun_profile.stage("render_deals"):
+        render_deals()
+    with tab_matrix, rerun_profile.stage("render_matrix"):
+        render_matrix()
+
+if rerun_capture is not None:
+    rerun_capture.stop().save(PROFILE_DIR)
+    st.session_state["rerun_capture"] = rerun_capture
+
+
+def arm_rerun_capture() -> None:
+    """Profile the next full rerun when the diagnostics toggle is switched on."""
+    armed = st.session_state["capture_next_rerun"]
+    st.session_state["rerun_capture_state"] = "armed" if armed else None
+
+
+# Memoria dei frame della sessione, dopo l'eventuale nuovo risultato: la
+# misura percorre tutti i frame, quindi solo su richiesta
+measure_session = st.session_state.get("measure_session_memory", False)
+if measure_session:
+    rerun_profile.record_session(st.session_state)
+session_total = sum(rerun_profile.session.values())
+
+with st.expander("⏱️ Diagnostica prestazioni"):
+    analysis_profile = st.session_state.get("analysis_profile")
+    if analysis_profile is not None:
+        st.caption(
+            f"Ultima analisi: {analysis_profile.total_seconds:.2f}s "
+            f"({analysis_profile.created_at:%H:%M:%S})"
         )
-        max_rank = st.number_input("Rank massimo", 0.0, 1e7, 200000.0)
-    with c3:
-        max_offers = st.number_input("Max offerte nuove", 0, 1000, 50)
-        max_vol = st.number_input("Max volatilità (std 90d)", 0.0, 10000.0, 50.0)
-
-    excl_amz_bb = st.checkbox(
-        "Escludi se %Amazon in Buy Box > 50%", value=True
+        st.dataframe(analysis_profile.report(), use_container_width=True)
+        st.caption("Memoria dei frame intermedi dell'analisi")
+        st.dataframe(analysis_profile.memory_report(), use_container_width=True)
+    st.caption(f"Rendering di questa esecuzione: {rerun_profile.total_seconds:.2f}s")
+    st.dataframe(rerun_profile.report(), use_container_width=True)
+    st.toggle(
+        "Misura la memoria della sessione",
+        key="measure_session_memory",
+        help="Misura i frame della sessione e registra ogni esecuzione in "
+        f"{PERF_LOG}. Rallenta ogni esecuzione con molti dati.",
     )
-    only_amz_oos = st.checkbox(
-        "Solo prodotti con Amazon OOS negli ultimi 90 giorni", value=False
+    if measure_session:
+        st.caption(f"Memoria dei frame della sessione: {session_total / 2**20:.2f} MB")
+    st.dataframe(rerun_profile.memory_report(), use_container_width=True)
+    st.caption(f"Registro: {PERF_LOG}")
+    st.toggle(
+        "Profila la prossima esecuzione completa (cProfile)",
+        key="capture_next_rerun",
+        on_change=arm_rerun_capture,
+        help=f"In alternativa apri l'app con ?{CAPTURE_QUERY_PARAM}=1 nell'URL",
     )
-
-    deals_df = compute_historic_deals(df_final)
-
-    if deals_df.empty:
-        st.info("Nessun dato disponibile per Affari Storici.")
-    else:
-        vol_series = deals_df["Volatility"].replace([np.inf, -np.inf], np.nan)
-        vol_thr = (
-            np.nanpercentile(vol_series.dropna(), 75)
-            if vol_series.notna().any()
-            else np.nan
+    last_capture = st.session_state.get("rerun_capture")
+    if last_capture is not None:
+        st.caption(
+            f"Profilo dell'esecuzione delle {last_capture.created_at:%H:%M:%S}: "
+            f"{last_capture.seconds:.2f}s, salvato in {last_capture.path}. "
+            "Le analisi in background non sono incluse."
         )
-        if math.isfinite(vol_thr):
-            deals_df["Badge_VolHigh"] = deals_df["Volatility"] > vol_thr
-
-        def pct_amz_bb(row):
-            s = [
-                float_or_nan(row.get("Buy Box: % Amazon 90 days")),
-                float_or_nan(row.get("Buy Box: % Amazon 180 days")),
-            ]
-            return max([x for x in s if math.isfinite(x)] + [0.0])
-
-        mask = pd.Series(True, index=deals_df.index)
-        if math.isfinite(min_marg_eur):
-            mask &= deals_df["Marg€"].fillna(-1e9) >= min_marg_eur
-        if math.isfinite(min_marg_pct):
-            mask &= deals_df["Marg%"].fillna(-1e9) >= min_marg_pct
-        if math.isfinite(min_under):
-            mask &= deals_df["UnderPct"].fillna(-1e9) >= min_under
-        mask &= (
-            deals_df.get(
-                "Sales Rank: Current", pd.Series(np.nan, index=deals_df.index)
-            )
-            .apply(float_or_nan)
-            .fillna(1e12)
-            <= max_rank
-        )
-        mask &= (
-            deals_df.get(
-                "New Offer Count: Current", pd.Series(np.nan, index=deals_df.index)
+        st.dataframe(last_capture.top(), use_container_width=True)
+        if last_capture.path.exists():
+            st.download_button(
+                "Scarica il profilo (.prof)",
+                data=last_capture.path.read_bytes(),
+                file_name=last_capture.path.name,
             )
-            .apply(float_or_nan)
-            .fillna(1e9)
-            <= max_offers
-        )
-        mask &= deals_df["Volatility"].fillna(0) <= max_vol
-        if excl_amz_bb:
-            mask &= deals_df.apply(lambda r: pct_amz_bb(r) <= 50.0, axis=1)
-        if only_amz_oos:
-            mask &= (
-                deals_df.get(
-                    "Amazon: 90 days OOS", pd.Series(0, index=deals_df.index)
-                ).fillna(0)
-                > 0
-            )
-
-        deals_f = deals_df[mask].copy()
-
-        if deals_f.empty:
-            st.info("Nessun affare storico trovato con i filtri correnti.")
-        else:
-            S_under = scale_0_100(deals_f["UnderPct"])
-            S_marg = scale_0_100(deals_f["Marg%"])
-            S_dem = scale_0_100(deals_f["Demand"])
-            S_comp = scale_0_100(deals_f["Competition"])
-            S_vol = scale_0_100(deals_f["Volatility"])
-
-            deals_f["DealScore"] = (
-                w1 * S_under
-                + w2 * S_marg
-                + w3 * S_dem
-                - w4 * S_comp
-                - w5 * S_vol
-            )
-            deals_f["DealScore"] = scale_0_100(deals_f["DealScore"])
-
-            k1, k2, k3, k4 = st.columns(4)
-            with k1:
-                st.metric("Prodotti (filtrati)", len(deals_f))
-            with k2:
-                st.metric(
-                    "Margine medio %",
-                    f"{np.nanmean(deals_f['Marg%']) * 100:0.1f}%",
-                )
-            with k3:
-                st.metric(
-                    "Sottoprezzo medio %",
-                    f"{np.nanmean(deals_f['UnderPct']) * 100:0.1f}%",
-                )
-            with k4:
-                st.metric(
-                    "DealScore medio",
-                    f"{np.nanmean(deals_f['DealScore']):0.1f}",
-                )
-
-            try:
-                scatter = (
-                    alt.Chart(deals_f.reset_index())
-                    .mark_circle()
-                    .encode(
-                        x=alt.X("UnderPct:Q", title="Sottoprezzo %"),
-                        y=alt.Y("Marg%:Q", title="Margine %"),
-                        color=alt.Color("DealScore:Q"),
-                        size=alt.Size("Demand:Q"),
-                        tooltip=[
-                            "ASIN:N",
-                            "Title:N",
-                            "UnderPct:Q",
-                            "Marg%:Q",
-                            "DealScore:Q",
-                        ],
-                    )
-                    .interactive()
-                )
-                st.altair_chart(scatter, use_container_width=True)
-
-                hist = (
-                    alt.Chart(deals_f)
-                    .mark_bar()
-                    .encode(
-                        x=alt.X("DealScore:Q", bin=alt.Bin(maxbins=30), title="DealScore"),
-                        y="count()",
-                    )
-                )
-                st.altair_chart(hist, use_container_width=True)
-            except Exception:
-                pass
-
-            show_cols = [
-                c
-                for c in [
-                    "Locale",
-                    "ASIN",
-                    "Title",
-                    "PriceNowGrossAfterDisc",
-                    "FairPrice",
-                    "UnderPct",
-                    "NetSale",
-                    "ReferralFee€",
-                    "Fulfillment€",
-                    "NetProceed€",
-                    "Acquisto_Netto",
-                    "Marg€",
-                    "Marg%",
-                    "Demand",
-                    "Competition",
-                    "Volatility",
-                    "DealScore",
-                    "URL: Amazon",
-                    "Brand",
-                ]
-                if c in deals_f.columns
-            ]
-
-            disp = deals_f.copy()
-            for c in [
-                "PriceNowGrossAfterDisc",
-                "FairPrice",
-                "NetSale",
-                "ReferralFee€",
-                "Fulfillment€",
-                "NetProceed€",
-                "Acquisto_Netto",
-                "Marg€",
-            ]:
-                if c in disp.columns:
-                    disp[c] = disp[c].map(
-                        lambda v: f"€ {v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-                        if pd.notna(v)
-                        else v
-                    )
-            disp = disp.sort_values("DealScore", ascending=False)
-            st.dataframe(disp[show_cols], use_container_width=True)
-
-            cexp1, cexp2 = st.columns(2)
-            with cexp1:
-                csv = deals_f.to_csv(index=False).encode("utf-8")
-                st.download_button(
-                    "Scarica CSV (Affari Storici)",
-                    csv,
-                    file_name="affari_storici.csv",
-                    mime="text/csv",
-                )
-            with cexp2:
-                try:
-                    import io
-                    from pandas import ExcelWriter
-
-                    bio = io.BytesIO()
-                    with pd.ExcelWriter(bio, engine="xlsxwriter") as writer:
-                        deals_f.to_excel(writer, index=False, sheet_name="AffariStorici")
-                    st.download_button(
-                        "Scarica XLSX (Affari Storici)",
-                        bio.getvalue(),
-                        file_name="affari_storici.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
-                except Exception:
-                    pass
+if measure_session and st.session_state.get("filtered_data") is not None:
+    rerun_profile.append_log(PERF_LOG)
+
+if "result_memory" in st.session_state:
+    raw_bytes, compact_bytes = st.session_state["result_memory"]
+    st.sidebar.caption(
+        f"Memoria risultati: {compact_bytes / 2**20:.2f} MB "
+        f"(non compatti {raw_bytes / 2**20:.2f} MB)"
+        + (f" · sessione: {session_total / 2**20:.2f} MB" if measure_session else "")
+    )
 
 # Footer
 st.markdown(
@@ -0,0 +1 @@
+"""Synthetic data and speed benchmarks of the analysis pipeline."""
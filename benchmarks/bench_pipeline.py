@@ -0,0 +1,248 @@
+"""Stage timings of the analysis pipeline on synthetic exports.
+
+Example::
+
+    python -m benchmarks.bench_pipeline --rows 10000 100000 --repeat 3
+
+Each run appends one JSON line per size to the results file, with the best
+and median time of every stage, and compares it with the previous run of the
+same size: stages slower than ``--threshold`` times the previous best are
+reported as regressions.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from benchmarks.synthetic import BENCH_SIZES, make_pair, write_export
+from cli import write_frame
+from deals import compute_historic_deals
+from engine import (
+    EngineConfig,
+    add_row_features,
+    apply_scores,
+    compute_margins,
+    finalize_results,
+    merge_frames,
+    parse_columns,
+)
+from loaders import load_data
+from score import compute_scores
+
+RESULTS_FILE = Path(__file__).with_name("results.jsonl")
+
+# Rallentamento oltre il quale una fase è segnalata come regressione
+REGRESSION_THRESHOLD = 1.25
+
+
+def _rows(value: Any) -> Optional[int]:
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, dict) and "filtered_data" in value:
+        return len(value["filtered_data"])
+    return None
+
+
+def run_stages(
+    base_path: Path, comp_path: Path, config: EngineConfig, workdir: Path
+) -> Dict[str, Dict[str, Any]]:
+    """Run every stage once on the exported files; return seconds and rows out."""
+    timings: Dict[str, Dict[str, Any]] = {}
+
+    def timed(name: str, func: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        result = func()
+        timings[name] = {"seconds": time.perf_counter() - start, "rows": _rows(result)}
+        return result
+
+    with ExitStack() as stack:
+        f_base = stack.enter_context(open(base_path, "rb"))
+        f_comp = stack.enter_context(open(comp_path, "rb"))
+        df_base = timed("load", lambda: load_data(f_base))
+        df_comp = load_data(f_comp)
+
+    df = timed("merge", lambda: merge_frames(df_base, df_comp))
+    # parse_columns lavora sul posto: si riporta il frame per contarne le righe
+    timed("parse", lambda: parse_columns(df, config) or df)
+    df = timed("margins", lambda: compute_margins(df, config))
+    df = timed("features", lambda: add_row_features(df))
+    timed("compute_scores", lambda: compute_scores(df, config.weights.components()))
+    df = timed("apply_scores", lambda: apply_scores(df, config))
+    results = timed("finalize", lambda: finalize_results(df))
+    timed("historic_deals", lambda: compute_historic_deals(results["full_data"]))
+
+    filtered = results["filtered_data"]
+    timed("export_csv", lambda: write_frame(filtered, workdir / "out.csv"))
+    timed("export_parquet", lambda: write_frame(filtered, workdir / "out.parquet"))
+    timed("export_xlsx", lambda: filtered.to_excel(workdir / "out.xlsx", index=False))
+    return timings
+
+
+def _commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def benchmark(
+    rows: int,
+    repeat: int = 3,
+    seed: int = 0,
+    config: Optional[EngineConfig] = None,
+    label: str = "",
+) -> Dict[str, Any]:
+    """Time the stages ``repeat`` times on a synthetic pair of ``rows`` rows."""
+    config = config or EngineConfig()
+    base, comp = make_pair(rows, seed)
+    runs: List[Dict[str, Dict[str, Any]]] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        base_path = write_export(base, workdir / "base.csv")
+        comp_path = write_export(comp, workdir / "comp.csv")
+        del base, comp
+        for _ in range(repeat):
+            runs.append(run_stages(base_path, comp_path, config, workdir))
+
+    stages = {
+        name: {
+            "best": min(run[name]["seconds"] for run in runs),
+            "median": statistics.median(run[name]["seconds"] for run in runs),
+            "rows": runs[-1][name]["rows"],
+        }
+        for name in runs[0]
+    }
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "label": label,
+        "commit": _commit(),
+        "rows": rows,
+        "repeat": repeat,
+        "seed": seed,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "stages": stages,
+    }
+
+
+def load_runs(path: str | Path = RESULTS_FILE) -> List[Dict[str, Any]]:
+    """Return the stored runs, oldest first."""
+    path = Path(path)
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+def save_run(run: Dict[str, Any], path: str | Path = RESULTS_FILE) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps(run) + "\n")
+
+
+def previous_run(
+    runs: List[Dict[str, Any]], rows: int, label: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """Return the latest stored run of ``rows`` rows, optionally with ``label``."""
+    for run in reversed(runs):
+        if run["rows"] == rows and (label is None or run["label"] == label):
+            return run
+    return None
+
+
+def compare(
+    current: Dict[str, Any],
+    previous: Dict[str, Any],
+    threshold: float = REGRESSION_THRESHOLD,
+) -> pd.DataFrame:
+    """Return the best time of each stage in both runs and their ratio."""
+    rows = []
+    for name, stage in current["stages"].items():
+        before = previous["stages"].get(name, {}).get("best")
+        ratio = stage["best"] / before if before else None
+        rows.append(
+            {
+                "stage": name,
+                "before_s": before,
+                "now_s": stage["best"],
+                "ratio": ratio,
+                "regression": ratio is not None and ratio > threshold,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Misura i tempi delle fasi della pipeline su export sintetici."
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[BENCH_SIZES[0]],
+        help=f"Righe per export (es. {' '.join(map(str, BENCH_SIZES))})",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni per fase")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="Etichetta della misura")
+    parser.add_argument("--results", default=str(RESULTS_FILE), help="File JSON lines")
+    parser.add_argument(
+        "--baseline", help="Confronta con l'ultima misura con questa etichetta"
+    )
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument(
+        "--no-save", action="store_true", help="Non salvare la misura"
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Esci con codice 1 se una fase è più lenta della soglia",
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    stored = load_runs(args.results)
+    regressions = False
+    for rows in args.rows:
+        run = benchmark(rows, args.repeat, args.seed, label=args.label)
+        print(f"\n{rows} righe ({args.repeat} ripetizioni)")
+        previous = previous_run(stored, rows, args.baseline)
+        if previous is None:
+            table = pd.DataFrame(
+                [{"stage": k, "now_s": v["best"]} for k, v in run["stages"].items()]
+            )
+        else:
+            table = compare(run, previous, args.threshold)
+            regressions |= bool(table["regression"].any())
+            print(f"confronto con {previous['time']} ({previous.get('commit')})")
+        print(table.to_string(index=False, float_format="{:.4f}".format))
+        if not args.no_save:
+            save_run(run, args.results)
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
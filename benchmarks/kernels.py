@@ -0,0 +1,374 @@
+"""Equivalence and speed of the scalar kernels and their batched versions.
+
+Example::
+
+    python -m benchmarks.kernels --rows 100000 --seeds 3
+
+Every kernel is run row by row, as the pipeline used to call it, and as one
+array operation on the same inputs. The inputs are random values in the
+formats of the exports plus a fixed pool of adversarial values (empty and
+malformed text, thousands separators, Unicode digits, signed zeros,
+infinities, mixed Python types, missing columns), tiled at the start of
+every frame so every run covers all of them. The two results must agree
+within the tolerance and have NaN in the same rows; the table reports the
+speedup of the batched version.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from deals import (
+    FAIR_PRICE_COLUMNS,
+    apply_discounts,
+    competition_score,
+    competition_scores,
+    demand_score,
+    demand_scores,
+    discounted_prices,
+    fair_price_row,
+    fair_prices,
+)
+from loaders import parse_weight, parse_weights
+from score import (
+    calc_final_purchase_price,
+    calculate_shipping_cost,
+    final_purchase_prices,
+    shipping_costs,
+)
+
+RTOL = 1e-9
+ATOL = 1e-12
+
+# Quota di valori avversari sparsi tra quelli casuali
+ODD_RATE = 0.05
+
+# Sconto usato per i prezzi d'acquisto
+DISCOUNT = 0.21
+
+# Valori non testuali che le colonne object degli export possono contenere
+ODD_VALUES = [
+    None, np.nan, pd.NA, True, False, 0, -3, 7, 2.5, -0.0, np.inf, -np.inf, 1e300,
+    np.float64(3.3), np.int64(4),
+]
+
+NUMBER_TEXTS = [
+    "12,34", "12.34", "€ 12,34", "12,34 €", "1.234,56", "1,234.56", "1.234.567",
+    "1,2,3", "12 %", "5%", " 12,5", "1 234,5", " 7 ", "", " ", "abc",
+    "nan", "NaN", "inf", "-inf", "Infinity", "-5", "0", "0,0", "-0", "1e3",
+    "1E-3", "١٢", "1_000", "0x10", "+3", "--3", ".5", "5.", ",5", "5,", "\t9\n",
+    "\x1c8\x1c", "9" * 30, "1e400", "yes", "None", "True", "€", "€€5",
+]
+
+WEIGHT_TEXTS = [
+    "350 g", "1,2 kg", "0,04 kg", "0.45 Kilograms", "12kg", "1.5 KG", "abc g", "",
+    "  7 ", "7\n", "7 \n", "g", "kg", "1.2.3 kg", "١٢ kg", "12 G", "1.5 lbs",
+    "kg 5", "5 grams", "0.0 kg", "10 kg 500 g", "500 g 1 kg", "12.", "İ 3 kg",
+    "3 Kg", "0 g", "1e3 g",
+]
+
+LOCALE_VALUES = [
+    "it", "IT", " it ", "Amazon.it", "de", "de-DE", "gb", "uk", "Amazon.co.uk",
+    "fr", "es", "xx", "", "it-IT", "i", None, np.nan, 5,
+]
+
+SHIPPING_WEIGHTS = [
+    np.nan, -1.0, -0.0, 0.0, 1e-9, 3.0, 3.0000001, 4.0, 5.0, 10.0, 25.0, 50.0,
+    100.0, 100.0001, 1e9, np.inf, -np.inf,
+]
+
+
+def _tiled(pool: Sequence[Any], n: int) -> np.ndarray:
+    out = np.empty(n, dtype=object)
+    values = np.empty(len(pool), dtype=object)
+    values[:] = list(pool)
+    out[:] = np.resize(values, n)
+    return out
+
+
+def _mixed(
+    rng: np.random.Generator, n: int, random: np.ndarray, pool: Sequence[Any]
+) -> np.ndarray:
+    """``random`` with the adversarial ``pool`` first and sprinkled after it."""
+    out = random.astype(object)
+    head = min(n, len(pool))
+    out[:head] = list(pool)[:head]
+    odd = rng.random(n) < ODD_RATE
+    out[odd] = _tiled(pool, int(odd.sum()))
+    return out
+
+
+def _prices(rng: np.random.Generator, n: int, low: float, high: float) -> np.ndarray:
+    values = np.round(rng.uniform(low, high, n), 2).astype(str)
+    style = rng.integers(0, 4, n)
+    comma = np.char.replace(values, ".", ",")
+    forms = [values, comma, np.char.add("€ ", comma), np.char.add(comma, " €")]
+    return np.choose(style, forms)
+
+
+def _number_column(
+    rng: np.random.Generator, n: int, low: float, high: float
+) -> np.ndarray:
+    return _mixed(rng, n, _prices(rng, n, low, high), NUMBER_TEXTS + ODD_VALUES)
+
+
+def _drop_columns(rng: np.random.Generator, df: pd.DataFrame) -> pd.DataFrame:
+    # Colonne assenti dall'export: le funzioni riga per riga leggono None
+    drop = [c for c in df.columns if rng.random() < 0.15]
+    return df.drop(columns=drop)
+
+
+def shipping_inputs(rng: np.random.Generator, n: int) -> pd.DataFrame:
+    weights = rng.exponential(8.0, n)
+    weights[: len(SHIPPING_WEIGHTS)] = SHIPPING_WEIGHTS[:n]
+    return pd.DataFrame({"Weight_kg": weights})
+
+
+def purchase_inputs(rng: np.random.Generator, n: int) -> pd.DataFrame:
+    gross = rng.uniform(-5, 500, n)
+    special = [np.nan, np.inf, -np.inf, 0.0, -0.0, 1e308]
+    gross[: len(special)] = special[:n]
+    gross[rng.random(n) < 0.05] = np.nan
+    locales = _tiled(LOCALE_VALUES, n)
+    rng.shuffle(locales[len(LOCALE_VALUES):])
+    return pd.DataFrame({"Price_Base": gross, "Locale (base)": locales})
+
+
+def weight_inputs(rng: np.random.Generator, n: int) -> pd.DataFrame:
+    grams = rng.integers(1, 60_000, n)
+    kg = np.round(grams / 1000, 2).astype(str)
+    forms = [
+        np.char.add(grams.astype(str), " g"),
+        np.char.add(kg, " kg"),
+        np.char.add(np.char.replace(kg, ".", ","), " kg"),
+        np.char.add(kg, " Kilograms"),
+        kg,
+    ]
+    random = np.choose(rng.integers(0, len(forms), n), forms)
+    return pd.DataFrame({"Weight": _mixed(rng, n, random, WEIGHT_TEXTS + ODD_VALUES)})
+
+
+def discount_inputs(rng: np.random.Generator, n: int) -> pd.DataFrame:
+    price = rng.uniform(-5, 500, n)
+    price[rng.random(n) < 0.05] = np.nan
+    price[rng.random(n) < 0.01] = np.inf
+    return pd.DataFrame(
+        {
+            "PriceNowGross": price,
+            "One Time Coupon: Absolute": _number_column(rng, n, 0, 60),
+            "One Time Coupon: Percentage": _number_column(rng, n, 0, 40),
+            "Business Discount: Percentage": _number_column(rng, n, 0, 15),
+        }
+    )
+
+
+def fair_price_inputs(rng: np.random.Generator, n: int) -> pd.DataFrame:
+    columns = {c: _number_column(rng, n, 5, 400) for c in FAIR_PRICE_COLUMNS}
+    columns["Buy Box 🚚: Lowest"] = _number_column(rng, n, 5, 150)
+    columns["Buy Box 🚚: Highest"] = _number_column(rng, n, 150, 450)
+    return _drop_columns(rng, pd.DataFrame(columns))
+
+
+def demand_inputs(rng: np.random.Generator, n: int) -> pd.DataFrame:
+    def ints(high: int) -> np.ndarray:
+        values = rng.integers(-10, high, n).astype(str)
+        return _mixed(rng, n, values, NUMBER_TEXTS + ODD_VALUES)
+
+    df = pd.DataFrame(
+        {
+            "Sales Rank: Current": ints(500_000),
+            "Sales Rank: 90 days avg.": ints(500_000),
+            "Bought in past month": ints(5_000),
+            "Reviews: Rating Count": ints(20_000),
+            "Reviews: Rating Count - 90 days avg.": ints(20_000),
+        }
+    )
+    return _drop_columns(rng, df)
+
+
+def competition_inputs(rng: np.random.Generator, n: int) -> pd.DataFrame:
+    unqualified = _mixed(
+        rng,
+        n,
+        rng.choice(np.array(["yes", "no", "Yes", " YES ", ""]), n),
+        ["yes\n", "\x1cyes", "yes.", "ye s", "no"] + ODD_VALUES,
+    )
+    df = pd.DataFrame(
+        {
+            "New Offer Count: Current": _number_column(rng, n, -5, 150),
+            "Buy Box: % Amazon 90 days": _number_column(rng, n, -10, 120),
+            "Buy Box: % Amazon 180 days": _number_column(rng, n, -10, 120),
+            "Buy Box: Unqualified": unqualified,
+        }
+    )
+    return _drop_columns(rng, df)
+
+
+@dataclass(frozen=True)
+class Kernel:
+    """A scalar function, its batched version and the inputs they read."""
+
+    name: str
+    scalar: Callable[[pd.DataFrame], Any]
+    batch: Callable[[pd.DataFrame], Any]
+    inputs: Callable[[np.random.Generator, int], pd.DataFrame]
+
+
+DISCOUNT_COLUMNS = (
+    "PriceNowGross",
+    "One Time Coupon: Absolute",
+    "One Time Coupon: Percentage",
+    "Business Discount: Percentage",
+)
+
+
+def _rows(func: Callable[[pd.Series], float]) -> Callable[[pd.DataFrame], Any]:
+    # Come _apply_rows della pipeline: una chiamata per riga
+    return lambda df: df.apply(func, axis=1)
+
+
+KERNELS: Dict[str, Kernel] = {
+    k.name: k
+    for k in (
+        Kernel(
+            "calculate_shipping_cost",
+            lambda df: df["Weight_kg"].apply(calculate_shipping_cost),
+            lambda df: shipping_costs(df["Weight_kg"]),
+            shipping_inputs,
+        ),
+        Kernel(
+            "calc_final_purchase_price",
+            _rows(lambda r: calc_final_purchase_price(r, DISCOUNT)),
+            lambda df: final_purchase_prices(
+                df["Price_Base"], df["Locale (base)"], DISCOUNT
+            ),
+            purchase_inputs,
+        ),
+        Kernel(
+            "parse_weight",
+            lambda df: df["Weight"].apply(parse_weight),
+            lambda df: parse_weights(df["Weight"]),
+            weight_inputs,
+        ),
+        Kernel(
+            "apply_discounts",
+            _rows(lambda r: apply_discounts(*(r[c] for c in DISCOUNT_COLUMNS))),
+            lambda df: discounted_prices(*(df[c] for c in DISCOUNT_COLUMNS)),
+            discount_inputs,
+        ),
+        Kernel("fair_price_row", _rows(fair_price_row), fair_prices, fair_price_inputs),
+        Kernel("demand_score", _rows(demand_score), demand_scores, demand_inputs),
+        Kernel(
+            "competition_score",
+            _rows(competition_score),
+            competition_scores,
+            competition_inputs,
+        ),
+    )
+}
+
+
+def assert_equivalent(
+    expected: Any,
+    actual: Any,
+    inputs: Optional[pd.DataFrame] = None,
+    rtol: float = RTOL,
+    atol: float = ATOL,
+) -> float:
+    """Check NaN placement and values; return the largest absolute difference."""
+    expected = np.asarray(expected, dtype=float)
+    actual = np.asarray(actual, dtype=float)
+    if expected.shape != actual.shape:
+        raise AssertionError(f"forme diverse: {expected.shape} e {actual.shape}")
+    nan = np.isnan(expected)
+    with np.errstate(invalid="ignore"):
+        close = np.isclose(actual, expected, rtol=rtol, atol=atol)
+    bad = np.flatnonzero((nan != np.isnan(actual)) | (~nan & ~close))
+    if bad.size:
+        rows = bad[:5]
+        message = (
+            f"{bad.size} righe diverse, es. righe {rows.tolist()}: "
+            f"attesi {expected[rows].tolist()}, ottenuti {actual[rows].tolist()}"
+        )
+        if inputs is not None:
+            message += f"\n{inputs.iloc[rows].to_dict('records')}"
+        raise AssertionError(message)
+    finite = np.isfinite(expected)
+    diff = np.abs(actual[finite] - expected[finite])
+    return float(diff.max()) if diff.size else 0.0
+
+
+def _timed(func: Callable[[pd.DataFrame], Any], df: pd.DataFrame) -> tuple:
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+
+def check_kernel(kernel: Kernel, rows: int, seed: int = 0) -> Dict[str, Any]:
+    """Run both versions of ``kernel`` on ``rows`` inputs and compare them."""
+    df = kernel.inputs(np.random.default_rng(seed), rows)
+    expected, scalar_s = _timed(kernel.scalar, df)
+    actual, batch_s = _timed(kernel.batch, df)
+    max_diff = assert_equivalent(expected, actual, df)
+    return {
+        "kernel": kernel.name,
+        "rows": rows,
+        "seed": seed,
+        "scalar_s": scalar_s,
+        "batch_s": batch_s,
+        "speedup": scalar_s / batch_s if batch_s else float("inf"),
+        "max_abs_diff": max_diff,
+    }
+
+
+def run_all(
+    rows: int, seeds: Sequence[int] = (0,), names: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    """Check every kernel (or ``names``) with each seed."""
+    return pd.DataFrame(
+        [
+            check_kernel(KERNELS[name], rows, seed)
+            for name in (names or KERNELS)
+            for seed in seeds
+        ]
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Confronta le funzioni riga per riga con le versioni vettoriali."
+    )
+    parser.add_argument("--rows", type=int, default=100_000, help="Righe per kernel")
+    parser.add_argument("--seeds", type=int, default=1, help="Input casuali per kernel")
+    parser.add_argument(
+        "--kernel", nargs="+", choices=sorted(KERNELS), help="Solo questi kernel"
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        table = run_all(args.rows, range(args.seeds), args.kernel)
+    except AssertionError as exc:
+        print(f"Risultati diversi: {exc}", file=sys.stderr)
+        return 1
+    summary = table.groupby("kernel", sort=False).agg(
+        scalar_s=("scalar_s", "min"),
+        batch_s=("batch_s", "min"),
+        max_abs_diff=("max_abs_diff", "max"),
+    )
+    summary["speedup"] = summary["scalar_s"] / summary["batch_s"]
+    print(summary.reset_index().to_string(index=False, float_format="{:.4g}".format))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
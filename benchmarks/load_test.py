@@ -0,0 +1,274 @@
+"""Load test of concurrent sessions of the Streamlit app.
+
+Example::
+
+    python -m benchmarks.load_test --sessions 1 2 4 8 --rows 5000
+
+Each simulated session is an ``AppTest`` of ``app.py`` driven from its own
+thread, so all the sessions share this process like the sessions of one
+Streamlit server share its caches and memory. A session uploads a
+synthetic base and comparison export, clicks "Calcola Opportunity Score",
+reruns until the analysis is done and then moves the weight sliders of the
+"Affari Storici" tab. Every rerun is timed; for each number of sessions the
+report gives the p50/p95 rerun latency, the time to results and the RSS of
+the process before, during (peak) and after the sessions.
+
+``AppTest`` swaps process-wide state (the runtime instance, the config, the
+uploaded files) around each script run, so the runs of different sessions
+take turns on a lock while their analyses overlap in the background job
+threads. A rerun's latency includes its wait for the lock, as script runs
+of a server queue behind each other on the GIL.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_pair
+from diagnostics import rss_bytes
+
+APP_FILE = Path(__file__).resolve().parents[1] / "app.py"
+
+# Cursori della scheda "Affari Storici" mossi da ogni sessione
+DEALS_SLIDERS = ("Peso Sottoprezzo", "Peso Domanda", "Penalità Concorrenza")
+
+# Attesa tra due rerun mentre l'analisi gira in background
+POLL_INTERVAL = 0.2
+
+# AppTest non è rientrante: un'esecuzione dello script alla volta
+_RUN_LOCK = threading.Lock()
+
+
+@dataclass
+class SessionResult:
+    """Timings of one simulated session."""
+
+    reruns: List[Tuple[str, float]] = field(default_factory=list)
+    analysis_s: Optional[float] = None
+    error: Optional[str] = None
+
+
+def _csv_bytes(df: pd.DataFrame) -> bytes:
+    # Stesso formato di write_export: load_data prova prima il ";"
+    return df.to_csv(index=False, sep=";").encode("utf-8")
+
+
+def session_files(rows: int, seed: int) -> Tuple[bytes, bytes]:
+    """Return the base and comparison exports uploaded by a session."""
+    base, comp = make_pair(rows, seed)
+    return _csv_bytes(base), _csv_bytes(comp)
+
+
+def _results_ready(at: Any) -> bool:
+    try:
+        return at.session_state["filtered_data"] is not None
+    except KeyError:
+        return False
+
+
+def _widget(widgets: Any, label: str) -> Any:
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"widget '{label}' non trovato tra {[w.label for w in widgets]}")
+
+
+def run_session(
+    files: Tuple[bytes, bytes],
+    slider_moves: int = 3,
+    timeout: float = 300.0,
+    start: Optional[threading.Barrier] = None,
+) -> SessionResult:
+    """Drive one session of the app and time every rerun."""
+    from streamlit.testing.v1 import AppTest
+
+    result = SessionResult()
+    at = AppTest.from_file(str(APP_FILE), default_timeout=timeout)
+
+    def rerun(kind: str, element: Any = at) -> None:
+        began = time.perf_counter()
+        with _RUN_LOCK:
+            element.run()
+        result.reruns.append((kind, time.perf_counter() - began))
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+
+    try:
+        if start is not None:
+            start.wait()
+        rerun("first_paint")
+        at.file_uploader[0].upload("base.csv", files[0], "text/csv")
+        at.file_uploader[1].upload("comp.csv", files[1], "text/csv")
+        rerun("upload")
+
+        clicked = time.perf_counter()
+        button = _widget(at.button, "🚀 Calcola Opportunity Score")
+        rerun("calcola", button.click())
+        while not _results_ready(at):
+            if time.perf_counter() - clicked > timeout:
+                raise TimeoutError(f"analisi non completata in {timeout:.0f}s")
+            time.sleep(POLL_INTERVAL)
+            rerun("poll")
+        result.analysis_s = time.perf_counter() - clicked
+
+        values = np.linspace(0.0, 1.0, slider_moves + 2)[1:-1]
+        for i, value in enumerate(values):
+            label = DEALS_SLIDERS[i % len(DEALS_SLIDERS)]
+            slider = _widget(at.slider, label)
+            rerun("slider", slider.set_value(round(float(value) / 0.05) * 0.05))
+    except Exception as exc:  # una sessione fallita non ferma le altre
+        result.error = f"{type(exc).__name__}: {exc}"
+    return result
+
+
+def _sample_rss(stop: threading.Event, samples: List[int], interval: float) -> None:
+    while not stop.is_set():
+        samples.append(rss_bytes() or 0)
+        stop.wait(interval)
+
+
+def _percentile(values: Sequence[float], q: float) -> Optional[float]:
+    return float(np.percentile(values, q)) if len(values) else None
+
+
+def _mb(nbytes: Optional[int]) -> Optional[float]:
+    return None if not nbytes else nbytes / 2**20
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else seconds * 1000
+
+
+def load_test(
+    sessions: int,
+    rows: int = 2_000,
+    seed: int = 0,
+    slider_moves: int = 3,
+    shared_files: bool = False,
+    timeout: float = 300.0,
+) -> Dict[str, Any]:
+    """Run ``sessions`` concurrent sessions and summarize their reruns.
+
+    With ``shared_files`` every session uploads the same exports, as a team
+    opening the same morning files; otherwise each gets its own data.
+    """
+    files = [
+        session_files(rows, seed if shared_files else seed + i) for i in range(sessions)
+    ]
+    results = [SessionResult() for _ in range(sessions)]
+    start = threading.Barrier(sessions)
+
+    def worker(i: int) -> None:
+        results[i] = run_session(files[i], slider_moves, timeout, start)
+
+    samples: List[int] = []
+    stop = threading.Event()
+    sampler = threading.Thread(
+        target=_sample_rss, args=(stop, samples, 0.05), daemon=True
+    )
+    # Lo script runner lascia app.py come __main__: i processi "spawn" avviati
+    # dopo (run_sharded) lo rieseguirebbero
+    main_module = sys.modules.get("__main__")
+    rss_start = rss_bytes()
+    sampler.start()
+    began = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(sessions)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.modules["__main__"] = main_module
+    wall = time.perf_counter() - began
+    stop.set()
+    sampler.join()
+
+    latencies = [s for r in results for _, s in r.reruns]
+    interactive = [s for r in results for kind, s in r.reruns if kind == "slider"]
+    analysis = [r.analysis_s for r in results if r.analysis_s is not None]
+    return {
+        "sessions": sessions,
+        "rows": rows,
+        "shared_files": shared_files,
+        "reruns": len(latencies),
+        "p50_ms": _ms(_percentile(latencies, 50)),
+        "p95_ms": _ms(_percentile(latencies, 95)),
+        "slider_p95_ms": _ms(_percentile(interactive, 95)),
+        "analysis_p50_s": _percentile(analysis, 50),
+        "analysis_max_s": max(analysis) if analysis else None,
+        "wall_s": wall,
+        "rss_start_mb": _mb(rss_start),
+        "rss_peak_mb": _mb(max(samples, default=0)),
+        "rss_end_mb": _mb(rss_bytes()),
+        "errors": [r.error for r in results if r.error],
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Simula sessioni concorrenti dell'app e misura i tempi di rerun."
+    )
+    parser.add_argument(
+        "--sessions", type=int, nargs="+", default=[1, 2, 4], help="Sessioni simultanee"
+    )
+    parser.add_argument("--rows", type=int, default=2_000, help="Righe per export")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--slider-moves", type=int, default=3)
+    parser.add_argument(
+        "--shared-files",
+        action="store_true",
+        help="Tutte le sessioni caricano gli stessi file",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300.0, help="Secondi massimi per analisi"
+    )
+    parser.add_argument("--results", help="Aggiungi le misure a questo file JSON lines")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Archivio e log delle prestazioni della prova, non quelli del server
+        os.environ.setdefault("RESULTS_DB", str(Path(tmp) / "results.duckdb"))
+        os.environ.setdefault("PERF_LOG", str(Path(tmp) / "perf.jsonl"))
+        runs = [
+            load_test(
+                n,
+                args.rows,
+                args.seed,
+                args.slider_moves,
+                args.shared_files,
+                args.timeout,
+            )
+            for n in args.sessions
+        ]
+    table = pd.DataFrame(runs).drop(columns=["errors", "rows", "shared_files"])
+    print(table.to_string(index=False, float_format="{:.1f}".format))
+    failed = False
+    for run in runs:
+        for error in run["errors"]:
+            failed = True
+            print(f"{run['sessions']} sessioni: {error}", file=sys.stderr)
+    if args.results:
+        with open(args.results, "a", encoding="utf-8") as fh:
+            for run in runs:
+                fh.write(json.dumps(run) + "\n")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
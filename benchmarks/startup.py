@@ -0,0 +1,182 @@
+"""Cold start of the Streamlit app: import time and time to first paint.
+
+Example::
+
+    python -m benchmarks.startup --repeat 5 --imports 15
+
+Each repetition starts a fresh interpreter, imports Streamlit's ``AppTest``
+and runs ``app.py`` once with no uploads, which is the page a user waits
+for when opening the app. The child process runs in an empty directory with
+the archive and logs pointed at it, so any file the imports create shows up
+in ``created_files``. The report gives the median of every phase, the
+deferred libraries (charts, grid, Excel export) and engine modules (with
+DuckDB and Parquet) that the first paint loaded anyway and, with ``--imports``, the slowest imports of the first run.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+APP_FILE = ROOT / "app.py"
+
+# Librerie che devono caricarsi solo quando una scheda mostra i risultati, e
+# moduli del motore, dello storico e dell'archivio che servono solo dopo un
+# caricamento o all'avvio di un'analisi
+DEFERRED_MODULES = (
+    "altair",
+    "st_aggrid",
+    "streamlit_extras",
+    "openpyxl",
+    "xlsxwriter",
+    "engine",
+    "deals",
+    "derived",
+    "delta",
+    "outofcore",
+    "results_db",
+    "snapshots",
+    "duckdb",
+    "pyarrow.parquet",
+)
+
+# Eseguito nel processo figlio: le importazioni dell'app partono da zero
+_CHILD = """
+import time
+started = time.perf_counter()
+import json, sys
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file({app!r}, default_timeout=120)
+sys.stderr.write("--first-paint--\\n")
+at.run()
+painted = time.perf_counter()
+at.run()
+rerun = time.perf_counter() - painted
+print(json.dumps({{
+    "streamlit_s": imported - started,
+    "first_paint_s": painted - imported,
+    "total_s": painted - started,
+    "rerun_s": rerun,
+    "exception": [str(e.value) for e in at.exception],
+    "deferred_loaded": [m for m in {deferred!r} if m in sys.modules],
+}}))
+"""
+
+
+def _slowest_imports(stderr: str, top: int) -> List[Dict[str, Any]]:
+    """Parse the ``-X importtime`` lines of the first run, slowest first."""
+    _, _, lines = stderr.partition("--first-paint--\n")
+    rows = []
+    for line in lines.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        rows.append(
+            {
+                # Un livello di annidamento ogni due spazi dopo il primo
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def cold_start(imports: int = 0) -> Dict[str, Any]:
+    """Start the app once in a fresh interpreter and time it.
+
+    With ``imports`` > 0 the child runs with ``-X importtime`` (which slows
+    it down a little) and the slowest imports of the first run are returned.
+    """
+    code = _CHILD.format(app=str(APP_FILE), deferred=DEFERRED_MODULES)
+    command = [sys.executable] + (["-X", "importtime"] if imports else []) + ["-c", code]
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp) / "cwd"
+        workdir.mkdir()
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")])),
+            RESULTS_DB=str(Path(tmp) / "results.duckdb"),
+            PERF_LOG=str(Path(tmp) / "perf.jsonl"),
+            PROFILE_DIR=str(Path(tmp) / "profiles"),
+            SNAPSHOT_DIR=str(Path(tmp) / "snapshots"),
+        )
+        out = subprocess.run(
+            command, cwd=workdir, env=env, capture_output=True, text=True, check=True
+        )
+        created = sorted(str(p.relative_to(workdir)) for p in workdir.rglob("*"))
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["created_files"] = created
+    if imports:
+        result["imports"] = _slowest_imports(out.stderr, imports)
+    return result
+
+
+def startup_benchmark(repeat: int = 3, imports: int = 0) -> Dict[str, Any]:
+    """Median of ``repeat`` cold starts; the import list comes from the last one."""
+    runs = [cold_start(imports if i == repeat - 1 else 0) for i in range(repeat)]
+    summary: Dict[str, Any] = {
+        key: statistics.median(run[key] for run in runs)
+        for key in ("streamlit_s", "first_paint_s", "total_s", "rerun_s")
+    }
+    summary["repeat"] = repeat
+    for key in ("deferred_loaded", "created_files", "exception"):
+        summary[key] = sorted({item for run in runs for item in run[key]})
+    summary["imports"] = runs[-1].get("imports", [])
+    return summary
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Misura il tempo di avvio dell'app fino alla prima pagina."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Avvii a freddo")
+    parser.add_argument(
+        "--imports", type=int, default=0, help="Mostra le N importazioni più lente"
+    )
+    parser.add_argument("--results", help="Aggiungi la misura a questo file JSON lines")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    summary = startup_benchmark(args.repeat, args.imports)
+    print(
+        f"import streamlit: {summary['streamlit_s']:.2f}s · "
+        f"prima pagina: {summary['first_paint_s']:.2f}s · "
+        f"totale: {summary['total_s']:.2f}s · "
+        f"rerun: {summary['rerun_s']:.2f}s (mediana di {args.repeat})"
+    )
+    if summary["imports"]:
+        table = pd.DataFrame(summary["imports"])
+        print(table.to_string(index=False, float_format="{:.1f}".format))
+    failed = False
+    for key, message in (
+        ("exception", "eccezione nella prima pagina"),
+        ("deferred_loaded", "librerie differite caricate alla prima pagina"),
+        ("created_files", "file creati dalle importazioni"),
+    ):
+        if summary[key]:
+            failed = True
+            print(f"{message}: {', '.join(summary[key])}", file=sys.stderr)
+    if args.results:
+        with open(args.results, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(summary) + "\n")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
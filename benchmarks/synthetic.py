@@ -0,0 +1,155 @@
+"""Synthetic Keepa exports for benchmarks.
+
+:func:`make_export` builds a frame with the columns of a Keepa product
+export, every value a string as :func:`loaders.load_data` reads it. Prices
+mix the formats found in European exports (``"12,34"``, ``"€ 12,34"``,
+``"12.34"``); every column has missing cells; weights come both as grams
+and as free text (``"1,2 kg"``, ``"350 g"``, ``"0.45 Kilograms"``).
+Generation is vectorized, so a million rows take seconds.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+BENCH_SIZES = (10_000, 100_000, 1_000_000)
+
+COMP_LOCALES = ("de", "fr", "es", "uk")
+
+BRANDS = ("Apple", "Samsung", "Philips", "Bosch", "Lego", "Braun", "Logitech")
+NOUNS = ("Cuffie", "Frullatore", "Trapano", "Smartphone", "Set", "Mouse", "Rasoio")
+
+# Quota di celle vuote per colonna
+MISSING_RATE = 0.05
+
+
+def _asins(n: int, rng: np.random.Generator) -> np.ndarray:
+    digits = rng.choice(list("0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"), size=(n, 8))
+    return np.char.add("B0", digits.view("<U8").ravel())
+
+
+def _int_text(values: np.ndarray) -> np.ndarray:
+    return values.astype(np.int64).astype(str)
+
+
+def _num_text(values: np.ndarray, decimals: int = 2) -> np.ndarray:
+    # Più veloce di np.char.mod; gli zeri finali cadono ("12.5")
+    return np.round(values, decimals).astype(str)
+
+
+def _price_text(values: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    plain = _num_text(values)
+    comma = np.char.replace(plain, ".", ",")
+    style = rng.integers(0, 3, len(values))
+    return np.where(style == 0, plain, np.where(style == 1, comma, np.char.add("€ ", comma)))
+
+
+def _weight_text(grams: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    kg = grams / 1000
+    forms = [
+        np.char.add(_int_text(grams), " g"),
+        np.char.add(_num_text(kg), " kg"),
+        np.char.add(np.char.replace(_num_text(kg, 1), ".", ","), " kg"),
+        np.char.add(_num_text(kg), " Kilograms"),
+    ]
+    return np.choose(rng.integers(0, len(forms), len(grams)), forms)
+
+
+def make_export(
+    n_rows: int,
+    locales: Sequence[str] = ("it",),
+    seed: int = 0,
+    asins: Optional[np.ndarray] = None,
+    price_factor: float = 1.0,
+) -> pd.DataFrame:
+    """Return a Keepa-shaped export of ``n_rows`` rows.
+
+    Rows are spread over ``locales``. ``asins`` fixes the ASIN of each row,
+    so comparison exports can share products with a base export; the base
+    prices of a product are the same in every export, times ``price_factor``
+    and some noise.
+    """
+    rng = np.random.default_rng(seed)
+    if asins is None:
+        asins = _asins(n_rows, rng)
+    # Prezzo e rank dipendono dall'ASIN: stessi prodotti, stessi ordini di grandezza
+    key = pd.util.hash_array(asins.astype(object)).astype(np.float64)
+    base_price = 5 + (key % 49_500) / 100
+    price = base_price * price_factor * rng.uniform(0.85, 1.25, n_rows)
+    rank = (1 + key % 300_000) * rng.uniform(0.8, 1.2, n_rows)
+    grams = 50 + (key % 12_000)
+
+    avg90 = price * rng.uniform(0.8, 1.3, n_rows)
+    columns = {
+        "Locale": rng.choice(np.asarray(locales), n_rows),
+        "Title": np.char.add(
+            np.char.add(rng.choice(BRANDS, n_rows), " "),
+            np.char.add(rng.choice(NOUNS, n_rows), np.char.add(" ", _int_text(key % 1000))),
+        ),
+        "Brand": rng.choice(BRANDS, n_rows),
+        "Sales Rank: Current": _int_text(rank),
+        "Sales Rank: 30 days avg.": _int_text(rank * rng.uniform(0.7, 1.4, n_rows)),
+        "Sales Rank: 90 days avg.": _int_text(rank * rng.uniform(0.6, 1.6, n_rows)),
+        "Bought in past month": _int_text(rng.integers(0, 20, n_rows) * 50),
+        "Reviews: Rating": _num_text(rng.uniform(2.5, 5, n_rows), 1),
+        "Reviews: Rating Count": _int_text(rng.integers(0, 20_000, n_rows)),
+        "Buy Box 🚚: Current": _price_text(price, rng),
+        "Buy Box 🚚: 30 days avg.": _price_text(price * rng.uniform(0.9, 1.2, n_rows), rng),
+        "Buy Box 🚚: 90 days avg.": _price_text(avg90, rng),
+        "Buy Box 🚚: 180 days avg.": _price_text(avg90 * rng.uniform(0.9, 1.1, n_rows), rng),
+        "Buy Box 🚚: 365 days avg.": _price_text(avg90 * rng.uniform(0.9, 1.1, n_rows), rng),
+        "Buy Box 🚚: Lowest": _price_text(price * rng.uniform(0.5, 0.9, n_rows), rng),
+        "Buy Box 🚚: Highest": _price_text(price * rng.uniform(1.1, 1.8, n_rows), rng),
+        "Buy Box: % Amazon 90 days": np.char.add(_int_text(rng.integers(0, 100, n_rows)), " %"),
+        "Buy Box: Standard Deviation 90 days": _num_text(
+            price * rng.uniform(0, 0.2, n_rows)
+        ),
+        "Amazon: Current": _price_text(price * rng.uniform(0.95, 1.1, n_rows), rng),
+        "Amazon: 90 days avg.": _price_text(avg90 * rng.uniform(0.95, 1.1, n_rows), rng),
+        "New: Current": _price_text(price * rng.uniform(0.9, 1.1, n_rows), rng),
+        "New: 90 days avg.": _price_text(avg90, rng),
+        "FBA Pick&Pack Fee": _num_text(rng.uniform(2.5, 9, n_rows)),
+        "Referral Fee %": _num_text(rng.choice([0.07, 0.08, 0.15], n_rows)),
+        "List Price: Current": _price_text(price * rng.uniform(1.0, 1.5, n_rows), rng),
+        "New Offer Count: Current": _int_text(rng.integers(1, 40, n_rows)),
+        "Used Offer Count: Current": _int_text(rng.integers(0, 25, n_rows)),
+        "ASIN": asins,
+        "Package: Weight (g)": _int_text(grams),
+        "Item Weight": _weight_text(grams * rng.uniform(0.7, 1.0, n_rows), rng),
+        "Prime Eligible (Buy Box)": rng.choice(["yes", "no"], n_rows),
+    }
+    df = pd.DataFrame(columns)
+    missing = rng.random(df.shape) < MISSING_RATE
+    # L'ASIN è sempre presente: senza, la riga non entra nell'analisi
+    missing[:, df.columns.get_loc("ASIN")] = False
+    return df.mask(missing).astype("str")
+
+
+def make_pair(
+    n_rows: int, seed: int = 0, overlap: float = 0.8
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Return a base export (``it``) and a comparison export over mixed locales.
+
+    ``overlap`` of the base ASINs appear in the comparison export, each in
+    one of :data:`COMP_LOCALES`; the other comparison rows are new ASINs.
+    """
+    base = make_export(n_rows, ("it",), seed)
+    rng = np.random.default_rng(seed + 1)
+    shared = rng.choice(base["ASIN"].to_numpy(dtype=str), int(n_rows * overlap), replace=False)
+    asins = np.concatenate([shared, _asins(n_rows - len(shared), rng)])
+    comp = make_export(n_rows, COMP_LOCALES, seed + 2, asins=asins, price_factor=1.3)
+    return base, comp
+
+
+def write_export(df: pd.DataFrame, path: str | Path) -> Path:
+    """Write ``df`` as a ``;``-separated CSV or an XLSX file, like the Keepa exports."""
+    path = Path(path)
+    if path.suffix.lower() == ".xlsx":
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, sep=";", index=False)
+    return path
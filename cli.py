@@ -0,0 +1,217 @@
+"""Command line entry point for headless batch scoring.
+
+Example::
+
+    python cli.py --base origine.xlsx --comp de.csv fr.csv -o risultati.parquet
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import pickle
+import sys
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from delta import analyze_delta
+from engine import STAGES, AnalysisError, EngineConfig, analyze_uploads
+from matrix import analyze_matrix
+from outofcore import OutOfCoreSettings, run_out_of_core
+from settings import OUT_OF_CORE_MAX_RSS_MB, OUT_OF_CORE_MEMORY_MB, PIPELINE_WORKERS
+from snapshots import SnapshotStore
+
+
+def write_frame(df: pd.DataFrame, path: str | Path) -> None:
+    """Write ``df`` to ``path`` as Parquet or CSV depending on the extension."""
+    path = Path(path)
+    if path.suffix.lower() == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False, sep=";")
+
+
+class StageTimer:
+    """Progress callback printing the duration of each pipeline stage."""
+
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.timings: Dict[str, float] = {}
+        self._stage: Optional[str] = None
+        self._start = 0.0
+
+    def __call__(self, stage: str, partial: Any = None) -> None:
+        self.close()
+        self._stage = stage
+        self._start = time.perf_counter()
+
+    def close(self) -> None:
+        if self._stage is not None:
+            elapsed = time.perf_counter() - self._start
+            self.timings[self._stage] = elapsed
+            print(f"{self._stage:>8}: {elapsed:8.3f}s", file=self.stream)
+        self._stage = None
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Calcola l'Opportunity Score da export Keepa senza browser."
+    )
+    parser.add_argument("--base", nargs="+", required=True, help="File di origine")
+    parser.add_argument("--comp", nargs="+", required=True, help="File di confronto")
+    parser.add_argument(
+        "-o", "--output", required=True, help="Risultati (.parquet o .csv)"
+    )
+    parser.add_argument("--ranking", help="Classifica per ASIN (.parquet o .csv)")
+    parser.add_argument(
+        "--full", action="store_true", help="Scrivi tutte le colonne calcolate"
+    )
+    parser.add_argument(
+        "--config", help="File JSON con i parametri (stesso formato delle ricette)"
+    )
+    parser.add_argument(
+        "--discount-percent", type=float, help="Sconto sugli acquisti (%%)"
+    )
+    parser.add_argument("--ref-price-base", help="Colonna prezzo lista di origine")
+    parser.add_argument("--ref-price-comp", help="Colonna prezzo liste di confronto")
+    parser.add_argument(
+        "--no-shipping", action="store_true", help="Escludi i costi di spedizione"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PIPELINE_WORKERS,
+        help="Processi per le fasi riga per riga (shard per ASIN)",
+    )
+    parser.add_argument(
+        "--out-of-core",
+        action="store_true",
+        help="Elabora i file a blocchi tramite un archivio su disco",
+    )
+    parser.add_argument(
+        "--memory-limit-mb",
+        type=int,
+        default=OUT_OF_CORE_MEMORY_MB,
+        help="Memoria massima per la modalità --out-of-core (MB)",
+    )
+    parser.add_argument(
+        "--max-rss-mb",
+        type=int,
+        default=OUT_OF_CORE_MAX_RSS_MB,
+        help="RSS massima del processo con --out-of-core: oltre, blocchi più piccoli (MB)",
+    )
+    parser.add_argument(
+        "--delta-state",
+        help="File di stato: ricalcola solo gli ASIN cambiati dall'ultima esecuzione",
+    )
+    parser.add_argument(
+        "--history",
+        help="Cartella dello storico snapshot: salva gli export e usa lo storico",
+    )
+    parser.add_argument(
+        "--matrix",
+        action="store_true",
+        help="Matrice di arbitraggio: ogni file è un mercato di acquisto e di vendita",
+    )
+    return parser
+
+
+def config_from_args(args: argparse.Namespace) -> EngineConfig:
+    """Merge the JSON config file and the command line overrides."""
+    data: Dict[str, Any] = {}
+    if args.config:
+        data.update(json.loads(Path(args.config).read_text(encoding="utf-8")))
+    if args.discount_percent is not None:
+        data["discount"] = args.discount_percent / 100.0
+    if args.ref_price_base:
+        data["ref_price_base"] = args.ref_price_base
+    if args.ref_price_comp:
+        data["ref_price_comp"] = args.ref_price_comp
+    if args.no_shipping:
+        data["include_shipping"] = False
+    return EngineConfig.from_dict(data)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    config = config_from_args(args)
+    timer = StageTimer()
+    history = SnapshotStore(args.history) if args.history else None
+    with ExitStack() as stack:
+        files_base = [stack.enter_context(open(p, "rb")) for p in args.base]
+        files_comp = [stack.enter_context(open(p, "rb")) for p in args.comp]
+        try:
+            if args.matrix:
+                results = analyze_matrix(files_base + files_comp, config, timer)
+            elif args.delta_state:
+                state_path = Path(args.delta_state)
+                previous = (
+                    pickle.loads(state_path.read_bytes()) if state_path.exists() else None
+                )
+                results = analyze_delta(
+                    files_base, files_comp, config, timer, previous, history
+                )
+                state_path.write_bytes(pickle.dumps(results["delta"]))
+            elif args.out_of_core:
+                settings = OutOfCoreSettings(
+                    memory_limit_mb=args.memory_limit_mb, max_rss_mb=args.max_rss_mb or None
+                )
+                results = run_out_of_core(
+                    files_base,
+                    files_comp,
+                    config,
+                    settings,
+                    timer,
+                    ignored_options=["--history"] if history is not None else [],
+                )
+            else:
+                results = analyze_uploads(
+                    files_base, files_comp, config, timer, args.workers, history
+                )
+        except AnalysisError as exc:
+            print(f"Errore: {exc}", file=sys.stderr)
+            return 1
+    timer.close()
+    for message in results["warnings"]:
+        print(f"Attenzione: {message}", file=sys.stderr)
+    if "memory" in results:
+        memory = results["memory"]
+        print(
+            f"Memoria: picco RSS {memory['peak_rss_mb']:.0f} MB, "
+            f"blocchi da {memory['chunk_rows']} righe",
+            file=sys.stderr,
+        )
+    if "delta" in results:
+        stats = results["delta"].stats
+        print(
+            f"Delta: {stats['recomputed']}/{stats['asins']} ASIN ricalcolati, "
+            f"{stats['reused_rows']} righe riutilizzate",
+            file=sys.stderr,
+        )
+
+    if args.matrix:
+        write_frame(results["routes"], args.output)
+        print(
+            f"{len(results['routes'])} rotte migliori su "
+            f"{len(results['matrix'].locales)} mercati in "
+            f"{sum(timer.timings.values()):.2f}s",
+            file=sys.stderr,
+        )
+        return 0
+    write_frame(results["full_data" if args.full else "filtered_data"], args.output)
+    if args.ranking:
+        write_frame(results["ranked_data"], args.ranking)
+    print(
+        f"{len(results['filtered_data'])} prodotti in {sum(timer.timings.values()):.2f}s "
+        f"({', '.join(s for s in STAGES if s in timer.timings)})",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
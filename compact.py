@@ -0,0 +1,90 @@
+"""Compact representation of the analysis results kept in a session.
+
+``full_data`` holds every raw Keepa column of both exports next to the
+derived float64 columns, while the app only reads from it the columns of the
+"Affari Storici" tab. :func:`compact_results` prunes the other raw columns,
+stores its float columns as float32 when that keeps their values (relative
+error within :data:`FLOAT32_RTOL`, integral values unchanged) and turns
+locales, brands and opportunity classes into categoricals. The displayed and
+exported frames keep float64: a rounded price such as 12.34 would otherwise
+print as 12.3400001526 in JSON and in the grid.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+from deals import DEAL_COLUMNS
+from engine import DISPLAY_COLS_ORDER
+
+# Colonne di testo a bassa cardinalità salvate come categorie
+CATEGORY_PREFIXES = ("Locale", "Brand", "Opportunity_Class")
+
+FLOAT32_RTOL = 1e-6
+
+
+def fits_float32(values: pd.Series, rtol: float = FLOAT32_RTOL) -> bool:
+    """Return whether ``values`` survive a round trip through float32."""
+    f64 = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(over="ignore"):
+        f32 = f64.astype(np.float32).astype(np.float64)
+    finite = np.isfinite(f64)
+    if not np.array_equal(np.isfinite(f32), finite):
+        return False
+    a, b = f64[finite], f32[finite]
+    # Rank, conteggi e simili restano interi esatti
+    integral = a == np.round(a)
+    if not np.array_equal(a[integral], b[integral]):
+        return False
+    return bool(np.all(np.abs(a - b) <= rtol * np.abs(a)))
+
+
+def compact_frame(
+    df: pd.DataFrame,
+    columns: Optional[Iterable[str]] = None,
+    rtol: float = FLOAT32_RTOL,
+    floats: bool = True,
+) -> pd.DataFrame:
+    """Return ``df`` restricted to ``columns`` with compact dtypes.
+
+    With ``floats=False`` float columns keep float64.
+    """
+    if columns is not None:
+        keep = set(columns)
+        df = df[[c for c in df.columns if c in keep]]
+    dtypes: Dict[str, Any] = {}
+    for col in df.columns:
+        series = df[col]
+        if floats and series.dtype == np.float64 and fits_float32(series, rtol):
+            dtypes[col] = np.float32
+        elif col.startswith(CATEGORY_PREFIXES) and (
+            pd.api.types.is_string_dtype(series.dtype)
+        ):
+            dtypes[col] = "category"
+    return df.astype(dtypes) if dtypes else df
+
+
+def compact_results(results: Mapping[str, Any]) -> Dict[str, Any]:
+    """Return ``results`` with compact frames; other entries are kept as they are.
+
+    ``full_data`` keeps only the display columns and those the deals tab
+    reads, the other frames keep all their columns and their float64 values.
+    """
+    compact = dict(results)
+    compact["full_data"] = compact_frame(
+        results["full_data"], [*DISPLAY_COLS_ORDER, *DEAL_COLUMNS]
+    )
+    compact["filtered_data"] = compact_frame(results["filtered_data"], floats=False)
+    compact["ranked_data"] = compact_frame(results["ranked_data"], floats=False)
+    return compact
+
+
+def frame_bytes(df: Optional[pd.DataFrame]) -> int:
+    """Return the deep memory usage of ``df`` in bytes."""
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True).sum())
+
@@ -0,0 +1,232 @@
+"""Process-wide cache of immutable datasets shared by the sessions.
+
+Every dataset is an Arrow table keyed by the content hash of its source
+(the bytes of an upload, or the key of an analysis). Sessions get a
+:class:`Dataset` lease whose ``frame`` is a pandas view of the table's
+buffers: string, integer and float columns are not copied. The views are
+shallow copies of one frame kept with the cached table, so copy-on-write
+gives a session writing to its view a private copy of the touched columns
+instead of changing the shared, read-only buffers. Leases are reference
+counted; when the cache exceeds its memory budget the least recently used
+datasets that no session holds are evicted.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from settings import DATASET_CACHE_MB
+
+
+def file_fingerprint(file: Any) -> str:
+    """Return the SHA-256 of an uploaded file or a path's content."""
+    digest = hashlib.sha256()
+    if hasattr(file, "getvalue"):
+        digest.update(file.getvalue())
+    elif hasattr(file, "read"):
+        file.seek(0)
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+        file.seek(0)
+    else:
+        with open(file, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def to_table(df: pd.DataFrame) -> pa.Table:
+    """Convert ``df`` to Arrow so that reading it back copies no numbers."""
+    table = pa.Table.from_pandas(df)
+    for i, name in enumerate(table.column_names):
+        col = df.get(name)
+        # NaN resta un valore e non diventa null: la vista float è a copia zero
+        if isinstance(col, pd.Series) and col.dtype.kind == "f":
+            table = table.set_column(
+                i, name, pa.array(col.to_numpy(), from_pandas=False)
+            )
+    return table
+
+
+def to_frame(table: pa.Table) -> pd.DataFrame:
+    """Return a read-only pandas view of ``table``."""
+    return table.to_pandas(split_blocks=True)
+
+
+@dataclass
+class _Entry:
+    table: pa.Table
+    frame: pd.DataFrame
+    nbytes: int
+    refs: int = 0
+
+
+class Dataset:
+    """A lease on a cached dataset, released by :meth:`release` or on collection."""
+
+    def __init__(
+        self,
+        key: str,
+        frame: pd.DataFrame,
+        table: Optional[pa.Table] = None,
+        cache: Optional["DatasetCache"] = None,
+    ):
+        self.key = key
+        self.table = table
+        # Copia superficiale: le scritture della sessione copiano le colonne
+        self.frame = frame.copy(deep=False) if table is not None else frame
+        self._release = (
+            weakref.finalize(self, cache._release, key) if cache is not None else None
+        )
+
+    @property
+    def cached(self) -> bool:
+        return self._release is not None
+
+    def release(self) -> None:
+        if self._release is not None:
+            self._release()
+
+    def keep_with(self, obj: Any) -> Any:
+        """Hold the lease until ``obj`` is garbage collected; return ``obj``.
+
+        ``obj`` must not be referenced by the lease itself (e.g. a shallow
+        copy of :attr:`frame`), or it would never be collected.
+        """
+        if self._release is not None:
+            weakref.finalize(obj, self.release)
+        return obj
+
+    def __enter__(self) -> "Dataset":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+
+class DatasetCache:
+    """Reference-counted LRU cache of Arrow tables under a memory budget."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Rientrante: il garbage collector può eseguire il finalizer di un
+        # lease (``_release``) mentre questo thread tiene già il lock
+        self._lock = threading.RLock()
+        self._building: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(e.nbytes for e in self._entries.values())
+
+    def _lease(self, key: str) -> Dataset:
+        entry = self._entries[key]
+        entry.refs += 1
+        self._entries.move_to_end(key)
+        return Dataset(key, entry.frame, entry.table, self)
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refs -= 1
+                self._evict()
+
+    def _evict(self) -> None:
+        total = self.nbytes
+        for key in [k for k, e in self._entries.items() if e.refs == 0]:
+            if total <= self.budget_bytes:
+                break
+            total -= self._entries.pop(key).nbytes
+            self.evictions += 1
+
+    def acquire(self, key: str) -> Optional[Dataset]:
+        """Return a lease on ``key``, or ``None`` if it is not cached."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._lease(key)
+
+    @contextmanager
+    def acquire_all(
+        self, keys: Iterable[str]
+    ) -> Iterator[Optional[Dict[str, Dataset]]]:
+        """Lease every key for the ``with`` block, or ``None`` if one is missing.
+
+        The leases are released on exit; hold one past the block with
+        :meth:`put` or :meth:`Dataset.keep_with`.
+        """
+        with ExitStack() as stack:
+            leases = {}
+            for key in keys:
+                lease = self.acquire(key)
+                if lease is None:
+                    stack.close()
+                    yield None
+                    return
+                leases[key] = stack.enter_context(lease)
+            yield leases
+
+    def put(self, key: str, df: pd.DataFrame) -> Dataset:
+        """Cache ``df`` under ``key`` and return a lease on it.
+
+        If ``key`` is already cached the existing dataset is returned. Frames
+        that Arrow cannot represent, or a zero budget, give an uncached lease
+        on ``df`` itself.
+        """
+        if self.budget_bytes <= 0:
+            return Dataset(key, df)
+        try:
+            table = to_table(df)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            return Dataset(key, df)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = _Entry(table, to_frame(table), table.nbytes)
+            lease = self._lease(key)
+            self._evict()
+            return lease
+
+    def get_or_build(self, key: str, build: Callable[[], pd.DataFrame]) -> Dataset:
+        """Return ``key``, building it once even if several sessions ask at once."""
+        lease = self.acquire(key)
+        if lease is not None:
+            return lease
+        with self._lock:
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            lease = self.acquire(key)
+            if lease is None:
+                lease = self.put(key, build())
+        with self._lock:
+            self._building.pop(key, None)
+        return lease
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "datasets": len(self._entries),
+                "bytes": self.nbytes,
+                "pinned": sum(1 for e in self._entries.values() if e.refs),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Cache condivisa da tutte le sessioni del processo
+DATASETS = DatasetCache(DATASET_CACHE_MB * 1024 * 1024)
@@ -0,0 +1,646 @@
+"""Historic deal detection for the "Affari Storici" tab."""
+
+from __future__ import annotations
+
+import math
+import statistics
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from diagnostics import profiled
+from score import VAT_RATES, normalize_locale, calculate_shipping_cost
+
+# Colonne dell'export lette da questo modulo e mostrate nella tabella degli affari
+DEAL_COLUMNS = (
+    "ASIN",
+    "Title",
+    "Brand",
+    "URL: Amazon",
+    "Locale",
+    "Locale (base)",
+    "Locale (comp)",
+    "Buy Box 🚚: Current",
+    "Amazon: Current",
+    "New: Current",
+    "New, 3rd Party FBM 🚚: Current",
+    "Buy Box 🚚: 90 days avg.",
+    "Buy Box 🚚: 180 days avg.",
+    "Buy Box 🚚: 365 days avg.",
+    "Amazon: 90 days avg.",
+    "Amazon: 180 days avg.",
+    "Amazon: 365 days avg.",
+    "New: 90 days avg.",
+    "New: 180 days avg.",
+    "New: 365 days avg.",
+    "Buy Box 🚚: Lowest",
+    "Buy Box 🚚: Highest",
+    "One Time Coupon: Absolute",
+    "One Time Coupon: Percentage",
+    "Business Discount: Percentage",
+    "Referral Fee %",
+    "FBA Pick&Pack Fee",
+    "Package: Weight (g)",
+    "Item: Weight (g)",
+    "Sales Rank: Current",
+    "Sales Rank: 90 days avg.",
+    "Bought in past month",
+    "Reviews: Rating Count",
+    "Reviews: Rating Count - 90 days avg.",
+    "Buy Box: Standard Deviation 30 days",
+    "Buy Box: Standard Deviation 90 days",
+    "Buy Box: Standard Deviation 365 days",
+    "New Offer Count: Current",
+    "Buy Box: % Amazon 90 days",
+    "Buy Box: % Amazon 180 days",
+    "Buy Box: Unqualified",
+    "Amazon: 90 days OOS",
+    "Prime Eligible (Buy Box)",
+    "MAP restriction",
+    "Acquisto_Netto",
+    "Hist_FairPrice",
+    "Hist_Volatility",
+)
+
+
+def float_or_nan(x) -> float:
+    try:
+        if x is None:
+            return float("nan")
+        if isinstance(x, (int, float)):
+            return float(x)
+        s = (
+            str(x)
+            .strip()
+            .replace("%", "")
+            .replace("\u202f", "")
+            .replace(" ", "")
+        )
+        s = s.replace(".", "").replace(",", ".") if s.count(",") and s.count(".") <= 1 else s
+        return float(s)
+    except Exception:
+        return float("nan")
+
+
+# Tipi convertiti direttamente con float() da float_or_nan
+_NUMBER_TYPES = (int, float, bool, np.float64)
+
+# Testi fatti solo di cifre, separatori e simboli rimossi dalla pulizia
+_PLAIN_NUMBER = "^[0-9.,+\\-% \u202f€]*$"
+# Sintassi accettata da float() su questi caratteri
+_FLOAT_SYNTAX = r"^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)$"
+
+
+def _text_to_float(text: pd.Series, euro: bool) -> np.ndarray:
+    """:func:`float_or_nan` (or :func:`euro_to_float`) of strings, NaN if missing.
+
+    Plain numeric strings are cleaned and parsed with Arrow kernels, whose
+    cast rounds like ``float()``; anything else goes through the scalar
+    function.
+    """
+    arr = pa.array(text, type=pa.string(), from_pandas=True)
+    plain = pc.fill_null(pc.match_substring_regex(arr, _PLAIN_NUMBER), False)
+    # float_or_nan lascia "€" nel testo: float() lo rifiuta e il valore è NaN
+    removed = "[% \u202f€]" if euro else "[% \u202f]"
+    s = pc.replace_substring_regex(pc.if_else(plain, arr, None), removed, "")
+    swap = pc.and_(
+        pc.greater(pc.count_substring(s, ","), 0),
+        pc.less_equal(pc.count_substring(s, "."), 1),
+    )
+    swapped = pc.replace_substring(pc.replace_substring(s, ".", ""), ",", ".")
+    s = pc.if_else(swap, swapped, s)
+    s = pc.if_else(pc.match_substring_regex(s, _FLOAT_SYNTAX), s, None)
+    out = pc.cast(s, pa.float64()).to_numpy(zero_copy_only=False)
+    rest = ~plain.to_numpy(zero_copy_only=False) & text.notna().to_numpy()
+    if rest.any():
+        scalar = euro_to_float if euro else float_or_nan
+        out[rest] = [scalar(v) for v in text[rest]]
+    return out
+
+
+def _values_to_float(values: Any, euro: bool) -> np.ndarray:
+    series = pd.Series(values, copy=False)
+    if isinstance(series.dtype, pd.StringDtype):
+        return _text_to_float(series, euro)
+    if pd.api.types.is_numeric_dtype(series.dtype) and not (
+        euro and pd.api.types.is_bool_dtype(series.dtype)
+    ):
+        return series.to_numpy(dtype=float, na_value=np.nan)
+    obj = series.astype(object)
+    kinds = obj.map(type)
+    # bool è un int: float_or_nan lo converte, euro_to_float passa da "True"
+    numbers = kinds.isin(_NUMBER_TYPES) & ~(euro & kinds.eq(bool))
+    text = ~numbers & kinds.ne(type(None))
+    out = np.full(len(obj), np.nan)
+    out[numbers.to_numpy()] = obj[numbers].to_numpy(dtype=float)
+    if text.any():
+        strings = obj[text]
+        if not kinds[text].eq(str).all():
+            strings = strings.map(str)
+        out[text.to_numpy()] = _text_to_float(strings, euro)
+    return out
+
+
+def floats_or_nan(values: Any) -> np.ndarray:
+    """Batched :func:`float_or_nan` of every value of ``values``."""
+    return _values_to_float(values, euro=False)
+
+
+def euro_to_float(x: Any) -> float:
+    if x is None or (isinstance(x, float) and math.isnan(x)):
+        return float("nan")
+    s = str(x).replace("€", "").strip()
+    return float_or_nan(s)
+
+
+def euros_to_float(values: Any) -> np.ndarray:
+    """Batched :func:`euro_to_float` of every value of ``values``."""
+    return _values_to_float(values, euro=True)
+
+
+def apply_discounts(price_gross: float, coupon_abs, coupon_pct, business_pct) -> float:
+    p = float(price_gross) if math.isfinite(price_gross) else float("nan")
+    if not math.isfinite(p):
+        return p
+    ca = euro_to_float(coupon_abs)
+    cp = float_or_nan(coupon_pct)
+    bp = float_or_nan(business_pct)
+    if math.isfinite(ca) and ca > 0:
+        p = max(0.0, p - ca)
+    if math.isfinite(cp) and cp > 0:
+        p = p * (1.0 - cp / 100.0)
+    if math.isfinite(bp) and bp > 0:
+        p = p * (1.0 - bp / 100.0)
+    return max(0.0, p)
+
+
+def discounted_prices(
+    price_gross: Any, coupon_abs, coupon_pct, business_pct
+) -> np.ndarray:
+    """Batched :func:`apply_discounts` of aligned arrays."""
+    p = np.asarray(price_gross, dtype=float)
+    p = np.where(np.isfinite(p), p, np.nan)
+    ca = euros_to_float(coupon_abs)
+    cp = floats_or_nan(coupon_pct)
+    bp = floats_or_nan(business_pct)
+    with np.errstate(invalid="ignore", over="ignore"):
+        p = np.where(np.isfinite(ca) & (ca > 0), np.maximum(0.0, p - ca), p)
+        p = np.where(np.isfinite(cp) & (cp > 0), p * (1.0 - cp / 100.0), p)
+        p = np.where(np.isfinite(bp) & (bp > 0), p * (1.0 - bp / 100.0), p)
+    return np.where(np.isnan(p), p, np.maximum(0.0, p))
+
+
+# Colonne lette dalle funzioni riga per riga: ``_apply_rows`` passa solo queste
+ROW_INPUTS = {
+    "price": (
+        "Buy Box 🚚: Current",
+        "Amazon: Current",
+        "New: Current",
+        "New, 3rd Party FBM 🚚: Current",
+    ),
+    "fulfillment": ("FBA Pick&Pack Fee", "Package: Weight (g)", "Item: Weight (g)"),
+    "amazon_bb": ("Buy Box: % Amazon 90 days", "Buy Box: % Amazon 180 days"),
+}
+
+
+def _apply_rows(df: pd.DataFrame, func, inputs: str) -> pd.Series:
+    """Apply ``func`` to every row of the ``ROW_INPUTS[inputs]`` columns of ``df``.
+
+    ``DataFrame.apply(axis=1)`` materializes the frame it runs on as one
+    object array, so it gets only the columns ``func`` reads.
+    """
+    cols = [c for c in ROW_INPUTS[inputs] if c in df.columns]
+    return df[cols].apply(func, axis=1)
+
+
+def pick_current_price(row: pd.Series) -> float:
+    # priorità: BB -> Amazon -> New -> New FBM current (se disponibile)
+    for col in [
+        "Buy Box 🚚: Current",
+        "Amazon: Current",
+        "New: Current",
+        "New, 3rd Party FBM 🚚: Current",
+    ]:
+        if (
+            col in row
+            and math.isfinite(euro_to_float(row[col]))
+            and euro_to_float(row[col]) > 0
+        ):
+            return euro_to_float(row[col])
+    return float("nan")
+
+
+# Medie storiche da cui si ricava il prezzo equo
+FAIR_PRICE_COLUMNS = (
+    "Buy Box 🚚: 90 days avg.",
+    "Buy Box 🚚: 180 days avg.",
+    "Buy Box 🚚: 365 days avg.",
+    "Amazon: 90 days avg.",
+    "Amazon: 180 days avg.",
+    "Amazon: 365 days avg.",
+    "New: 90 days avg.",
+    "New: 180 days avg.",
+    "New: 365 days avg.",
+)
+
+
+def fair_price_row(row: pd.Series) -> float:
+    # mediana robusta delle medie storiche (BB/Amazon/New su 90/180/365)
+    vals = [euro_to_float(row.get(c)) for c in FAIR_PRICE_COLUMNS if c in row]
+    vals = [v for v in vals if math.isfinite(v) and v > 0]
+    if not vals:
+        return float("nan")
+    fair = statistics.median(sorted(vals))
+    # clamp entro min/max storico BB se disponibili
+    low = euro_to_float(row.get("Buy Box 🚚: Lowest"))
+    high = euro_to_float(row.get("Buy Box 🚚: Highest"))
+    if math.isfinite(low) and fair < low:
+        fair = low
+    if math.isfinite(high) and fair > high:
+        fair = high
+    return fair
+
+
+def _column(df: pd.DataFrame, column: str) -> pd.Series:
+    # Colonna assente: NaN come row.get() -> None nella versione riga per riga
+    if column not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    return df[column]
+
+
+def _column_floats(df: pd.DataFrame, column: str, convert=floats_or_nan) -> np.ndarray:
+    return convert(_column(df, column))
+
+
+def fair_prices(df: pd.DataFrame) -> np.ndarray:
+    """Batched :func:`fair_price_row` of every row of ``df``."""
+    cols = [c for c in FAIR_PRICE_COLUMNS if c in df.columns]
+    vals = np.column_stack(
+        [euros_to_float(df[c]) for c in cols] or [np.full(len(df), np.nan)]
+    )
+    vals[~(np.isfinite(vals) & (vals > 0))] = np.nan
+    # Mediana come statistics.median: NaN in coda, media dei due centrali se pari
+    vals.sort(axis=1)
+    count = np.isfinite(vals).sum(axis=1)
+    rows = np.arange(len(vals))
+    lo = vals[rows, np.maximum(count - 1, 0) // 2]
+    hi = vals[rows, count // 2]
+    fair = np.where(count % 2 == 1, lo, (lo + hi) / 2)
+    fair = np.where(count > 0, fair, np.nan)
+    low = _column_floats(df, "Buy Box 🚚: Lowest", euros_to_float)
+    high = _column_floats(df, "Buy Box 🚚: Highest", euros_to_float)
+    fair = np.where(np.isfinite(low) & (fair < low), low, fair)
+    return np.where(np.isfinite(high) & (fair > high), high, fair)
+
+
+def get_vat_for_locale(locale_raw: str) -> float:
+    # RIUSA la tua mappa IVA se esiste (VAT_RATES + normalize_locale).
+    try:
+        loc = normalize_locale(locale_raw)
+        return VAT_RATES.get(loc, 0.22)
+    except Exception:
+        return 0.22
+
+
+def estimate_fulfillment_fee(row: pd.Series) -> float:
+    # Se c'è FBA Pick&Pack Fee usalo, altrimenti stima FBM via peso e tua funzione di spedizione
+    fba = float_or_nan(row.get("FBA Pick&Pack Fee"))
+    if math.isfinite(fba) and fba > 0:
+        return fba
+    # FBM: calcola costo spedizione dalla tua funzione principale, usando peso pacco/item
+    grams = float_or_nan(row.get("Package: Weight (g)"))
+    if not math.isfinite(grams) or grams <= 0:
+        grams = float_or_nan(row.get("Item: Weight (g)"))
+    if not math.isfinite(grams) or grams <= 0:
+        grams = 1000.0  # fallback = 1 kg
+    kg = grams / 1000.0
+    try:
+        return calculate_shipping_cost(kg)
+    except Exception:
+        if kg <= 1:
+            return 5.0
+        elif kg <= 2:
+            return 7.0
+        elif kg <= 5:
+            return 10.0
+        else:
+            return 15.0
+
+
+def demand_score(row: pd.Series) -> float:
+    rank_c = float_or_nan(row.get("Sales Rank: Current"))
+    rank_90 = float_or_nan(row.get("Sales Rank: 90 days avg."))
+    bought = float_or_nan(row.get("Bought in past month"))
+    rev_now = float_or_nan(row.get("Reviews: Rating Count"))
+    rev_90 = float_or_nan(row.get("Reviews: Rating Count - 90 days avg."))
+
+    def vol(r):
+        if not math.isfinite(r) or r <= 0:
+            return 0.0
+        return max(0.0, min(100.0, 1000.0 / math.log(r + 10.0)))
+
+    base = vol(rank_c)
+    if math.isfinite(rank_c) and math.isfinite(rank_90) and rank_c < rank_90:
+        base *= 1.10
+    if math.isfinite(bought) and bought > 0:
+        base += min(30.0, 10.0 * math.log(1.0 + bought))
+    if math.isfinite(rev_now) and math.isfinite(rev_90) and rev_now > rev_90:
+        base += min(10.0, (rev_now - rev_90) * 0.02)
+    return float(max(0.0, min(100.0, base)))
+
+
+def demand_scores(df: pd.DataFrame) -> np.ndarray:
+    """Batched :func:`demand_score` of every row of ``df``."""
+    rank_c = _column_floats(df, "Sales Rank: Current")
+    rank_90 = _column_floats(df, "Sales Rank: 90 days avg.")
+    bought = _column_floats(df, "Bought in past month")
+    rev_now = _column_floats(df, "Reviews: Rating Count")
+    rev_90 = _column_floats(df, "Reviews: Rating Count - 90 days avg.")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ranked = np.isfinite(rank_c) & (rank_c > 0)
+        vol = np.clip(1000.0 / np.log(np.where(ranked, rank_c, 1.0) + 10.0), 0.0, 100.0)
+        base = np.where(ranked, vol, 0.0)
+        rising = np.isfinite(rank_c) & np.isfinite(rank_90) & (rank_c < rank_90)
+        base = np.where(rising, base * 1.10, base)
+        sold = np.isfinite(bought) & (bought > 0)
+        bonus = np.minimum(30.0, 10.0 * np.log(1.0 + np.where(sold, bought, 0.0)))
+        base = np.where(sold, base + bonus, base)
+        reviewed = np.isfinite(rev_now) & np.isfinite(rev_90) & (rev_now > rev_90)
+        reviews = np.minimum(10.0, (rev_now - rev_90) * 0.02)
+        base = np.where(reviewed, base + reviews, base)
+    return np.clip(base, 0.0, 100.0)
+
+
+def competition_score(row: pd.Series) -> float:
+    offers = float_or_nan(row.get("New Offer Count: Current"))
+    amz90 = float_or_nan(row.get("Buy Box: % Amazon 90 days"))
+    amz180 = float_or_nan(row.get("Buy Box: % Amazon 180 days"))
+    amz = max(
+        amz90 if math.isfinite(amz90) else 0.0,
+        amz180 if math.isfinite(amz180) else 0.0,
+    )
+    unq = 100.0 if str(row.get("Buy Box: Unqualified")).strip().lower() == "yes" else 0.0
+    off_pen = min(100.0, (offers / 50.0) * 50.0) if math.isfinite(offers) else 0.0
+    amz_pen = min(100.0, amz) if math.isfinite(amz) else 0.0
+    return float(max(0.0, min(100.0, 0.6 * off_pen + 0.4 * amz_pen + 0.5 * unq)))
+
+
+def _says_yes(values: pd.Series) -> np.ndarray:
+    """``str(v).strip().lower() == "yes"`` for every value."""
+    if not isinstance(values.dtype, pd.StringDtype):
+        values = values.astype(object)
+        other = ~values.map(type).eq(str) & values.notna()
+        if other.any():
+            values = values.copy()
+            values[other] = values[other].map(str)
+    arr = pa.array(values, type=pa.string(), from_pandas=True)
+    ascii = pc.fill_null(pc.match_substring_regex(arr, r"^[\x20-\x7e]*$"), False)
+    yes = pc.equal(pc.utf8_lower(pc.utf8_trim(arr, " ")), "yes")
+    out = pc.fill_null(pc.and_(ascii, yes), False).to_numpy(zero_copy_only=False)
+    rest = ~ascii.to_numpy(zero_copy_only=False) & values.notna().to_numpy()
+    if rest.any():
+        out[rest] = [str(v).strip().lower() == "yes" for v in values[rest]]
+    return out
+
+
+def competition_scores(df: pd.DataFrame) -> np.ndarray:
+    """Batched :func:`competition_score` of every row of ``df``."""
+    offers = _column_floats(df, "New Offer Count: Current")
+    amz90 = _column_floats(df, "Buy Box: % Amazon 90 days")
+    amz180 = _column_floats(df, "Buy Box: % Amazon 180 days")
+    amz = np.maximum(
+        np.where(np.isfinite(amz90), amz90, 0.0),
+        np.where(np.isfinite(amz180), amz180, 0.0),
+    )
+    unq = np.zeros(len(df))
+    if "Buy Box: Unqualified" in df.columns:
+        unq[_says_yes(df["Buy Box: Unqualified"])] = 100.0
+    off_pen = np.where(
+        np.isfinite(offers), np.minimum(100.0, (offers / 50.0) * 50.0), 0.0
+    )
+    amz_pen = np.minimum(100.0, amz)
+    return np.clip(0.6 * off_pen + 0.4 * amz_pen + 0.5 * unq, 0.0, 100.0)
+
+
+def scale_0_100(series: pd.Series) -> pd.Series:
+    s = series.astype(float).replace([np.inf, -np.inf], np.nan)
+    mn, mx = s.min(skipna=True), s.max(skipna=True)
+    if not math.isfinite(mn) or not math.isfinite(mx) or mx == mn:
+        return pd.Series([50.0] * len(s), index=s.index)
+    return (s - mn) * 100.0 / (mx - mn)
+
+
+@profiled
+def compute_historic_deals(df: pd.DataFrame) -> pd.DataFrame:
+    if df is None or df.empty:
+        return pd.DataFrame()
+
+    # Copia superficiale: le colonne aggiunte non toccano ``df`` (copy-on-write)
+    work = df.copy(deep=False)
+
+    work["PriceNowGross"] = _apply_rows(work, pick_current_price, "price")
+    work["PriceNowGrossAfterDisc"] = discounted_prices(
+        work["PriceNowGross"],
+        *(
+            _column(work, c)
+            for c in (
+                "One Time Coupon: Absolute",
+                "One Time Coupon: Percentage",
+                "Business Discount: Percentage",
+            )
+        ),
+    )
+    if "Locale" not in work.columns:
+        work["Locale"] = (
+            # astype prima di fillna: i locali possono essere categorici
+            work.get("Locale (comp)", pd.Series("", index=work.index)).astype(str).fillna("")
+            + work.get("Locale (base)", pd.Series("", index=work.index)).astype(str).fillna("")
+        )
+    work["VAT"] = work["Locale"].apply(get_vat_for_locale)
+    work["NetSale"] = work["PriceNowGrossAfterDisc"] / (1.0 + work["VAT"])
+
+    work["FairPrice"] = fair_prices(work)
+    if "Hist_FairPrice" in work.columns:
+        # Storico locale degli snapshot, se disponibile, al posto delle medie Keepa
+        work["FairPrice"] = work["Hist_FairPrice"].fillna(work["FairPrice"])
+    work["UnderPct"] = (
+        work["FairPrice"] - work["PriceNowGrossAfterDisc"]
+    ) / work["FairPrice"]
+    work.loc[~np.isfinite(work["UnderPct"]), "UnderPct"] = np.nan
+
+    work["ReferralFeePct"] = work.get(
+        "Referral Fee %", pd.Series(np.nan, index=work.index)
+    ).apply(float_or_nan).fillna(0.0)
+    work["ReferralFee€"] = work["NetSale"] * (work["ReferralFeePct"] / 100.0)
+    work["Fulfillment€"] = _apply_rows(work, estimate_fulfillment_fee, "fulfillment")
+    work["NetProceed€"] = (
+        work["NetSale"] - work["ReferralFee€"] - work["Fulfillment€"]
+    )
+
+    if "Acquisto_Netto" not in work.columns:
+        work["Acquisto_Netto"] = np.nan
+
+    work["Marg€"] = work["NetProceed€"] - work["Acquisto_Netto"]
+    work["Marg%"] = np.where(
+        work["Acquisto_Netto"] > 0,
+        work["Marg€"] / work["Acquisto_Netto"],
+        np.nan,
+    )
+
+    work["Demand"] = demand_scores(work)
+    vol_candidates = []
+    for c in [
+        "Buy Box: Standard Deviation 90 days",
+        "Buy Box: Standard Deviation 30 days",
+        "Buy Box: Standard Deviation 365 days",
+    ]:
+        if c in work.columns:
+            vol_candidates.append(work[c].apply(euro_to_float))
+    work["Volatility"] = (
+        pd.concat(vol_candidates, axis=1).bfill(axis=1).iloc[:, 0]
+        if vol_candidates
+        else np.nan
+    )
+    if "Hist_Volatility" in work.columns:
+        work["Volatility"] = work["Hist_Volatility"].fillna(work["Volatility"])
+    work["Competition"] = competition_scores(work)
+
+    work["Badge_AMZ_OOS"] = (
+        work.get("Amazon: 90 days OOS", pd.Series(0, index=work.index)).fillna(0) > 0
+    )
+    amzbb90 = work.get("Buy Box: % Amazon 90 days", pd.Series(0, index=work.index))
+    amzbb90 = amzbb90.apply(float_or_nan)
+    work["Badge_BB_Amazon"] = amzbb90.fillna(0) > 50
+    work["Badge_Coupon"] = (
+        work.get("One Time Coupon: Absolute", pd.Series(0, index=work.index))
+        .apply(euro_to_float)
+        .fillna(0)
+        > 0
+    ) | (
+        work.get("One Time Coupon: Percentage", pd.Series(0, index=work.index))
+        .apply(float_or_nan)
+        .fillna(0)
+        > 0
+    )
+    work["Badge_Prime"] = (
+        work.get("Prime Eligible (Buy Box)", pd.Series(False, index=work.index))
+        .astype(str)
+        .str.lower()
+        .eq("yes")
+    )
+    work["Badge_VolHigh"] = False
+    work["Badge_MAP"] = (
+        work.get("MAP restriction", pd.Series("", index=work.index))
+        .astype(str)
+        .str.lower()
+        .eq("yes")
+    )
+
+    return work
+
+
+@dataclass(frozen=True)
+class DealWeights:
+    """Weights of the DealScore components; penalties are subtracted."""
+
+    under: float = 0.30
+    margin: float = 0.25
+    demand: float = 0.25
+    competition: float = 0.10
+    volatility: float = 0.10
+
+
+@dataclass(frozen=True)
+class DealFilters:
+    """Thresholds applied to the historic deals before scoring."""
+
+    min_marg_eur: float = 10.0
+    min_under: float = 0.10
+    min_marg_pct: float = 0.10
+    max_rank: float = 200000.0
+    max_offers: float = 50
+    max_vol: float = 50.0
+    excl_amz_bb: bool = True
+    only_amz_oos: bool = False
+
+
+def pct_amz_bb(row: pd.Series) -> float:
+    s = [
+        float_or_nan(row.get("Buy Box: % Amazon 90 days")),
+        float_or_nan(row.get("Buy Box: % Amazon 180 days")),
+    ]
+    return max([x for x in s if math.isfinite(x)] + [0.0])
+
+
+@profiled
+def select_deals(deals_df: pd.DataFrame, filters: DealFilters) -> pd.DataFrame:
+    """Return the rows of ``deals_df`` passing ``filters``, high volatility flagged.
+
+    ``deals_df`` itself is left unchanged, so it can be kept across reruns.
+    """
+    vol_series = deals_df["Volatility"].replace([np.inf, -np.inf], np.nan)
+    vol_thr = (
+        np.nanpercentile(vol_series.dropna(), 75)
+        if vol_series.notna().any()
+        else np.nan
+    )
+    if math.isfinite(vol_thr):
+        deals_df = deals_df.assign(Badge_VolHigh=deals_df["Volatility"] > vol_thr)
+
+    mask = pd.Series(True, index=deals_df.index)
+    if math.isfinite(filters.min_marg_eur):
+        mask &= deals_df["Marg€"].fillna(-1e9) >= filters.min_marg_eur
+    if math.isfinite(filters.min_marg_pct):
+        mask &= deals_df["Marg%"].fillna(-1e9) >= filters.min_marg_pct
+    if math.isfinite(filters.min_under):
+        mask &= deals_df["UnderPct"].fillna(-1e9) >= filters.min_under
+    mask &= (
+        deals_df.get("Sales Rank: Current", pd.Series(np.nan, index=deals_df.index))
+        .apply(float_or_nan)
+        .fillna(1e12)
+        <= filters.max_rank
+    )
+    mask &= (
+        deals_df.get(
+            "New Offer Count: Current", pd.Series(np.nan, index=deals_df.index)
+        )
+        .apply(float_or_nan)
+        .fillna(1e9)
+        <= filters.max_offers
+    )
+    mask &= deals_df["Volatility"].fillna(0) <= filters.max_vol
+    if filters.excl_amz_bb:
+        mask &= _apply_rows(deals_df, lambda r: pct_amz_bb(r) <= 50.0, "amazon_bb")
+    if filters.only_amz_oos:
+        mask &= (
+            deals_df.get(
+                "Amazon: 90 days OOS", pd.Series(0, index=deals_df.index)
+            ).fillna(0)
+            > 0
+        )
+    return deals_df[mask]
+
+
+@profiled
+def score_deals(deals_f: pd.DataFrame, weights: DealWeights) -> pd.DataFrame:
+    """Add the 0-100 ``DealScore`` column to the selected deals."""
+    S_under = scale_0_100(deals_f["UnderPct"])
+    S_marg = scale_0_100(deals_f["Marg%"])
+    S_dem = scale_0_100(deals_f["Demand"])
+    S_comp = scale_0_100(deals_f["Competition"])
+    S_vol = scale_0_100(deals_f["Volatility"])
+
+    deals_f["DealScore"] = (
+        weights.under * S_under
+        + weights.margin * S_marg
+        + weights.demand * S_dem
+        - weights.competition * S_comp
+        - weights.volatility * S_vol
+    )
+    deals_f["DealScore"] = scale_0_100(deals_f["DealScore"])
+    return deals_f
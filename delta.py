@@ -0,0 +1,199 @@
+"""Delta ingestion of refreshed exports of the same ASIN lists.
+
+A :class:`DeltaState` keeps, for the previous run, a hash of the rows of
+every ASIN in the base and comparison exports and the rows it produced
+after the per-row stages (parse, margins, row features). A new export is
+diffed against it by ASIN: only the ASINs whose rows were added, changed or
+removed go through the per-row stages again. The global part of the run,
+min/max normalization, scores and ranking, is then re-applied to all the
+rows, so the results equal those of a full :func:`engine.run_analysis`
+(integer columns may come back as float when a part had missing values).
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from engine import (
+    DISPLAY_COLS_ORDER,
+    TOP_K,
+    AnalysisError,
+    EngineConfig,
+    Progress,
+    ScoreWeights,
+    _no_progress,
+    _process_shard,
+    apply_scores,
+    finalize_results,
+    load_uploads,
+)
+from snapshots import SnapshotStore
+
+# Posizione della riga tra quelle dello stesso ASIN nei due export
+BASE_OCC = "__base_occ"
+COMP_OCC = "__comp_occ"
+
+
+@dataclass
+class DeltaState:
+    """Inputs and per-row results of the previous run."""
+
+    config: EngineConfig
+    columns_base: List[str]
+    columns_comp: List[str]
+    base_hashes: pd.Series
+    comp_hashes: pd.Series
+    rows: pd.DataFrame
+    stats: Dict[str, int] = field(default_factory=dict)
+
+
+def _occurrence(df: pd.DataFrame) -> np.ndarray:
+    return df.groupby("ASIN", sort=False, dropna=False).cumcount().to_numpy()
+
+
+def asin_hashes(df: pd.DataFrame) -> pd.Series:
+    """Return one hash per ASIN of its rows, in order."""
+    rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    # La posizione entra nell'hash: righe scambiate contano come modifica
+    rows = rows ^ pd.util.hash_array(_occurrence(df))
+    rows = pd.Series(rows, index=df["ASIN"].to_numpy())
+    return rows.groupby(level=0, dropna=False).sum()
+
+
+def changed_asins(new: pd.Series, old: pd.Series) -> pd.Index:
+    """Return the ASINs added, removed or changed between two hash series."""
+    common = new.index.intersection(old.index)
+    modified = common[new.loc[common].to_numpy() != old.loc[common].to_numpy()]
+    return (
+        new.index.difference(old.index)
+        .union(old.index.difference(new.index))
+        .union(modified)
+    )
+
+
+def _delta_key(config: EngineConfig) -> EngineConfig:
+    # I pesi agiscono solo nella fase globale
+    return replace(config, weights=ScoreWeights())
+
+
+def _process_asins(
+    df_base: pd.DataFrame, df_comp: pd.DataFrame, asins: pd.Index, config: EngineConfig
+) -> pd.DataFrame:
+    base = df_base[df_base["ASIN"].isin(asins)]
+    comp = df_comp[df_comp["ASIN"].isin(asins)]
+    merged = pd.merge(
+        base, comp, on="ASIN", how="inner", suffixes=(" (base)", " (comp)")
+    )
+    if merged.empty:
+        return merged
+    rows, _ = _process_shard(merged, config)
+    return rows
+
+
+def ingest(
+    df_base: pd.DataFrame,
+    df_comp: pd.DataFrame,
+    config: EngineConfig,
+    previous: Optional[DeltaState] = None,
+    progress: Progress = _no_progress,
+) -> Dict[str, Any]:
+    """Run the pipeline on refreshed exports, reusing ``previous`` when it applies.
+
+    ``previous`` is used only if it was built with the same parameters (the
+    score weights excepted) and the same columns; otherwise every ASIN is
+    processed. The results hold the new state under ``"delta"``.
+    """
+    if "ASIN" not in df_base.columns or "ASIN" not in df_comp.columns:
+        raise AnalysisError(
+            "Assicurati che entrambi i file (origine e confronto) contengano la colonna ASIN."
+        )
+
+    progress("merge")
+    df_base = df_base.assign(ASIN=df_base["ASIN"].str.strip().str.upper())
+    df_comp = df_comp.assign(ASIN=df_comp["ASIN"].str.strip().str.upper())
+    base_hashes = asin_hashes(df_base)
+    comp_hashes = asin_hashes(df_comp)
+    df_base[BASE_OCC] = _occurrence(df_base)
+    df_comp[COMP_OCC] = _occurrence(df_comp)
+
+    # Ordine e indice che avrebbe il merge completo
+    order = pd.merge(
+        df_base[["ASIN", BASE_OCC]], df_comp[["ASIN", COMP_OCC]], on="ASIN"
+    )
+    if order.empty:
+        raise AnalysisError(
+            "Nessuna corrispondenza trovata tra la Lista di Origine e le Liste di Confronto."
+        )
+
+    usable = (
+        previous is not None
+        and _delta_key(previous.config) == _delta_key(config)
+        and previous.columns_base == list(df_base.columns)
+        and previous.columns_comp == list(df_comp.columns)
+    )
+    if usable:
+        affected = changed_asins(base_hashes, previous.base_hashes).union(
+            changed_asins(comp_hashes, previous.comp_hashes)
+        )
+        kept = previous.rows[~previous.rows["ASIN"].isin(affected)]
+    else:
+        affected = base_hashes.index.union(comp_hashes.index)
+        kept = None
+
+    progress("parse")
+    fresh = _process_asins(df_base, df_comp, affected, config)
+    parts = [p for p in (kept, fresh) if p is not None and not p.empty]
+    rows = pd.concat(parts or [fresh if kept is None else kept])
+
+    # Riporta le righe nell'ordine del merge completo
+    positions = pd.Series(
+        np.arange(len(order)),
+        index=pd.MultiIndex.from_frame(order[["ASIN", BASE_OCC, COMP_OCC]]),
+    )
+    keys = pd.MultiIndex.from_arrays([rows["ASIN"], rows[BASE_OCC], rows[COMP_OCC]])
+    rows.index = positions.reindex(keys).to_numpy()
+    rows = rows.sort_index()
+
+    state = DeltaState(
+        config=config,
+        columns_base=list(df_base.columns),
+        columns_comp=list(df_comp.columns),
+        base_hashes=base_hashes,
+        comp_hashes=comp_hashes,
+        rows=rows,
+        stats={
+            "asins": len(base_hashes.index.union(comp_hashes.index)),
+            "recomputed": len(affected),
+            "reused_rows": 0 if kept is None else len(kept),
+        },
+    )
+
+    progress("scoring")
+    df_rows = apply_scores(rows.drop(columns=[BASE_OCC, COMP_OCC]), config)
+    top = df_rows.nlargest(TOP_K, "Opportunity_Score")
+    progress("ranking", partial=top[[c for c in DISPLAY_COLS_ORDER if c in top]])
+    results = finalize_results(df_rows)
+    results["config"] = config
+    results["delta"] = state
+    return results
+
+
+def analyze_delta(
+    files_base: Any,
+    comparison_files: Any,
+    config: EngineConfig,
+    progress: Progress = _no_progress,
+    previous: Optional[DeltaState] = None,
+    history: Optional[SnapshotStore] = None,
+) -> Dict[str, Any]:
+    """Load the uploaded files and :func:`ingest` them against ``previous``."""
+    progress("load")
+    df_base, df_comp, warnings = load_uploads(files_base, comparison_files, history)
+
+    results = ingest(df_base, df_comp, config, previous, progress)
+    results["warnings"] = warnings
+    return results
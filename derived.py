@@ -0,0 +1,280 @@
+"""Dependency-tracked incremental recomputation of the derived columns.
+
+Each node of :data:`NODES` computes a group of columns from the parsed
+frame, the columns of the nodes it depends on and a few fields of the
+:class:`engine.EngineConfig`. The key of a node combines those fields with
+the keys of its dependencies, so when a parameter changes only the nodes
+downstream of it are recomputed; the others are served from the cache.
+Changing ``discount``, for example, recomputes ``Acquisto_Netto``, the
+margins, the filter and the scores but not shipping, trend or volume.
+
+The caches are shared by all sessions and keyed by the content of the
+uploads: at most :data:`settings.DERIVED_CACHE_SIZE` parsed frames are kept,
+each pinned in :data:`datacache.DATASETS` so it counts against its budget.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from operator import attrgetter
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import pandas as pd
+
+from datacache import DATASETS, Dataset, file_fingerprint
+from diagnostics import profile_stage
+from engine import (
+    DISPLAY_COLS_ORDER,
+    TOP_K,
+    EngineConfig,
+    Progress,
+    _no_progress,
+    apply_scores,
+    assign_columns,
+    filter_mask,
+    finalize_results,
+    load_uploads,
+    margin_columns,
+    prepare_frames,
+    purchase_columns,
+    rank_columns,
+    roi_columns,
+    sale_columns,
+    shipping_columns,
+    trend_columns,
+    vat_columns,
+)
+from settings import DERIVED_CACHE_SIZE
+from snapshots import SnapshotStore, upload_source
+
+KEEP_COL = "__keep"
+
+# Varianti conservate per nodo (es. avanti e indietro su uno slider)
+NODE_CACHE_SIZE = 4
+
+
+@dataclass(frozen=True)
+class Node:
+    """A group of derived columns, its upstream nodes and config fields."""
+
+    name: str
+    compute: Callable[[pd.DataFrame, EngineConfig], Dict[str, pd.Series]]
+    deps: Tuple[str, ...] = ()
+    params: Tuple[str, ...] = ()
+
+
+# In ordine topologico
+NODES: Tuple[Node, ...] = (
+    Node("shipping", lambda df, c: shipping_columns(df)),
+    Node(
+        "purchase",
+        lambda df, c: purchase_columns(df, c.discount),
+        params=("discount",),
+    ),
+    Node("sale", lambda df, c: sale_columns(df)),
+    Node(
+        "margins",
+        lambda df, c: margin_columns(df, c.include_shipping),
+        deps=("shipping", "purchase", "sale"),
+        params=("include_shipping",),
+    ),
+    Node("ranks", lambda df, c: rank_columns(df)),
+    Node("trend", lambda df, c: trend_columns(df), deps=("ranks",)),
+    Node("roi", lambda df, c: roi_columns(df), deps=("margins",)),
+    Node("vat", lambda df, c: vat_columns(df)),
+    Node(
+        "keep",
+        lambda df, c: {KEEP_COL: filter_mask(df, c.filters)},
+        deps=("margins", "ranks", "sale"),
+        params=("filters",),
+    ),
+)
+
+
+class DerivedColumns:
+    """Derived columns of one parsed frame, cached per node and key.
+
+    ``df_parsed`` is the result of :func:`engine.prepare_frames` and is never
+    modified. ``source`` identifies the uploads it was built from, so callers
+    can tell whether the cache still applies. ``lease`` is the
+    :class:`datacache.Dataset` holding ``df_parsed``, released by
+    :meth:`release`.
+    """
+
+    def __init__(
+        self,
+        df_parsed: pd.DataFrame,
+        source: Hashable = None,
+        nodes: Tuple[Node, ...] = NODES,
+        cache_size: int = NODE_CACHE_SIZE,
+        lease: Optional[Dataset] = None,
+    ):
+        self.df_parsed = df_parsed
+        self.source = source
+        self.lease = lease
+        self.nodes = nodes
+        self._cache_size = cache_size
+        self._columns: Dict[str, OrderedDict] = {n.name: OrderedDict() for n in nodes}
+        self._results: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # Nodi ricalcolati dall'ultima chiamata a ``frame``
+        self.recomputed: List[str] = []
+
+    def release(self) -> None:
+        if self.lease is not None:
+            self.lease.release()
+
+    def keys(self, config: EngineConfig) -> Dict[str, Hashable]:
+        """Return the cache key of every node for ``config``."""
+        keys: Dict[str, Hashable] = {}
+        for node in self.nodes:
+            params = tuple(attrgetter(p)(config) for p in node.params)
+            keys[node.name] = (params, tuple(keys[d] for d in node.deps))
+        return keys
+
+    def _remember(self, cache: OrderedDict, key: Hashable, value: Any) -> None:
+        cache[key] = value
+        while len(cache) > self._cache_size:
+            cache.popitem(last=False)
+
+    def frame(self, config: EngineConfig) -> pd.DataFrame:
+        """Return the parsed frame with every derived column for ``config``."""
+        df = self.df_parsed.copy(deep=False)
+        self.recomputed = []
+        for node, key in zip(self.nodes, self.keys(config).values()):
+            cache = self._columns[node.name]
+            with profile_stage(node.name, len(df)) as entry:
+                if key in cache:
+                    cache.move_to_end(key)
+                    entry["cache"] = "hit"
+                else:
+                    self._remember(cache, key, node.compute(df, config))
+                    self.recomputed.append(node.name)
+                    entry["cache"] = "miss"
+                assign_columns(df, cache[key])
+        return df
+
+    def results(
+        self, config: EngineConfig, progress: Progress = _no_progress
+    ) -> Dict[str, Any]:
+        """Return the same results as :func:`engine.score_prepared`.
+
+        The scores depend on every other node and on the weights, so a full
+        result set is cached as well and reused when nothing changed.
+        """
+        with self._lock:
+            return self._results_locked(config, progress)
+
+    def _results_locked(
+        self, config: EngineConfig, progress: Progress
+    ) -> Dict[str, Any]:
+        key = (tuple(self.keys(config).values()), config.weights)
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.recomputed = []
+            return self._results[key]
+
+        progress("margins")
+        df = self.frame(config)
+        df_rows = df[df.pop(KEEP_COL)]
+
+        progress("scoring")
+        df_rows = apply_scores(df_rows, config)
+        self.recomputed.append("scores")
+
+        top = df_rows.nlargest(TOP_K, "Opportunity_Score")
+        progress("ranking", partial=top[[c for c in DISPLAY_COLS_ORDER if c in top]])
+        results = finalize_results(df_rows)
+        results["config"] = config
+        self._remember(self._results, key, results)
+        return results
+
+
+def source_key(
+    files_base: Any,
+    comparison_files: Any,
+    config: EngineConfig,
+    history: Optional[SnapshotStore] = None,
+) -> Tuple:
+    """Identify the uploads and the price columns a parsed frame depends on.
+
+    Uploads are identified by the hash of their content, so a re-exported
+    file with the same name and size is not mistaken for the previous one;
+    the history version is the one after these uploads are ingested.
+    """
+    base = tuple(file_fingerprint(f) for f in files_base or [])
+    comp = tuple(file_fingerprint(f) for f in comparison_files or [])
+    return (
+        base,
+        comp,
+        config.ref_price_base,
+        config.ref_price_comp,
+        history.version([upload_source(base), upload_source(comp)])
+        if history is not None
+        else None,
+    )
+
+
+# Colonne derivate condivise tra le sessioni, dalla meno recente
+_shared: "OrderedDict[Hashable, DerivedColumns]" = OrderedDict()
+_shared_lock = threading.Lock()
+
+
+def shared_derived(source: Hashable) -> Optional[DerivedColumns]:
+    """Return the shared :class:`DerivedColumns` built from ``source``, if any."""
+    with _shared_lock:
+        derived = _shared.get(source)
+        if derived is not None:
+            _shared.move_to_end(source)
+        return derived
+
+
+def share_derived(
+    df_parsed: pd.DataFrame, source: Hashable, size: int = DERIVED_CACHE_SIZE
+) -> DerivedColumns:
+    """Keep ``df_parsed`` for the sessions that analyse the same uploads.
+
+    The frame is pinned in :data:`datacache.DATASETS`; beyond ``size``
+    sources the least recently used one is dropped and its lease released.
+    """
+    digest = hashlib.sha256(repr(source).encode("utf-8")).hexdigest()[:32]
+    lease = DATASETS.put(f"parsed:{digest}", df_parsed)
+    derived = DerivedColumns(lease.frame, source, lease=lease)
+    with _shared_lock:
+        previous = _shared.pop(source, None)
+        _shared[source] = derived
+        dropped = [previous] if previous is not None else []
+        while len(_shared) > max(size, 0):
+            dropped.append(_shared.popitem(last=False)[1])
+    for old in dropped:
+        old.release()
+    return derived
+
+
+def analyze_incremental(
+    files_base: Any,
+    comparison_files: Any,
+    config: EngineConfig,
+    progress: Progress = _no_progress,
+    history: Optional[SnapshotStore] = None,
+) -> Dict[str, Any]:
+    """Like :func:`engine.analyze_uploads`, reusing the derived columns of a
+    previous run on the same uploads, by any session.
+    """
+    source = source_key(files_base, comparison_files, config, history)
+    warnings: List[str] = []
+    derived = shared_derived(source)
+    if derived is None:
+        progress("load")
+        df_base, df_comp, warnings = load_uploads(
+            files_base, comparison_files, history
+        )
+        df_parsed = prepare_frames(df_base, df_comp, config, progress)
+        derived = share_derived(df_parsed, source)
+
+    results = dict(derived.results(config, progress))
+    results["warnings"] = warnings
+    return results
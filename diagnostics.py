@@ -0,0 +1,396 @@
+"""Diagnostics of the analysis pipeline and of the rendering path."""
+
+from __future__ import annotations
+
+import cProfile
+import functools
+import json
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+import pandas as pd
+
+try:  # solo POSIX
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+
+class StageMemory:
+    """Peak allocation of each stage, measured with :mod:`tracemalloc`.
+
+    The peak of a stage is the largest amount of memory allocated above what
+    was allocated when it started, so a stage that copies a frame shows at
+    least the frame's size. NumPy buffers are traced; Arrow buffers, which
+    pandas string columns use, are not. ``budgets`` maps stage names to the
+    bytes a stage may allocate. Stages may nest: a stage's peak includes the
+    allocations of the stages inside it. Tracing is process-wide, so stages
+    running at the same time in other threads add to each other's peaks.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None):
+        self.budgets = dict(budgets or {})
+        self.peaks: Dict[str, int] = {}
+        # Picco dell'ultima fase chiusa
+        self.last_peak = 0
+        # [memoria all'avvio, picco già visto] delle fasi aperte
+        self._open: List[List[int]] = []
+
+    def _fold_peak(self, peak: int) -> None:
+        # reset_peak azzera anche il picco della fase esterna: lo conserviamo
+        if self._open:
+            outer = self._open[-1]
+            outer[1] = max(outer[1], peak - outer[0])
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        self._fold_peak(tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._open.append([tracemalloc.get_traced_memory()[0], 0])
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            base, seen = self._open.pop()
+            self._fold_peak(peak)
+            self.last_peak = max(seen, peak - base)
+            self.peaks[name] = max(self.peaks.get(name, 0), self.last_peak)
+            if started:
+                tracemalloc.stop()
+
+    def over_budget(self) -> Dict[str, int]:
+        """Return the stages whose peak exceeded their budget, with the peak."""
+        return {
+            name: peak
+            for name, peak in self.peaks.items()
+            if name in self.budgets and peak > self.budgets[name]
+        }
+
+    def report(self) -> pd.DataFrame:
+        """Return one row per stage with its peak, budget and outcome."""
+        rows = [
+            {
+                "stage": name,
+                "peak_mb": peak / 2**20,
+                "budget_mb": self.budgets[name] / 2**20 if name in self.budgets else None,
+                "ok": peak <= self.budgets.get(name, peak),
+            }
+            for name, peak in self.peaks.items()
+        ]
+        return pd.DataFrame(rows, columns=["stage", "peak_mb", "budget_mb", "ok"])
+
+
+_ACTIVE: ContextVar[Optional["PipelineProfile"]] = ContextVar(
+    "pipeline_profile", default=None
+)
+
+# Parametro dell'URL che chiede il profilo cProfile della prima esecuzione
+CAPTURE_QUERY_PARAM = "profile"
+
+# Righe della tabella delle funzioni più costose di una cattura cProfile
+CAPTURE_TOP_N = 30
+
+CAPTURE_COLUMNS = ["function", "location", "calls", "tottime_s", "cumtime_s"]
+
+PROFILE_COLUMNS = [
+    "stage",
+    "depth",
+    "seconds",
+    "rows_in",
+    "rows_out",
+    "cache",
+    "rss_mb",
+    "rss_peak_mb",
+    "alloc_peak_mb",
+]
+
+
+def _rows(value: Any) -> Optional[int]:
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+def rss_bytes() -> Optional[int]:
+    """Return the current resident set size of the process, if known."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * resource.getpagesize()
+    except (OSError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Return the high-water mark of the resident set size of the process."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KiB, macOS byte
+    peak = peak if sys.platform == "darwin" else peak * 1024
+    # Il kernel aggiorna ru_maxrss in ritardo: mai sotto la RSS corrente
+    return max(peak, rss_bytes() or 0)
+
+
+def _mb(nbytes: Optional[int]) -> Optional[float]:
+    return None if nbytes is None else nbytes / 2**20
+
+
+def frames_bytes(value: Any, seen: Optional[set] = None) -> int:
+    """Return the memory of the DataFrames in ``value``.
+
+    ``value`` is a frame, or a mapping or sequence holding frames; other
+    objects (indexes, caches, NumPy arrays) are not measured. Frames reached
+    twice, such as a frame stored under two keys, count once.
+    """
+    seen = set() if seen is None else seen
+    if isinstance(value, pd.DataFrame):
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, Mapping):
+        return sum(frames_bytes(v, seen) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(frames_bytes(v, seen) for v in value)
+    return 0
+
+
+def state_bytes(state: Mapping[str, Any]) -> Dict[str, int]:
+    """Return the bytes of the DataFrames held by each entry of a session state.
+
+    Entries without frames are left out. This walks every frame of the
+    session, so the app only calls it when the diagnostics ask for it.
+    """
+    seen: set = set()
+    sizes = {key: frames_bytes(state[key], seen) for key in list(state.keys())}
+    return {key: n for key, n in sizes.items() if n}
+
+
+class PipelineProfile:
+    """Duration, row counts and cache outcome of each stage of one run.
+
+    Stages are recorded with :meth:`stage`, or by the functions decorated with
+    :func:`profiled` and :func:`profiled_cache` while the profile is active in
+    the calling thread (see :meth:`activate`). Nested stages keep their depth.
+    With a ``memory`` tracker each stage also records its peak allocation
+    (``alloc_peak_mb``); tracing slows the run, so it is off by default.
+    """
+
+    def __init__(self, label: str, memory: Optional[StageMemory] = None):
+        self.label = label
+        self.memory = memory
+        self.created_at = datetime.now()
+        self.entries: List[Dict[str, Any]] = []
+        self.frames: Dict[str, int] = {}
+        self.session: Dict[str, int] = {}
+        self._depth = 0
+
+    @contextmanager
+    def activate(self) -> Iterator["PipelineProfile"]:
+        token = _ACTIVE.set(self)
+        try:
+            yield self
+        finally:
+            _ACTIVE.reset(token)
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Time the block; the yielded entry takes ``rows_out`` and ``cache``."""
+        entry: Dict[str, Any] = dict.fromkeys(PROFILE_COLUMNS)
+        entry.update(stage=name, depth=self._depth, rows_in=rows_in)
+        # Registrata all'avvio: le fasi restano nell'ordine in cui iniziano
+        self.entries.append(entry)
+        self._depth += 1
+        traced = self.memory.stage(name) if self.memory is not None else nullcontext()
+        start = time.perf_counter()
+        try:
+            with traced:
+                yield entry
+        finally:
+            entry["seconds"] = time.perf_counter() - start
+            if self.memory is not None:
+                entry["alloc_peak_mb"] = _mb(self.memory.last_peak)
+            entry["rss_mb"] = _mb(rss_bytes())
+            entry["rss_peak_mb"] = _mb(peak_rss_bytes())
+            self._depth -= 1
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(e["seconds"] or 0.0 for e in self.entries if e["depth"] == 0)
+
+    def record_frame(self, name: str, df: pd.DataFrame) -> None:
+        """Record the deep memory usage of an intermediate frame."""
+        self.frames[name] = int(df.memory_usage(deep=True).sum())
+
+    def record_session(self, state: Mapping[str, Any]) -> None:
+        """Record the bytes of the frames held by each entry of a session state."""
+        self.session = state_bytes(state)
+
+    def report(self) -> pd.DataFrame:
+        """Return one row per stage, in the order the stages started."""
+        return pd.DataFrame(self.entries, columns=PROFILE_COLUMNS)
+
+    def memory_report(self) -> pd.DataFrame:
+        """Return the size of the recorded frames and session entries, largest first."""
+        rows = [("frame", name, n) for name, n in self.frames.items()]
+        rows += [("session", name, n) for name, n in self.session.items()]
+        df = pd.DataFrame(rows, columns=["kind", "name", "bytes"])
+        df["mb"] = df["bytes"] / 2**20
+        return df.sort_values("bytes", ascending=False, ignore_index=True)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "time": self.created_at.isoformat(timespec="seconds"),
+            "label": self.label,
+            "total_s": self.total_seconds,
+            "stages": self.entries,
+            "frames": self.frames,
+            "session_bytes": sum(self.session.values()),
+            "session": self.session,
+            "over_budget": self.memory.over_budget() if self.memory else {},
+        }
+
+    def append_log(self, path: str | Path) -> None:
+        """Append the profile to the JSON-lines log at ``path``."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(self.to_dict(), default=str) + "\n")
+
+
+@contextmanager
+def profile_stage(name: str, rows_in: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Record a stage in the active profile; without one, only run the block."""
+    profile = _ACTIVE.get()
+    if profile is None:
+        yield {}
+        return
+    with profile.stage(name, rows_in) as entry:
+        yield entry
+
+
+def profile_frame(name: str, df: Optional[pd.DataFrame]) -> None:
+    """Record the memory of ``df`` in the active profile, if there is one."""
+    profile = _ACTIVE.get()
+    if profile is not None and df is not None:
+        profile.record_frame(name, df)
+
+
+def _record(
+    name: str, func: Callable, args: tuple, kwargs: dict
+) -> Tuple[Any, Dict[str, Any]]:
+    rows_in = next((_rows(a) for a in args if _rows(a) is not None), None)
+    with profile_stage(name, rows_in) as entry:
+        result = func(*args, **kwargs)
+        entry["rows_out"] = rows_in if result is None else _rows(result)
+    return result, entry
+
+
+def profiled(func: Callable) -> Callable:
+    """Record each call of ``func`` as a stage of the active profile.
+
+    Input rows are those of the first frame argument; output rows those of
+    the returned frame, or of the input when ``func`` works in place.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if _ACTIVE.get() is None:
+            return func(*args, **kwargs)
+        return _record(func.__name__, func, args, kwargs)[0]
+
+    return wrapper
+
+
+def profiled_cache(cache: Callable[[Callable], Callable]) -> Callable[[Callable], Callable]:
+    """Wrap a function with ``cache`` and record each call as a hit or a miss.
+
+    ``cache`` is a caching decorator such as ``st.cache_data(...)``; the app
+    passes it, so the engine modules stay free of Streamlit.
+    """
+
+    def decorate(func: Callable) -> Callable:
+        calls = threading.local()
+
+        @functools.wraps(func)
+        def compute(*args: Any, **kwargs: Any) -> Any:
+            # Eseguita solo quando la cache non ha il risultato
+            calls.missed = True
+            return func(*args, **kwargs)
+
+        cached = cache(compute)
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _ACTIVE.get() is None:
+                return cached(*args, **kwargs)
+            calls.missed = False
+            result, entry = _record(func.__name__, cached, args, kwargs)
+            entry["cache"] = "miss" if calls.missed else "hit"
+            return result
+
+        wrapper.clear = cached.clear
+        return wrapper
+
+    return decorate
+
+
+class RerunCapture:
+    """cProfile capture of one script run.
+
+    Only the thread that calls :meth:`start` is profiled: the analyses that
+    run in background jobs show up in the pipeline profile instead.
+    """
+
+    def __init__(self, label: str = "rerun"):
+        self.label = label
+        self.created_at = datetime.now()
+        self.seconds: Optional[float] = None
+        self.path: Optional[Path] = None
+        self._profiler = cProfile.Profile()
+        self._start = 0.0
+
+    def start(self) -> "RerunCapture":
+        self._start = time.perf_counter()
+        self._profiler.enable()
+        return self
+
+    def stop(self) -> "RerunCapture":
+        self._profiler.disable()
+        self.seconds = time.perf_counter() - self._start
+        return self
+
+    def save(self, directory: str | Path) -> Path:
+        """Write the profile in ``pstats`` format to ``directory``; return its path."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / f"{self.label}-{self.created_at:%Y%m%d-%H%M%S-%f}.prof"
+        self._profiler.dump_stats(str(self.path))
+        return self.path
+
+    def top(self, n: int = CAPTURE_TOP_N) -> pd.DataFrame:
+        """Return the ``n`` functions with the largest cumulative time."""
+        return top_functions(pstats.Stats(self._profiler), n)
+
+
+def top_functions(stats: pstats.Stats, n: int = CAPTURE_TOP_N) -> pd.DataFrame:
+    """Return the ``n`` entries of ``stats`` with the largest cumulative time."""
+    rows = []
+    for (filename, line, name), (primitive, calls, tottime, cumtime, _) in (
+        stats.stats.items()
+    ):
+        # Le funzioni built-in hanno file "~" e riga 0
+        location = filename if line == 0 else f"{filename}:{line}"
+        calls_text = str(calls) if calls == primitive else f"{calls}/{primitive}"
+        rows.append((name, location, calls_text, tottime, cumtime))
+    df = pd.DataFrame(rows, columns=CAPTURE_COLUMNS)
+    return df.sort_values("cumtime_s", ascending=False, ignore_index=True).head(n)
@@ -0,0 +1,689 @@
+"""Opportunity analysis pipeline independent from the Streamlit script."""
+
+from __future__ import annotations
+
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from datacache import DATASETS, Dataset, file_fingerprint
+from diagnostics import profile_frame, profile_stage, profiled
+from loaders import load_data, parse_float, parse_int, parse_weights
+from score import (
+    VAT_RATES,
+    normalize_locale,
+    shipping_costs,
+    final_purchase_prices,
+    format_trend,
+    classify_opportunities,
+    final_scores,
+    merge_score_bounds,
+    score_bounds,
+    aggregate_opportunities,
+)
+from snapshots import SnapshotStore, upload_source
+
+# Pipeline stages, in execution order, reported to the progress callback
+STAGES = ("load", "merge", "parse", "margins", "scoring", "ranking")
+
+# Result grid column order
+# Only the following columns are displayed in this exact sequence.
+DISPLAY_COLS_ORDER = [
+    "Locale (base)",
+    "Locale (comp)",
+    "Title (base)",
+    "ASIN",
+    "Margine_Stimato",
+    "Margine_Netto_%",
+    "Margine_Netto",
+    "Price_Base",
+    "Acquisto_Netto",
+    "Shipping_Cost",
+    "Price_Comp",
+    "Vendita_Netto",
+    "Bought_Comp",
+    "SalesRank_Comp",
+    "Trend",
+    "NewOffer_Comp",
+    "Opportunity_Score",
+    "Opportunity_Class",
+    "Volume_Score",
+    "Weight_kg",
+    "Package: Dimension (cm³) (base)",
+    "IVA_Origine",
+    "IVA_Confronto",
+]
+
+COLS_TO_ROUND = [
+    "Price_Base",
+    "Acquisto_Netto",
+    "Price_Comp",
+    "Vendita_Netto",
+    "Margine_Stimato",
+    "Shipping_Cost",
+    "Margine_Netto",
+    "Margine_Netto_%",
+    "Margine_%",
+    "Opportunity_Score",
+    "Volume_Score",
+    "Weight_kg",
+]
+
+# Columns that may contain weight information, in order of preference
+POSSIBLE_WEIGHT_COLS = [
+    "Weight (base)",
+    "Item Weight (base)",
+    "Package: Weight (kg) (base)",
+    "Package: Weight (g) (base)",
+    "Product details (base)",
+    "Features (base)",
+]
+
+
+
+@dataclass(frozen=True)
+class ScoreWeights:
+    """Weights of the Opportunity Score components."""
+
+    alpha: float = 1.0  # Sales Rank (penalità)
+    beta: float = 1.0  # Bought in past month
+    delta: float = 1.0  # Offer Count (penalità)
+    epsilon: float = 3.0  # Margine %
+    zeta: float = 1.0  # Trend Sales Rank
+    gamma: float = 2.0  # Volume di vendita
+    theta: float = 1.5  # Margine assoluto
+    min_margin_multiplier: float = 1.2
+
+    def components(self) -> Dict[str, float]:
+        """Return the weights in the form expected by ``final_scores``."""
+        return {
+            "margin": self.epsilon + self.theta,
+            "demand": self.beta + self.gamma,
+            "competition": self.delta,
+            "volatility": self.zeta,
+            "risk": self.alpha,
+        }
+
+
+@dataclass(frozen=True)
+class Filters:
+    """Thresholds a row must satisfy to be kept in the results."""
+
+    max_sales_rank: float = 999999
+    max_offer_count: float = 30
+    min_buybox_price: float = 15.0
+    max_buybox_price: float = 200.0
+    min_margin_pct: float = 15.0
+    min_margin_abs: float = 5.0
+
+
+@dataclass(frozen=True)
+class EngineConfig:
+    """Parameters of an analysis run, matching the sidebar settings."""
+
+    ref_price_base: str = "Buy Box 🚚: Current"
+    ref_price_comp: str = "Buy Box 🚚: Current"
+    discount: float = 0.20  # frazione, non percentuale
+    include_shipping: bool = True
+    weights: ScoreWeights = field(default_factory=ScoreWeights)
+    filters: Filters = field(default_factory=Filters)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "EngineConfig":
+        """Build a config from a flat mapping such as a saved recipe.
+
+        Unknown keys are ignored; ``discount_percent`` is accepted in place
+        of ``discount``.
+        """
+        data = dict(data)
+        if "discount_percent" in data and "discount" not in data:
+            data["discount"] = float(data["discount_percent"]) / 100.0
+        top = {f.name for f in fields(cls)} - {"weights", "filters"}
+        return cls(
+            **{k: data[k] for k in top if k in data},
+            weights=ScoreWeights(
+                **{f.name: data[f.name] for f in fields(ScoreWeights) if f.name in data}
+            ),
+            filters=Filters(
+                **{f.name: data[f.name] for f in fields(Filters) if f.name in data}
+            ),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the config as a flat mapping, the inverse of ``from_dict``."""
+        flat = asdict(self)
+        return {**flat.pop("weights"), **flat.pop("filters"), **flat}
+
+
+TOP_K = 20
+
+# Below this many merged rows the process pool costs more than it saves
+SHARD_MIN_ROWS = 20_000
+
+Progress = Callable[..., None]
+
+
+class AnalysisError(ValueError):
+    """Raised when the uploaded data cannot be analysed."""
+
+
+def _no_progress(stage: str, partial: Optional[pd.DataFrame] = None) -> None:
+    return None
+
+
+def _lease_upload(file: Any) -> Dataset:
+    key = f"upload:{file_fingerprint(file)}"
+    built = []
+
+    def build() -> pd.DataFrame:
+        built.append(key)
+        return load_data(file)
+
+    with profile_stage("load_data") as entry:
+        lease = DATASETS.get_or_build(key, build)
+        entry.update(rows_out=len(lease.frame), cache="miss" if built else "hit")
+    return lease
+
+
+def load_shared(file: Any) -> pd.DataFrame:
+    """Load ``file`` through the shared cache, keyed by its content.
+
+    Sessions uploading the same export read the same read-only frame, which
+    stays pinned in the cache until the returned frame is garbage collected.
+    """
+    lease = _lease_upload(file)
+    return lease.keep_with(lease.frame.copy(deep=False))
+
+
+def load_frames(files: Iterable[Any], label: str) -> Tuple[pd.DataFrame, List[str]]:
+    """Load and concatenate ``files``; return the frame and warning messages.
+
+    The cached uploads stay pinned while the returned frame is alive.
+    """
+    frames = []
+    leases = []
+    warnings = []
+    for f in files or []:
+        lease = _lease_upload(f)
+        if lease.frame is not None and not lease.frame.empty:
+            frames.append(lease.frame)
+            leases.append(lease)
+        else:
+            warnings.append(f"Il file {label} {f.name} è vuoto o non valido.")
+    if not frames:
+        return pd.DataFrame(), warnings
+    df = pd.concat(frames, ignore_index=True)
+    for lease in leases:
+        lease.keep_with(df)
+    return df, warnings
+
+
+def _grams_to_kg(val: Any) -> float:
+    # Valori espressi in grammi
+    if pd.isna(val):
+        return np.nan
+    try:
+        num = re.search(r"(\d+\.?\d*)", str(val))
+        return float(num.group(1)) / 1000 if num else np.nan
+    except Exception:
+        return np.nan
+
+
+@profiled
+def merge_frames(df_base: pd.DataFrame, df_comp: pd.DataFrame) -> pd.DataFrame:
+    """Normalize the ASINs and inner-join the base and comparison lists."""
+    if "ASIN" not in df_base.columns or "ASIN" not in df_comp.columns:
+        raise AnalysisError(
+            "Assicurati che entrambi i file (origine e confronto) contengano la colonna ASIN."
+        )
+
+    # Normalizza gli ASIN rimuovendo spazi e usando il maiuscolo, su copie
+    # superficiali: i frame del chiamante restano invariati
+    df_base = df_base.assign(ASIN=df_base["ASIN"].str.strip().str.upper())
+    df_comp = df_comp.assign(ASIN=df_comp["ASIN"].str.strip().str.upper())
+
+    df_merged = pd.merge(
+        df_base, df_comp, on="ASIN", how="inner", suffixes=(" (base)", " (comp)")
+    )
+    if df_merged.empty:
+        raise AnalysisError(
+            "Nessuna corrispondenza trovata tra la Lista di Origine e le Liste di Confronto."
+        )
+    return df_merged
+
+
+@profiled
+def parse_columns(df_merged: pd.DataFrame, config: EngineConfig) -> None:
+    """Add parsed prices, ranks, offers and weights to ``df_merged`` in place."""
+    rows = len(df_merged)
+    with profile_stage("parse_prices", rows):
+        # Utilizza le colonne di prezzo selezionate dalla sidebar
+        price_col_base = f"{config.ref_price_base} (base)"
+        price_col_comp = f"{config.ref_price_comp} (comp)"
+        df_merged["Price_Base"] = df_merged.get(
+            price_col_base, pd.Series(np.nan)
+        ).apply(parse_float)
+        df_merged["Price_Comp"] = df_merged.get(
+            price_col_comp, pd.Series(np.nan)
+        ).apply(parse_float)
+
+    with profile_stage("parse_ranks", rows):
+        # Conversione dei dati dal mercato di confronto per le altre metriche
+        df_merged["SalesRank_Comp"] = df_merged.get(
+            "Sales Rank: Current (comp)", pd.Series(np.nan)
+        ).apply(parse_int)
+        df_merged["Bought_Comp"] = df_merged.get(
+            "Bought in past month (comp)", pd.Series(np.nan)
+        ).apply(parse_int)
+        df_merged["NewOffer_Comp"] = df_merged.get(
+            "New Offer Count: Current (comp)", pd.Series(np.nan)
+        ).apply(parse_int)
+        # Leggi anche il Sales Rank a 30 giorni, se presente
+        df_merged["SalesRank_30d"] = df_merged.get(
+            "Sales Rank: 30 days avg. (comp)", pd.Series(np.nan)
+        ).apply(parse_int)
+
+    with profile_stage("parse_weights", rows):
+        # Estrai informazioni sul peso cercando nelle possibili colonne di peso
+        df_merged["Weight_kg"] = np.nan
+        for col in POSSIBLE_WEIGHT_COLS:
+            if col in df_merged.columns:
+                if "(g)" in col:
+                    weight_data = df_merged[col].apply(_grams_to_kg)
+                else:
+                    weight_data = pd.Series(
+                        parse_weights(df_merged[col]), index=df_merged.index
+                    )
+                # Aggiorna solo i valori mancanti
+                missing = df_merged["Weight_kg"].isna()
+                df_merged.loc[missing, "Weight_kg"] = weight_data.loc[missing]
+
+        # Se non ci sono informazioni sul peso, assume 1kg come predefinito
+        df_merged["Weight_kg"] = df_merged["Weight_kg"].fillna(1.0)
+
+
+def assign_columns(df: pd.DataFrame, *groups: Dict[str, pd.Series]) -> None:
+    """Set the columns of each group on ``df`` in place."""
+    for columns in groups:
+        for name, values in columns.items():
+            df[name] = values
+
+
+def shipping_columns(df: pd.DataFrame) -> Dict[str, pd.Series]:
+    """Return the shipping cost of each row, from its weight."""
+    return {"Shipping_Cost": pd.Series(shipping_costs(df["Weight_kg"]), index=df.index)}
+
+
+def purchase_columns(df: pd.DataFrame, discount: float) -> Dict[str, pd.Series]:
+    """Return the net purchase price of each row for ``discount``."""
+    # Calcolo del prezzo d'acquisto netto con IVA variabile
+    locales = df.get("Locale (base)", pd.Series("", index=df.index))
+    return {
+        "Acquisto_Netto": pd.Series(
+            final_purchase_prices(df["Price_Base"], locales, discount), index=df.index
+        )
+    }
+
+
+def sale_columns(df: pd.DataFrame) -> Dict[str, pd.Series]:
+    """Return the comparison price and its net of VAT."""
+    # Margine = Prezzo confronto / (1 + IVA) - Prezzo acquisto netto
+    price_comp = df["Price_Comp"].fillna(0)
+    locale_comp = df.get("Locale (comp)", pd.Series("", index=df.index))
+
+    # Prezzo netto di vendita nel mercato di confronto (senza IVA)
+    vat = locale_comp.map(lambda x: VAT_RATES.get(normalize_locale(x), 0) / 100.0)
+    return {
+        "Price_Comp": price_comp,
+        "Vendita_Netto": price_comp / (1 + vat.astype(float)),
+    }
+
+
+def margin_columns(df: pd.DataFrame, include_shipping: bool) -> Dict[str, pd.Series]:
+    """Return estimated, net and gross margins from the net prices."""
+    # Margine stimato e percentuale rispetto al prezzo d'acquisto
+    margine_stimato = df["Vendita_Netto"] - df["Acquisto_Netto"]
+    margine_pct = (margine_stimato / df["Acquisto_Netto"]) * 100
+
+    # Calcolo del margine netto con o senza costi di spedizione
+    if include_shipping:
+        margine_netto = margine_stimato - df["Shipping_Cost"]
+        margine_netto_pct = (margine_netto / df["Acquisto_Netto"]) * 100
+    else:
+        margine_netto = margine_stimato
+        margine_netto_pct = margine_pct
+
+    return {
+        "Margine_Stimato": margine_stimato,
+        "Margine_%": margine_pct,
+        "Margine_Netto": margine_netto,
+        "Margine_Netto_%": margine_netto_pct,
+        # Margine percentuale lordo per riferimento
+        "Margin_Pct_Lordo": (
+            (df["Price_Comp"] - df["Price_Base"]) / df["Price_Base"]
+        )
+        * 100,
+    }
+
+
+def rank_columns(df: pd.DataFrame) -> Dict[str, pd.Series]:
+    """Return sales rank and offer count with their defaults for missing values."""
+    return {
+        "SalesRank_Comp": df["SalesRank_Comp"].fillna(999999),
+        "NewOffer_Comp": df["NewOffer_Comp"].fillna(0),
+    }
+
+
+def filter_mask(df: pd.DataFrame, filters: Filters) -> pd.Series:
+    """Return the rows satisfying ``filters``."""
+    return (
+        (df["Margine_Netto_%"] > filters.min_margin_pct)
+        & (df["Margine_Netto"] > filters.min_margin_abs)
+        & (df["SalesRank_Comp"] <= filters.max_sales_rank)
+        & (df["NewOffer_Comp"] <= filters.max_offer_count)
+        & (df["Price_Comp"].between(filters.min_buybox_price, filters.max_buybox_price))
+    )
+
+
+@profiled
+def compute_margins(df_merged: pd.DataFrame, config: EngineConfig) -> pd.DataFrame:
+    """Compute shipping, net prices and margins; return the rows passing the filters."""
+    assign_columns(
+        df_merged,
+        shipping_columns(df_merged),
+        purchase_columns(df_merged, config.discount),
+        sale_columns(df_merged),
+    )
+    assign_columns(
+        df_merged,
+        margin_columns(df_merged, config.include_shipping),
+        rank_columns(df_merged),
+    )
+    return df_merged[filter_mask(df_merged, config.filters)]
+
+
+def trend_columns(df: pd.DataFrame) -> Dict[str, pd.Series]:
+    """Return the sales rank trend and volume columns."""
+    # Calcolo del bonus/penalità per il Trend del Sales Rank
+    rank_30d = df["SalesRank_30d"]
+    if "Hist_SalesRank_30d" in df.columns:
+        # Media dallo storico locale, se disponibile
+        rank_30d = df["Hist_SalesRank_30d"].fillna(rank_30d)
+    trend_bonus = np.log(
+        (rank_30d.fillna(df["SalesRank_Comp"]) + 1) / (df["SalesRank_Comp"] + 1)
+    )
+    norm_rank = np.log(df["SalesRank_Comp"].fillna(999999) + 10)
+    return {
+        "Trend_Bonus": trend_bonus,
+        "Trend": trend_bonus.apply(format_trend),
+        "Norm_Rank": norm_rank,
+        "Volume_Score": 1000 / norm_rank,
+    }
+
+
+def roi_columns(df: pd.DataFrame) -> Dict[str, pd.Series]:
+    return {"ROI_Factor": df["Margine_Netto"] / df["Acquisto_Netto"]}
+
+
+def vat_columns(df: pd.DataFrame) -> Dict[str, pd.Series]:
+    """Return the VAT rates applied to the base and comparison prices."""
+    # Aggiunta dell'informazione sulle aliquote IVA utilizzate
+    return {
+        "IVA_Origine": df["Locale (base)"].map(
+            lambda x: f"{VAT_RATES.get(normalize_locale(x), 0)}%"
+        ),
+        "IVA_Confronto": df["Locale (comp)"].map(
+            lambda x: f"{VAT_RATES.get(normalize_locale(x), 0)}%"
+        ),
+    }
+
+
+@profiled
+def add_row_features(df_merged: pd.DataFrame) -> pd.DataFrame:
+    """Add the per-row trend, volume, ROI and VAT columns to ``df_merged``."""
+    assign_columns(
+        df_merged,
+        trend_columns(df_merged),
+        roi_columns(df_merged),
+        vat_columns(df_merged),
+    )
+    return df_merged
+
+
+@profiled
+def apply_scores(
+    df_merged: pd.DataFrame,
+    config: EngineConfig,
+    bounds: Optional[Dict[str, Tuple[float, float]]] = None,
+) -> pd.DataFrame:
+    """Add Opportunity Score and class columns; ``bounds`` as in ``final_scores``."""
+    df_merged["Opportunity_Score"] = final_scores(
+        df_merged, config.weights.components(), bounds
+    )
+
+    min_margin_threshold = (
+        config.filters.min_margin_abs * config.weights.min_margin_multiplier
+    )
+    df_merged.loc[
+        df_merged["Margine_Netto"] < min_margin_threshold, "Opportunity_Score"
+    ] *= (df_merged["Margine_Netto"] / min_margin_threshold)
+
+    # Classificazione dell'opportunità: classe e tag in colonne separate
+    classes = classify_opportunities(df_merged["Opportunity_Score"])
+    df_merged["Opportunity_Class"] = classes["Opportunity_Class"]
+    df_merged["Opportunity_Tag"] = classes["Opportunity_Tag"]
+    return df_merged
+
+
+def score_opportunities(df_merged: pd.DataFrame, config: EngineConfig) -> pd.DataFrame:
+    """Add trend, volume, Opportunity Score and class columns to ``df_merged``."""
+    return apply_scores(add_row_features(df_merged), config)
+
+
+@profiled
+def finalize_results(df_merged: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Sort the scored rows and build the display and ranking frames."""
+    # Ordiniamo i risultati per Opportunity Score decrescente
+    df_merged = df_merged.sort_values("Opportunity_Score", ascending=False)
+
+    # Selezione delle colonne finali da visualizzare
+    cols_final = [c for c in DISPLAY_COLS_ORDER if c in df_merged.columns]
+    # Copy-on-write: la selezione condivide le colonne finché non cambiano
+    df_finale = df_merged[cols_final]
+
+    # Arrotonda i valori numerici principali a 2 decimali
+    df_finale = df_finale.assign(
+        **{col: df_finale[col].round(2) for col in COLS_TO_ROUND if col in df_finale}
+    )
+
+    # Classifica cross-country per ASIN
+    df_ranked = aggregate_opportunities(df_finale)
+    profile_frame("full_data", df_merged)
+    profile_frame("filtered_data", df_finale)
+    profile_frame("ranked_data", df_ranked)
+    return {
+        "full_data": df_merged,
+        "filtered_data": df_finale,
+        "ranked_data": df_ranked,
+    }
+
+
+def prepare_frames(
+    df_base: pd.DataFrame,
+    df_comp: pd.DataFrame,
+    config: EngineConfig,
+    progress: Progress = _no_progress,
+) -> pd.DataFrame:
+    """Merge the lists and parse their values; the parameter-free part of a run.
+
+    Only the reference price columns of ``config`` are used, so the result can
+    be reused by :func:`score_prepared` for any discount, weights or filters.
+    """
+    progress("merge")
+    df_merged = merge_frames(df_base, df_comp)
+
+    progress("parse")
+    parse_columns(df_merged, config)
+    profile_frame("df_merged", df_merged)
+    return df_merged
+
+
+def score_prepared(
+    df_parsed: pd.DataFrame,
+    config: EngineConfig,
+    progress: Progress = _no_progress,
+) -> Dict[str, Any]:
+    """Compute margins, scores and rankings from a :func:`prepare_frames` result.
+
+    ``df_parsed`` is not modified: the stages only add or replace whole
+    columns, so they work on a shallow copy.
+    """
+    progress("margins")
+    df_merged = compute_margins(df_parsed.copy(deep=False), config)
+
+    progress("scoring")
+    df_merged = score_opportunities(df_merged, config)
+
+    top = df_merged.nlargest(TOP_K, "Opportunity_Score")
+    progress("ranking", partial=top[[c for c in DISPLAY_COLS_ORDER if c in top]])
+    results = finalize_results(df_merged)
+    results["config"] = config
+    return results
+
+
+def _process_shard(
+    shard: pd.DataFrame, config: EngineConfig
+) -> Tuple[pd.DataFrame, Dict[str, Tuple[float, float]]]:
+    # Eseguito nei processi worker: solo le fasi riga per riga
+    parse_columns(shard, config)
+    shard = add_row_features(compute_margins(shard, config))
+    return shard, score_bounds(shard)
+
+
+def shard_by_asin(df: pd.DataFrame, n_shards: int) -> List[pd.DataFrame]:
+    """Split ``df`` in ``n_shards`` parts so that each ASIN falls in one part."""
+    codes = pd.util.hash_array(df["ASIN"].to_numpy(dtype=object)) % n_shards
+    return [df[codes == i] for i in range(n_shards)]
+
+
+def run_sharded(
+    df_base: pd.DataFrame,
+    df_comp: pd.DataFrame,
+    config: EngineConfig,
+    workers: int,
+    progress: Progress = _no_progress,
+    min_rows: int = SHARD_MIN_ROWS,
+) -> Dict[str, Any]:
+    """Run the pipeline with the per-row stages spread over a process pool.
+
+    The merged frame is split by ASIN hash; each worker parses, computes
+    margins and row features for its shard and returns the partial bounds of
+    the score inputs. The bounds are merged before scoring, so the global
+    normalization sees the whole dataset and scores match :func:`run_analysis`
+    with a single process exactly.
+    """
+    progress("merge")
+    df_merged = merge_frames(df_base, df_comp)
+    profile_frame("df_merged", df_merged)
+    n_shards = workers if len(df_merged) >= min_rows else 1
+
+    progress("parse")
+    if n_shards == 1:
+        parts = [_process_shard(df_merged, config)]
+    else:
+        shards = shard_by_asin(df_merged, n_shards)
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            parts = list(pool.map(_process_shard, shards, [config] * n_shards))
+
+    progress("scoring")
+    frames = [frame for frame, _ in parts if not frame.empty] or [parts[0][0]]
+    # Ripristina l'ordine originale delle righe prima del riordino finale
+    df_rows = pd.concat(frames).sort_index()
+    bounds = merge_score_bounds(part_bounds for _, part_bounds in parts)
+    df_rows = apply_scores(df_rows, config, bounds)
+
+    top = df_rows.nlargest(TOP_K, "Opportunity_Score")
+    progress("ranking", partial=top[[c for c in DISPLAY_COLS_ORDER if c in top]])
+    results = finalize_results(df_rows)
+    results["config"] = config
+    return results
+
+
+def run_analysis(
+    df_base: pd.DataFrame,
+    df_comp: pd.DataFrame,
+    config: EngineConfig,
+    progress: Progress = _no_progress,
+    workers: int = 1,
+) -> Dict[str, Any]:
+    """Run the full pipeline on already loaded base and comparison frames.
+
+    ``progress`` is called with the name of each stage of ``STAGES`` before it
+    starts; after scoring it also receives the provisional top rows through the
+    ``partial`` keyword so they can be shown before the run is finalized.
+    With ``workers`` above one the per-row stages run in :func:`run_sharded`.
+    """
+    if workers > 1:
+        return run_sharded(df_base, df_comp, config, workers, progress)
+    df_parsed = prepare_frames(df_base, df_comp, config, progress)
+    return score_prepared(df_parsed, config, progress)
+
+
+def load_uploads(
+    files_base: Iterable[Any],
+    comparison_files: Iterable[Any],
+    history: Optional[SnapshotStore] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
+    """Load base and comparison uploads; return both frames and the warnings.
+
+    With a ``history`` store the exports are appended to it as snapshots and
+    the comparison frame gets the ``Hist_*`` columns of the local history;
+    uploads already ingested (same file content) are not stored again.
+    """
+    files_base = list(files_base)
+    comparison_files = list(comparison_files)
+    df_base, warnings = load_frames(files_base, "base")
+    if df_base.empty:
+        raise AnalysisError("Nessun file di origine valido caricato.")
+    df_comp, comp_warnings = load_frames(comparison_files, "di confronto")
+    warnings += comp_warnings
+    if df_comp.empty:
+        raise AnalysisError("Nessun file di confronto valido caricato.")
+    if history is not None and "ASIN" in df_comp.columns:
+        history.append(
+            df_base, source=upload_source(map(file_fingerprint, files_base))
+        )
+        history.append(
+            df_comp, source=upload_source(map(file_fingerprint, comparison_files))
+        )
+        df_comp = history.enrich(df_comp)
+    profile_frame("df_base", df_base)
+    profile_frame("df_comp", df_comp)
+    return df_base, df_comp, warnings
+
+
+def analyze_uploads(
+    files_base: Iterable[Any],
+    comparison_files: Iterable[Any],
+    config: EngineConfig,
+    progress: Progress = _no_progress,
+    workers: int = 1,
+    history: Optional[SnapshotStore] = None,
+) -> Dict[str, Any]:
+    """Load the uploaded files and run the pipeline on them.
+
+    The returned dictionary holds the result frames of :func:`run_analysis`
+    plus the ``warnings`` raised for empty or invalid files.
+    """
+    progress("load")
+    df_base, df_comp, warnings = load_uploads(files_base, comparison_files, history)
+
+    results = run_analysis(df_base, df_comp, config, progress, workers)
+    results["warnings"] = warnings
+    return results
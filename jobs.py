@@ -0,0 +1,97 @@
+"""Background execution of long running analyses."""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Optional, Sequence
+
+import pandas as pd
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation has been requested."""
+
+
+class BackgroundJob:
+    """Run ``target`` in a daemon thread reporting stage-level progress.
+
+    ``target`` receives the job's :meth:`report` method as its progress
+    callback. Every report checks for a pending cancellation, so a cancelled
+    job stops at the next stage boundary.
+    """
+
+    def __init__(self, target: Callable[..., Any], stages: Sequence[str]):
+        self._target = target
+        self.stages = tuple(stages)
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.status = "pending"
+        self.stage: Optional[str] = None
+        self.partial: Optional[pd.DataFrame] = None
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self) -> "BackgroundJob":
+        """Start the worker thread and return the job."""
+        self.status = "running"
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        try:
+            result = self._target(self.report)
+        except JobCancelled:
+            status, result, error = "cancelled", None, None
+        except Exception as exc:  # reported to the UI through ``error``
+            status, result, error = "failed", None, exc
+        else:
+            status, error = "done", None
+        with self._lock:
+            self.result = result
+            self.error = error
+            self.status = status
+            self.finished_at = time.perf_counter()
+
+    def report(self, stage: str, partial: Optional[pd.DataFrame] = None) -> None:
+        """Record that ``stage`` started; raise :class:`JobCancelled` if requested."""
+        if self._cancel.is_set():
+            raise JobCancelled(stage)
+        with self._lock:
+            self.stage = stage
+            if partial is not None:
+                self.partial = partial
+
+    def cancel(self) -> None:
+        """Ask the job to stop at the next stage boundary."""
+        self._cancel.set()
+
+    @property
+    def running(self) -> bool:
+        return self.status == "running"
+
+    @property
+    def progress(self) -> float:
+        """Return the completed fraction of the stages, between 0 and 1."""
+        if self.status == "done":
+            return 1.0
+        if self.stage not in self.stages:
+            return 0.0
+        return self.stages.index(self.stage) / len(self.stages)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at or time.perf_counter()
+        return end - self.started_at
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Block until the worker thread finishes."""
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,167 @@
+"""Disk cache of Keepa product objects, so recent lookups cost no tokens.
+
+Products are stored in one SQLite table as zlib-compressed JSON, keyed by
+ASIN, Keepa domain and the requested fields (the ``stats``, ``buybox`` and
+``history`` parameters of the request that fetched them). An entry is
+*fresh* for ``ttl`` seconds and then *stale* for ``stale_ttl`` more: stale
+entries are still served while :class:`keepa_client.KeepaClient` refreshes
+them in the background. When the blobs exceed ``max_bytes`` the least
+recently read entries are deleted.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Sequence
+
+from settings import (
+    KEEPA_CACHE_MB,
+    KEEPA_CACHE_PATH,
+    KEEPA_CACHE_STALE_MIN,
+    KEEPA_CACHE_TTL_MIN,
+)
+
+# Dopo l'eliminazione la cache scende a questa frazione del limite
+EVICT_TO = 0.9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    asin TEXT NOT NULL,
+    domain INTEGER NOT NULL,
+    fields TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    read_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (asin, domain, fields)
+) WITHOUT ROWID
+"""
+
+
+class Lookup(NamedTuple):
+    """Cached products of a lookup, by ASIN, and the ASINs to fetch."""
+
+    fresh: Dict[str, Dict[str, Any]]
+    stale: Dict[str, Dict[str, Any]]
+    missing: List[str]
+
+
+def _pack(product: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(product, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(blob: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(blob))
+
+
+class KeepaCache:
+    """SQLite store of Keepa product objects with TTL and size-based eviction."""
+
+    def __init__(
+        self,
+        path: str | Path = KEEPA_CACHE_PATH,
+        ttl: float = KEEPA_CACHE_TTL_MIN * 60,
+        stale_ttl: float = KEEPA_CACHE_STALE_MIN * 60,
+        max_bytes: int = KEEPA_CACHE_MB * 2**20,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as con:
+            # WAL: le letture non attendono le scritture delle rivalidazioni
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Una connessione per operazione: la cache è usata da più thread
+        with closing(sqlite3.connect(self.path, timeout=30)) as con:
+            with con:
+                yield con
+
+    def lookup(self, asins: Sequence[str], domain: int, fields: str) -> Lookup:
+        """Split ``asins`` into fresh and stale cached products and misses."""
+        now = self._clock()
+        fresh: Dict[str, Dict[str, Any]] = {}
+        stale: Dict[str, Dict[str, Any]] = {}
+        unique = list(dict.fromkeys(asins))
+        with self._connect() as con:
+            rows = []
+            # SQLite limita i parametri di una query: ASIN a blocchi
+            for i in range(0, len(unique), 500):
+                chunk = unique[i : i + 500]
+                rows += con.execute(
+                    "SELECT asin, fetched_at, data FROM products "
+                    f"WHERE domain = ? AND fields = ? AND asin IN ({','.join('?' * len(chunk))})",
+                    [domain, fields, *chunk],
+                ).fetchall()
+            for asin, fetched_at, blob in rows:
+                age = now - fetched_at
+                if age <= self.ttl:
+                    fresh[asin] = _unpack(blob)
+                elif age <= self.ttl + self.stale_ttl:
+                    stale[asin] = _unpack(blob)
+            served = [*fresh, *stale]
+            con.executemany(
+                "UPDATE products SET read_at = ? WHERE asin = ? AND domain = ? AND fields = ?",
+                [(now, asin, domain, fields) for asin in served],
+            )
+        missing = [a for a in unique if a not in fresh and a not in stale]
+        return Lookup(fresh, stale, missing)
+
+    def put(self, products: Iterable[Dict[str, Any]], domain: int, fields: str) -> None:
+        """Store ``products`` (keyed by their ``asin``), then evict if over budget."""
+        now = self._clock()
+        rows = []
+        for product in products:
+            blob = _pack(product)
+            rows.append((product["asin"], domain, fields, now, now, len(blob), blob))
+        if not rows:
+            return
+        with self._lock, self._connect() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._evict(con)
+
+    def _evict(self, con: sqlite3.Connection) -> None:
+        (total,) = con.execute("SELECT COALESCE(SUM(size), 0) FROM products").fetchone()
+        if total <= self.max_bytes:
+            return
+        # Si tengono le voci lette più di recente finché stanno nel budget ridotto
+        con.execute(
+            """
+            DELETE FROM products WHERE (asin, domain, fields) IN (
+                SELECT asin, domain, fields FROM (
+                    SELECT asin, domain, fields,
+                           SUM(size) OVER (ORDER BY read_at DESC, fetched_at DESC
+                                           ROWS UNBOUNDED PRECEDING) AS kept
+                    FROM products
+                ) WHERE kept > ?
+            )
+            """,
+            (self.max_bytes * EVICT_TO,),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of entries and their compressed size in bytes."""
+        with self._connect() as con:
+            entries, size = con.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM products"
+            ).fetchone()
+        return {"entries": entries, "bytes": size}
+
+    def clear(self) -> None:
+        with self._lock, self._connect() as con:
+            con.execute("DELETE FROM products")
@@ -0,0 +1,551 @@
+"""Keepa product API client returning frames shaped like the Keepa exports.
+
+Example::
+
+    with KeepaClient(KEEPA_API_KEY) as client:
+        df_comp = client.fetch_frame(asins, "de")
+
+ASINs are requested in batches of up to :data:`MAX_BATCH` over one pooled
+HTTP session, with at most ``max_in_flight`` requests open at a time. A
+:class:`TokenBucket` mirrors Keepa's token accounting: it refills at the
+plan's rate, is corrected with the ``tokensLeft`` of every response, and
+holds a batch back until its tokens are available instead of letting the
+API reject it. The frames have the export headers the pipeline reads
+(``Buy Box 🚚: Current``, ``Sales Rank: 90 days avg.``...) as text, like
+the frames of :func:`loaders.load_data`. With a :class:`keepa_cache.KeepaCache`
+only the ASINs missing from the cache are requested.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from score import normalize_locale
+from settings import KEEPA_API_URL, KEEPA_MAX_IN_FLIGHT
+
+if TYPE_CHECKING:
+    from keepa_cache import KeepaCache
+
+logger = logging.getLogger("keepa-client")
+
+# ASIN per richiesta /product (limite dell'API)
+MAX_BATCH = 100
+
+# Tentativi di una richiesta respinta per token esauriti (HTTP 429)
+MAX_RETRIES = 5
+
+# Codice paese -> id del dominio Keepa e dominio Amazon
+DOMAINS = {
+    "US": (1, "com"),
+    "UK": (2, "co.uk"),
+    "DE": (3, "de"),
+    "FR": (4, "fr"),
+    "JP": (5, "co.jp"),
+    "CA": (6, "ca"),
+    "IT": (8, "it"),
+    "ES": (9, "es"),
+    "IN": (10, "in"),
+    "MX": (11, "com.mx"),
+}
+
+# Id venditore di Amazon per la quota di Buy Box
+AMAZON_SELLERS = {
+    "US": "ATVPDKIKX0DER",
+    "UK": "A3P5ROKL5A1OLE",
+    "DE": "A3JWKAKR8XB7XF",
+    "FR": "A1X6FK5RDHNB96",
+    "IT": "A11IL2PNWYJU7H",
+    "ES": "A1AT7YVPFBWXBL",
+}
+
+# Indici degli array csv/stats di Keepa
+AMAZON, NEW, SALES, LIST_PRICE, NEW_FBM = 0, 1, 3, 4, 7
+COUNT_NEW, COUNT_USED, RATING, COUNT_REVIEWS, BUY_BOX = 11, 12, 16, 17, 18
+
+KEEPA_COLUMNS = (
+    "Locale",
+    "ASIN",
+    "Title",
+    "Brand",
+    "URL: Amazon",
+    "Sales Rank: Current",
+    "Sales Rank: 30 days avg.",
+    "Sales Rank: 90 days avg.",
+    "Bought in past month",
+    "Reviews: Rating",
+    "Reviews: Rating Count",
+    "Buy Box 🚚: Current",
+    "Buy Box 🚚: 30 days avg.",
+    "Buy Box 🚚: 90 days avg.",
+    "Buy Box 🚚: 180 days avg.",
+    "Buy Box 🚚: 365 days avg.",
+    "Buy Box 🚚: Lowest",
+    "Buy Box 🚚: Highest",
+    "Buy Box: % Amazon 90 days",
+    "Amazon: Current",
+    "Amazon: 90 days avg.",
+    "Amazon: 180 days avg.",
+    "Amazon: 365 days avg.",
+    "Amazon: 90 days OOS",
+    "New: Current",
+    "New: 90 days avg.",
+    "New: 180 days avg.",
+    "New: 365 days avg.",
+    "New, 3rd Party FBM 🚚: Current",
+    "List Price: Current",
+    "New Offer Count: Current",
+    "Used Offer Count: Current",
+    "One Time Coupon: Absolute",
+    "One Time Coupon: Percentage",
+    "Package: Dimension (cm³)",
+    "Package: Weight (g)",
+    "Item: Weight (g)",
+)
+
+
+class KeepaError(RuntimeError):
+    """Raised when the Keepa API rejects a request."""
+
+
+def domain_of(locale: str) -> int:
+    """Return the Keepa domain id of a locale such as ``de`` or ``Amazon.de``."""
+    code = normalize_locale(locale)
+    if code not in DOMAINS:
+        raise KeepaError(f"Mercato non supportato da Keepa: {locale!r}")
+    return DOMAINS[code][0]
+
+
+class TokenBucket:
+    """Client-side copy of the Keepa token balance.
+
+    Tokens refill continuously at ``refill_per_minute`` up to ``capacity``
+    (Keepa keeps at most one hour of refill). :meth:`sync` replaces the
+    estimate with the balance reported by the API.
+    """
+
+    def __init__(
+        self,
+        refill_per_minute: float,
+        tokens: Optional[float] = None,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = refill_per_minute / 60
+        self.capacity = capacity if capacity is not None else refill_per_minute * 60
+        self.tokens = self.capacity if tokens is None else tokens
+        self._clock = clock
+        self._updated = clock()
+        # Condiviso con i thread che rivalidano la cache
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait(self, cost: float) -> float:
+        if self.rate <= 0:
+            # Senza ricarica l'attesa sarebbe infinita
+            raise KeepaError(
+                f"Keepa: {cost:g} token richiesti, {self.tokens:g} disponibili "
+                "e nessuna ricarica"
+            )
+        return (cost - self.tokens) / self.rate
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until ``cost`` tokens are available.
+
+        Raises :class:`KeepaError` if they are missing and the bucket does
+        not refill.
+        """
+        with self._lock:
+            self._refill()
+            if self.tokens >= cost:
+                return 0.0
+            return self._wait(cost)
+
+    def take(self, cost: float) -> None:
+        with self._lock:
+            self._refill()
+            self.tokens -= cost
+
+    def try_take(self, cost: float) -> float:
+        """Take ``cost`` tokens and return 0, or return the seconds to wait."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return 0.0
+            return self._wait(cost)
+
+    async def acquire(self, cost: float) -> None:
+        """Wait until ``cost`` tokens are available, then take them."""
+        while (wait := self.try_take(cost)) > 0:
+            await asyncio.sleep(wait)
+
+    def sync(self, tokens_left: float, refill_per_minute: Optional[float] = None) -> None:
+        """Align the balance with the ``tokensLeft`` of an API response."""
+        with self._lock:
+            if refill_per_minute:
+                self.rate = refill_per_minute / 60
+                self.capacity = refill_per_minute * 60
+            self.tokens = tokens_left
+            self._updated = self._clock()
+
+
+def _at(values: Optional[Sequence[Any]], index: int) -> Optional[float]:
+    # Keepa usa -1 (o null) per "nessun dato"
+    if not values or index >= len(values) or values[index] is None:
+        return None
+    value = values[index]
+    if isinstance(value, list):  # min/max: [keepa minute, valore]
+        value = value[1] if len(value) > 1 else None
+    return None if value is None or value < 0 else value
+
+
+def _price(value: Optional[float]) -> Optional[str]:
+    return None if value is None else f"{value / 100:.2f}"
+
+
+def _count(value: Optional[float]) -> Optional[str]:
+    return None if value is None else str(int(value))
+
+
+def _percent(value: Optional[float]) -> Optional[str]:
+    return None if value is None else f"{value:g} %"
+
+
+def product_row(product: Dict[str, Any], code: str) -> Dict[str, Optional[str]]:
+    """Return the export columns of one Keepa product object."""
+    stats = product.get("stats") or {}
+    current = stats.get("current")
+    asin = product.get("asin")
+
+    amazon_share = None
+    buy_box_stats = stats.get("buyBoxStats")
+    if buy_box_stats is not None and code in AMAZON_SELLERS:
+        won = (buy_box_stats.get(AMAZON_SELLERS[code]) or {}).get("percentageWon", 0)
+        amazon_share = _percent(won)
+
+    # Coupon: positivo = importo in centesimi, negativo = percentuale
+    coupon = (product.get("coupon") or [None])[0]
+    coupon_abs = _price(coupon) if coupon and coupon > 0 else None
+    coupon_pct = _percent(-coupon) if coupon and coupon < 0 else None
+
+    dims = [product.get(k) for k in ("packageLength", "packageWidth", "packageHeight")]
+    volume = (
+        f"{dims[0] * dims[1] * dims[2] / 1000:g}" if all(d and d > 0 for d in dims) else None
+    )
+    rating = _at(current, RATING)
+
+    return {
+        "Locale": code.lower(),
+        "ASIN": asin,
+        "Title": product.get("title"),
+        "Brand": product.get("brand"),
+        "URL: Amazon": f"https://www.amazon.{DOMAINS[code][1]}/dp/{asin}",
+        "Sales Rank: Current": _count(_at(current, SALES)),
+        "Sales Rank: 30 days avg.": _count(_at(stats.get("avg30"), SALES)),
+        "Sales Rank: 90 days avg.": _count(_at(stats.get("avg90"), SALES)),
+        "Bought in past month": _count(_at([product.get("monthlySold")], 0)),
+        "Reviews: Rating": None if rating is None else f"{rating / 10:.1f}",
+        "Reviews: Rating Count": _count(_at(current, COUNT_REVIEWS)),
+        "Buy Box 🚚: Current": _price(_at(current, BUY_BOX)),
+        "Buy Box 🚚: 30 days avg.": _price(_at(stats.get("avg30"), BUY_BOX)),
+        "Buy Box 🚚: 90 days avg.": _price(_at(stats.get("avg90"), BUY_BOX)),
+        "Buy Box 🚚: 180 days avg.": _price(_at(stats.get("avg180"), BUY_BOX)),
+        "Buy Box 🚚: 365 days avg.": _price(_at(stats.get("avg365"), BUY_BOX)),
+        "Buy Box 🚚: Lowest": _price(_at(stats.get("min"), BUY_BOX)),
+        "Buy Box 🚚: Highest": _price(_at(stats.get("max"), BUY_BOX)),
+        "Buy Box: % Amazon 90 days": amazon_share,
+        "Amazon: Current": _price(_at(current, AMAZON)),
+        "Amazon: 90 days avg.": _price(_at(stats.get("avg90"), AMAZON)),
+        "Amazon: 180 days avg.": _price(_at(stats.get("avg180"), AMAZON)),
+        "Amazon: 365 days avg.": _price(_at(stats.get("avg365"), AMAZON)),
+        "Amazon: 90 days OOS": _percent(_at(stats.get("outOfStockPercentage90"), AMAZON)),
+        "New: Current": _price(_at(current, NEW)),
+        "New: 90 days avg.": _price(_at(stats.get("avg90"), NEW)),
+        "New: 180 days avg.": _price(_at(stats.get("avg180"), NEW)),
+        "New: 365 days avg.": _price(_at(stats.get("avg365"), NEW)),
+        "New, 3rd Party FBM 🚚: Current": _price(_at(current, NEW_FBM)),
+        "List Price: Current": _price(_at(current, LIST_PRICE)),
+        "New Offer Count: Current": _count(_at(current, COUNT_NEW)),
+        "Used Offer Count: Current": _count(_at(current, COUNT_USED)),
+        "One Time Coupon: Absolute": coupon_abs,
+        "One Time Coupon: Percentage": coupon_pct,
+        "Package: Dimension (cm³)": volume,
+        "Package: Weight (g)": _count(_at([product.get("packageWeight")], 0)),
+        "Item: Weight (g)": _count(_at([product.get("itemWeight")], 0)),
+    }
+
+
+def products_frame(products: Iterable[Dict[str, Any]], locale: str) -> pd.DataFrame:
+    """Return Keepa product objects as a text frame with :data:`KEEPA_COLUMNS`."""
+    code = normalize_locale(locale)
+    rows = [product_row(p, code) for p in products]
+    frame = pd.DataFrame(rows, columns=list(KEEPA_COLUMNS))
+    # Valori mancanti come NaN, come in un export letto con dtype=str
+    return frame.astype("str").where(frame.notna())
+
+
+class KeepaClient:
+    """Batched, rate-limited client of the Keepa ``/product`` endpoint.
+
+    ``stats_days`` sets the window of the ``stats`` object (and of the
+    Amazon Buy Box share); ``buybox`` adds the Buy Box statistics at two
+    extra tokens per product; ``history`` also returns the ``csv`` price
+    and rank histories, which cost no tokens but make responses larger.
+    With a ``cache``, fresh cached products are returned without a request
+    and stale ones are returned at once and refreshed in the background.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = KEEPA_API_URL,
+        max_in_flight: int = KEEPA_MAX_IN_FLIGHT,
+        stats_days: int = 90,
+        buybox: bool = True,
+        history: bool = False,
+        timeout: float = 60.0,
+        max_retries: int = MAX_RETRIES,
+        cache: Optional["KeepaCache"] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_in_flight = max(1, max_in_flight)
+        self.stats_days = stats_days
+        self.buybox = buybox
+        self.history = history
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.cache = cache
+        self.bucket: Optional[TokenBucket] = None
+        self.tokens_consumed = 0
+        self.requests = 0
+        # Una connessione per richiesta in volo, riusate tra i lotti
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Costo dei lotti in volo e secchio sono condivisi dal ciclo principale
+        # e dai thread di rivalidazione: li protegge _tokens_lock
+        self._in_flight_cost = 0
+        self._tokens_lock = threading.Lock()
+        self._refreshing: set = set()
+        self._refresh_threads: List[threading.Thread] = []
+        self._refresh_lock = threading.Lock()
+
+    def __enter__(self) -> "KeepaClient":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.wait_revalidations()
+        self.session.close()
+
+    @property
+    def fields(self) -> str:
+        """Request parameters that shape a product object (the cache key)."""
+        return f"stats={self.stats_days},buybox={int(self.buybox)},history={int(self.history)}"
+
+    @property
+    def cost_per_product(self) -> int:
+        return 1 + (2 if self.buybox else 0)
+
+    @property
+    def batch_size(self) -> int:
+        """ASINs per request: the API limit, or what a full bucket can pay for."""
+        if self.bucket is None:
+            return MAX_BATCH
+        affordable = int(self.bucket.capacity // self.cost_per_product)
+        return max(1, min(MAX_BATCH, affordable))
+
+    def _get(self, path: str, params: Dict[str, Any]) -> requests.Response:
+        return self.session.get(
+            f"{self.base_url}/{path}",
+            params={"key": self.api_key, **params},
+            timeout=self.timeout,
+        )
+
+    def _json(self, response: requests.Response) -> Dict[str, Any]:
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        if response.status_code != 200 and response.status_code != 429:
+            error = data.get("error") or {}
+            message = error.get("message") or response.reason
+            raise KeepaError(f"Keepa {response.status_code}: {message}")
+        return data
+
+    def token_status(self) -> Dict[str, Any]:
+        """Return the token balance and refill rate (no tokens used)."""
+        return self._json(self._get("token", {}))
+
+    def _ensure_bucket(self) -> TokenBucket:
+        with self._tokens_lock:
+            if self.bucket is None:
+                status = self.token_status()
+                self.bucket = TokenBucket(
+                    status.get("refillRate", 1), tokens=status.get("tokensLeft", 0)
+                )
+            return self.bucket
+
+    def _reserve(self, bucket: TokenBucket, cost: int) -> float:
+        # Token presi e costo in volo insieme: un sync nel mezzo non li perde
+        with self._tokens_lock:
+            wait = bucket.try_take(cost)
+            if wait <= 0:
+                self._in_flight_cost += cost
+            return wait
+
+    async def _fetch_batch(
+        self,
+        batch: List[str],
+        domain: int,
+        slots: asyncio.Semaphore,
+        turn: asyncio.Lock,
+    ) -> List[Dict[str, Any]]:
+        params = {
+            "domain": domain,
+            "asin": ",".join(batch),
+            "stats": self.stats_days,
+            "buybox": int(self.buybox),
+            "history": int(self.history),
+        }
+        cost = len(batch) * self.cost_per_product
+        bucket = self._ensure_bucket()
+        async with slots:
+            for _ in range(self.max_retries + 1):
+                # Un lotto alla volta attende i token: l'ordine di arrivo è rispettato
+                async with turn:
+                    while (wait := self._reserve(bucket, cost)) > 0:
+                        await asyncio.sleep(wait)
+                try:
+                    response = await asyncio.to_thread(self._get, "product", params)
+                finally:
+                    with self._tokens_lock:
+                        self._in_flight_cost -= cost
+                        self.requests += 1
+                data = self._json(response)
+                with self._tokens_lock:
+                    if "tokensLeft" in data:
+                        # Il saldo del server non conta ancora i lotti in volo
+                        bucket.sync(
+                            data["tokensLeft"] - self._in_flight_cost,
+                            data.get("refillRate"),
+                        )
+                    if response.status_code != 429:
+                        self.tokens_consumed += data.get("tokensConsumed", cost)
+                if response.status_code != 429:
+                    return data.get("products") or []
+                # Respinta: il server indica quando arrivano i prossimi token
+                await asyncio.sleep(data.get("refillIn", 1000) / 1000)
+        raise KeepaError(f"Keepa: token esauriti dopo {self.max_retries} tentativi")
+
+    async def _fetch_unique(self, asins: List[str], domain: int) -> List[Dict[str, Any]]:
+        if not asins:
+            return []
+        await asyncio.to_thread(self._ensure_bucket)
+        size = self.batch_size
+        batches = [asins[i : i + size] for i in range(0, len(asins), size)]
+        slots = asyncio.Semaphore(self.max_in_flight)
+        turn = asyncio.Lock()
+        results = await asyncio.gather(
+            *(self._fetch_batch(batch, domain, slots, turn) for batch in batches)
+        )
+        return [p for products in results for p in products]
+
+    def _revalidate(self, asins: List[str], domain: int) -> None:
+        """Refresh stale cached products in a background thread."""
+        with self._refresh_lock:
+            # Gli ASIN già in aggiornamento non si richiedono due volte
+            todo = [a for a in asins if (a, domain) not in self._refreshing]
+            self._refreshing.update((a, domain) for a in todo)
+        if not todo:
+            return
+
+        def refresh() -> None:
+            try:
+                products = asyncio.run(self._fetch_unique(todo, domain))
+                self.cache.put(products, domain, self.fields)
+            except Exception:  # la copia scaduta resta servita fino al prossimo tentativo
+                logger.exception("rivalidazione di %d ASIN non riuscita", len(todo))
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.difference_update((a, domain) for a in todo)
+
+        thread = threading.Thread(target=refresh, name="keepa-revalidate", daemon=True)
+        with self._refresh_lock:
+            self._refresh_threads = [t for t in self._refresh_threads if t.is_alive()]
+            self._refresh_threads.append(thread)
+        thread.start()
+
+    def wait_revalidations(self, timeout: Optional[float] = None) -> None:
+        """Wait for the background refreshes of stale products to finish."""
+        with self._refresh_lock:
+            threads = list(self._refresh_threads)
+        for thread in threads:
+            thread.join(timeout)
+
+    async def fetch_products_async(
+        self, asins: Sequence[str], locale: str
+    ) -> List[Dict[str, Any]]:
+        """Return the Keepa product objects of ``asins`` in ``locale``.
+
+        Duplicate ASINs are requested once; products come back in the order
+        of their first appearance in ``asins``. With a cache, only the ASINs
+        it does not hold (or holds past the stale window) are requested, in
+        full batches.
+        """
+        domain = domain_of(locale)
+        unique = list(dict.fromkeys(a for a in asins if isinstance(a, str) and a))
+        if not unique:
+            return []
+        if self.cache is None:
+            by_asin = {p.get("asin"): p for p in await self._fetch_unique(unique, domain)}
+        else:
+            cached = await asyncio.to_thread(self.cache.lookup, unique, domain, self.fields)
+            fetched = await self._fetch_unique(cached.missing, domain)
+            await asyncio.to_thread(self.cache.put, fetched, domain, self.fields)
+            if cached.stale:
+                self._revalidate(list(cached.stale), domain)
+            by_asin = {**cached.stale, **cached.fresh}
+            by_asin.update((p.get("asin"), p) for p in fetched)
+        return [by_asin[a] for a in unique if a in by_asin]
+
+    def fetch_products(self, asins: Sequence[str], locale: str) -> List[Dict[str, Any]]:
+        """Blocking version of :meth:`fetch_products_async`."""
+        return asyncio.run(self.fetch_products_async(asins, locale))
+
+    def fetch_frame(
+        self, asins: Sequence[str], locale: str, history_columns: bool = False
+    ) -> pd.DataFrame:
+        """Return ``asins`` in ``locale`` as a frame like an uploaded export.
+
+        With ``history_columns`` (on a client with ``history``) the frame also
+        gets the ``Hist_*`` columns of :func:`keepa_history.enrich`. Ask for
+        them on the comparison frame only, like the local snapshot history,
+        so the pipeline reads them without merge suffixes.
+        """
+        if history_columns and not self.history:
+            raise ValueError("history_columns requires a client with history=True")
+        products = self.fetch_products(asins, locale)
+        frame = products_frame(products, locale)
+        if not history_columns:
+            return frame
+        # Import locale: keepa_history importa le costanti di questo modulo
+        from keepa_history import enrich
+
+        return enrich(frame, products)
@@ -0,0 +1,253 @@
+"""Vectorized decoding of the price and sales rank histories of Keepa products.
+
+Keepa product objects fetched with ``history=1`` (see
+:class:`keepa_client.KeepaClient`) carry a ``csv`` list with one flat integer
+array per series: ``[minute, value, minute, value, ...]``, or ``[minute,
+price, shipping, ...]`` for the Buy Box. Minutes count from 2011-01-01 UTC,
+prices are in cents and ``-1`` means no offer. :func:`decode_history` turns
+one series of many products into three NumPy buffers (minutes, values and
+the offset of each product's points), and :func:`window_stats` computes
+time-weighted statistics of every product at once, treating each series as
+a step function: a value holds until the next point.
+
+:func:`history_features` returns the ``Hist_*`` columns of
+:mod:`snapshots`, so :func:`enrich` can join Keepa's own history to a frame
+in place of the local snapshot store (see
+:meth:`keepa_client.KeepaClient.fetch_frame`): ``Hist_FairPrice`` and
+``Hist_Volatility`` feed :func:`deals.compute_historic_deals` and
+``Hist_SalesRank_30d`` the sales rank trend. ``Hist_PriceMin``,
+``Hist_PriceMax`` and ``Hist_RankSlope`` are extra columns for display and
+export; no score reads them.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from keepa_client import AMAZON, BUY_BOX, NEW, SALES
+from snapshots import FAIR_WINDOW_DAYS, HIST_COLUMNS, TREND_WINDOW_DAYS
+
+# Minuti Keepa: minuti dal 2011-01-01 UTC (21564000 minuti Unix)
+KEEPA_EPOCH_MINUTES = 21_564_000
+
+MINUTES_PER_DAY = 1440
+
+KEEPA_HIST_COLUMNS = HIST_COLUMNS + ["Hist_PriceMin", "Hist_PriceMax", "Hist_RankSlope"]
+
+# Serie di prezzo in ordine di preferenza per il prezzo equo, come gli snapshot
+PRICE_SERIES = (BUY_BOX, AMAZON, NEW)
+
+STAT_COLUMNS = ["median", "mean", "std", "min", "max", "slope", "points", "covered_days"]
+
+
+def to_datetime(minutes: Any) -> np.ndarray:
+    """Convert Keepa minutes to ``datetime64[m]`` (UTC)."""
+    minutes = np.asarray(minutes, dtype=np.int64)
+    return (minutes + KEEPA_EPOCH_MINUTES).astype("datetime64[m]")
+
+
+def keepa_minute(when: datetime) -> int:
+    """Return the Keepa minute of ``when`` (naive datetimes are UTC)."""
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return int(when.timestamp() // 60) - KEEPA_EPOCH_MINUTES
+
+
+@dataclass(frozen=True)
+class History:
+    """One series of many products in flat buffers.
+
+    The points of product ``i`` are ``minutes[offsets[i]:offsets[i + 1]]``
+    and ``values[...]``, in time order; ``values`` is NaN where Keepa had
+    no offer.
+    """
+
+    minutes: np.ndarray
+    values: np.ndarray
+    offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def rows(self) -> np.ndarray:
+        """Product index of every point."""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+
+def decode_history(
+    products: Sequence[Dict[str, Any]],
+    index: int,
+    scale: float = 1.0,
+) -> History:
+    """Decode the ``csv[index]`` series of every product.
+
+    Values are multiplied by ``scale`` (0.01 turns cents into euros). The
+    Buy Box series has a shipping cost after each price, which is added.
+    """
+    stride = 3 if index == BUY_BOX else 2
+    arrays = []
+    counts = np.zeros(len(products), dtype=np.int64)
+    for i, product in enumerate(products):
+        csv = product.get("csv") or ()
+        series = csv[index] if index < len(csv) else None
+        if series:
+            # Un array troncato non deve spostare le coppie dei prodotti successivi
+            series = np.asarray(series, dtype=np.int64)
+            series = series[: len(series) - len(series) % stride]
+            arrays.append(series)
+            counts[i] = len(series) // stride
+    flat = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+    points = flat.reshape(-1, stride)
+    raw = points[:, 1]
+    values = raw.astype(np.float64)
+    if stride == 3:
+        values += np.where(points[:, 2] > 0, points[:, 2], 0)
+    values[raw < 0] = np.nan
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return History(points[:, 0].copy(), values * scale, offsets)
+
+
+def window_stats(history: History, start: int, end: int) -> pd.DataFrame:
+    """Time-weighted statistics of each product between two Keepa minutes.
+
+    Each point counts for the minutes it holds inside ``[start, end]``; the
+    last point holds until ``end`` and a point before ``start`` counts from
+    ``start``. ``median`` is the weighted median (the mean of the two middle
+    values when the weight splits exactly in half), ``std`` the weighted
+    standard deviation and ``slope`` the least-squares slope of the step
+    function per day. Minutes with no offer are left out.
+    """
+    n = len(history)
+    rows = history.rows
+    t = history.minutes
+    following = np.empty_like(t)
+    following[:-1] = t[1:]
+    nonempty = np.diff(history.offsets) > 0
+    following[history.offsets[1:][nonempty] - 1] = end
+    # Estremi di ciascun tratto, in giorni da ``end``
+    a = (np.maximum(t, start) - end) / MINUTES_PER_DAY
+    b = (np.minimum(following, end) - end) / MINUTES_PER_DAY
+    held = np.minimum(following, end) - np.maximum(t, start)
+    valid = (held > 0) & ~np.isnan(history.values)
+    r, v, a, b = rows[valid], history.values[valid], a[valid], b[valid]
+    w = b - a
+    # Minuti interi per la mediana: somme cumulate esatte, pareggi riconoscibili
+    minutes = held[valid].astype(np.float64)
+
+    def total(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(r, weights, minlength=n)
+
+    days = total(w)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total(w * v) / days
+        var = total(w * (v - mean[r]) ** 2) / days
+        # Regressione della funzione a gradini sul tempo, con integrali esatti
+        t1 = total((b**2 - a**2) / 2)
+        t2 = total((b**3 - a**3) / 3)
+        ty = total(v * (b**2 - a**2) / 2)
+        slope = (days * ty - t1 * mean * days) / (days * t2 - t1**2)
+
+    order = np.lexsort((v, r))
+    r, v, minutes = r[order], v[order], minutes[order]
+    first = np.searchsorted(r, np.arange(n), side="left")
+    stop = np.searchsorted(r, np.arange(n), side="right")
+    has = stop > first
+    cum = np.cumsum(minutes)
+    before = np.concatenate([[0.0], cum])[first]
+    half = before + np.bincount(r, minutes, minlength=n) / 2
+    # Primo valore che porta il peso cumulato a metà del totale
+    mid = np.minimum(np.searchsorted(cum, half, side="left"), np.maximum(stop - 1, 0))
+    median = np.full(n, np.nan)
+    minimum = np.full(n, np.nan)
+    maximum = np.full(n, np.nan)
+    if len(v):
+        median[has] = v[mid[has]]
+        tie = has & (cum[mid] == half) & (mid + 1 < stop)
+        median[tie] = (v[mid[tie]] + v[mid[tie] + 1]) / 2
+        minimum[has] = v[first[has]]
+        maximum[has] = v[stop[has] - 1]
+    return pd.DataFrame(
+        {
+            "median": median,
+            "mean": mean,
+            "std": np.sqrt(var),
+            "min": minimum,
+            "max": maximum,
+            "slope": np.where(np.isfinite(slope), slope, np.nan),
+            "points": stop - first,
+            "covered_days": days,
+        },
+        columns=STAT_COLUMNS,
+    )
+
+
+def _first_available(stats: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    # Per ogni prodotto la prima serie con dati nella finestra
+    stats = list(stats)
+    chosen = stats[0].copy()
+    for other in stats[1:]:
+        empty = chosen["points"].to_numpy() == 0
+        chosen.loc[empty] = other.loc[empty]
+    return chosen
+
+
+def history_features(
+    products: Sequence[Dict[str, Any]],
+    as_of: Optional[datetime] = None,
+    fair_window: int = FAIR_WINDOW_DAYS,
+    trend_window: int = TREND_WINDOW_DAYS,
+) -> pd.DataFrame:
+    """Return the ``Hist_*`` columns of each product from its Keepa history.
+
+    ``Hist_FairPrice`` is the time-weighted median of the reference price
+    (Buy Box with shipping, else Amazon, else New) over ``fair_window``
+    days, ``Hist_Volatility`` its standard deviation and ``Hist_PriceMin``
+    and ``Hist_PriceMax`` its range. ``Hist_SalesRank_30d`` is the mean
+    sales rank over ``trend_window`` days and ``Hist_RankSlope`` the slope
+    of the log sales rank per day over the same window (negative when the
+    rank improves). ``Hist_Snapshots`` counts the price points in the window.
+    """
+    end = keepa_minute(as_of or datetime.now(timezone.utc))
+    fair_start = end - fair_window * MINUTES_PER_DAY
+    trend_start = end - trend_window * MINUTES_PER_DAY
+    price = _first_available(
+        window_stats(decode_history(products, index, scale=0.01), fair_start, end)
+        for index in PRICE_SERIES
+    )
+    rank = decode_history(products, SALES)
+    rank_stats = window_stats(rank, trend_start, end)
+    log_rank = replace(rank, values=np.log(np.where(rank.values > 0, rank.values, np.nan)))
+    log_stats = window_stats(log_rank, trend_start, end)
+    return pd.DataFrame(
+        {
+            "ASIN": [p.get("asin") for p in products],
+            "Hist_FairPrice": price["median"].to_numpy(),
+            "Hist_Volatility": price["std"].to_numpy(),
+            "Hist_SalesRank_30d": rank_stats["mean"].to_numpy(),
+            "Hist_Snapshots": price["points"].to_numpy(),
+            "Hist_PriceMin": price["min"].to_numpy(),
+            "Hist_PriceMax": price["max"].to_numpy(),
+            "Hist_RankSlope": log_stats["slope"].to_numpy(),
+        }
+    )
+
+
+def enrich(
+    df: pd.DataFrame,
+    products: Sequence[Dict[str, Any]],
+    as_of: Optional[datetime] = None,
+) -> pd.DataFrame:
+    """Return ``df`` with the ``Hist_*`` columns of its ASINs' Keepa history."""
+    features = history_features(products, as_of).drop_duplicates("ASIN")
+    asins = df["ASIN"].astype(str).str.strip().str.upper()
+    joined = features.set_index("ASIN").reindex(asins)
+    df = df.copy()
+    for column in KEEPA_HIST_COLUMNS:
+        df[column] = joined[column].to_numpy()
+    return df
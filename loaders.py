@@ -7,9 +7,11 @@ import re
 from pathlib import Path
 from typing import Any, Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import duckdb
-import streamlit as st
 
 
 def load_data(uploaded_file: Any) -> Optional[pd.DataFrame]:
@@ -22,6 +24,9 @@ def load_data(uploaded_file: Any) -> Optional[pd.DataFrame]:
         return None
     import pandas as pd  # imported lazily
 
+    # The same upload may already have been read during this script run
+    if hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)
     fname = uploaded_file.name.lower()
     if fname.endswith(".xlsx"):
         df = pd.read_excel(uploaded_file, dtype=str)
@@ -35,14 +40,12 @@ def load_data(uploaded_file: Any) -> Optional[pd.DataFrame]:
     return df
 
 
-@st.cache_data(show_spinner=False)
 def load_keepa(path: str | Path) -> pd.DataFrame:
     """Load a Keepa export file from ``path``."""
     df = pd.read_excel(path, dtype=str)
     return df.loc[:, ~df.columns.str.contains("^Unnamed")]
 
 
-@st.cache_data(show_spinner=False)
 def load_prices(path: str | Path) -> pd.DataFrame:
     """Load a price CSV/Excel file from ``path``."""
     if str(path).lower().endswith(".xlsx"):
@@ -102,3 +105,37 @@ def parse_weight(text: Any) -> float:
         except ValueError:
             return math.nan
     return math.nan
+
+
+# Testi ASCII stampabili: qui le regex di Arrow coincidono con quelle di ``re``
+_PRINTABLE_ASCII = r"^[\x20-\x7e]*$"
+
+
+def _extract_float(texts: pa.Array, pattern: str) -> np.ndarray:
+    match = pc.extract_regex(texts, pattern)
+    digits = pc.if_else(pc.is_valid(match), pc.struct_field(match, [0]), None)
+    return pc.cast(digits, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def parse_weights(texts: Any) -> np.ndarray:
+    """Batched :func:`parse_weight` of every value of ``texts``.
+
+    Printable ASCII strings are parsed with Arrow kernels; other strings
+    (Unicode digits or spaces) go through :func:`parse_weight`.
+    """
+    texts = pd.Series(texts, copy=False)
+    if not isinstance(texts.dtype, pd.StringDtype):
+        texts = texts.astype(object)
+        texts = texts.where(texts.map(type).eq(str))
+    arr = pa.array(texts, type=pa.string(), from_pandas=True)
+    simple = pc.fill_null(pc.match_substring_regex(arr, _PRINTABLE_ASCII), False)
+    arr = pc.if_else(simple, arr, None)
+    low = pc.utf8_lower(arr)
+    kg = _extract_float(low, r"(?P<kg>[0-9]+\.?[0-9]*) *kg")
+    g = _extract_float(low, r"(?P<g>[0-9]+\.?[0-9]*) *g")
+    num = _extract_float(arr, r"^ *(?P<num>[0-9]+\.?[0-9]*) *$")
+    out = np.where(~np.isnan(kg), kg, np.where(~np.isnan(g), g / 1000, num))
+    rest = ~simple.to_numpy(zero_copy_only=False) & texts.notna().to_numpy()
+    if rest.any():
+        out[rest] = [parse_weight(t) for t in texts[rest]]
+    return out
@@ -0,0 +1,244 @@
+"""Arbitrage matrix: every market as origin and as destination in one pass.
+
+The exports of all the markets are loaded once and indexed by ASIN × locale
+into dense arrays of gross prices, weights, ranks and offers. The net
+purchase price, net sale price and shipping of every cell follow the
+formulas of :mod:`engine`; the net margin of every origin → destination pair
+is then a broadcast difference over an ``(ASIN, origin, destination)`` array,
+instead of one pipeline run per pair. Each ASIN keeps its best route among
+those passing the :class:`engine.Filters`.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from diagnostics import profiled
+from engine import (
+    POSSIBLE_WEIGHT_COLS,
+    AnalysisError,
+    EngineConfig,
+    Progress,
+    _grams_to_kg,
+    _no_progress,
+    load_frames,
+)
+from loaders import parse_float, parse_int, parse_weights
+from score import VAT_RATES, final_purchase_prices, normalize_locale, shipping_costs
+
+# ASIN elaborati insieme: l'array delle rotte ha ASIN × L × L celle
+MATRIX_CHUNK_ASINS = 50_000
+
+ROUTE_COLUMNS = [
+    "ASIN",
+    "Title",
+    "Locale (base)",
+    "Locale (comp)",
+    "Price_Base",
+    "Price_Comp",
+    "Acquisto_Netto",
+    "Vendita_Netto",
+    "Shipping_Cost",
+    "Margine_Netto",
+    "Margine_Netto_%",
+    "SalesRank_Comp",
+    "NewOffer_Comp",
+    "Routes",
+]
+
+
+@dataclass
+class MarketMatrix:
+    """Values of every ASIN (rows) in every market (columns)."""
+
+    asins: pd.Index
+    locales: pd.Index
+    titles: np.ndarray
+    buy: np.ndarray
+    sell: np.ndarray
+    weight_kg: np.ndarray
+    rank: np.ndarray
+    offers: np.ndarray
+
+    @property
+    def vat(self) -> np.ndarray:
+        """VAT rate of each market, as a fraction."""
+        return np.array([VAT_RATES.get(loc, 0) / 100.0 for loc in self.locales])
+
+
+def _parsed(df: pd.DataFrame, column: str, parse) -> pd.Series:
+    return df.get(column, pd.Series(np.nan, index=df.index)).apply(parse).astype(float)
+
+
+def _weights(df: pd.DataFrame) -> pd.Series:
+    # Stesse colonne e priorità del merge, senza il suffisso " (base)"
+    weight = pd.Series(np.nan, index=df.index)
+    for col in POSSIBLE_WEIGHT_COLS:
+        col = col.removesuffix(" (base)")
+        if col in df.columns:
+            if "(g)" in col:
+                parsed = df[col].apply(_grams_to_kg).astype(float)
+            else:
+                parsed = pd.Series(parse_weights(df[col]), index=df.index)
+            weight = weight.fillna(parsed)
+    return weight.fillna(1.0)
+
+
+@profiled
+def build_matrix(df: pd.DataFrame, config: EngineConfig) -> MarketMatrix:
+    """Index the rows of all the exports by ASIN and locale.
+
+    Only the first row of each ASIN in each locale is used.
+    """
+    if "ASIN" not in df.columns or "Locale" not in df.columns:
+        raise AnalysisError(
+            "Per la matrice ogni export deve contenere le colonne ASIN e Locale."
+        )
+    df = df.assign(
+        ASIN=df["ASIN"].str.strip().str.upper(),
+        Locale=df["Locale"].map(normalize_locale),
+    )
+    df = df[df["ASIN"].notna() & (df["Locale"] != "")]
+    df = df.drop_duplicates(["ASIN", "Locale"])
+    if df["Locale"].nunique() < 2:
+        raise AnalysisError("La matrice richiede export di almeno due mercati.")
+
+    rows, asins = pd.factorize(df["ASIN"])
+    cols, locales = pd.factorize(df["Locale"], sort=True)
+
+    def dense(values: pd.Series) -> np.ndarray:
+        out = np.full((len(asins), len(locales)), np.nan)
+        out[rows, cols] = values.to_numpy(dtype=float, na_value=np.nan)
+        return out
+
+    titles = (
+        df.groupby(rows)["Title"].first().reindex(range(len(asins))).to_numpy()
+        if "Title" in df.columns
+        else np.full(len(asins), np.nan, dtype=object)
+    )
+    return MarketMatrix(
+        asins=pd.Index(asins),
+        locales=pd.Index(locales),
+        titles=titles,
+        buy=dense(_parsed(df, config.ref_price_base, parse_float)),
+        sell=dense(_parsed(df, config.ref_price_comp, parse_float)),
+        weight_kg=dense(_weights(df)),
+        rank=dense(_parsed(df, "Sales Rank: Current", parse_int)),
+        offers=dense(_parsed(df, "New Offer Count: Current", parse_int)),
+    )
+
+
+def route_margins(
+    matrix: MarketMatrix, config: EngineConfig, rows: slice = slice(None)
+) -> Dict[str, np.ndarray]:
+    """Return the ``(ASIN, origin, destination)`` arrays of the route values."""
+    purchase = final_purchase_prices(matrix.buy[rows], matrix.locales, config.discount)
+    sale = (matrix.sell / (1 + matrix.vat))[rows]
+    shipping = shipping_costs(matrix.weight_kg[rows])
+
+    margin = sale[:, None, :] - purchase[:, :, None]
+    if config.include_shipping:
+        margin = margin - shipping[:, :, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margin_pct = margin / purchase[:, :, None] * 100
+    return {
+        "purchase": purchase,
+        "sale": sale,
+        "shipping": shipping,
+        "margin": margin,
+        "margin_pct": margin_pct,
+    }
+
+
+def _valid_routes(
+    matrix: MarketMatrix, config: EngineConfig, routes: Dict[str, np.ndarray], rows: slice
+) -> np.ndarray:
+    f = config.filters
+    sell = matrix.sell[rows][:, None, :]
+    rank = np.nan_to_num(matrix.rank[rows], nan=999999)[:, None, :]
+    offers = np.nan_to_num(matrix.offers[rows], nan=0)[:, None, :]
+    n = len(matrix.locales)
+    return (
+        ~np.eye(n, dtype=bool)[None, :, :]
+        & (routes["margin_pct"] > f.min_margin_pct)
+        & (routes["margin"] > f.min_margin_abs)
+        & (rank <= f.max_sales_rank)
+        & (offers <= f.max_offer_count)
+        & (sell >= f.min_buybox_price)
+        & (sell <= f.max_buybox_price)
+    )
+
+
+@profiled
+def best_routes(
+    matrix: MarketMatrix, config: EngineConfig, chunk_asins: int = MATRIX_CHUNK_ASINS
+) -> pd.DataFrame:
+    """Return the route with the highest net margin of each ASIN.
+
+    Only routes passing ``config.filters`` are considered; ``Routes`` counts
+    them. ASINs without any such route are left out.
+    """
+    n = len(matrix.locales)
+    parts: List[pd.DataFrame] = []
+    for start in range(0, len(matrix.asins), chunk_asins):
+        rows = slice(start, start + chunk_asins)
+        routes = route_margins(matrix, config, rows)
+        valid = _valid_routes(matrix, config, routes, rows)
+        flat = np.where(valid, routes["margin"], -np.inf).reshape(len(valid), n * n)
+        best = flat.argmax(axis=1)
+        keep = np.isfinite(flat[np.arange(len(flat)), best])
+        a = np.flatnonzero(keep)
+        o, d = np.divmod(best[keep], n)
+        g = a + start
+        parts.append(
+            pd.DataFrame(
+                {
+                    "ASIN": matrix.asins[g],
+                    "Title": matrix.titles[g],
+                    "Locale (base)": matrix.locales[o].str.lower(),
+                    "Locale (comp)": matrix.locales[d].str.lower(),
+                    "Price_Base": matrix.buy[g, o],
+                    "Price_Comp": matrix.sell[g, d],
+                    "Acquisto_Netto": routes["purchase"][a, o],
+                    "Vendita_Netto": routes["sale"][a, d],
+                    "Shipping_Cost": routes["shipping"][a, o],
+                    "Margine_Netto": routes["margin"][a, o, d],
+                    "Margine_Netto_%": routes["margin_pct"][a, o, d],
+                    "SalesRank_Comp": matrix.rank[g, d],
+                    "NewOffer_Comp": matrix.offers[g, d],
+                    "Routes": valid[a].sum(axis=(1, 2)),
+                }
+            )
+        )
+    result = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    result = result.reindex(columns=ROUTE_COLUMNS)
+    return result.sort_values("Margine_Netto", ascending=False, ignore_index=True)
+
+
+def analyze_matrix(
+    files: Iterable[Any],
+    config: EngineConfig,
+    progress: Progress = _no_progress,
+) -> Dict[str, Any]:
+    """Load the exports of all the markets and return their best routes.
+
+    ``config.ref_price_base`` is the purchase price column and
+    ``config.ref_price_comp`` the sale price column of every market.
+    """
+    progress("load")
+    df, warnings = load_frames(files, "di mercato")
+    if df.empty:
+        raise AnalysisError("Nessun file di mercato valido caricato.")
+
+    progress("merge")
+    matrix = build_matrix(df, config)
+
+    progress("margins")
+    routes = best_routes(matrix, config)
+
+    progress("ranking")
+    return {"routes": routes, "matrix": matrix, "config": config, "warnings": warnings}
@@ -0,0 +1,346 @@
+"""Out-of-core pipeline for exports larger than the available memory.
+
+The uploaded exports are spilled chunk by chunk into an on-disk DuckDB
+database, joined there (DuckDB spills to disk within its memory limit) and
+streamed back in chunks through the per-row stages of :mod:`engine`. Score
+bounds are accumulated during that first pass, so only the rows that pass
+the filters are ever materialized in pandas. CSV and XLSX exports are both
+read row by row; the chunk size shrinks while the process RSS is above
+``max_rss_mb``.
+"""
+
+from __future__ import annotations
+
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+from diagnostics import rss_bytes
+
+from engine import (
+    DISPLAY_COLS_ORDER,
+    TOP_K,
+    AnalysisError,
+    EngineConfig,
+    Progress,
+    _no_progress,
+    _process_shard,
+    apply_scores,
+    finalize_results,
+)
+from score import merge_score_bounds
+from settings import OUT_OF_CORE_MAX_RSS_MB, OUT_OF_CORE_MEMORY_MB
+
+ROW_COL = "__row"
+
+# Righe lette per volta dal join; i chunk non scendono sotto questa soglia
+MIN_CHUNK_ROWS = 1_000
+
+MB = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class OutOfCoreSettings:
+    """Resource limits of an out-of-core run."""
+
+    memory_limit_mb: int = OUT_OF_CORE_MEMORY_MB
+    # RSS massima del processo (DuckDB compreso); None = nessun controllo
+    max_rss_mb: Optional[int] = OUT_OF_CORE_MAX_RSS_MB
+    # Righe per chunk; None = stimate in base al limite di memoria
+    chunk_rows: Optional[int] = None
+    read_chunk_rows: int = 100_000
+    workdir: Optional[str] = None
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _cell_text(value: Any) -> Optional[str]:
+    # Come pd.read_excel(dtype=str): celle vuote mancanti, float interi "12"
+    if value is None or value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _iter_xlsx(file: Any, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    # Importato qui: openpyxl non serve all'avvio dell'app
+    from openpyxl import load_workbook
+
+    # Foglio letto in streaming (read_only): in memoria solo un chunk di righe
+    book = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = book.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [
+            str(name) if name is not None else f"Unnamed: {i}"
+            for i, name in enumerate(header)
+        ]
+        chunk: List[List[Optional[str]]] = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            # Le colonne oltre l'intestazione sarebbero "Unnamed", scartate in spill
+            cells = [_cell_text(value) for value in row[: len(columns)]]
+            chunk.append(cells + [None] * (len(columns) - len(cells)))
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns, dtype=object)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns, dtype=object)
+    finally:
+        book.close()
+
+
+def _iter_chunks(file: Any, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Yield ``file`` as string frames of at most ``chunk_rows`` rows."""
+    if hasattr(file, "seek"):
+        file.seek(0)
+    name = getattr(file, "name", str(file)).lower()
+    if name.endswith(".xlsx"):
+        yield from _iter_xlsx(file, chunk_rows)
+        return
+    if hasattr(file, "readline"):
+        header = file.readline()
+        file.seek(0)
+    else:
+        with open(file, "rb") as fh:
+            header = fh.readline()
+    if isinstance(header, bytes):
+        header = header.decode("utf-8", errors="ignore")
+    sep = ";" if ";" in header else ","
+    yield from pd.read_csv(file, sep=sep, dtype=str, chunksize=chunk_rows)
+
+
+class SpillStore:
+    """On-disk DuckDB database holding the spilled exports."""
+
+    def __init__(self, settings: OutOfCoreSettings):
+        self.settings = settings
+        self._dir = tempfile.mkdtemp(prefix="ama-ooc-", dir=settings.workdir)
+        self.con = duckdb.connect(str(Path(self._dir) / "spill.duckdb"))
+        self.con.execute(f"SET memory_limit='{int(settings.memory_limit_mb)}MB'")
+        self.con.execute(f"SET temp_directory='{Path(self._dir) / 'tmp'}'")
+        self.columns: Dict[str, List[str]] = {}
+        self.warnings: List[str] = []
+
+    def close(self) -> None:
+        self.con.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self) -> "SpillStore":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def spill(self, table: str, files: Iterable[Any], label: str = "") -> int:
+        """Append ``files`` to ``table`` chunk by chunk; return the row count.
+
+        Files with no rows add a message to :attr:`warnings`.
+        """
+        columns = self.columns.setdefault(table, [])
+        rows = 0
+        for file in files or []:
+            file_start = rows
+            for chunk in _iter_chunks(file, self.settings.read_chunk_rows):
+                chunk = chunk.loc[:, ~chunk.columns.str.startswith("Unnamed")]
+                if "ASIN" not in chunk.columns:
+                    raise AnalysisError(
+                        "Assicurati che entrambi i file (origine e confronto) "
+                        "contengano la colonna ASIN."
+                    )
+                chunk = chunk.assign(
+                    ASIN=chunk["ASIN"].str.strip().str.upper(),
+                    **{ROW_COL: range(rows, rows + len(chunk))},
+                )
+                if not columns:
+                    self.con.execute(
+                        f"CREATE TABLE {table} ({ROW_COL} BIGINT, "
+                        + ", ".join(f"{_quote(c)} VARCHAR" for c in chunk.columns[:-1])
+                        + ")"
+                    )
+                    columns.extend(chunk.columns[:-1])
+                for col in chunk.columns[:-1]:
+                    if col not in columns:
+                        self.con.execute(
+                            f"ALTER TABLE {table} ADD COLUMN {_quote(col)} VARCHAR"
+                        )
+                        columns.append(col)
+                self.con.register("chunk", chunk)
+                self.con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM chunk")
+                self.con.unregister("chunk")
+                rows += len(chunk)
+            if rows == file_start:
+                name = getattr(file, "name", str(file))
+                self.warnings.append(f"Il file {label} {name} è vuoto o non valido.")
+        return rows
+
+    def join_query(self) -> str:
+        """Return the SQL of the inner join, with pandas-style column suffixes."""
+        base, comp = self.columns["base"], self.columns["comp"]
+        shared = set(base) & set(comp)
+        select = []
+        for col in base:
+            alias = f"{col} (base)" if col in shared and col != "ASIN" else col
+            select.append(f"b.{_quote(col)} AS {_quote(alias)}")
+        for col in comp:
+            if col == "ASIN":
+                continue
+            alias = f"{col} (comp)" if col in shared else col
+            select.append(f"c.{_quote(col)} AS {_quote(alias)}")
+        # Stesso ordine delle righe di pandas.merge(how="inner")
+        return (
+            f"SELECT {', '.join(select)} FROM base b JOIN comp c "
+            f"ON b.\"ASIN\" = c.\"ASIN\" ORDER BY b.{ROW_COL}, c.{ROW_COL}"
+        )
+
+    def iter_joined(self, guard: "MemoryGuard") -> Iterator[pd.DataFrame]:
+        """Stream the joined rows as pandas frames of ``guard.chunk_rows`` rows.
+
+        The size is read again before each chunk, so it follows the guard.
+        """
+        step = min(MIN_CHUNK_ROWS, guard.chunk_rows)
+        result = self.con.execute(self.join_query())
+        reader = (
+            result.to_arrow_reader(step)
+            if hasattr(result, "to_arrow_reader")
+            else result.fetch_record_batch(step)
+        )
+        start = 0
+        batches, pending = [], 0
+        for batch in reader:
+            batches.append(batch)
+            pending += batch.num_rows
+            if pending >= guard.chunk_rows:
+                yield self._frame(batches, start)
+                start += pending
+                batches, pending = [], 0
+        if batches:
+            yield self._frame(batches, start)
+
+    @staticmethod
+    def _frame(batches: List[Any], start: int) -> pd.DataFrame:
+        frame = pa.Table.from_batches(batches).to_pandas()
+        frame.index = pd.RangeIndex(start, start + len(frame))
+        return frame
+
+
+class MemoryGuard:
+    """Chunk size of the streaming pass, halved while the RSS is over budget.
+
+    :meth:`check` is called after each chunk; :attr:`peak_mb` is the
+    highest RSS it observed and :attr:`exceeded` tells whether the budget
+    was still exceeded with the smallest chunks.
+    """
+
+    def __init__(self, chunk_rows: int, max_rss_mb: Optional[int]):
+        self.chunk_rows = chunk_rows
+        self.max_rss_mb = max_rss_mb
+        self.min_rows = min(MIN_CHUNK_ROWS, chunk_rows)
+        self.peak_mb = (rss_bytes() or 0) / MB
+        self.exceeded = False
+
+    def check(self) -> None:
+        rss = rss_bytes()
+        if rss is None:
+            return
+        self.peak_mb = max(self.peak_mb, rss / MB)
+        if self.max_rss_mb and rss / MB > self.max_rss_mb:
+            if self.chunk_rows > self.min_rows:
+                self.chunk_rows = max(self.min_rows, self.chunk_rows // 2)
+            else:
+                self.exceeded = True
+
+
+def _chunk_rows_for(sample: pd.DataFrame, settings: OutOfCoreSettings) -> int:
+    """Size chunks so that one chunk and its derived columns fit the limit."""
+    if settings.chunk_rows:
+        return settings.chunk_rows
+    per_row = max(1, sample.memory_usage(deep=True).sum() // max(1, len(sample)))
+    # Un chunk con le colonne calcolate occupa circa il doppio dei dati grezzi
+    budget = settings.memory_limit_mb * 1024 * 1024 // 8
+    return int(max(1_000, budget // (2 * per_row)))
+
+
+def run_out_of_core(
+    files_base: Iterable[Any],
+    comparison_files: Iterable[Any],
+    config: EngineConfig,
+    settings: OutOfCoreSettings = OutOfCoreSettings(),
+    progress: Progress = _no_progress,
+    ignored_options: Sequence[str] = (),
+) -> Dict[str, Any]:
+    """Run the pipeline on files without loading them fully in memory.
+
+    Returns the same result dictionary as :func:`engine.analyze_uploads`,
+    plus ``memory`` with the peak RSS seen and the final chunk size.
+    ``settings.memory_limit_mb`` bounds DuckDB's memory for the spill and
+    the join and sizes the first chunks; the chunks then shrink while the
+    process RSS is above ``settings.max_rss_mb``. ``ignored_options`` names
+    the options of the caller this mode does not support (delta updates,
+    local history), reported among the warnings.
+    """
+    warnings = [
+        f"Elaborazione a blocchi su disco: l'opzione «{name}» non è supportata "
+        "ed è stata ignorata."
+        for name in ignored_options
+    ]
+    with SpillStore(settings) as store:
+        progress("load")
+        if not store.spill("base", files_base, "base"):
+            raise AnalysisError("Nessun file di origine valido caricato.")
+        if not store.spill("comp", comparison_files, "di confronto"):
+            raise AnalysisError("Nessun file di confronto valido caricato.")
+        warnings += store.warnings
+
+        progress("merge")
+        sample = store.con.execute(store.join_query() + " LIMIT 1000").df()
+        if sample.empty:
+            raise AnalysisError(
+                "Nessuna corrispondenza trovata tra la Lista di Origine e le Liste di Confronto."
+            )
+        guard = MemoryGuard(_chunk_rows_for(sample, settings), settings.max_rss_mb)
+
+        # Primo passaggio: fasi riga per riga e limiti di normalizzazione
+        progress("parse")
+        kept, bounds = [], []
+        for chunk in store.iter_joined(guard):
+            rows, part_bounds = _process_shard(chunk, config)
+            bounds.append(part_bounds)
+            if not rows.empty or not kept:
+                kept.append(rows)
+            guard.check()
+
+    # Secondo passaggio: punteggi con i limiti globali sulle sole righe filtrate
+    progress("scoring")
+    df_rows = pd.concat([k for k in kept if not k.empty] or kept[:1])
+    df_rows = apply_scores(df_rows, config, merge_score_bounds(bounds))
+
+    top = df_rows.nlargest(TOP_K, "Opportunity_Score")
+    progress("ranking", partial=top[[c for c in DISPLAY_COLS_ORDER if c in top]])
+    results = finalize_results(df_rows)
+    guard.check()
+    if guard.exceeded:
+        warnings.append(
+            f"Memoria oltre il limite di {settings.max_rss_mb} MB anche con blocchi "
+            f"da {guard.chunk_rows} righe (picco {guard.peak_mb:.0f} MB)."
+        )
+    results["config"] = config
+    results["warnings"] = warnings
+    results["memory"] = {
+        "peak_rss_mb": round(guard.peak_mb, 1),
+        "max_rss_mb": settings.max_rss_mb,
+        "chunk_rows": guard.chunk_rows,
+    }
+    return results
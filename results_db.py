@@ -0,0 +1,210 @@
+"""Persistent store of completed analyses in a local DuckDB database.
+
+Each analysis is keyed by the fingerprints of its input files and its
+parameters, so the same uploads analysed with the same settings map to the
+same key in any session or after a restart. The ``analyses`` table holds the
+metadata; the result frames are stored as one table each (``full_<key>``,
+``filtered_<key>``, ``ranked_<key>``) and can be queried with plain SQL.
+
+The process keeps one DuckDB connection per file. Writes run one at a time
+under a lock; reads use their own cursor and see the last committed state
+without waiting for a write in progress.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import duckdb
+import pandas as pd
+
+from engine import EngineConfig
+
+RESULT_FRAMES = ("full_data", "filtered_data", "ranked_data")
+
+_lock = threading.Lock()
+_open_lock = threading.Lock()
+_connections: Dict[Path, duckdb.DuckDBPyConnection] = {}
+# Versione di ogni archivio, incrementata a ogni scrittura: invalida l'elenco
+_versions: Dict[Path, int] = {}
+_listings: Dict[Path, Tuple[int, pd.DataFrame]] = {}
+
+
+def analysis_key(
+    fingerprints_base: Iterable[str],
+    fingerprints_comp: Iterable[str],
+    config: EngineConfig,
+    history: Optional[str] = None,
+) -> str:
+    """Return the key of an analysis from its input fingerprints and parameters.
+
+    ``history`` identifies the snapshot store and its version (see
+    :meth:`snapshots.SnapshotStore.version`) when the run is enriched with
+    it, since new snapshots change the results of the same uploads.
+    """
+    payload = json.dumps(
+        {
+            "base": list(fingerprints_base),
+            "comp": list(fingerprints_comp),
+            "config": config.to_dict(),
+            "history": history,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _table(frame: str, key: str) -> str:
+    return f'"{frame.split("_")[0]}_{key}"'
+
+
+def _restore(df: pd.DataFrame) -> pd.DataFrame:
+    # Le colonne testuali tutte vuote tornano da DuckDB come object con None
+    empty = [
+        c for c in df.columns if df[c].dtype == object and df[c].isna().all()
+    ]
+    if not empty:
+        return df
+    # Restano NaN come nei frame originali, non il testo "None"
+    return df.assign(**{c: df[c].astype("str").where(df[c].notna()) for c in empty})
+
+
+class ResultsDB:
+    """Completed analyses saved in the DuckDB file at ``path``."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+
+    def _shared(self) -> duckdb.DuckDBPyConnection:
+        path = self.path.resolve()
+        with _open_lock:
+            con = _connections.get(path)
+            if con is None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                con = duckdb.connect(str(path))
+                con.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS analyses (
+                        key VARCHAR PRIMARY KEY,
+                        created_at TIMESTAMP,
+                        label VARCHAR,
+                        files VARCHAR,
+                        config VARCHAR,
+                        rows_full BIGINT,
+                        rows_filtered BIGINT,
+                        elapsed_s DOUBLE
+                    )
+                    """
+                )
+                _connections[path] = con
+            return con
+
+    @contextmanager
+    def connect(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        """Yield a cursor for writing; writes run one at a time."""
+        with _lock:
+            con = self._shared().cursor()
+            try:
+                yield con
+            finally:
+                con.close()
+                path = self.path.resolve()
+                _versions[path] = _versions.get(path, 0) + 1
+
+    @contextmanager
+    def reader(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        """Yield a cursor for reading, without waiting for running writes."""
+        con = self._shared().cursor()
+        try:
+            yield con
+        finally:
+            con.close()
+
+    def save(
+        self,
+        key: str,
+        results: Dict[str, Any],
+        files: Optional[Dict[str, List[str]]] = None,
+        label: str = "",
+        elapsed_s: float = 0.0,
+    ) -> None:
+        """Store ``results`` under ``key``, replacing a previous copy."""
+        config: EngineConfig = results["config"]
+        with self.connect() as con:
+            con.execute("BEGIN TRANSACTION")
+            for frame in RESULT_FRAMES:
+                # Indice non significativo: le tabelle salvano solo le colonne
+                con.register("frame", results[frame].reset_index(drop=True))
+                con.execute(
+                    f"CREATE OR REPLACE TABLE {_table(frame, key)} AS SELECT * FROM frame"
+                )
+                con.unregister("frame")
+            con.execute(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    key,
+                    datetime.now(),
+                    label,
+                    json.dumps(files or {}, ensure_ascii=False),
+                    json.dumps(config.to_dict(), ensure_ascii=False),
+                    len(results["full_data"]),
+                    len(results["filtered_data"]),
+                    elapsed_s,
+                ],
+            )
+            con.execute("COMMIT")
+
+    def analyses(self) -> pd.DataFrame:
+        """Return the metadata of the stored analyses, newest first.
+
+        The listing is cached until the next save or delete.
+        """
+        path = self.path.resolve()
+        version = _versions.get(path, 0)
+        cached = _listings.get(path)
+        if cached is None or cached[0] != version:
+            with self.reader() as con:
+                listing = con.execute(
+                    "SELECT * FROM analyses ORDER BY created_at DESC"
+                ).df()
+            cached = _listings[path] = (version, listing)
+        return cached[1].copy()
+
+    def exists(self, key: str) -> bool:
+        with self.reader() as con:
+            found = con.execute("SELECT 1 FROM analyses WHERE key = ?", [key])
+            return found.fetchone() is not None
+
+    def load(self, key: str) -> Dict[str, Any]:
+        """Return the results stored under ``key`` like a fresh analysis."""
+        with self.reader() as con:
+            meta = con.execute(
+                "SELECT config FROM analyses WHERE key = ?", [key]
+            ).fetchone()
+            if meta is None:
+                raise KeyError(key)
+            results: Dict[str, Any] = {
+                frame: _restore(con.execute(f"SELECT * FROM {_table(frame, key)}").df())
+                for frame in RESULT_FRAMES
+            }
+        results["config"] = EngineConfig.from_dict(json.loads(meta[0]))
+        results["warnings"] = []
+        results["key"] = key
+        return results
+
+    def query(self, sql: str, params: Optional[list] = None) -> pd.DataFrame:
+        """Run a read query, e.g. ``SELECT * FROM filtered_<key> WHERE ...``."""
+        with self.reader() as con:
+            return con.execute(sql, params or []).df()
+
+    def delete(self, key: str) -> None:
+        with self.connect() as con:
+            for frame in RESULT_FRAMES:
+                con.execute(f"DROP TABLE IF EXISTS {_table(frame, key)}")
+            con.execute("DELETE FROM analyses WHERE key = ?", [key])
@@ -4,11 +4,12 @@ from __future__ import annotations
 
 import math
 import re
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, Optional, Tuple
 
+import numpy as np
 import pandas as pd
-import streamlit as st
 
+from diagnostics import profiled
 from settings import SHIPPING_TABLE as SHIPPING_COSTS, VAT_RATES
 
 
@@ -54,6 +55,37 @@ def calc_final_purchase_price(row: Dict[str, Any], discount: float) -> float:
     return max(final_price, 0)
 
 
+def shipping_costs(weights_kg: Any) -> np.ndarray:
+    """Batched :func:`calculate_shipping_cost` of an array of weights."""
+    weights = np.asarray(weights_kg, dtype=float)
+    limits = np.array(sorted(SHIPPING_COSTS))
+    costs = np.array([SHIPPING_COSTS[k] for k in limits] + [SHIPPING_COSTS[100]])
+    cost = costs[np.searchsorted(limits, weights, side="left")]
+    return np.where(np.isnan(weights) | (weights <= 0), 0.0, cost)
+
+
+def final_purchase_prices(gross: Any, locales: Any, discount: float) -> np.ndarray:
+    """Batched :func:`calc_final_purchase_price`.
+
+    ``locales`` holds the raw ``Locale (base)`` values and is broadcast
+    against ``gross``.
+    """
+    gross = np.asarray(gross, dtype=float)
+    locales = np.asarray(locales, dtype=object)
+    # normalize_locale una volta per valore distinto
+    codes, uniques = pd.factorize(locales.ravel(), use_na_sentinel=False)
+    normalized = [normalize_locale(u) for u in uniques]
+    vat = np.array([VAT_RATES.get(c, 0) for c in normalized], dtype=float) / 100.0
+    is_it = np.array([c == "IT" for c in normalized], dtype=bool)
+    vat = vat[codes].reshape(locales.shape)
+    is_it = is_it[codes].reshape(locales.shape)
+    net = gross / (1 + vat)
+    with np.errstate(invalid="ignore"):
+        final = np.where(is_it, net - gross * discount, net * (1 - discount))
+    # np.maximum propaga i NaN come max(nan, 0)
+    return np.maximum(final, 0)
+
+
 def format_trend(trend: Any) -> str:
     """Return a textual representation for a trend value."""
     if trend is None or (isinstance(trend, float) and math.isnan(trend)):
@@ -76,50 +108,137 @@ def classify_opportunity(score: float):
     return "Bassa", "danger-tag"
 
 
-def _minmax(series: pd.Series) -> pd.Series:
-    min_val = series.min()
-    max_val = series.max()
+def classify_opportunities(scores: pd.Series) -> pd.DataFrame:
+    """Vectorized :func:`classify_opportunity` returning class and tag columns."""
+    values = scores.to_numpy(dtype=float)
+    conditions = [values > 100, values > 50, values > 20]
+    return pd.DataFrame(
+        {
+            "Opportunity_Class": np.select(
+                conditions, ["Eccellente", "Buona", "Discreta"], "Bassa"
+            ),
+            "Opportunity_Tag": np.select(
+                conditions, ["success-tag", "success-tag", "warning-tag"], "danger-tag"
+            ),
+        },
+        index=scores.index,
+    )
+
+
+Bounds = Tuple[float, float]
+
+
+def _minmax(series: pd.Series, bounds: Optional[Bounds] = None) -> pd.Series:
+    min_val, max_val = bounds if bounds is not None else (series.min(), series.max())
     if pd.isna(min_val) or pd.isna(max_val) or max_val == min_val:
         return pd.Series(0.0, index=series.index)
     return (series - min_val) / (max_val - min_val)
 
 
-def margin_score(df: pd.DataFrame) -> pd.Series:
-    return _minmax(df["Margine_Netto_%"].fillna(0))
+def _fill_max(series: pd.Series, bounds: Optional[Bounds]) -> pd.Series:
+    return series.fillna(bounds[1] if bounds is not None else series.max())
+
+
+def margin_score(df: pd.DataFrame, bounds: Optional[Bounds] = None) -> pd.Series:
+    return _minmax(df["Margine_Netto_%"].fillna(0), bounds)
+
+
+def demand_score(df: pd.DataFrame, bounds: Optional[Bounds] = None) -> pd.Series:
+    return 1 - _minmax(_fill_max(df["SalesRank_Comp"], bounds), bounds)
+
 
+def competition_score(df: pd.DataFrame, bounds: Optional[Bounds] = None) -> pd.Series:
+    return 1 - _minmax(_fill_max(df["NewOffer_Comp"], bounds), bounds)
 
-def demand_score(df: pd.DataFrame) -> pd.Series:
-    return 1 - _minmax(df["SalesRank_Comp"].fillna(df["SalesRank_Comp"].max()))
 
+def volatility_score(df: pd.DataFrame, bounds: Optional[Bounds] = None) -> pd.Series:
+    return _minmax(df["Trend_Bonus"].fillna(0), bounds)
 
-def competition_score(df: pd.DataFrame) -> pd.Series:
-    return 1 - _minmax(df["NewOffer_Comp"].fillna(df["NewOffer_Comp"].max()))
 
+def risk_score(df: pd.DataFrame, bounds: Optional[Bounds] = None) -> pd.Series:
+    return _minmax(df["ROI_Factor"].fillna(0), bounds)
 
-def volatility_score(df: pd.DataFrame) -> pd.Series:
-    return _minmax(df["Trend_Bonus"].fillna(0))
 
+SUBSCORES = {
+    "margin": (margin_score, "Margine_Netto_%", 0.0),
+    "demand": (demand_score, "SalesRank_Comp", None),
+    "competition": (competition_score, "NewOffer_Comp", None),
+    "volatility": (volatility_score, "Trend_Bonus", 0.0),
+    "risk": (risk_score, "ROI_Factor", 0.0),
+}
 
-def risk_score(df: pd.DataFrame) -> pd.Series:
-    return _minmax(df["ROI_Factor"].fillna(0))
 
+def score_bounds(df: pd.DataFrame) -> Dict[str, Bounds]:
+    """Return the min/max used by each sub-score to normalize ``df``.
 
-@st.cache_data(show_spinner=False)
-def compute_scores(df: pd.DataFrame, weights: Dict[str, float]) -> pd.DataFrame:
-    """Return ``df`` with a normalized opportunity score."""
-    df = df.copy()
-    subs = {
-        "margin": margin_score(df),
-        "demand": demand_score(df),
-        "competition": competition_score(df),
-        "volatility": volatility_score(df),
-        "risk": risk_score(df),
-    }
-    score = sum(weights.get(k, 1.0) * subs[k] for k in subs)
-    df["final_score"] = _minmax(score) * 100
-    return df
+    This is the first phase of a two-phase normalization: bounds computed on
+    parts of a dataset can be combined with :func:`merge_score_bounds` and
+    passed to :func:`final_scores`, giving exactly the scores a single pass
+    over the whole dataset would produce.
+    """
+    bounds = {}
+    for name, (_, column, fill) in SUBSCORES.items():
+        series = df[column]
+        if fill is not None and series.isna().any():
+            series = series.fillna(fill)
+        bounds[name] = (series.min(), series.max())
+    return bounds
 
 
+def merge_score_bounds(parts: Iterable[Dict[str, Bounds]]) -> Dict[str, Bounds]:
+    """Combine per-part :func:`score_bounds` into the bounds of the whole."""
+    merged: Dict[str, Bounds] = {}
+    for part in parts:
+        for name, (lo, hi) in part.items():
+            if name not in merged:
+                merged[name] = (lo, hi)
+                continue
+            cur_lo, cur_hi = merged[name]
+            merged[name] = (
+                lo if pd.isna(cur_lo) else cur_lo if pd.isna(lo) else min(cur_lo, lo),
+                hi if pd.isna(cur_hi) else cur_hi if pd.isna(hi) else max(cur_hi, hi),
+            )
+    return merged
+
+
+def opportunity_raw(
+    df: pd.DataFrame,
+    weights: Dict[str, float],
+    bounds: Optional[Dict[str, Bounds]] = None,
+) -> pd.Series:
+    """Return the weighted sum of the sub-scores, before the final scaling."""
+    bounds = bounds or {}
+    return sum(
+        weights.get(name, 1.0) * func(df, bounds.get(name))
+        for name, (func, _, _) in SUBSCORES.items()
+    )
+
+
+def final_scores(
+    df: pd.DataFrame,
+    weights: Dict[str, float],
+    bounds: Optional[Dict[str, Bounds]] = None,
+) -> pd.Series:
+    """Return the normalized opportunity score of every row of ``df``.
+
+    ``bounds`` are the sub-score bounds of the whole dataset when ``df`` is only
+    part of it; by default they are computed from ``df`` itself.
+    """
+    return _minmax(opportunity_raw(df, weights, bounds)) * 100
+
+
+@profiled
+def compute_scores(
+    df: pd.DataFrame,
+    weights: Dict[str, float],
+    bounds: Optional[Dict[str, Bounds]] = None,
+) -> pd.DataFrame:
+    """Return ``df`` with a normalized opportunity score, see :func:`final_scores`."""
+    # Copy-on-write: le colonne esistenti non vengono copiate
+    return df.assign(final_score=final_scores(df, weights, bounds))
+
+
+@profiled
 def aggregate_opportunities(df: pd.DataFrame) -> pd.DataFrame:
     """Return one row per ASIN with the best market and score."""
     if df is None or df.empty or "ASIN" not in df.columns:
@@ -129,12 +248,11 @@ def aggregate_opportunities(df: pd.DataFrame) -> pd.DataFrame:
         return pd.DataFrame(columns=["ASIN", "Best_Market", "Opportunity_Score"])
 
     idx = df.groupby("ASIN") ["Opportunity_Score"].idxmax()
-    best = df.loc[idx].copy()
-    best = best.rename(columns={"Locale (comp)": "Best_Market"})
-
     cols = ["ASIN"]
-    if "Title (base)" in best.columns:
+    if "Title (base)" in df.columns:
         cols.append("Title (base)")
-    cols += ["Best_Market", "Opportunity_Score"]
+    cols += ["Locale (comp)", "Opportunity_Score"]
+    # Solo le colonne della classifica: niente copia delle altre
+    best = df.loc[idx, cols].rename(columns={"Locale (comp)": "Best_Market"})
 
-    return best[cols].sort_values("Opportunity_Score", ascending=False).reset_index(drop=True)
+    return best.sort_values("Opportunity_Score", ascending=False).reset_index(drop=True)
@@ -0,0 +1,266 @@
+"""In-memory search index for ASIN and title lookups."""
+
+from __future__ import annotations
+
+import re
+import sys
+import unicodedata
+from typing import Any, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+NGRAM = 3
+
+# Ogni testo è codificato come START, caratteri, END, END: nessun trigramma
+# attraversa due testi e ogni prefisso di 1-2 caratteri ha i suoi trigrammi
+START = 1
+END = 0
+
+# Righe codificate per blocco durante la costruzione, per limitare la memoria
+BUILD_CHUNK = 65_536
+
+# Spazi e caratteri di controllo, scritti per esteso: RE2 (Arrow) e ``re``
+# danno a ``\s`` significati diversi
+_SPACES = "[\x00-\x20\x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+"
+_SPACES_RE = re.compile(_SPACES)
+
+
+def normalize_array(values: Iterable[Any]) -> pa.Array:
+    """Normalize many texts at once, like :func:`normalize_text`."""
+    arr = values if isinstance(values, pa.Array) else pa.array(
+        [v if isinstance(v, str) else "" for v in values], type=pa.string()
+    )
+    arr = pc.utf8_normalize(pc.utf8_lower(arr.fill_null("")), "NFKD")
+    arr = pc.replace_substring_regex(arr, r"\p{Mn}+", "")
+    arr = pc.replace_substring_regex(arr, _SPACES, " ")
+    return pc.utf8_trim(arr, " ")
+
+
+def normalize_text(text: Any) -> str:
+    """Return ``text`` lowercased, without accents and with collapsed spaces."""
+    if not isinstance(text, str):
+        return ""
+    # Stesse regole di normalize_array, senza il costo di una chiamata Arrow
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    stripped = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return _SPACES_RE.sub(" ", stripped).strip(" ")
+
+
+def _codes(asins: pa.Array, titles: pa.Array) -> Tuple[np.ndarray, np.ndarray]:
+    # Code point di tutte le righe in un unico array:
+    # START asin END END START titolo END END
+    lengths = pc.add(pc.utf8_length(asins), pc.utf8_length(titles))
+    lengths = lengths.to_numpy(zero_copy_only=False).astype(np.int64)
+    start, end = chr(START), chr(END) * 2
+    wrapped = pc.binary_join_element_wise(start, asins, end + start, titles, end, "")
+    # I testi di un array Arrow sono contigui nel buffer dei dati
+    offsets = np.frombuffer(wrapped.buffers()[1], dtype=np.int32)
+    offsets = offsets[wrapped.offset : wrapped.offset + len(wrapped) + 1]
+    data = wrapped.buffers()[2].to_pybytes()[offsets[0] : offsets[-1]]
+    codes = np.frombuffer(data.decode("utf-8").encode("utf-32-le"), dtype=np.uint32)
+    return codes, lengths + 6
+
+
+def _gram_keys(ids: np.ndarray, bits: int) -> np.ndarray:
+    c = ids.astype(np.uint64)
+    return (c[:-2] << np.uint64(2 * bits)) | (c[1:-1] << np.uint64(bits)) | c[2:]
+
+
+class SearchIndex:
+    """Search index over the ``ASIN`` and ``Title (base)`` columns of a frame.
+
+    The index is built once per result set. Texts are normalized with
+    :func:`normalize_text`, so matching ignores case, accents and repeated
+    spaces, and the query is a plain substring (not a regular expression).
+    Postings of every trigram are kept in flat NumPy arrays: queries of up to
+    three characters are answered from the postings alone, longer queries
+    verify the rows shared by all their trigrams.
+    """
+
+    def __init__(self, asins: Iterable[Any], titles: Iterable[Any], labels=None):
+        self._asins = normalize_array(asins)
+        self._titles = normalize_array(titles)
+        n = len(self._asins)
+        if len(self._titles) != n:
+            raise ValueError("asins and titles must have the same length")
+        self.labels = pd.Index(range(n) if labels is None else labels)
+        self._by_asin = pd.Index(self._asins.to_numpy(zero_copy_only=False))
+
+        chunks = [
+            _codes(self._asins.slice(lo, BUILD_CHUNK), self._titles.slice(lo, BUILD_CHUNK))
+            for lo in range(0, n, BUILD_CHUNK)
+        ]
+        # Alfabeto dei caratteri presenti: chiavi di trigramma molto più corte
+        # dei code point, che lasciano posto alla riga nello stesso uint64
+        seen = np.zeros(sys.maxunicode + 1, dtype=bool)
+        seen[[END, START]] = True
+        for codes, _ in chunks:
+            seen[codes] = True
+        self._alphabet = np.flatnonzero(seen).astype(np.uint32)
+        self._bits = max(1, (len(self._alphabet) - 1).bit_length())
+        keys, rows = self._pairs(chunks, n)
+        self._rows = rows
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else []
+        self._keys = keys[starts]
+        self._starts = np.append(starts, len(keys)).astype(np.int64)
+
+    def _pairs(self, chunks, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Coppie (trigramma, riga) distinte, ordinate per trigramma e riga
+        row_bits = max(1, (n - 1).bit_length())
+        packed = 3 * self._bits + row_bits <= 64
+        table = np.zeros(sys.maxunicode + 1, dtype=np.uint32)
+        table[self._alphabet] = np.arange(len(self._alphabet), dtype=np.uint32)
+        keys, rows = [np.empty(0, dtype=np.uint64)], [np.empty(0, dtype=np.int32)]
+        for i, (codes, spans) in enumerate(chunks):
+            lo = i * BUILD_CHUNK
+            owner = np.repeat(np.arange(lo, lo + len(spans), dtype=np.int32), spans)
+            # Nessun trigramma parte da un END
+            keep = codes[:-2] != END
+            gram = _gram_keys(table[codes], self._bits)[keep]
+            owner = owner[:-2][keep]
+            if packed:
+                gram = (gram << np.uint64(row_bits)) | owner.astype(np.uint64)
+            keys.append(gram)
+            rows.append(owner)
+        if packed:
+            # Trigramma e riga in un solo intero: basta ordinare i valori
+            pairs = np.concatenate(keys)
+            del keys, rows
+            pairs.sort()
+            pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]] if len(pairs) else pairs
+            rows = (pairs & np.uint64((1 << row_bits) - 1)).astype(np.int32)
+            return pairs >> np.uint64(row_bits), rows
+        # Alfabeti molto ampi: ordinamento per chiave e riga separate
+        keys, rows = np.concatenate(keys), np.concatenate(rows)
+        order = np.lexsort((rows, keys))
+        keys, rows = keys[order], rows[order]
+        fresh = np.r_[True, (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])]
+        return keys[fresh], rows[fresh]
+
+    def _ids(self, text: str) -> np.ndarray | None:
+        # Posizioni nell'alfabeto dei caratteri di ``text``; None se uno manca
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        ids = np.searchsorted(self._alphabet, codes)
+        if (ids >= len(self._alphabet)).any() or (self._alphabet[ids] != codes).any():
+            return None
+        return ids
+
+    def _query_keys(self, text: str) -> np.ndarray:
+        ids = self._ids(text)
+        if ids is None or len(ids) < NGRAM:
+            return np.empty(0, dtype=np.uint64)
+        return np.unique(_gram_keys(ids, self._bits))
+
+    @classmethod
+    def from_frame(
+        cls, df: pd.DataFrame, asin_col: str = "ASIN", title_col: str = "Title (base)"
+    ) -> "SearchIndex":
+        """Build an index from ``df`` keeping its index labels."""
+        empty = pd.Series("", index=df.index)
+        return cls(
+            df.get(asin_col, empty).tolist(),
+            df.get(title_col, empty).tolist(),
+            labels=df.index,
+        )
+
+    def __len__(self) -> int:
+        return len(self._asins)
+
+    def lookup_asin(self, asin: str) -> pd.Index:
+        """Return the labels of rows whose ASIN equals ``asin``."""
+        positions = self._by_asin.get_indexer_non_unique([normalize_text(asin)])[0]
+        return self.labels[np.sort(positions[positions >= 0])]
+
+    def _postings(self, key: np.uint64) -> np.ndarray:
+        i = np.searchsorted(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return np.empty(0, dtype=np.int32)
+        return self._rows[self._starts[i] : self._starts[i + 1]]
+
+    def _short(self, ids: np.ndarray) -> np.ndarray:
+        # Query di 1-2 caratteri: unione dei trigrammi che iniziano così
+        shift = self._bits * (NGRAM - len(ids))
+        base = np.uint64(0)
+        for i in ids:
+            base = (base << np.uint64(self._bits)) | np.uint64(i)
+        lo = base << np.uint64(shift)
+        hi = (base + np.uint64(1)) << np.uint64(shift)
+        i, j = np.searchsorted(self._keys, [lo, hi])
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self._rows[self._starts[i] : self._starts[j]]] = True
+        return np.flatnonzero(mask)
+
+    def _candidates(self, text: str) -> np.ndarray:
+        lists = sorted((self._postings(k) for k in self._query_keys(text)), key=len)
+        result = lists[0]
+        for rows in lists[1:]:
+            if not len(result):
+                break
+            # Liste ordinate: ricerca binaria delle righe superstiti
+            at = np.minimum(np.searchsorted(rows, result), max(len(rows) - 1, 0))
+            result = result[rows[at] == result] if len(rows) else rows
+        return result
+
+    def _find(self, text: str, prefix: bool) -> np.ndarray:
+        ids = self._ids(text)
+        if ids is None:
+            return np.empty(0, dtype=np.int64)
+        if len(ids) < NGRAM:
+            return self._short(ids)
+        rows = self._candidates(text)
+        if len(ids) == NGRAM or not len(rows):
+            return rows
+        # Trigrammi comuni ma non in sequenza: verifica delle candidate
+        take = pa.array(rows)
+        if prefix:
+            found = pc.or_(
+                pc.starts_with(self._asins.take(take), text[1:]),
+                pc.starts_with(self._titles.take(take), text[1:]),
+            )
+        else:
+            found = pc.or_(
+                pc.match_substring(self._asins.take(take), text),
+                pc.match_substring(self._titles.take(take), text),
+            )
+        return rows[found.to_numpy(zero_copy_only=False)]
+
+    def search(self, query: str) -> pd.Index:
+        """Return the labels of rows whose ASIN or title contains ``query``."""
+        q = normalize_text(query)
+        if not q:
+            return self.labels
+        return self.labels[self._find(q, prefix=False)]
+
+    def prefix(self, query: str, limit: int | None = None) -> pd.Index:
+        """Return rows whose ASIN or title starts with ``query``.
+
+        With ``limit`` only the first matching rows, in frame order, are kept.
+        """
+        q = normalize_text(query)
+        if not q:
+            rows = np.arange(len(self))
+        else:
+            rows = self._find(chr(START) + q, prefix=True)
+        return self.labels[rows[:limit]]
+
+    def fuzzy(
+        self, query: str, limit: int = 20, min_similarity: float = 0.3
+    ) -> pd.Index:
+        """Return up to ``limit`` rows ranked by trigram similarity with ``query``.
+
+        Similarity is the share of the query trigrams found in the row, so
+        typos and reordered words still produce matches.
+        """
+        keys = self._query_keys(normalize_text(query))
+        if not len(keys):
+            return self.labels[:0]
+        counts = np.zeros(len(self), dtype=np.int32)
+        for key in keys:
+            counts[self._postings(key)] += 1
+        similarity = counts / len(keys)
+        order = np.argsort(-similarity, kind="stable")[:limit]
+        order = order[similarity[order] >= min_similarity]
+        return self.labels[order]
@@ -0,0 +1,405 @@
+"""Local HTTP scoring service keeping parsed datasets warm in memory.
+
+Start it next to the dashboard with::
+
+    python server.py --port 8765 --workers 8 \
+        --dataset mattina --base origine.xlsx --comp de.csv fr.csv
+
+All endpoints take and return JSON. ``config`` objects use the flat keys of
+:meth:`engine.EngineConfig.from_dict` (the same keys as the saved recipes).
+
+``GET  /health``            liveness check
+``GET  /datasets``          loaded datasets and their size
+``GET  /stats``             request count and latency percentiles per endpoint
+``POST /datasets``          ``{"name", "base": [paths], "comp": [paths]}``
+``POST /score``             ``{"dataset", "config", "limit"}`` scored rows
+``POST /top``               ``{"dataset", "config", "k"}`` best market per ASIN
+``POST /asin``              ``{"dataset", "asins": [...], "config"}`` row lookup
+``POST /deals``             ``{"dataset", "config", "weights", "filters", "limit"}``
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from deals import (
+    DealFilters,
+    DealWeights,
+    compute_historic_deals,
+    score_deals,
+    select_deals,
+)
+from engine import (
+    AnalysisError,
+    EngineConfig,
+    load_frames,
+    prepare_frames,
+    score_prepared,
+)
+
+logger = logging.getLogger("scoring-server")
+
+RESULT_CACHE_SIZE = 32
+
+# Richieste in attesa oltre ai worker: le successive ricevono 503
+MAX_QUEUED_REQUESTS = 64
+
+_versions = itertools.count()
+
+
+class DatasetNotFound(KeyError):
+    """Raised when a request names a dataset that is not loaded."""
+
+
+class ScoringDataset:
+    """Base and comparison exports loaded once, with their parsed merges."""
+
+    def __init__(self, name: str, df_base: pd.DataFrame, df_comp: pd.DataFrame):
+        self.name = name
+        self.df_base = df_base
+        self.df_comp = df_comp
+        self.loaded_at = time.time()
+        self.version = next(_versions)
+        self._parsed: Dict[Tuple[str, str], pd.DataFrame] = {}
+        self._lock = threading.Lock()
+
+    def parsed(self, config: EngineConfig) -> pd.DataFrame:
+        """Return the merged and parsed frame for the config's price columns."""
+        key = (config.ref_price_base, config.ref_price_comp)
+        with self._lock:
+            if key not in self._parsed:
+                self._parsed[key] = prepare_frames(
+                    self.df_base.copy(), self.df_comp.copy(), config
+                )
+            return self._parsed[key]
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "base_rows": len(self.df_base),
+            "comp_rows": len(self.df_comp),
+            "loaded_at": self.loaded_at,
+        }
+
+
+class ScoringService:
+    """Datasets and a small LRU of scored results shared by all requests."""
+
+    def __init__(self, cache_size: int = RESULT_CACHE_SIZE):
+        self.datasets: Dict[str, ScoringDataset] = {}
+        self._results: OrderedDict = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def load(
+        self, name: str, base_paths: List[str], comp_paths: List[str]
+    ) -> ScoringDataset:
+        """Load the exports at the given paths under ``name``."""
+        with ExitStack() as stack:
+            df_base, _ = load_frames(
+                [stack.enter_context(open(p, "rb")) for p in base_paths], "base"
+            )
+            df_comp, _ = load_frames(
+                [stack.enter_context(open(p, "rb")) for p in comp_paths],
+                "di confronto",
+            )
+        if df_base.empty or df_comp.empty:
+            raise AnalysisError("Nessun file valido caricato.")
+        return self.add(name, df_base, df_comp)
+
+    def add(
+        self, name: str, df_base: pd.DataFrame, df_comp: pd.DataFrame
+    ) -> ScoringDataset:
+        """Register loaded frames under ``name``, replacing any previous one."""
+        dataset = ScoringDataset(name, df_base, df_comp)
+        with self._lock:
+            self.datasets[name] = dataset
+        return dataset
+
+    def dataset(self, name: Optional[str]) -> ScoringDataset:
+        with self._lock:
+            if name is None and len(self.datasets) == 1:
+                return next(iter(self.datasets.values()))
+            if name not in self.datasets:
+                raise DatasetNotFound(f"dataset non trovato: {name}")
+            return self.datasets[name]
+
+    def results(self, name: Optional[str], config: EngineConfig) -> Dict[str, Any]:
+        """Return the scored results of a dataset, computing them at most once."""
+        dataset = self.dataset(name)
+        key = (dataset.version, config)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+        results = score_prepared(dataset.parsed(config), config)
+        with self._lock:
+            results = self._results.setdefault(key, results)
+            while len(self._results) > self._cache_size:
+                self._results.popitem(last=False)
+        return results
+
+    def deals(self, name: Optional[str], config: EngineConfig) -> pd.DataFrame:
+        """Return the historic deals of a dataset, kept next to its results."""
+        results = self.results(name, config)
+        deals_df = results.get("deals_data")
+        if deals_df is None:
+            # Calcolate una volta per risultato: restano nella stessa voce LRU
+            deals_df = compute_historic_deals(results["full_data"])
+            with self._lock:
+                deals_df = results.setdefault("deals_data", deals_df)
+        return deals_df
+
+    def warm(self, name: str, config: Optional[EngineConfig] = None) -> None:
+        """Compute the results and deals of ``name`` before the first request."""
+        self.deals(name, config or EngineConfig())
+
+
+def frame_records(df: pd.DataFrame, limit: Optional[int] = None) -> List[Dict]:
+    """Return ``df`` as JSON-ready records, NaN and infinities as ``null``."""
+    if limit is not None:
+        df = df.head(limit)
+    df = df.replace([np.inf, -np.inf], np.nan)
+    return json.loads(df.to_json(orient="records"))
+
+
+class LatencyStats:
+    """Thread-safe per-endpoint request latencies."""
+
+    def __init__(self, keep: int = 1000):
+        self._keep = keep
+        self._samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, millis: float) -> None:
+        with self._lock:
+            samples = self._samples[endpoint]
+            samples.append(millis)
+            del samples[: -self._keep]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                endpoint: {
+                    "count": len(samples),
+                    "p50_ms": float(np.percentile(samples, 50)),
+                    "p95_ms": float(np.percentile(samples, 95)),
+                }
+                for endpoint, samples in self._samples.items()
+            }
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    server: "ScoringServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status: int, payload: Dict[str, Any], started: float) -> None:
+        elapsed = (time.perf_counter() - started) * 1000
+        payload["elapsed_ms"] = round(elapsed, 3)
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Response-Time-ms", f"{elapsed:.3f}")
+        self.end_headers()
+        self.wfile.write(body)
+        endpoint = f"{self.command} {self.path.split('?')[0]}"
+        self.server.stats.record(endpoint, elapsed)
+
+    def _dispatch(self, routes: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        route = routes.get(self.path.split("?")[0])
+        if route is None:
+            self._send(404, {"error": "endpoint non trovato"}, started)
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+            self._send(200, route(body), started)
+        except DatasetNotFound as exc:
+            self._send(404, {"error": str(exc.args[0])}, started)
+        except KeyError as exc:
+            self._send(400, {"error": f"campo mancante: {exc.args[0]}"}, started)
+        except (AnalysisError, ValueError, TypeError, OSError) as exc:
+            self._send(400, {"error": str(exc)}, started)
+        except Exception as exc:  # keep serving other clients
+            logger.exception("errore non gestito")
+            self._send(500, {"error": str(exc)}, started)
+
+    def do_GET(self) -> None:
+        service = self.server.service
+        self._dispatch(
+            {
+                "/health": lambda body: {"status": "ok"},
+                "/datasets": lambda body: {
+                    "datasets": [d.describe() for d in service.datasets.values()]
+                },
+                "/stats": lambda body: {"endpoints": self.server.stats.summary()},
+            }
+        )
+
+    def do_POST(self) -> None:
+        self._dispatch(
+            {
+                "/datasets": self.post_datasets,
+                "/score": self.post_score,
+                "/top": self.post_top,
+                "/asin": self.post_asin,
+                "/deals": self.post_deals,
+            }
+        )
+
+    def _results(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        config = EngineConfig.from_dict(body.get("config") or {})
+        return self.server.service.results(body.get("dataset"), config)
+
+    def post_datasets(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        dataset = self.server.service.load(body["name"], body["base"], body["comp"])
+        return dataset.describe()
+
+    def post_score(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        df = self._results(body)["filtered_data"]
+        return {"count": len(df), "rows": frame_records(df, body.get("limit"))}
+
+    def post_top(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        df = self._results(body)["ranked_data"]
+        return {"rows": frame_records(df, int(body.get("k", 10)))}
+
+    def post_asin(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        asins = [str(a).strip().upper() for a in body["asins"]]
+        df = self._results(body)["filtered_data"]
+        return {"rows": frame_records(df[df["ASIN"].isin(asins)])}
+
+    def post_deals(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        config = EngineConfig.from_dict(body.get("config") or {})
+        deals_df = self.server.service.deals(body.get("dataset"), config)
+        if deals_df.empty:
+            return {"count": 0, "rows": []}
+        deals_f = select_deals(deals_df, DealFilters(**(body.get("filters") or {})))
+        if not deals_f.empty:
+            deals_f = score_deals(deals_f, DealWeights(**(body.get("weights") or {})))
+            deals_f = deals_f.sort_values("DealScore", ascending=False)
+        rows = frame_records(deals_f, body.get("limit"))
+        return {"count": len(deals_f), "rows": rows}
+
+
+class OverloadHandler(ScoringHandler):
+    """Answers 503 to a request that finds the worker queue full."""
+
+    def _reject(self) -> None:
+        started = time.perf_counter()
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self._send(503, {"error": "server sovraccarico, riprova"}, started)
+
+    do_GET = do_POST = _reject
+
+
+class ScoringServer(HTTPServer):
+    """HTTP server handling requests on a bounded pool of worker threads.
+
+    At most ``max_queued`` requests wait for a free worker; further ones are
+    answered at once with 503, so an overload cannot grow memory and latency
+    without bound.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        service: ScoringService,
+        workers: int = 4,
+        max_queued: int = MAX_QUEUED_REQUESTS,
+    ):
+        super().__init__(address, ScoringHandler)
+        self.service = service
+        self.stats = LatencyStats()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+
+    def process_request(self, request, client_address) -> None:
+        if not self._slots.acquire(blocking=False):
+            self._reject(request, client_address)
+            return
+        try:
+            self._pool.submit(self._process, request, client_address)
+        except RuntimeError:  # pool chiuso durante lo spegnimento
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _reject(self, request, client_address) -> None:
+        # Nel thread di accettazione: un client lento non deve bloccarlo
+        request.settimeout(1.0)
+        try:
+            OverloadHandler(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def _process(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Servizio HTTP di scoring locale.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--max-queued",
+        type=int,
+        default=MAX_QUEUED_REQUESTS,
+        help="Richieste in attesa oltre le quali si risponde 503",
+    )
+    parser.add_argument("--dataset", help="Nome del dataset da precaricare")
+    parser.add_argument("--base", nargs="+", default=[])
+    parser.add_argument("--comp", nargs="+", default=[])
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    service = ScoringService()
+    if args.dataset:
+        service.load(args.dataset, args.base, args.comp)
+        service.warm(args.dataset)
+    server = ScoringServer(
+        (args.host, args.port), service, args.workers, args.max_queued
+    )
+    logger.info("in ascolto su http://%s:%d", args.host, server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
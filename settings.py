@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+import os
+
 VAT_RATES = {
     "IT": 22,
     "DE": 19,
@@ -30,3 +32,49 @@ SLIDER_DEFAULTS = {
     "theta": 1.5,
     "min_margin_multiplier": 1.2,
 }
+
+# Worker processes for the per-row pipeline stages (1 = single process)
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "1"))
+
+# Memory budget of the out-of-core pipeline (MB); files above the upload
+# threshold are spilled to disk and processed in chunks
+OUT_OF_CORE_MEMORY_MB = int(os.environ.get("OUT_OF_CORE_MEMORY_MB", "2048"))
+OUT_OF_CORE_MIN_UPLOAD_MB = int(os.environ.get("OUT_OF_CORE_MIN_UPLOAD_MB", "200"))
+# Peak RSS of the whole process in out-of-core mode, DuckDB included; the
+# chunks shrink above it (0 = no check)
+OUT_OF_CORE_MAX_RSS_MB = int(os.environ.get("OUT_OF_CORE_MAX_RSS_MB", "4096")) or None
+
+# Local snapshot history of the ingested exports (Parquet, by date and locale)
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", ".streamlit/snapshots")
+
+# Archive of completed analyses (DuckDB), reopened without recomputing
+RESULTS_DB = os.environ.get("RESULTS_DB", ".streamlit/results.duckdb")
+
+# Memory budget (MB) of the dataset cache shared by all sessions (0 = off)
+DATASET_CACHE_MB = int(os.environ.get("DATASET_CACHE_MB", "1024"))
+
+# Parsed uploads whose derived columns are kept for incremental reruns,
+# shared by all sessions
+DERIVED_CACHE_SIZE = int(os.environ.get("DERIVED_CACHE_SIZE", "2"))
+
+# JSON-lines log of the stage timings of each analysis and rerun
+PERF_LOG = os.environ.get("PERF_LOG", ".streamlit/perf.jsonl")
+
+# Trace the peak allocation of each analysis stage (tracemalloc, slower runs)
+PROFILE_ALLOCATIONS = os.environ.get("PROFILE_ALLOCATIONS", "0") == "1"
+
+# cProfile captures of single reruns (diagnostics toggle or ?profile=1)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", ".streamlit/profiles")
+
+# Keepa product API: key (also in .streamlit/secrets.toml), endpoint and
+# requests kept in flight at once by keepa_client
+KEEPA_API_KEY = os.environ.get("API_KEY", "")
+KEEPA_API_URL = os.environ.get("KEEPA_API_URL", "https://api.keepa.com")
+KEEPA_MAX_IN_FLIGHT = int(os.environ.get("KEEPA_MAX_IN_FLIGHT", "4"))
+
+# Disk cache of Keepa products: fresh for the TTL, then served stale while
+# refreshed in the background, evicted least recently read above the size
+KEEPA_CACHE_PATH = os.environ.get("KEEPA_CACHE_PATH", ".streamlit/keepa_cache.sqlite")
+KEEPA_CACHE_TTL_MIN = float(os.environ.get("KEEPA_CACHE_TTL_MIN", "60"))
+KEEPA_CACHE_STALE_MIN = float(os.environ.get("KEEPA_CACHE_STALE_MIN", "1440"))
+KEEPA_CACHE_MB = int(os.environ.get("KEEPA_CACHE_MB", "256"))
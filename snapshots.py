@@ -0,0 +1,407 @@
+"""Local history of Keepa exports as a partitioned Parquet snapshot store.
+
+Every ingested export is reduced to one row per ASIN and locale with the
+current prices, sales rank and offer count, and appended under::
+
+    <root>/data/date=YYYY-MM/locale=XX/part-<id>.parquet
+    <root>/index.parquet
+    <root>/sources.parquet
+
+Partitions are monthly; each append adds a part file and a partition with
+many parts is compacted into one. The sources file lists the ingested
+exports, so uploading the same files again adds no snapshot; appends and
+compactions of one root are serialized by a lock. Rows are sorted by ASIN
+and timestamp and written in small row groups. The ASIN index records the ASIN and timestamp
+range of every row group, so a lookback for a list of ASINs reads only the
+row groups that can contain them. :func:`history_features` turns the
+snapshots into trend, fair price and volatility columns with vectorized
+window aggregations; :meth:`SnapshotStore.enrich` joins them to an export
+as ``Hist_*`` columns, which the pipeline and the deals use in place of
+Keepa's precomputed averages when present.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import reduce
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+try:  # pragma: no cover - non disponibile su Windows
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from loaders import parse_float, parse_int
+from score import normalize_locale
+
+SNAPSHOT_SCHEMA = pa.schema(
+    [
+        ("ASIN", pa.string()),
+        ("ts", pa.timestamp("s")),
+        ("BuyBox", pa.float32()),
+        ("Amazon", pa.float32()),
+        ("New", pa.float32()),
+        ("SalesRank", pa.float32()),
+        ("Offers", pa.float32()),
+    ]
+)
+
+# Colonne dell'export Keepa per ciascun campo dello snapshot
+SOURCE_COLUMNS = {
+    "BuyBox": ("Buy Box 🚚: Current", parse_float),
+    "Amazon": ("Amazon: Current", parse_float),
+    "New": ("New: Current", parse_float),
+    "SalesRank": ("Sales Rank: Current", parse_int),
+    "Offers": ("New Offer Count: Current", parse_int),
+}
+
+HIST_COLUMNS = [
+    "Hist_FairPrice",
+    "Hist_Volatility",
+    "Hist_SalesRank_30d",
+    "Hist_Snapshots",
+]
+
+# Finestre (giorni) per prezzo equo/volatilità e per il trend del rank
+FAIR_WINDOW_DAYS = 90
+TREND_WINDOW_DAYS = 30
+
+ROW_GROUP_ROWS = 1024
+
+# Oltre questo numero di file una partizione viene compattata
+COMPACT_PARTS = 4
+
+# Un lock per radice nel processo; tra processi fa da guardia il file .lock
+_ROOT_LOCKS: Dict[Path, threading.Lock] = {}
+_ROOT_LOCKS_GUARD = threading.Lock()
+
+
+def upload_source(fingerprints: Iterable[str]) -> str:
+    """Return the source id of a group of uploads from their file fingerprints."""
+    digest = hashlib.sha256()
+    for fingerprint in sorted(fingerprints):
+        digest.update(fingerprint.encode("ascii"))
+    return digest.hexdigest()
+
+
+def extract_snapshot(df: pd.DataFrame, when: Optional[datetime] = None) -> pd.DataFrame:
+    """Reduce a Keepa export to the snapshot columns, one row per ASIN and locale."""
+    when = when or datetime.now()
+    df = df[df["ASIN"].notna()]
+    snap = pd.DataFrame(
+        {
+            "ASIN": df["ASIN"].astype(str).str.strip().str.upper(),
+            "Locale": df.get("Locale", pd.Series("", index=df.index)).map(
+                normalize_locale
+            ),
+        }
+    )
+    for name, (column, parser) in SOURCE_COLUMNS.items():
+        values = df.get(column, pd.Series(np.nan, index=df.index))
+        snap[name] = values.map(parser).astype("float32")
+    snap["ts"] = pd.Timestamp(when).floor("s")
+    snap = snap[snap["ASIN"].str.len() > 0]
+    return snap.drop_duplicates(["ASIN", "Locale"], keep="last")
+
+
+def _write_sorted(table: pa.Table, path: Path) -> pd.DataFrame:
+    """Write ``table`` sorted by ASIN and time; return its row-group index."""
+    table = table.sort_by([("ASIN", "ascending"), ("ts", "ascending")])
+    tmp = path.with_suffix(".tmp")
+    pq.write_table(table, tmp, compression="zstd", row_group_size=ROW_GROUP_ROWS)
+    os.replace(tmp, path)
+    starts = np.arange(0, table.num_rows, ROW_GROUP_ROWS)
+    asins = table.column("ASIN").to_numpy(zero_copy_only=False)
+    ts = table.column("ts").to_numpy()
+    return pd.DataFrame(
+        {
+            "row_group": np.arange(len(starts)),
+            "asin_min": asins[starts],
+            "asin_max": asins[np.minimum(starts + ROW_GROUP_ROWS, len(asins)) - 1],
+            "ts_min": np.minimum.reduceat(ts, starts),
+            "ts_max": np.maximum.reduceat(ts, starts),
+        }
+    )
+
+
+def _ts(value: pd.Timestamp) -> pa.Scalar:
+    return pa.scalar(value, pa.timestamp("s"))
+
+
+class SnapshotStore:
+    """Append-only store of export snapshots rooted at ``root``."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.data_dir = self.root / "data"
+        self.index_path = self.root / "index.parquet"
+        self.sources_path = self.root / "sources.parquet"
+
+    def index(self) -> pd.DataFrame:
+        """Return the row-group index: file, locale, ASIN and time ranges."""
+        if not self.index_path.exists():
+            return pd.DataFrame(
+                columns=["file", "locale", "row_group", "asin_min", "asin_max",
+                         "ts_min", "ts_max"]
+            )
+        return pd.read_parquet(self.index_path)
+
+    def sources(self) -> pd.DataFrame:
+        """Return the ingested sources with their timestamp and stored rows."""
+        if not self.sources_path.exists():
+            return pd.DataFrame(
+                {
+                    "source": pd.Series(dtype=str),
+                    "ts": pd.Series(dtype="datetime64[s]"),
+                    "rows": pd.Series(dtype="int64"),
+                }
+            )
+        return pd.read_parquet(self.sources_path)
+
+    def version(self, pending: Iterable[str] = ()) -> str:
+        """Return a token identifying the stored snapshots.
+
+        The token is derived from the ingested sources, so it is known before
+        an append: ``pending`` lists the sources about to be appended and the
+        result equals :meth:`version` after they are ingested.
+        """
+        known = set(self.sources()["source"]) | set(pending)
+        if not known:
+            return f"{self.root}@0"
+        return f"{self.root}@{upload_source(known)[:16]}"
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Serializza lettura e riscrittura di indice e sorgenti
+        self.root.mkdir(parents=True, exist_ok=True)
+        with _ROOT_LOCKS_GUARD:
+            lock = _ROOT_LOCKS.setdefault(self.root.resolve(), threading.Lock())
+        with lock, open(self.root / ".lock", "a+b") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _save(self, frame: pd.DataFrame, path: Path) -> None:
+        tmp = path.with_suffix(".tmp")
+        frame.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+    def append(
+        self,
+        df: pd.DataFrame,
+        when: Optional[datetime] = None,
+        source: Optional[str] = None,
+    ) -> int:
+        """Append a Keepa export as a snapshot; return the number of rows stored.
+
+        ``source`` identifies the export (see :func:`upload_source`): an
+        export already ingested under the same source is skipped.
+        """
+        snap = extract_snapshot(df, when)
+        if snap.empty:
+            return 0
+        month = snap["ts"].iloc[0].strftime("%Y-%m")
+        with self._locked():
+            sources = self.sources()
+            if source is not None and (sources["source"] == source).any():
+                return 0
+            index = self.index()
+            for locale, part in snap.groupby("Locale", sort=False):
+                directory = self.data_dir / f"date={month}" / f"locale={locale or 'NA'}"
+                directory.mkdir(parents=True, exist_ok=True)
+                table = pa.Table.from_pandas(
+                    part[SNAPSHOT_SCHEMA.names], schema=SNAPSHOT_SCHEMA, preserve_index=False
+                )
+                path = directory / f"part-{uuid.uuid4().hex}.parquet"
+                entries = {path: _write_sorted(table, path)}
+                # Solo i file già indicizzati: un file non in indice è di un
+                # append interrotto e non va toccato
+                indexed = set(index["file"])
+                parts = sorted(
+                    p for p in directory.glob("part-*.parquet") if self._rel(p) in indexed
+                )
+                stale = pd.Series(False, index=index.index)
+                if len(parts) >= COMPACT_PARTS:
+                    entries = self._compact([*parts, path])
+                    stale = index["file"].isin([self._rel(p) for p in parts])
+                index = pd.concat(
+                    [index[~stale]]
+                    + [
+                        rows.assign(file=self._rel(p), locale=locale)
+                        for p, rows in entries.items()
+                    ],
+                    ignore_index=True,
+                )
+            self._save(index, self.index_path)
+            entry = pd.DataFrame(
+                {
+                    "source": [source or uuid.uuid4().hex],
+                    "ts": pd.Series([snap["ts"].iloc[0]], dtype="datetime64[s]"),
+                    "rows": [len(snap)],
+                }
+            )
+            self._save(
+                pd.concat([sources, entry], ignore_index=True) if len(sources) else entry,
+                self.sources_path,
+            )
+        return len(snap)
+
+    def _rel(self, path: Path) -> str:
+        return path.relative_to(self.data_dir).as_posix()
+
+    def _compact(self, parts: List[Path]) -> dict:
+        # Un solo file ordinato per partizione: meno aperture per lookback
+        table = pa.concat_tables(pq.read_table(p, schema=SNAPSHOT_SCHEMA) for p in parts)
+        path = parts[0].with_name(f"part-{uuid.uuid4().hex}.parquet")
+        entries = {path: _write_sorted(table, path)}
+        for p in parts:
+            p.unlink()
+        return entries
+
+    def history(
+        self,
+        asins: Optional[Sequence[str]] = None,
+        locales: Optional[Sequence[str]] = None,
+        since: Optional[date] = None,
+        until: Optional[date] = None,
+    ) -> pd.DataFrame:
+        """Return the snapshots matching the filters.
+
+        Rows come grouped by partition file, not in time order; ``Locale`` is
+        categorical.
+        """
+        index = self.index()
+        if locales is not None:
+            index = index[index["locale"].isin(list(locales))]
+        if since is not None:
+            since_ts = pd.Timestamp(since)
+            index = index[index["ts_max"] >= since_ts]
+        if until is not None:
+            until_ts = pd.Timestamp(until) + pd.Timedelta(days=1)
+            index = index[index["ts_min"] < until_ts]
+        if asins is not None:
+            wanted = np.unique(np.asarray(list(asins), dtype=object).astype(str))
+            lo = np.searchsorted(wanted, index["asin_min"].to_numpy(dtype=str), "left")
+            hi = np.searchsorted(wanted, index["asin_max"].to_numpy(dtype=str), "right")
+            index = index[hi > lo]
+
+        frames = []
+        value_set = pa.array(wanted, pa.string()) if asins is not None else None
+        for (file, locale), groups in index.groupby(["file", "locale"], sort=False):
+            table = pq.ParquetFile(self.data_dir / file).read_row_groups(
+                list(groups["row_group"])
+            )
+            conditions = []
+            if value_set is not None:
+                conditions.append(pc.is_in(table.column("ASIN"), value_set=value_set))
+            if since is not None:
+                conditions.append(pc.greater_equal(table.column("ts"), _ts(since_ts)))
+            if until is not None:
+                conditions.append(pc.less(table.column("ts"), _ts(until_ts)))
+            if conditions:
+                table = table.filter(reduce(pc.and_, conditions))
+            locale = "" if locale == "NA" else locale
+            codes = pa.array(np.zeros(len(table), dtype=np.int8))
+            frames.append(
+                table.add_column(
+                    1, "Locale", pa.DictionaryArray.from_arrays(codes, [locale])
+                )
+            )
+
+        if not frames:
+            columns = ["ASIN", "Locale", *SNAPSHOT_SCHEMA.names[1:]]
+            return pd.DataFrame(columns=columns)
+        return pa.concat_tables(frames).to_pandas()
+
+    def enrich(
+        self,
+        df: pd.DataFrame,
+        as_of: Optional[datetime] = None,
+        lookback_days: int = FAIR_WINDOW_DAYS,
+    ) -> pd.DataFrame:
+        """Return ``df`` with the ``Hist_*`` columns of its ASINs and locale."""
+        as_of = as_of or datetime.now()
+        keys = pd.DataFrame(
+            {
+                "ASIN": df["ASIN"].astype(str).str.strip().str.upper(),
+                "Locale": df.get("Locale", pd.Series("", index=df.index)).map(
+                    normalize_locale
+                ),
+            }
+        )
+        hist = self.history(
+            asins=keys.loc[df["ASIN"].notna().to_numpy(), "ASIN"].unique(),
+            since=(as_of - timedelta(days=lookback_days)).date(),
+        )
+        features = history_features(hist, as_of)
+        joined = keys.merge(features, on=["ASIN", "Locale"], how="left")
+        df = df.copy()
+        for column in HIST_COLUMNS:
+            df[column] = joined[column].to_numpy()
+        return df
+
+
+def history_features(
+    hist: pd.DataFrame,
+    as_of: Optional[datetime] = None,
+    fair_window: int = FAIR_WINDOW_DAYS,
+    trend_window: int = TREND_WINDOW_DAYS,
+    min_snapshots: int = 3,
+) -> pd.DataFrame:
+    """Compute fair price, volatility and trend inputs per ASIN and locale.
+
+    ``Hist_FairPrice`` is the median of the reference price (Buy Box, then
+    Amazon, then New) over ``fair_window`` days, clamped to the observed
+    range; ``Hist_Volatility`` its standard deviation over the same window;
+    ``Hist_SalesRank_30d`` the mean sales rank over ``trend_window`` days.
+    Products with fewer than ``min_snapshots`` snapshots get no values.
+    """
+    keys = ["ASIN", "Locale"]
+    if hist.empty:
+        return pd.DataFrame(columns=keys + HIST_COLUMNS)
+    as_of = pd.Timestamp(as_of or datetime.now())
+    hist = hist[hist["ts"] <= as_of]
+    age = (as_of - hist["ts"]).dt.total_seconds().to_numpy() / 86400.0
+    price = (
+        hist["BuyBox"].where(hist["BuyBox"] > 0)
+        .fillna(hist["Amazon"].where(hist["Amazon"] > 0))
+        .fillna(hist["New"].where(hist["New"] > 0))
+        .astype(float)
+    )
+    rank = hist["SalesRank"].astype(float)
+
+    frame = hist[keys].assign(
+        fair=price.where(age <= fair_window),
+        rank30=rank.where(age <= trend_window),
+        price=price,
+    )
+    grouped = frame.groupby(keys, sort=False, observed=True)
+    features = pd.DataFrame(
+        {
+            "Hist_FairPrice": grouped["fair"].median(),
+            "Hist_Volatility": grouped["fair"].std(),
+            "Hist_SalesRank_30d": grouped["rank30"].mean(),
+            "Hist_Snapshots": grouped["price"].size(),
+        }
+    )
+    low, high = grouped["price"].min(), grouped["price"].max()
+    features["Hist_FairPrice"] = features["Hist_FairPrice"].clip(low, high)
+    too_short = features["Hist_Snapshots"] < min_snapshots
+    features.loc[too_short, HIST_COLUMNS[:-1]] = np.nan
+    return features.reset_index()
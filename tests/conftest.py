@@ -0,0 +1,45 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pandas as pd
+import pytest
+from loaders import load_keepa
+
+SAMPLE = "sample_data/keepa_sample.xlsx"
+PRICE = "Buy Box 🚚: Current"
+
+
+@pytest.fixture(scope="session")
+def sample_export():
+    return load_keepa(SAMPLE)
+
+
+@pytest.fixture(scope="session")
+def make_market(sample_export):
+    """Return a factory of the sample export as another market, prices scaled."""
+
+    def make(locale="de", factor=1.6):
+        market = sample_export.copy()
+        market["Locale"] = locale
+        prices = pd.to_numeric(market[PRICE], errors="coerce") * factor
+        market[PRICE] = prices.round(2).astype(str)
+        return market
+
+    return make
+
+
+@pytest.fixture
+def sample_frames(sample_export, make_market):
+    """Base export and its "de" copy with the Buy Box prices 60% higher."""
+    return sample_export.copy(), make_market()
+
+
+@pytest.fixture
+def sample_files(sample_frames, tmp_path):
+    """The :func:`sample_frames` written as ``base.csv`` and ``de.csv``."""
+    paths = tmp_path / "base.csv", tmp_path / "de.csv"
+    for df, path in zip(sample_frames, paths):
+        df.to_csv(path, sep=";", index=False)
+    return paths
@@ -0,0 +1,68 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+from compact import compact_frame, compact_results, fits_float32, frame_bytes
+from deals import compute_historic_deals
+from engine import EngineConfig, Filters, analyze_uploads
+
+
+def test_fits_float32():
+    assert fits_float32(pd.Series([12.34, np.nan, 1e5 + 0.25, -3.0]))
+    # Un rank oltre 2**24 non è rappresentabile esattamente in float32
+    assert not fits_float32(pd.Series([16_777_217.0]))
+    assert not fits_float32(pd.Series([1e300]))
+
+
+def test_compact_frame_dtypes():
+    df = pd.DataFrame(
+        {
+            "Locale (comp)": ["de", "fr", "de", None],
+            "Brand (base)": ["Acme", "Acme", "Other", "Acme"],
+            "Title (base)": ["a", "b", "c", "d"],
+            "Margine_Netto": [1.5, 2.25, np.nan, 3.0],
+            "SalesRank_Comp": [1.0, 2.0, 3.0, 20_000_001.0],
+        }
+    )
+    kept = ["Locale (comp)", "Brand (base)", "Margine_Netto", "SalesRank_Comp"]
+    out = compact_frame(df, kept)
+    assert list(out.columns) == kept
+    assert isinstance(out["Locale (comp)"].dtype, pd.CategoricalDtype)
+    assert out["Locale (comp)"].isna().sum() == 1
+    assert isinstance(out["Brand (base)"].dtype, pd.CategoricalDtype)
+    assert out["Margine_Netto"].dtype == np.float32
+    assert out["SalesRank_Comp"].dtype == np.float64
+
+
+def test_compact_results_keep_deals(sample_files):
+    base_path, comp_path = sample_files
+    config = EngineConfig(filters=Filters(min_margin_pct=0.0, min_margin_abs=0.0))
+    with open(base_path, "rb") as fb, open(comp_path, "rb") as fc:
+        results = analyze_uploads([fb], [fc], config)
+
+    compact = compact_results(results)
+    for name in ("full_data", "filtered_data", "ranked_data"):
+        assert frame_bytes(compact[name]) <= frame_bytes(results[name])
+    assert frame_bytes(compact["full_data"]) < frame_bytes(results["full_data"]) / 2
+    pd.testing.assert_series_equal(
+        compact["ranked_data"]["ASIN"], results["ranked_data"]["ASIN"]
+    )
+    # Le tabelle mostrate ed esportate restano float64: niente 12.3400001526
+    for name in ("filtered_data", "ranked_data"):
+        floats = results[name].select_dtypes("float64").columns
+        assert (compact[name][floats].dtypes == np.float64).all()
+    assert (compact["full_data"].dtypes == np.float32).any()
+    assert compact_frame(pd.DataFrame({"Prezzo": [12.34]}), floats=False).to_json() == (
+        '{"Prezzo":{"0":12.34}}'
+    )
+
+    expected = compute_historic_deals(results["full_data"])
+    actual = compute_historic_deals(compact["full_data"])
+    cols = ["FairPrice", "UnderPct", "NetSale", "Marg€", "Marg%", "Demand", "Competition"]
+    pd.testing.assert_frame_equal(
+        actual[cols], expected[cols], check_dtype=False, rtol=1e-5
+    )
+    assert actual["Locale"].tolist() == expected["Locale"].tolist()
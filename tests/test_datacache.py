@@ -0,0 +1,150 @@
+import gc
+import pathlib
+import sys
+import threading
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from datacache import DatasetCache, file_fingerprint
+from engine import load_shared
+
+
+def _frame(n=1000, offset=0.0):
+    return pd.DataFrame(
+        {
+            "ASIN": [f"B{i:09d}" for i in range(n)],
+            "Price": np.where(np.arange(n) % 7 == 0, np.nan, np.arange(n) + offset),
+            "Rank": np.arange(n, dtype="int64"),
+        }
+    )
+
+
+def test_leases_share_read_only_buffers():
+    cache = DatasetCache(10 * 1024 * 1024)
+    df = _frame()
+    first = cache.put("a", df)
+    second = cache.acquire("a")
+    pd.testing.assert_frame_equal(second.frame, df)
+
+    prices = second.frame["Price"].to_numpy()
+    assert np.shares_memory(first.frame["Price"].to_numpy(), prices)
+    assert not prices.flags.writeable
+    # Copy-on-write: una sessione che modifica non tocca i dati condivisi
+    view = second.frame
+    view.loc[0, "Price"] = -1.0
+    assert np.isnan(first.frame.loc[0, "Price"])
+    assert cache.stats()["hits"] == 1
+
+
+def test_lru_eviction_skips_held_datasets():
+    size = DatasetCache(1 << 30).put("probe", _frame()).table.nbytes
+    cache = DatasetCache(int(size * 2.5))
+    held = cache.put("a", _frame())
+    cache.put("b", _frame(offset=1)).release()
+    cache.put("c", _frame(offset=2)).release()
+    # "a" è in uso: viene sacrificato "b", il meno recente tra i liberi
+    assert cache.acquire("b") is None
+    assert cache.acquire("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+    del held
+    gc.collect()
+    cache.put("d", _frame(offset=3)).release()
+    assert cache.stats()["datasets"] == 2
+    assert cache.nbytes <= cache.budget_bytes
+
+
+def test_acquire_all_releases_on_exit():
+    cache = DatasetCache(10 * 1024 * 1024)
+    cache.put("a", _frame()).release()
+    cache.put("b", _frame(offset=1)).release()
+
+    with cache.acquire_all(["a", "b"]) as leases:
+        assert set(leases) == {"a", "b"}
+        assert cache.stats()["pinned"] == 2
+    assert cache.stats()["pinned"] == 0
+    # Una chiave mancante: nessuna lease resta aperta sulle altre
+    with cache.acquire_all(["a", "missing"]) as leases:
+        assert leases is None
+        assert cache.stats()["pinned"] == 0
+    assert cache.stats()["pinned"] == 0
+
+
+def test_finalizer_inside_lock_does_not_deadlock():
+    cache = DatasetCache(10 * 1024 * 1024)
+    lease = cache.put("a", _frame())
+    # Come il garbage collector che rilascia un lease durante ``acquire``
+    with cache._lock:
+        del lease
+        gc.collect()
+    assert cache.stats()["pinned"] == 0
+
+
+def test_concurrent_sessions_build_once():
+    cache = DatasetCache(10 * 1024 * 1024)
+    calls = []
+
+    def build():
+        calls.append(1)
+        return _frame()
+
+    leases = []
+    threads = [
+        threading.Thread(target=lambda: leases.append(cache.get_or_build("k", build)))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert cache.stats()["pinned"] == 1
+    assert len({id(lease.table) for lease in leases}) == 1
+
+
+def test_zero_budget_disables_caching():
+    cache = DatasetCache(0)
+    df = _frame()
+    lease = cache.put("a", df)
+    assert lease.frame is df
+    assert not lease.cached
+    assert cache.stats()["datasets"] == 0
+
+
+def test_same_upload_is_loaded_once(tmp_path):
+    path = tmp_path / "base.csv"
+    _frame().astype(str).to_csv(path, sep=";", index=False)
+    copy = tmp_path / "copy.csv"
+    copy.write_bytes(path.read_bytes())
+    first = load_shared(path)
+    second = load_shared(copy)
+    pd.testing.assert_frame_equal(first, second)
+    assert first is not second
+    # Le colonne di testo puntano agli stessi buffer Arrow
+    data = [pa.array(df["ASIN"]).buffers()[-1].address for df in (first, second)]
+    assert data[0] == data[1]
+
+
+def test_uploads_stay_pinned_while_sessions_hold_them(tmp_path):
+    from datacache import DATASETS
+    from engine import load_frames
+
+    path = tmp_path / "pinned.csv"
+    _frame(offset=0.5).astype(str).to_csv(path, sep=";", index=False)
+    key = f"upload:{file_fingerprint(path)}"
+
+    frame = load_shared(path)
+    gc.collect()
+    assert DATASETS._entries[key].refs == 1
+    with open(path, "rb") as f:
+        merged, _ = load_frames([f, f], "base")
+    gc.collect()
+    assert DATASETS._entries[key].refs == 3
+
+    # La sessione abbandona i frame: il dataset torna libero per l'LRU
+    del frame, merged
+    gc.collect()
+    assert DATASETS._entries[key].refs == 0
@@ -0,0 +1,46 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pandas as pd
+from delta import ingest
+from engine import EngineConfig, Filters, ScoreWeights, run_analysis
+
+PRICE = "Buy Box 🚚: Current"
+
+
+def _assert_same(results, expected):
+    # Le colonne intere diventano float se un blocco ha valori mancanti
+    for key in ("filtered_data", "ranked_data"):
+        pd.testing.assert_frame_equal(results[key], expected[key], check_dtype=False)
+
+
+def test_delta_matches_full_run_after_refresh(sample_frames):
+    config = EngineConfig(filters=Filters(min_margin_pct=0.0, min_margin_abs=0.0))
+    base, comp = sample_frames
+    first = ingest(base, comp, config)
+    _assert_same(first, run_analysis(base.copy(), comp.copy(), config))
+
+    # Export aggiornato: prezzi cambiati, una riga rimossa e una duplicata
+    comp2 = comp.copy()
+    comp2.loc[comp2.index[:5], PRICE] = "99.99"
+    comp2 = pd.concat([comp2.drop(comp2.index[7]), comp2.iloc[[3]]], ignore_index=True)
+    base2 = base.copy()
+    base2.loc[base2.index[10], PRICE] = "1.00"
+
+    weights = ScoreWeights(alpha=2.0)
+    config2 = EngineConfig(weights=weights, filters=config.filters)
+    second = ingest(base2, comp2, config2, first["delta"])
+    _assert_same(second, run_analysis(base2.copy(), comp2.copy(), config2))
+    stats = second["delta"].stats
+    assert 0 < stats["recomputed"] <= 8
+    assert stats["reused_rows"] > 0
+
+
+def test_changed_parameters_reprocess_everything(sample_frames):
+    base, comp = sample_frames
+    first = ingest(base, comp, EngineConfig())
+    second = ingest(base, comp, EngineConfig(discount=0.1), first["delta"])
+    assert second["delta"].stats["reused_rows"] == 0
+    _assert_same(second, run_analysis(base.copy(), comp.copy(), EngineConfig(discount=0.1)))
@@ -0,0 +1,90 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from collections import OrderedDict
+
+import derived as derived_mod
+import pandas as pd
+from datacache import DATASETS
+from derived import DerivedColumns, analyze_incremental, share_derived
+from engine import (
+    EngineConfig,
+    Filters,
+    ScoreWeights,
+    analyze_uploads,
+    prepare_frames,
+    score_prepared,
+)
+
+
+def _assert_same(results, expected):
+    for key in ("full_data", "filtered_data", "ranked_data"):
+        pd.testing.assert_frame_equal(results[key], expected[key])
+
+
+def test_incremental_results_match_full_run(sample_frames):
+    config = EngineConfig(filters=Filters(min_margin_pct=0.0, min_margin_abs=0.0))
+    df_parsed = prepare_frames(*sample_frames, config)
+    derived = DerivedColumns(df_parsed)
+    _assert_same(derived.results(config), score_prepared(df_parsed, config))
+
+    changed = EngineConfig(discount=0.1, filters=config.filters)
+    _assert_same(derived.results(changed), score_prepared(df_parsed, changed))
+
+
+def test_parameter_change_recomputes_only_affected_nodes(sample_frames):
+    config = EngineConfig()
+    derived = DerivedColumns(prepare_frames(*sample_frames, config))
+    derived.results(config)
+    assert "shipping" in derived.recomputed and "trend" in derived.recomputed
+
+    derived.results(EngineConfig(discount=0.1))
+    assert derived.recomputed == ["purchase", "margins", "roi", "keep", "scores"]
+
+    derived.results(EngineConfig(discount=0.1, weights=ScoreWeights(alpha=2.0)))
+    assert derived.recomputed == ["scores"]
+
+    derived.results(EngineConfig())
+    assert derived.recomputed == []
+
+
+def test_shared_cache_keyed_on_file_content(sample_files, monkeypatch):
+    monkeypatch.setattr(derived_mod, "_shared", OrderedDict())
+    base_path, comp_path = sample_files
+    config = EngineConfig(filters=Filters(min_margin_pct=0.0, min_margin_abs=0.0))
+    stages = []
+
+    def run(cfg=config):
+        stages.clear()
+        with open(base_path, "rb") as fb, open(comp_path, "rb") as fc:
+            return analyze_incremental(
+                [fb], [fc], cfg, lambda stage, partial=None: stages.append(stage)
+            )
+
+    first = run()
+    with open(base_path, "rb") as fb, open(comp_path, "rb") as fc:
+        expected = analyze_uploads([fb], [fc], config)
+    _assert_same(first, expected)
+    assert "load" in stages
+
+    # Altra sessione, stessi file: niente caricamento né parsing
+    run(EngineConfig(discount=0.1, filters=config.filters))
+    assert "load" not in stages
+
+    # Export rigenerato con lo stesso nome e la stessa dimensione
+    size = comp_path.stat().st_size
+    lines = comp_path.read_bytes().split(b"\n")
+    lines[1], lines[2] = lines[2], lines[1]
+    comp_path.write_bytes(b"\n".join(lines))
+    assert comp_path.stat().st_size == size
+    run()
+    assert "load" in stages
+    assert len(derived_mod._shared) == 2
+
+    # Oltre il limite la sorgente meno recente lascia la cache dei dataset
+    oldest = next(iter(derived_mod._shared.values()))
+    share_derived(expected["full_data"], "altro", size=2)
+    assert oldest.lease.key not in {d.lease.key for d in derived_mod._shared.values()}
+    assert DATASETS._entries[oldest.lease.key].refs == 0
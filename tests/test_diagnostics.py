@@ -0,0 +1,208 @@
+import json
+import pathlib
+import pstats
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from deals import DealFilters, DealWeights, score_deals, select_deals
+from diagnostics import (
+    PipelineProfile,
+    RerunCapture,
+    StageMemory,
+    profile_stage,
+    profiled_cache,
+    state_bytes,
+)
+from engine import (
+    EngineConfig,
+    Filters,
+    apply_scores,
+    finalize_results,
+    prepare_frames,
+    score_prepared,
+)
+from loaders import load_keepa
+from score import aggregate_opportunities, compute_scores
+
+OPEN = Filters(
+    max_sales_rank=1e12,
+    max_offer_count=1e9,
+    min_buybox_price=0.0,
+    max_buybox_price=1e9,
+    min_margin_pct=-1e9,
+    min_margin_abs=-1e9,
+)
+
+
+def _rows(copies=40):
+    sample = load_keepa("sample_data/keepa_sample.xlsx")
+    base = pd.concat([sample] * copies, ignore_index=True)
+    base["ASIN"] = base["ASIN"] + (base.index // len(sample)).astype(str)
+    comp = base.assign(Locale="de")
+    config = EngineConfig(filters=OPEN)
+    rows = score_prepared(prepare_frames(base, comp, config), config)["full_data"]
+    return rows.drop(columns=["Opportunity_Score", "Opportunity_Class", "Opportunity_Tag"])
+
+
+def test_stage_memory_reports_budget():
+    memory = StageMemory({"copy": 1024})
+    data = np.ones(100_000)
+    with memory.stage("copy"):
+        data.copy()
+    with memory.stage("view"):
+        data[::2].sum()
+    assert memory.peaks["copy"] >= data.nbytes
+    assert memory.peaks["view"] < data.nbytes / 10
+    assert list(memory.over_budget()) == ["copy"]
+    report = memory.report().set_index("stage")
+    assert not report.loc["copy", "ok"] and report.loc["view", "ok"]
+
+
+def test_profile_reports_nested_allocation_peaks(tmp_path):
+    profile = PipelineProfile("test", memory=StageMemory({"outer": 1024}))
+    data = np.ones(100_000)
+    with profile.activate():
+        with profile_stage("outer"):
+            copy = data.copy()
+            del copy
+            with profile_stage("inner"):
+                data[::2].sum()
+    report = profile.report().set_index("stage")
+    # La copia precede la fase interna ma resta nel picco di quella esterna
+    assert report.loc["outer", "alloc_peak_mb"] * 2**20 >= data.nbytes
+    assert report.loc["inner", "alloc_peak_mb"] * 2**20 < data.nbytes / 10
+
+    profile.append_log(tmp_path / "perf.jsonl")
+    logged = json.loads((tmp_path / "perf.jsonl").read_text())
+    assert list(logged["over_budget"]) == ["outer"]
+    assert logged["stages"][0]["alloc_peak_mb"] > 0
+
+
+def _stage_peaks(rows):
+    config = EngineConfig(filters=OPEN)
+    memory = StageMemory()
+    with memory.stage("scoring"):
+        scored = apply_scores(rows.copy(deep=False), config)
+    with memory.stage("finalize"):
+        results = finalize_results(scored)
+    with memory.stage("ranking"):
+        aggregate_opportunities(results["filtered_data"])
+    deals = rows.assign(
+        Volatility=np.linspace(0, 20, len(rows)),
+        **{"Marg€": 20.0, "Marg%": 0.2},
+        UnderPct=0.3,
+        Demand=50.0,
+        Competition=10.0,
+    )
+    with memory.stage("deals"):
+        score_deals(
+            select_deals(deals, DealFilters(max_vol=1e9, excl_amz_bb=False)),
+            DealWeights(),
+        )
+    return memory.peaks
+
+
+def test_scoring_path_does_not_copy_frames():
+    rows = _rows()
+    # Colonne non usate da nessuno stadio: una copia del frame le duplicherebbe
+    extra = pd.DataFrame(
+        np.random.default_rng(0).random((len(rows), 40)),
+        index=rows.index,
+        columns=[f"extra_{i}" for i in range(40)],
+    )
+    narrow = _stage_peaks(rows)
+    wide = _stage_peaks(pd.concat([rows, extra], axis=1))
+    budget = extra.memory_usage(index=False).sum() // 4
+    grown = {stage: wide[stage] - narrow[stage] for stage in narrow}
+    assert {stage: b for stage, b in grown.items() if b > budget} == {}
+
+
+def test_pipeline_profile_records_stages(tmp_path):
+    sample = load_keepa("sample_data/keepa_sample.xlsx")
+    config = EngineConfig(filters=OPEN)
+    profile = PipelineProfile("test")
+    with profile.activate():
+        parsed = prepare_frames(sample, sample.assign(Locale="de"), config)
+        results = score_prepared(parsed, config)
+        weights = config.weights.components()
+        # Come nell'app: la cache di Streamlit arriva dal chiamante
+        cached_scores = profiled_cache(st.cache_data(show_spinner=False))(compute_scores)
+        for _ in range(2):
+            cached_scores(results["full_data"], weights)
+    # Fuori dal profilo le chiamate non vengono registrate
+    aggregate_opportunities(results["filtered_data"])
+
+    report = profile.report()
+    stages = list(report["stage"])
+    for name in ("merge_frames", "parse_columns", "parse_weights", "compute_margins"):
+        assert name in stages
+    assert stages.count("aggregate_opportunities") == 1
+    assert stages.index("parse_columns") < stages.index("parse_weights")
+    parse = report[report["stage"] == "parse_columns"].iloc[0]
+    weights_row = report[report["stage"] == "parse_weights"].iloc[0]
+    assert parse["rows_in"] == parse["rows_out"] == len(parsed)
+    assert weights_row["depth"] == parse["depth"] + 1
+    scores = report[report["stage"] == "compute_scores"]
+    # Il calcolo eseguito al miss compare come fase annidata senza esito
+    assert list(scores["cache"].dropna()) == ["miss", "hit"]
+    assert scores["depth"].tolist() == [0, 1, 0]
+    assert (report["seconds"] >= 0).all()
+    assert (report["rss_peak_mb"] >= report["rss_mb"]).all()
+    assert profile.frames["df_merged"] > profile.frames["filtered_data"] > 0
+
+    log = tmp_path / "perf.jsonl"
+    profile.append_log(log)
+    profile.append_log(log)
+    lines = [json.loads(line) for line in log.read_text().splitlines()]
+    assert len(lines) == 2 and lines[0]["label"] == "test"
+    assert [e["stage"] for e in lines[0]["stages"]] == stages
+
+
+def test_state_bytes_counts_shared_frames_once():
+    frame = pd.DataFrame({"x": np.ones(10_000), "s": ["abc"] * 10_000}).astype(
+        {"s": "str"}
+    )
+    size = int(frame.memory_usage(deep=True).sum())
+    other = frame.head(100)
+
+    class Index:
+        # Come SearchIndex: oggetti che non sono frame non vengono percorsi
+        frame = other
+
+    state = {
+        "filtered_data": frame,
+        "results": {"filtered_data": frame, "ranked": [other], "extra": np.ones(1000)},
+        "search_index": Index(),
+        "label": "x",
+    }
+    sizes = state_bytes(state)
+    assert sizes == {
+        "filtered_data": size,
+        "results": int(other.memory_usage(deep=True).sum()),
+    }
+
+
+def test_rerun_capture_saves_cumulative_table(tmp_path):
+    sample = load_keepa("sample_data/keepa_sample.xlsx")
+    config = EngineConfig(filters=OPEN)
+    capture = RerunCapture().start()
+    prepare_frames(sample, sample.assign(Locale="de"), config)
+    capture.stop()
+    path = capture.save(tmp_path / "profiles")
+    assert path.exists() and capture.seconds > 0
+
+    top = capture.top(10)
+    assert len(top) == 10
+    assert top["cumtime_s"].is_monotonic_decreasing
+    assert (top["cumtime_s"] >= top["tottime_s"]).all()
+    # Il file si rilegge con pstats, con le stesse funzioni
+    saved = pstats.Stats(str(path))
+    assert {(f, n) for f, _, n in saved.stats} >= {
+        (loc.rsplit(":", 1)[0], name)
+        for loc, name in zip(top["location"], top["function"])
+        if loc != "~"
+    }
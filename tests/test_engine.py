@@ -0,0 +1,65 @@
+import pathlib
+import subprocess
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pandas as pd
+from engine import (
+    DISPLAY_COLS_ORDER,
+    EngineConfig,
+    Filters,
+    merge_frames,
+    run_analysis,
+    run_sharded,
+)
+
+
+def test_config_round_trip():
+    config = EngineConfig.from_dict({"discount_percent": 10, "alpha": 2.0, "x": 1})
+    assert config.discount == 0.1
+    assert config.weights.alpha == 2.0
+    assert EngineConfig.from_dict(config.to_dict()) == config
+
+
+def test_run_analysis_results(sample_frames):
+    base, comp = sample_frames
+    stages = []
+    results = run_analysis(
+        base, comp, EngineConfig(), lambda stage, partial=None: stages.append(stage)
+    )
+    finale = results["filtered_data"]
+    assert stages == ["merge", "parse", "margins", "scoring", "ranking"]
+    assert not finale.empty
+    assert list(finale.columns) == [c for c in DISPLAY_COLS_ORDER if c in finale]
+    assert finale["Opportunity_Score"].is_monotonic_decreasing
+    assert (finale["Margine_Netto"] > 5.0).all()
+    assert set(results["ranked_data"]["ASIN"]) == set(finale["ASIN"])
+
+
+def test_sharded_run_matches_single_process(sample_frames):
+    base, comp = sample_frames
+    config = EngineConfig(filters=Filters(min_margin_pct=0.0, min_margin_abs=0.0))
+    single = run_analysis(base.copy(), comp.copy(), config)
+    sharded = run_sharded(base.copy(), comp.copy(), config, workers=2, min_rows=0)
+    pd.testing.assert_frame_equal(single["filtered_data"], sharded["filtered_data"])
+    pd.testing.assert_frame_equal(single["ranked_data"], sharded["ranked_data"])
+
+
+def test_engine_is_free_of_streamlit():
+    # CLI e server girano senza runtime: nessun import di Streamlit
+    code = "import sys, cli, server; print('streamlit' in sys.modules)"
+    root = pathlib.Path(__file__).resolve().parents[1]
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True
+    )
+    assert out.stdout.strip() == "False"
+
+
+def test_merge_leaves_callers_frames_untouched(sample_frames):
+    base, comp = sample_frames
+    base.loc[0, "ASIN"] = " " + base.loc[0, "ASIN"].lower()
+    before = base["ASIN"].copy()
+    merged = merge_frames(base, comp)
+    pd.testing.assert_series_equal(base["ASIN"], before)
+    assert before.iloc[0].strip().upper() in set(merged["ASIN"])
@@ -0,0 +1,51 @@
+import pathlib
+import sys
+import threading
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from jobs import BackgroundJob
+
+
+def test_job_reports_stages_and_result():
+    seen = []
+
+    def target(report):
+        for stage in ["a", "b", "c"]:
+            report(stage)
+            seen.append(stage)
+        return 42
+
+    job = BackgroundJob(target, ["a", "b", "c"]).start()
+    job.wait(5)
+    assert job.status == "done"
+    assert job.result == 42
+    assert job.progress == 1.0
+    assert seen == ["a", "b", "c"]
+
+
+def test_job_cancel_stops_at_next_stage():
+    gate = threading.Event()
+
+    def target(report):
+        report("a")
+        gate.wait(5)
+        report("b")
+        return "unreachable"
+
+    job = BackgroundJob(target, ["a", "b"]).start()
+    job.cancel()
+    gate.set()
+    job.wait(5)
+    assert job.status == "cancelled"
+    assert job.result is None
+
+
+def test_job_failure_is_captured():
+    def target(report):
+        raise ValueError("boom")
+
+    job = BackgroundJob(target, ["a"]).start()
+    job.wait(5)
+    assert job.status == "failed"
+    assert str(job.error) == "boom"
@@ -0,0 +1,113 @@
+import pathlib
+import sys
+import threading
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from keepa_cache import KeepaCache
+from keepa_client import KeepaClient
+
+FIELDS = "stats=90,buybox=1,history=0"
+
+
+def _product(asin, version=1):
+    # Storia lunga: il blob compresso resta molto più piccolo del JSON
+    return {"asin": asin, "title": f"Prodotto {asin}", "version": version, "csv": [[0, 1999] * 200]}
+
+
+def _asins(n):
+    return [f"B0{i:08d}" for i in range(n)]
+
+
+def test_lookup_fresh_stale_and_missing(tmp_path):
+    now = [1000.0]
+    cache = KeepaCache(tmp_path / "c.sqlite", ttl=60, stale_ttl=600, clock=lambda: now[0])
+    cache.put([_product(a) for a in _asins(3)], 3, FIELDS)
+
+    hit = cache.lookup(_asins(4), 3, FIELDS)
+    assert list(hit.fresh) == _asins(3) and hit.stale == {} and hit.missing == _asins(4)[3:]
+    assert hit.fresh["B000000001"] == _product("B000000001")
+    # Altro dominio o altri campi: chiavi diverse
+    assert cache.lookup(_asins(3), 4, FIELDS).missing == _asins(3)
+    assert cache.lookup(_asins(3), 3, "stats=30,buybox=0,history=1").missing == _asins(3)
+
+    now[0] += 120
+    stale = cache.lookup(_asins(3), 3, FIELDS)
+    assert stale.fresh == {} and list(stale.stale) == _asins(3)
+    now[0] += 600
+    assert cache.lookup(_asins(3), 3, FIELDS).missing == _asins(3)
+
+    stats = cache.stats()
+    assert stats["entries"] == 3
+    assert stats["bytes"] < 3 * len(str(_product("B000000000"))) / 5
+
+
+def test_eviction_keeps_recently_read(tmp_path):
+    now = [0.0]
+    cache = KeepaCache(tmp_path / "c.sqlite", max_bytes=10**9, clock=lambda: now[0])
+    for i, asin in enumerate(_asins(20)):
+        now[0] = i
+        cache.put([_product(asin)], 3, FIELDS)
+    now[0] = 100
+    cache.lookup(_asins(2), 3, FIELDS)  # le prime due lette di recente
+    size = cache.stats()["bytes"] // 20
+    cache.max_bytes = size * 10
+    now[0] = 101
+    cache.put([_product("B099999999")], 3, FIELDS)
+
+    stats = cache.stats()
+    assert stats["bytes"] <= cache.max_bytes
+    kept = cache.lookup(_asins(20) + ["B099999999"], 3, FIELDS)
+    assert {"B000000000", "B000000001", "B099999999"} <= set(kept.fresh)
+    assert "B000000002" in kept.missing
+
+
+class _CountingClient(KeepaClient):
+    """Client whose requests return made-up products and are recorded."""
+
+    def __init__(self, cache, version=1):
+        super().__init__("chiave", "http://127.0.0.1:9", cache=cache)
+        self.calls = []
+        self.version = version
+        self.release = threading.Event()
+        self.release.set()
+
+    async def _fetch_unique(self, asins, domain):
+        if not asins:
+            return []
+        self.calls.append(list(asins))
+        if threading.current_thread().name == "keepa-revalidate":
+            self.release.wait(10)
+        return [_product(a, self.version) for a in asins]
+
+
+def test_client_fetches_only_misses(tmp_path):
+    now = [0.0]
+    cache = KeepaCache(tmp_path / "c.sqlite", ttl=60, stale_ttl=600, clock=lambda: now[0])
+    with _CountingClient(cache) as client:
+        first = client.fetch_products(_asins(150), "de")
+        again = client.fetch_products(_asins(200), "Amazon.de")
+    assert [p["asin"] for p in first] == _asins(150)
+    assert [p["asin"] for p in again] == _asins(200)
+    # La seconda lettura chiede solo i 50 ASIN nuovi, in un solo blocco
+    assert client.calls == [_asins(150), _asins(200)[150:]]
+
+
+def test_stale_products_are_served_then_revalidated(tmp_path):
+    now = [0.0]
+    cache = KeepaCache(tmp_path / "c.sqlite", ttl=60, stale_ttl=600, clock=lambda: now[0])
+    with _CountingClient(cache) as client:
+        client.fetch_products(_asins(10), "de")
+        now[0] = 120
+        client.version = 2
+        client.release.clear()
+        served = client.fetch_products(_asins(12), "de")
+        # Le copie scadute arrivano subito; l'aggiornamento è ancora in corso
+        assert [p["version"] for p in served] == [1] * 10 + [2] * 2
+        # Una seconda lettura non avvia un altro aggiornamento degli stessi ASIN
+        client.fetch_products(_asins(10), "de")
+        client.release.set()
+        client.wait_revalidations()
+    assert client.calls == [_asins(10), _asins(12)[10:], _asins(10)]
+    refreshed = cache.lookup(_asins(10), 3, client.fields)
+    assert [p["version"] for p in refreshed.fresh.values()] == [2] * 10
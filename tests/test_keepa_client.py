@@ -0,0 +1,324 @@
+import asyncio
+import json
+import pathlib
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pandas as pd
+import pytest
+from deals import compute_historic_deals
+from engine import EngineConfig, Filters, prepare_frames, score_prepared
+from keepa_client import (
+    AMAZON_SELLERS,
+    BUY_BOX,
+    KEEPA_COLUMNS,
+    MAX_BATCH,
+    SALES,
+    KeepaClient,
+    KeepaError,
+    TokenBucket,
+    products_frame,
+)
+from keepa_history import MINUTES_PER_DAY, keepa_minute
+
+OPEN = Filters(
+    max_sales_rank=1e12,
+    max_offer_count=1e9,
+    min_buybox_price=0.0,
+    max_buybox_price=1e9,
+    min_margin_pct=-1e9,
+    min_margin_abs=-1e9,
+)
+
+DOMAIN_CODES = {3: "DE", 8: "IT"}
+
+
+def _product(asin, domain):
+    key = zlib.crc32(asin.encode())
+    price = 1000 + key % 20_000 + (4000 if domain == 3 else 0)
+    stats = [-1] * 35
+    current = list(stats)
+    current[0], current[1], current[3], current[18] = price, price - 50, 1 + key % 90_000, price
+    current[11], current[16], current[17] = 1 + key % 30, 45, key % 5000
+    avg = list(current)
+    return {
+        "asin": asin,
+        "title": f"Prodotto {asin}",
+        "brand": "Bosch",
+        "domainId": domain,
+        "monthlySold": 100,
+        "packageWeight": 200 + key % 5000,
+        "packageLength": 100,
+        "packageWidth": 50,
+        "packageHeight": 20,
+        "coupon": [-5, 0],
+        "stats": {
+            "current": current,
+            "avg30": avg,
+            "avg90": avg,
+            "avg180": avg,
+            "avg365": avg,
+            "min": [None] * 18 + [[1000, price - 300]],
+            "max": [None] * 18 + [[1000, price + 300]],
+            "outOfStockPercentage90": [12] + [-1] * 34,
+            "buyBoxStats": {AMAZON_SELLERS[DOMAIN_CODES[domain]]: {"percentageWon": 40}},
+        },
+    }
+
+
+class KeepaStub(ThreadingHTTPServer):
+    """Keepa API stand-in with a continuously refilled token balance."""
+
+    daemon_threads = True
+
+    def __init__(self, tokens=10_000, refill_per_minute=600_000, delay=0.02):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.tokens = tokens
+        self.refill_per_minute = refill_per_minute
+        self.delay = delay
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.batches = []
+        self.rejected = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.clients = set()
+
+    def balance(self):
+        now = time.monotonic()
+        cap = self.refill_per_minute * 60
+        self.tokens = min(cap, self.tokens + (now - self.updated) * self.refill_per_minute / 60)
+        self.updated = now
+        return self.tokens
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if query.get("key") != "chiave":
+            self._send(400, {"error": {"type": "invalidKey", "message": "Invalid key"}})
+            return
+        with stub.lock:
+            stub.clients.add(self.client_address)
+            tokens = stub.balance()
+        status = {"refillRate": stub.refill_per_minute, "refillIn": 100}
+        if url.path == "/token":
+            self._send(200, {**status, "tokensLeft": int(tokens)})
+            return
+        asins = query["asin"].split(",")
+        cost = len(asins) * (3 if query.get("buybox") == "1" else 1)
+        with stub.lock:
+            if stub.balance() < cost:
+                stub.rejected += 1
+                self._send(429, {**status, "tokensLeft": int(stub.tokens)})
+                return
+            stub.tokens -= cost
+            stub.batches.append(len(asins))
+            stub.in_flight += 1
+            stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+        time.sleep(stub.delay)
+        with stub.lock:
+            stub.in_flight -= 1
+            left = int(stub.tokens)
+        domain = int(query["domain"])
+        products = [_product(a, domain) for a in asins]
+        self._send(
+            200,
+            {**status, "tokensLeft": left, "tokensConsumed": cost, "products": products},
+        )
+
+
+@pytest.fixture
+def stub_factory():
+    servers = []
+
+    def start(**kwargs):
+        server = KeepaStub(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _asins(n, prefix="B0"):
+    return [f"{prefix}{i:08d}" for i in range(n)]
+
+
+def test_fetch_frame_batches_and_columns(stub_factory):
+    stub, url = stub_factory()
+    asins = _asins(250)
+    with KeepaClient("chiave", url, max_in_flight=3) as client:
+        df = client.fetch_frame(asins + asins[:10], "Amazon.de")
+    assert sorted(stub.batches) == [50, MAX_BATCH, MAX_BATCH]
+    assert list(df.columns) == list(KEEPA_COLUMNS)
+    assert list(df["ASIN"]) == asins
+    assert client.tokens_consumed == 250 * 3
+    # Più richieste in volo, sulle connessioni del pool
+    assert 1 < stub.max_in_flight <= 3
+    assert len(stub.clients) <= 4
+
+    row = df.iloc[0]
+    product = _product(asins[0], 3)
+    assert row["Locale"] == "de"
+    assert row["Buy Box 🚚: Current"] == f"{product['stats']['current'][18] / 100:.2f}"
+    assert row["Buy Box 🚚: Lowest"] < row["Buy Box 🚚: Current"] < row["Buy Box 🚚: Highest"]
+    assert row["Buy Box: % Amazon 90 days"] == "40 %"
+    assert row["Amazon: 90 days OOS"] == "12 %"
+    assert row["One Time Coupon: Percentage"] == "5 %"
+    assert row["Package: Dimension (cm³)"] == "100"
+    assert row["Reviews: Rating"] == "4.5"
+    assert pd.isna(row["List Price: Current"])
+    assert row["URL: Amazon"].startswith("https://www.amazon.de/dp/")
+
+
+def test_frames_run_through_the_pipeline(stub_factory):
+    _, url = stub_factory()
+    asins = _asins(40)
+    with KeepaClient("chiave", url) as client:
+        base = client.fetch_frame(asins, "it")
+        comp = client.fetch_frame(asins, "de")
+    config = EngineConfig(filters=OPEN)
+    results = score_prepared(prepare_frames(base, comp, config), config)
+    assert len(results["full_data"]) == 40
+    assert results["full_data"]["Margine_Netto"].notna().all()
+
+
+def test_history_columns_are_scored(monkeypatch):
+    now = keepa_minute(datetime.now(timezone.utc))
+    day = MINUTES_PER_DAY
+
+    def products(asins, locale):
+        domain = 8 if locale == "it" else 3
+        found = [_product(a, domain) for a in asins]
+        for p in found:
+            # Buy Box a 19 € + 1 € di spedizione, rank in miglioramento
+            p["csv"] = [None] * 19
+            p["csv"][BUY_BOX] = [now - 90 * day, 1900, 100]
+            p["csv"][SALES] = [now - 30 * day, 8000, now - 10 * day, 1000]
+        return found
+
+    client = KeepaClient("chiave", history=True)
+    monkeypatch.setattr(client, "fetch_products", products)
+    asins = _asins(5)
+    base = client.fetch_frame(asins, "it")
+    comp = client.fetch_frame(asins, "de", history_columns=True)
+    assert comp["Hist_FairPrice"].tolist() == [20.0] * 5
+
+    config = EngineConfig(filters=OPEN)
+    full = score_prepared(prepare_frames(base, comp, config), config)["full_data"]
+    rank_30d = (8000 * 20 + 1000 * 10) / 30
+    assert full["Hist_SalesRank_30d"].tolist() == pytest.approx([rank_30d] * 5)
+    assert (full["Trend_Bonus"] != 0).all()
+    assert compute_historic_deals(full)["FairPrice"].tolist() == [20.0] * 5
+
+    with pytest.raises(ValueError):
+        KeepaClient("chiave").fetch_frame(asins, "de", history_columns=True)
+
+
+def test_rate_limit_waits_for_tokens(stub_factory):
+    # Secchio da 30 token ricaricato a 30 token/s: lotti da 10 ASIN, uno al secondo
+    stub, url = stub_factory(tokens=30, refill_per_minute=1800)
+    with KeepaClient("chiave", url, max_in_flight=4) as client:
+        client.bucket = TokenBucket(1800, tokens=30, capacity=30)
+        start = time.perf_counter()
+        products = client.fetch_products(_asins(40), "de")
+        elapsed = time.perf_counter() - start
+    assert len(products) == 40
+    assert stub.batches == [10, 10, 10, 10]
+    # Tre ricariche da 30 token a 30 token/s: circa 3 secondi, senza rifiuti
+    assert elapsed >= 2.5
+    assert stub.rejected <= 1
+
+
+def test_threads_share_one_bucket_and_in_flight_cost(stub_factory):
+    # Come le rivalidazioni in background: più thread, ognuno con il suo ciclo
+    stub, url = stub_factory(tokens=300, refill_per_minute=6000)
+    with KeepaClient("chiave", url, max_in_flight=2) as client:
+        status_calls = []
+        token_status = client.token_status
+
+        def slow_status():
+            status_calls.append(threading.current_thread().name)
+            time.sleep(0.05)
+            return token_status()
+
+        client.token_status = slow_status
+        threads = [
+            threading.Thread(
+                target=client.fetch_products, args=(_asins(30, f"B{i}"), "de")
+            )
+            for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len(status_calls) == 1
+    assert client._in_flight_cost == 0
+    assert client.requests == len(stub.batches) + stub.rejected
+    assert client.tokens_consumed == 3 * sum(stub.batches) == 3 * 120
+
+
+def test_token_bucket_refill_and_sync():
+    now = [0.0]
+    bucket = TokenBucket(60, tokens=5, capacity=10, clock=lambda: now[0])
+    assert bucket.wait_time(5) == 0
+    bucket.take(5)
+    assert bucket.wait_time(3) == pytest.approx(3.0)
+    now[0] = 100.0
+    assert bucket.wait_time(10) == 0 and bucket.tokens == 10
+    bucket.sync(-6, refill_per_minute=120)
+    assert bucket.wait_time(2) == pytest.approx(4.0)
+
+    # Nessuna ricarica: errore invece di un'attesa infinita
+    empty = TokenBucket(0, tokens=1, capacity=10, clock=lambda: now[0])
+    assert empty.wait_time(1) == 0
+    with pytest.raises(KeepaError, match="nessuna ricarica"):
+        empty.wait_time(5)
+    with pytest.raises(KeepaError, match="nessuna ricarica"):
+        asyncio.run(empty.acquire(5))
+
+
+def test_products_frame_keeps_missing_values():
+    df = products_frame([{"asin": "B000000001"}], "de")
+    assert df.loc[0, "ASIN"] == "B000000001"
+    assert df["Title"].isna().all() and df["Brand"].isna().all()
+    assert not df.isin(["None", "nan"]).any().any()
+
+
+def test_errors(stub_factory):
+    _, url = stub_factory()
+    with KeepaClient("sbagliata", url) as client:
+        with pytest.raises(KeepaError, match="Invalid key"):
+            client.fetch_products(_asins(3), "de")
+    with KeepaClient("chiave", url) as client:
+        with pytest.raises(KeepaError, match="non supportato"):
+            client.fetch_products(_asins(3), "xx")
+        assert client.fetch_products([], "de") == []
@@ -0,0 +1,144 @@
+import pathlib
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+import pytest
+from deals import compute_historic_deals
+from engine import trend_columns
+from keepa_client import AMAZON, BUY_BOX, NEW, SALES
+from keepa_history import (
+    KEEPA_HIST_COLUMNS,
+    MINUTES_PER_DAY,
+    decode_history,
+    enrich,
+    history_features,
+    keepa_minute,
+    to_datetime,
+    window_stats,
+)
+
+AS_OF = datetime(2024, 6, 1, tzinfo=timezone.utc)
+END = keepa_minute(AS_OF)
+HOUR = 60
+
+
+def _product(asin, **series):
+    csv = [None] * 19
+    for index, points in series.items():
+        csv[int(index)] = points
+    return {"asin": asin, "csv": csv}
+
+
+def _series(rng, start, end):
+    # Punti a ore intere, qualche buco senza offerta (-1)
+    hours = np.sort(rng.choice(np.arange(start, end, HOUR), size=rng.integers(1, 12), replace=False))
+    prices = rng.integers(500, 3000, size=len(hours))
+    prices[rng.random(len(hours)) < 0.15] = -1
+    return np.column_stack([hours, prices]).ravel().tolist()
+
+
+def test_decode_minutes_prices_and_buy_box_shipping():
+    assert to_datetime(0) == np.datetime64("2011-01-01T00:00")
+    assert keepa_minute(datetime(2011, 1, 2)) == MINUTES_PER_DAY
+
+    products = [
+        _product("A", **{str(AMAZON): [0, 1999, 60, -1, 120, 2500]}),
+        {"asin": "B"},
+        # Tripletta troncata in coda: l'ultimo punto è scartato
+        _product("C", **{str(BUY_BOX): [10, 1000, 499, 20, 1200, -1, 30]}),
+    ]
+    amazon = decode_history(products, AMAZON, scale=0.01)
+    assert list(amazon.offsets) == [0, 3, 3, 3]
+    np.testing.assert_array_equal(amazon.minutes, [0, 60, 120])
+    np.testing.assert_allclose(amazon.values, [19.99, np.nan, 25.0])
+
+    buy_box = decode_history(products, BUY_BOX, scale=0.01)
+    assert list(buy_box.offsets) == [0, 0, 0, 2]
+    np.testing.assert_allclose(buy_box.values, [14.99, 12.0])
+
+
+def test_window_stats_match_hourly_samples():
+    rng = np.random.default_rng(7)
+    start = END - 30 * MINUTES_PER_DAY
+    products = [
+        _product(f"P{i}", **{str(NEW): _series(rng, start - 10 * MINUTES_PER_DAY, END)})
+        for i in range(200)
+    ]
+    history = decode_history(products, NEW)
+    stats = window_stats(history, start, END)
+
+    grid = np.arange(start, END, HOUR)
+    days = (grid - END) / MINUTES_PER_DAY
+    for i in range(len(history)):
+        lo, hi = history.offsets[i], history.offsets[i + 1]
+        t, v = history.minutes[lo:hi], history.values[lo:hi]
+        # Valore in vigore a ogni ora della finestra
+        held = np.searchsorted(t, grid, side="right") - 1
+        samples = np.where(held >= 0, v[np.maximum(held, 0)], np.nan)
+        keep = ~np.isnan(samples)
+        row = stats.iloc[i]
+        if not keep.any():
+            assert row["points"] == 0 and np.isnan(row["median"])
+            continue
+        y, x = samples[keep], days[keep]
+        assert row["median"] == pytest.approx(np.median(y))
+        assert row["mean"] == pytest.approx(y.mean())
+        assert row["std"] == pytest.approx(y.std(), abs=1e-6)
+        assert (row["min"], row["max"]) == (y.min(), y.max())
+        assert row["covered_days"] == pytest.approx(keep.sum() / 24)
+        if np.ptp(x) > 0 and keep.sum() > 1:
+            # Campioni orari puntuali contro integrali: pendenze vicine
+            expected = np.polyfit(x, y, 1)[0]
+            assert row["slope"] == pytest.approx(expected, rel=0.05, abs=5.0)
+
+
+def test_features_feed_fair_price_and_rank_trend():
+    day = MINUTES_PER_DAY
+    start = END - 90 * day
+    products = [
+        # Buy Box: 20 € per 60 giorni, 30 € per 30 giorni; rank in miglioramento
+        _product(
+            "B000000001",
+            **{
+                str(BUY_BOX): [start, 1900, 100, start + 60 * day, 2900, 100],
+                str(SALES): [END - 30 * day, 8000, END - 20 * day, 4000, END - 10 * day, 1000],
+            },
+        ),
+        # Solo Amazon: il prezzo equo ripiega sulla serie Amazon
+        _product("B000000002", **{str(AMAZON): [start - day, 4000]}),
+        {"asin": "B000000003"},
+    ]
+    features = history_features(products, AS_OF)
+    assert list(features.columns) == ["ASIN"] + KEEPA_HIST_COLUMNS
+    first, second, third = features.to_dict("records")
+    assert first["Hist_FairPrice"] == 20.0
+    assert (first["Hist_PriceMin"], first["Hist_PriceMax"]) == (20.0, 30.0)
+    assert first["Hist_Volatility"] == pytest.approx(np.sqrt(200 / 9))
+    assert first["Hist_SalesRank_30d"] == pytest.approx((8000 + 4000 + 1000) / 3)
+    assert first["Hist_RankSlope"] < 0
+    assert second["Hist_FairPrice"] == 40.0 and second["Hist_Snapshots"] == 1
+    assert np.isnan(third["Hist_FairPrice"]) and third["Hist_Snapshots"] == 0
+
+    df = pd.DataFrame(
+        {
+            "ASIN": [" b000000001", "B000000002", "B000000009"],
+            "Locale": "de",
+            "Buy Box 🚚: Current": ["25,00", "30,00", "30,00"],
+            "Buy Box 🚚: 90 days avg.": ["50,00", "50,00", "50,00"],
+            "SalesRank_30d": [5000.0, 5000.0, 5000.0],
+            "SalesRank_Comp": [1000.0, 1000.0, 1000.0],
+        }
+    )
+    enriched = enrich(df, products, AS_OF)
+    assert enriched["Hist_FairPrice"].tolist()[:2] == [20.0, 40.0]
+    assert np.isnan(enriched["Hist_FairPrice"].iloc[2])
+
+    deals = compute_historic_deals(enriched)
+    assert deals["FairPrice"].tolist() == [20.0, 40.0, 50.0]
+    trend = trend_columns(enriched)["Trend_Bonus"]
+    assert trend.iloc[0] == pytest.approx(np.log((13000 / 3 + 1) / 1001))
+    assert trend.iloc[2] == pytest.approx(np.log(5001 / 1001))
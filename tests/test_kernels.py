@@ -0,0 +1,23 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pytest
+from benchmarks.kernels import KERNELS, assert_equivalent, check_kernel
+
+
+@pytest.mark.parametrize("name", sorted(KERNELS))
+def test_batch_kernel_matches_scalar(name):
+    for seed in range(3):
+        result = check_kernel(KERNELS[name], rows=1500, seed=seed)
+        assert result["batch_s"] > 0
+
+
+def test_assert_equivalent_checks_nan_placement():
+    assert assert_equivalent([1.0, np.nan, np.inf], [1.0 + 1e-12, np.nan, np.inf]) < 1e-9
+    with pytest.raises(AssertionError, match="righe diverse"):
+        assert_equivalent([1.0, np.nan], [1.0, 0.0])
+    with pytest.raises(AssertionError, match="righe diverse"):
+        assert_equivalent([1.0, 2.0], [1.0, 2.1])
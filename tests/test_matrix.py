@@ -0,0 +1,48 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+import pytest
+from engine import EngineConfig, Filters, run_analysis
+from matrix import best_routes, build_matrix, route_margins
+
+
+@pytest.fixture
+def markets(sample_export, make_market):
+    return {"it": sample_export.copy(), "de": make_market(), "fr": make_market("fr", 1.3)}
+
+
+def test_route_margins_match_pipeline(markets):
+    config = EngineConfig(filters=Filters(min_margin_pct=-1e9, min_margin_abs=-1e9))
+    matrix = build_matrix(pd.concat(markets.values(), ignore_index=True), config)
+    margins = route_margins(matrix, config)["margin"]
+
+    for origin, dest in (("it", "de"), ("fr", "it")):
+        full = run_analysis(markets[origin].copy(), markets[dest].copy(), config)[
+            "full_data"
+        ].drop_duplicates("ASIN")
+        full = full[full["Price_Base"].notna() & full["Price_Comp"].notna()]
+        o = matrix.locales.get_loc(origin.upper())
+        d = matrix.locales.get_loc(dest.upper())
+        got = margins[matrix.asins.get_indexer(full["ASIN"]), o, d]
+        np.testing.assert_allclose(got, full["Margine_Netto"], rtol=1e-12)
+
+
+def test_best_routes(markets):
+    config = EngineConfig()
+    matrix = build_matrix(pd.concat(markets.values(), ignore_index=True), config)
+    routes = best_routes(matrix, config, chunk_asins=7)
+
+    assert routes["ASIN"].is_unique
+    assert routes["Margine_Netto"].is_monotonic_decreasing
+    assert (routes["Locale (base)"] != routes["Locale (comp)"]).all()
+    assert (routes["Margine_Netto"] > config.filters.min_margin_abs).all()
+    # Prezzi di acquisto più bassi in IT: è l'origine migliore
+    assert set(routes["Locale (base)"]) == {"it"}
+    margins = route_margins(matrix, config)["margin"]
+    rows = matrix.asins.get_indexer(routes["ASIN"])
+    best = np.nanmax(np.where(np.eye(3, dtype=bool), np.nan, margins[rows]), axis=(1, 2))
+    assert (routes["Margine_Netto"].to_numpy() <= best + 1e-9).all()
@@ -0,0 +1,77 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import outofcore
+import pandas as pd
+import pytest
+from engine import AnalysisError, EngineConfig, Filters, analyze_uploads
+from outofcore import OutOfCoreSettings, run_out_of_core
+
+
+def test_out_of_core_matches_in_memory(tmp_path, sample_files):
+    base_path, comp_path = sample_files
+    config = EngineConfig(filters=Filters(min_margin_pct=0.0, min_margin_abs=0.0))
+    with open(base_path, "rb") as fb, open(comp_path, "rb") as fc:
+        expected = analyze_uploads([fb], [fc], config)
+    settings = OutOfCoreSettings(
+        memory_limit_mb=64, chunk_rows=50, read_chunk_rows=40, workdir=str(tmp_path)
+    )
+    with open(base_path, "rb") as fb, open(comp_path, "rb") as fc:
+        results = run_out_of_core([fb], [fc], config, settings)
+    for key in ("filtered_data", "ranked_data"):
+        pd.testing.assert_frame_equal(
+            results[key].reset_index(drop=True),
+            expected[key].reset_index(drop=True),
+            check_dtype=False,
+        )
+
+
+def test_out_of_core_without_matches(tmp_path, sample_files):
+    base_path, _ = sample_files
+    other = tmp_path / "other.csv"
+    other.write_text("ASIN;Locale\nB000000000;de\n", encoding="utf-8")
+    settings = OutOfCoreSettings(workdir=str(tmp_path))
+    with open(base_path, "rb") as fb, open(other, "rb") as fc:
+        with pytest.raises(AnalysisError):
+            run_out_of_core([fb], [fc], EngineConfig(), settings)
+    assert not list(tmp_path.glob("ama-ooc-*"))
+
+
+def test_xlsx_streamed_in_chunks(tmp_path, monkeypatch, sample_files):
+    base_path, comp_path = sample_files
+    # Nessuna lettura completa del foglio con pandas
+    monkeypatch.setattr(pd, "read_excel", None)
+    comp_xlsx = tmp_path / "de.xlsx"
+    pd.read_csv(comp_path, sep=";", dtype=str).to_excel(comp_xlsx, index=False)
+    config = EngineConfig(filters=Filters(min_margin_pct=0.0, min_margin_abs=0.0))
+    settings = OutOfCoreSettings(chunk_rows=50, read_chunk_rows=30, workdir=str(tmp_path))
+    with open(base_path, "rb") as fb, open(comp_path, "rb") as fc:
+        expected = run_out_of_core([fb], [fc], config, settings)
+    with open("sample_data/keepa_sample.xlsx", "rb") as fb, open(comp_xlsx, "rb") as fc:
+        results = run_out_of_core([fb], [fc], config, settings)
+    pd.testing.assert_frame_equal(
+        results["ranked_data"].reset_index(drop=True),
+        expected["ranked_data"].reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_memory_guard_and_ignored_options(tmp_path, monkeypatch, sample_files):
+    monkeypatch.setattr(outofcore, "MIN_CHUNK_ROWS", 8)
+    base_path, comp_path = sample_files
+    empty = tmp_path / "vuoto.csv"
+    empty.write_text("ASIN;Locale\n", encoding="utf-8")
+    # Limite irraggiungibile: i blocchi scendono al minimo e l'utente è avvisato
+    settings = OutOfCoreSettings(chunk_rows=64, max_rss_mb=1, workdir=str(tmp_path))
+    with open(base_path, "rb") as fb, open(comp_path, "rb") as fc, open(empty, "rb") as fe:
+        results = run_out_of_core(
+            [fb], [fc, fe], EngineConfig(), settings, ignored_options=["Storico locale"]
+        )
+    memory = results["memory"]
+    assert memory["chunk_rows"] == 8 and memory["peak_rss_mb"] > 1
+    messages = " ".join(results["warnings"])
+    assert "Storico locale" in messages
+    assert "vuoto.csv" in messages
+    assert "Memoria oltre il limite di 1 MB" in messages
@@ -0,0 +1,106 @@
+import pathlib
+import sys
+import threading
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pandas as pd
+import pytest
+from datacache import file_fingerprint
+from engine import EngineConfig, Filters, analyze_uploads
+import results_db
+from results_db import RESULT_FRAMES, ResultsDB, _restore, analysis_key
+from snapshots import SnapshotStore
+
+
+def test_save_and_load_round_trip(tmp_path, sample_files):
+    base_path, comp_path = sample_files
+    config = EngineConfig(filters=Filters(min_margin_pct=0.0, min_margin_abs=0.0))
+    with open(base_path, "rb") as fb, open(comp_path, "rb") as fc:
+        results = analyze_uploads([fb], [fc], config)
+    key = analysis_key([file_fingerprint(base_path)], [file_fingerprint(comp_path)], config)
+
+    db = ResultsDB(tmp_path / "db" / "results.duckdb")
+    assert not db.exists(key)
+    db.save(key, results, {"base": ["base.csv"], "comp": ["de.csv"]}, elapsed_s=1.5)
+    assert db.exists(key)
+
+    # Una nuova istanza (altra sessione) ritrova l'analisi senza ricalcolo
+    loaded = ResultsDB(tmp_path / "db" / "results.duckdb").load(key)
+    assert loaded["config"] == config
+    for frame in RESULT_FRAMES:
+        pd.testing.assert_frame_equal(
+            loaded[frame],
+            results[frame].reset_index(drop=True),
+            check_dtype=False,
+        )
+
+    meta = db.analyses()
+    assert meta.loc[0, "key"] == key
+    assert meta.loc[0, "rows_filtered"] == len(results["filtered_data"])
+    assert '"de.csv"' in meta.loc[0, "files"]
+
+    top = db.query(
+        f'SELECT ASIN FROM "ranked_{key}" ORDER BY "Opportunity_Score" DESC LIMIT 1'
+    )
+    assert top["ASIN"].iloc[0] == results["ranked_data"]["ASIN"].iloc[0]
+
+    db.delete(key)
+    assert not db.exists(key)
+    with pytest.raises(KeyError):
+        db.load(key)
+
+
+def test_analysis_key_depends_on_inputs_and_parameters():
+    config = EngineConfig()
+    key = analysis_key(["a"], ["b"], config)
+    assert key == analysis_key(["a"], ["b"], EngineConfig())
+    assert key != analysis_key(["a"], ["c"], config)
+    assert key != analysis_key(["a"], ["b"], EngineConfig(discount=0.1))
+    assert key != analysis_key(["a"], ["b"], config, history="/tmp/snapshots")
+
+
+def test_history_version_changes_the_key(tmp_path, sample_export):
+    store = SnapshotStore(tmp_path / "snapshots")
+    before = store.version()
+    assert before == SnapshotStore(tmp_path / "snapshots").version()
+    store.append(sample_export)
+    config = EngineConfig()
+    # Nuovi snapshot: la stessa analisi va ricalcolata, non riaperta
+    assert analysis_key(["a"], ["b"], config, history=before) != analysis_key(
+        ["a"], ["b"], config, history=store.version()
+    )
+
+
+def test_listing_is_cached_and_reads_skip_the_write_lock(tmp_path, sample_files):
+    base_path, comp_path = sample_files
+    config = EngineConfig(filters=Filters(min_margin_pct=0.0, min_margin_abs=0.0))
+    with open(base_path, "rb") as fb, open(comp_path, "rb") as fc:
+        results = analyze_uploads([fb], [fc], config)
+    db = ResultsDB(tmp_path / "results.duckdb")
+    assert db.analyses().empty
+    calls = []
+    reader = db.reader
+    db.reader = lambda: calls.append(1) or reader()
+    db.analyses()
+    assert not calls
+    db.save("k1", results)
+    assert db.analyses()["key"].tolist() == ["k1"]
+    assert len(calls) == 1
+
+    # Una scrittura in corso non blocca le letture delle altre sessioni
+    found = []
+    with results_db._lock:
+        reading = threading.Thread(
+            target=lambda: found.append((db.exists("k1"), len(db.analyses())))
+        )
+        reading.start()
+        reading.join(timeout=10)
+        assert not reading.is_alive()
+    assert found == [(True, 1)]
+
+
+def test_restore_keeps_empty_text_columns_missing():
+    df = _restore(pd.DataFrame({"Brand": [None, None], "ASIN": ["a", "b"]}, dtype=object))
+    assert df["Brand"].isna().all()
+    assert df["ASIN"].tolist() == ["a", "b"]
@@ -12,6 +12,9 @@ from score import (
     volatility_score,
     risk_score,
     aggregate_opportunities,
+    compute_scores,
+    merge_score_bounds,
+    score_bounds,
 )
 
 
@@ -46,3 +49,21 @@ def test_aggregate_opportunities():
     a1 = agg[agg["ASIN"] == "A1"].iloc[0]
     assert a1["Opportunity_Score"] == 20
     assert a1["Best_Market"] == "FR"
+
+
+def test_two_phase_bounds_match_single_pass():
+    df = pd.DataFrame(
+        {
+            "Margine_Netto_%": [10.0, None, 35.0, 5.0, 80.0, 12.0],
+            "SalesRank_Comp": [100, 2000, None, 50, 900, 10],
+            "NewOffer_Comp": [1, 5, 3, None, 10, 2],
+            "Trend_Bonus": [0.1, -0.2, 0.0, 0.5, None, 0.3],
+            "ROI_Factor": [0.2, 0.1, 0.4, None, 0.9, 0.3],
+        }
+    )
+    weights = {"margin": 4.5, "demand": 3.0}
+    expected = compute_scores(df, weights)["final_score"]
+    bounds = merge_score_bounds([score_bounds(df.iloc[:2]), score_bounds(df.iloc[2:])])
+    assert bounds == score_bounds(df)
+    scores = compute_scores(df, weights, bounds)["final_score"]
+    pd.testing.assert_series_equal(scores, expected)
@@ -0,0 +1,79 @@
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+import search
+from search import SearchIndex, normalize_array, normalize_text
+
+
+def _frame():
+    return pd.DataFrame(
+        {
+            "ASIN": ["B09MGGV4TN", "B09MJTKXY8", "B07XYZ1234", "B07XYZ9999"],
+            "Title (base)": [
+                "Apple iPhone 13 256GB - Azzurro",
+                "Apple iPhone 13 128GB - Mezzanotte",
+                "Caffè Espresso Macinato",
+                None,
+            ],
+        },
+        index=[10, 11, 12, 13],
+    )
+
+
+def test_search_matches_contains():
+    df = _frame()
+    index = SearchIndex.from_frame(df)
+    for query in ["iphone", "B07xyz", "GB -", "13 1", "zz", "nessuno"]:
+        expected = df.index[
+            df["ASIN"].str.contains(query, case=False, regex=False)
+            | df["Title (base)"].str.contains(query, case=False, regex=False, na=False)
+        ]
+        assert list(index.search(query)) == list(expected)
+
+
+def test_accents_and_asin_lookup():
+    index = SearchIndex.from_frame(_frame())
+    assert list(index.search("caffe")) == [12]
+    assert list(index.lookup_asin("b09mjtkxy8")) == [11]
+
+
+def test_prefix_and_fuzzy():
+    index = SearchIndex.from_frame(_frame())
+    assert list(index.prefix("apple iphone")) == [10, 11]
+    assert list(index.prefix("B07", limit=1)) == [12]
+    assert 12 in list(index.fuzzy("espreso macinato"))
+
+
+def test_short_queries_regex_characters_and_empty_index():
+    index = SearchIndex.from_frame(_frame())
+    assert list(index.search("e")) == [10, 11, 12]
+    assert list(index.search("b0")) == [10, 11, 12, 13]
+    # La query è una sottostringa letterale, non un'espressione regolare
+    assert list(index.search("13 .*")) == []
+    assert list(index.search("GB  -  ")) == [10, 11]
+    assert list(index.search("ж")) == []
+    assert list(index.prefix("c")) == [12]
+    empty = SearchIndex([], [])
+    assert len(empty.search("abc")) == 0 and len(empty.search("a")) == 0
+
+
+def test_matches_normalized_substring_across_chunks(monkeypatch):
+    monkeypatch.setattr(search, "BUILD_CHUNK", 7)
+    rng = np.random.default_rng(3)
+    words = ["Caffè", "caffe", "Tè", "verde", "ÄÖÜ", "ß", "GB", "1", "Straße", "x"]
+    titles = [" ".join(rng.choice(words, size=rng.integers(0, 5))) for _ in range(60)]
+    titles[5] = None
+    asins = [f"B0{i:03d}X" for i in range(60)]
+    index = SearchIndex(asins, titles)
+    texts = [(normalize_text(a), normalize_text(t)) for a, t in zip(asins, titles)]
+    assert [normalize_text(t) for t in titles] == normalize_array(titles).to_pylist()
+    for query in ["caffe", "e v", "te", "00", "b01", "ss", "ä", "strasse", "x", "gb 1"]:
+        q = normalize_text(query)
+        expected = [i for i, (a, t) in enumerate(texts) if q in a or q in t]
+        assert list(index.search(query)) == expected, query
+        starts = [i for i, (a, t) in enumerate(texts) if a.startswith(q) or t.startswith(q)]
+        assert list(index.prefix(query)) == starts, query
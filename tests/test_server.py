@@ -0,0 +1,122 @@
+import json
+import pathlib
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import pytest
+from server import ScoringServer, ScoringService
+
+
+@pytest.fixture(scope="module")
+def base_url(sample_export, make_market):
+    service = ScoringService()
+    service.add("sample", sample_export.copy(), make_market())
+    server = ScoringServer(("127.0.0.1", 0), service, workers=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def _post(url, payload):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        assert "X-Response-Time-ms" in response.headers
+        return json.loads(response.read())
+
+
+def test_score_top_and_asin(base_url):
+    scored = _post(base_url + "/score", {"dataset": "sample", "limit": 5})
+    assert scored["count"] > 0
+    assert len(scored["rows"]) <= 5
+    top = _post(base_url + "/top", {"dataset": "sample", "k": 3})
+    assert len(top["rows"]) <= 3
+    asin = top["rows"][0]["ASIN"]
+    found = _post(base_url + "/asin", {"dataset": "sample", "asins": [asin.lower()]})
+    assert {row["ASIN"] for row in found["rows"]} == {asin}
+
+
+def test_weights_change_scores(base_url):
+    config = {"epsilon": 0.0, "theta": 0.0, "discount_percent": 5}
+    scored = _post(base_url + "/score", {"dataset": "sample", "config": config})
+    default = _post(base_url + "/score", {"dataset": "sample"})
+    assert scored["count"] >= default["count"]
+
+
+def test_deals_and_stats(base_url):
+    deals = _post(base_url + "/deals", {"dataset": "sample", "filters": {}})
+    assert "rows" in deals
+    with urllib.request.urlopen(base_url + "/stats") as response:
+        stats = json.loads(response.read())["endpoints"]
+    assert stats["POST /score"]["count"] >= 1
+
+
+def test_unknown_dataset(base_url):
+    with pytest.raises(urllib.error.HTTPError) as err:
+        _post(base_url + "/score", {"dataset": "missing"})
+    assert err.value.code == 404
+
+
+def test_deals_computed_once_per_result(monkeypatch, sample_export):
+    import server
+
+    calls = []
+    compute = server.compute_historic_deals
+    monkeypatch.setattr(
+        server, "compute_historic_deals", lambda df: calls.append(1) or compute(df)
+    )
+    service = ScoringService()
+    service.add("sample", sample_export, sample_export.assign(Locale="de"))
+    service.warm("sample")
+    config = server.EngineConfig()
+    first = service.deals("sample", config)
+    assert service.deals(None, config) is first
+    assert len(calls) == 1
+
+
+def test_overload_is_rejected():
+    started, release = threading.Event(), threading.Event()
+
+    class SlowService(ScoringService):
+        def results(self, name, config):
+            started.set()
+            release.wait(10)
+            raise ValueError("interrotto")
+
+    server = ScoringServer(("127.0.0.1", 0), SlowService(), workers=1, max_queued=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        errors = []
+
+        def occupy():
+            try:
+                _post(url + "/score", {})
+            except urllib.error.HTTPError as exc:
+                errors.append(exc.code)
+
+        busy = threading.Thread(target=occupy)
+        busy.start()
+        assert started.wait(10)
+        # Worker occupato e nessun posto in coda: risposta immediata
+        with pytest.raises(urllib.error.HTTPError) as err:
+            _post(url + "/score", {})
+        assert err.value.code == 503
+        release.set()
+        busy.join(10)
+        assert errors == [400]
+        with urllib.request.urlopen(url + "/health") as response:
+            assert json.loads(response.read())["status"] == "ok"
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
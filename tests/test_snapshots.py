@@ -0,0 +1,111 @@
+import pathlib
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import pandas as pd
+from datacache import file_fingerprint
+from engine import load_uploads, trend_columns
+from snapshots import SnapshotStore, history_features, upload_source
+
+
+def _export(price, rank, locale="de"):
+    return pd.DataFrame(
+        {
+            "ASIN": ["B0001", "B0002"],
+            "Locale": [locale, locale],
+            "Buy Box 🚚: Current": [f"{price:.2f}", "10,00"],
+            "Sales Rank: Current": [str(rank), "500"],
+        }
+    )
+
+
+def test_append_and_lookback(tmp_path):
+    store = SnapshotStore(tmp_path)
+    start = datetime(2024, 1, 1)
+    for day in range(10):
+        store.append(_export(20 + day, 1000 - day * 50), start + timedelta(days=day))
+    store.append(_export(99, 1, "fr"), start)
+
+    # Le partizioni con troppi file vengono compattate
+    assert len(list(tmp_path.glob("data/date=2024-01/locale=DE/*.parquet"))) <= 4
+
+    hist = store.history(asins=["B0001"], locales=["DE"], since=date(2024, 1, 5))
+    assert set(hist["ASIN"]) == {"B0001"}
+    assert set(hist["Locale"]) == {"DE"}
+    assert len(hist) == 6
+    assert hist["ts"].min() == datetime(2024, 1, 5)
+
+    features = history_features(store.history(), start + timedelta(days=9))
+    row = features.set_index(["ASIN", "Locale"]).loc[("B0001", "DE")]
+    assert row["Hist_FairPrice"] == np.median(np.arange(20, 30))
+    assert row["Hist_Snapshots"] == 10
+    # Un solo snapshot per la Francia: nessun valore storico
+    assert np.isnan(features.set_index(["ASIN", "Locale"]).loc[("B0001", "FR")]["Hist_FairPrice"])
+
+
+def test_enrich_feeds_trend(tmp_path):
+    store = SnapshotStore(tmp_path)
+    now = datetime(2024, 3, 1)
+    for day in range(5):
+        store.append(_export(20, 1000), now - timedelta(days=day + 1))
+    export = _export(20, 100)
+    store.append(export, now)
+    enriched = store.enrich(export, as_of=now)
+    assert enriched.loc[0, "Hist_SalesRank_30d"] == (5 * 1000 + 100) / 6
+
+    df = pd.DataFrame(
+        {
+            "SalesRank_Comp": [100.0],
+            "SalesRank_30d": [np.nan],
+            "Hist_SalesRank_30d": enriched["Hist_SalesRank_30d"].iloc[:1].to_numpy(),
+        }
+    )
+    assert trend_columns(df)["Trend_Bonus"].iloc[0] > 0
+
+
+def test_same_upload_is_ingested_once(sample_files, tmp_path):
+    base, comp = sample_files
+    store = SnapshotStore(tmp_path / "history")
+    pending = [
+        upload_source([file_fingerprint(base)]),
+        upload_source([file_fingerprint(comp)]),
+    ]
+    expected = store.version(pending)
+    for _ in range(3):
+        _, df_comp, _ = load_uploads([base], [comp], store)
+        # La chiave calcolata prima dell'ingestione resta valida dopo
+        assert store.version() == expected
+
+    assert len(store.sources()) == 2
+    # Una sola riga per prodotto nonostante le tre ingestioni
+    snapshots = df_comp.loc[df_comp["ASIN"].notna(), "Hist_Snapshots"]
+    assert (snapshots == 1).all()
+    assert df_comp["Hist_Volatility"].isna().all()
+    assert df_comp["Hist_FairPrice"].isna().all()
+
+
+def test_concurrent_appends_keep_every_part(tmp_path):
+    store = SnapshotStore(tmp_path)
+    start = datetime(2024, 1, 1)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(
+            pool.map(
+                lambda day: store.append(
+                    _export(20 + day, 1000), start + timedelta(days=day)
+                ),
+                range(16),
+            )
+        )
+
+    index = store.index()
+    files = {
+        p.relative_to(store.data_dir).as_posix()
+        for p in store.data_dir.rglob("*.parquet")
+    }
+    assert set(index["file"]) == files
+    assert len(store.sources()) == 16
+    assert store.history(asins=["B0001"])["ts"].nunique() == 16
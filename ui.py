@@ -15,3 +15,22 @@ def apply_dark_theme():
         except FileNotFoundError:
             css = ""
     st.markdown("<style>\n" + css + "\n</style>", unsafe_allow_html=True)
+
+
+# Colore "blue-70" della palette di Streamlit, usato da tutte le intestazioni
+HEADER_COLOR = "#1c83e1"
+
+
+def colored_header(label: str, description: str = "") -> None:
+    """Render a subheader with a blue underline and an optional caption.
+
+    Same output as ``streamlit_extras.colored_header``, without importing
+    streamlit_extras at startup.
+    """
+    st.subheader(label)
+    st.html(
+        f'<hr style="background-color: {HEADER_COLOR}; margin-top: 0;'
+        ' margin-bottom: 0; height: 3px; border: none; border-radius: 3px;">'
+    )
+    if description:
+        st.caption(description)
@@ -7,11 +7,11 @@ from pathlib import Path
 from typing import Dict
 
 PRESET_DIR = Path(".streamlit/score_presets")
-PRESET_DIR.mkdir(parents=True, exist_ok=True)
 
 
 def save_preset(name: str, weights: Dict[str, float]) -> None:
     """Save ``weights`` dictionary to ``name.json`` inside ``PRESET_DIR``."""
+    PRESET_DIR.mkdir(parents=True, exist_ok=True)
     path = PRESET_DIR / f"{name}.json"
     path.write_text(json.dumps(weights), encoding="utf-8")
 